@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import *
+from .caching import bump_model_version
 
 from django.contrib import admin
 from .models import ContactSubmission
@@ -49,7 +50,7 @@ import json
 
 from .models import (
     User, Category, Product, Cart, CartItem,
-    Order, OrderItem, Coupon, Review
+    Order, OrderItem, OrderStatusHistory, Coupon, Review, CustomerStats
 )
 
 # ========================================
@@ -81,7 +82,7 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'is_active', 'products_count', 'order']
+    list_display = ['name', 'slug', 'event_type', 'is_active', 'products_count', 'order']
     list_editable = ['is_active', 'order']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
@@ -90,6 +91,11 @@ class CategoryAdmin(admin.ModelAdmin):
         return obj.products.count()
     products_count.short_description = 'Nombre de produits'
 
+class RecipeComponentInline(admin.TabularInline):
+    model = RecipeComponent
+    extra = 1
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = [
@@ -104,6 +110,7 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description', 'ingredients']
     prepopulated_fields = {'slug': ('name',)}
     readonly_fields = ['views_count', 'sales_count', 'created_at', 'updated_at']
+    inlines = [RecipeComponentInline]
     
     fieldsets = (
         ('Informations générales', {
@@ -118,6 +125,10 @@ class ProductAdmin(admin.ModelAdmin):
         ('Informations nutritionnelles', {
             'fields': ('calories', 'preparation_time', 'is_vegetarian', 'is_vegan', 'is_gluten_free')
         }),
+        ('Conditionnement', {
+            'fields': ('unit_weight', 'unit_volume', 'units_per_package', 'package_type', 'temperature'),
+            'description': 'Utilisé pour le nombre de colis, le poids et le plan de chargement des livraisons'
+        }),
         ('Visibilité', {
             'fields': ('is_featured', 'is_active')
         }),
@@ -172,6 +183,17 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ['product_name', 'product_price', 'quantity', 'subtotal']
 
 
+class OrderStatusHistoryInline(admin.TabularInline):
+    model = OrderStatusHistory
+    extra = 0
+    can_delete = False
+    fields = ['created_at', 'old_status', 'new_status', 'source', 'changed_by', 'note']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = [
@@ -181,7 +203,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'delivery_type', 'payment_status', 'created_at', 'delivery_date']
     search_fields = ['order_number', 'email', 'phone', 'first_name', 'last_name']
     date_hierarchy = 'created_at'
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderStatusHistoryInline]
     
     readonly_fields = [
         'order_number', 'user', 'created_at', 'updated_at',
@@ -256,18 +278,22 @@ class OrderAdmin(admin.ModelAdmin):
     
     def mark_as_confirmed(self, request, queryset):
         queryset.update(status='confirmed', confirmed_at=timezone.now())
+        bump_model_version(Order)
     mark_as_confirmed.short_description = "Marquer comme confirmée"
     
     def mark_as_preparing(self, request, queryset):
         queryset.update(status='preparing')
+        bump_model_version(Order)
     mark_as_preparing.short_description = "Marquer comme en préparation"
     
     def mark_as_ready(self, request, queryset):
         queryset.update(status='ready')
+        bump_model_version(Order)
     mark_as_ready.short_description = "Marquer comme prête"
     
     def mark_as_delivered(self, request, queryset):
         queryset.update(status='delivered', delivered_at=timezone.now())
+        bump_model_version(Order)
     mark_as_delivered.short_description = "Marquer comme livrée"
 
 # ========================================
@@ -353,6 +379,17 @@ class ReviewAdmin(admin.ModelAdmin):
 # 7. PERSONNALISATION DU SITE ADMIN
 # ========================================
 
+@admin.register(CustomerStats)
+class CustomerStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'orders_count', 'total_spent', 'average_order', 'last_order_at', 'segment']
+    list_filter = ['segment']
+    search_fields = ['user__username', 'user__email', 'user__last_name']
+    readonly_fields = [
+        'user', 'orders_count', 'total_spent', 'average_order', 'first_order_at',
+        'last_order_at', 'recency_score', 'frequency_score', 'monetary_score',
+        'segment', 'updated_at'
+    ]
+
 admin.site.site_header = "Julien-Leblanc Traiteur - Administration"
 admin.site.site_title = "JLT Admin"
 admin.site.index_title = "Tableau de bord"
@@ -547,15 +584,21 @@ class OrderChecklistAdmin(admin.ModelAdmin):
 class ChecklistTemplateItemInline(admin.TabularInline):
     model = ChecklistTemplateItem
     extra = 1
-    fields = ['inventory_item', 'default_quantity', 'notes', 'order']
+    fields = ['inventory_item', 'default_quantity', 'scaling', 'category', 'notes', 'order']
 
 @admin.register(ChecklistTemplate)
 class ChecklistTemplateAdmin(admin.ModelAdmin):
-    list_display = ['name', 'event_type', 'items_count', 'is_active', 'created_at']
+    list_display = ['name', 'event_type', 'order_size_range', 'items_count', 'is_active', 'created_at']
     list_filter = ['event_type', 'is_active', 'created_at']
     search_fields = ['name', 'description']
     inlines = [ChecklistTemplateItemInline]
     
+    def order_size_range(self, obj):
+        if obj.max_order_size is None:
+            return f'{obj.min_order_size}+'
+        return f'{obj.min_order_size}-{obj.max_order_size}'
+    order_size_range.short_description = 'Taille de commande'
+    
     def items_count(self, obj):
         return obj.checklisttemplateitem_set.count()
     items_count.short_description = 'Nombre d\'articles'
@@ -686,7 +729,7 @@ class DeliveryAdmin(admin.ModelAdmin):
         ('Instructions et contenu', {
             'fields': (
                 'delivery_instructions', 'items_description',
-                'total_packages', 'weight'
+                'total_packages', 'weight', 'volume'
             )
         }),
         ('Checklist', {
@@ -778,16 +821,19 @@ class DeliveryAdmin(admin.ModelAdmin):
     
     def mark_as_assigned(self, request, queryset):
         queryset.update(status='assigned')
+        bump_model_version(Delivery)
         self.message_user(request, f"{queryset.count()} livraison(s) marquée(s) comme assignée(s).")
     mark_as_assigned.short_description = "Marquer comme assignée"
     
     def mark_as_delivered(self, request, queryset):
         queryset.update(status='delivered', delivered_at=timezone.now())
+        bump_model_version(Delivery)
         self.message_user(request, f"{queryset.count()} livraison(s) marquée(s) comme livrée(s).")
     mark_as_delivered.short_description = "Marquer comme livrée"
     
     def mark_as_failed(self, request, queryset):
         queryset.update(status='failed')
+        bump_model_version(Delivery)
         self.message_user(request, f"{queryset.count()} livraison(s) marquée(s) comme échouée(s).")
     mark_as_failed.short_description = "Marquer comme échouée"
     
@@ -812,9 +858,9 @@ class RouteDeliveryAdminInline(admin.TabularInline):
     extra = 0
     fields = [
         'delivery', 'position', 'estimated_arrival', 'estimated_departure',
-        'is_completed', 'distance_from_previous'
+        'late_risk', 'is_completed', 'distance_from_previous'
     ]
-    readonly_fields = ['is_completed', 'completed_at']
+    readonly_fields = ['late_risk', 'is_completed', 'completed_at']
     ordering = ['position']
 
 @admin.register(DeliveryRoute)
@@ -938,7 +984,7 @@ class DriverPlanningAdmin(admin.ModelAdmin):
             'fields': ('is_available', 'unavailability_reason')
         }),
         ('Capacité', {
-            'fields': ('max_deliveries', 'max_weight')
+            'fields': ('max_deliveries', 'max_weight', 'max_volume')
         }),
         ('Zones', {
             'fields': ('zones',)
@@ -1039,6 +1085,27 @@ class DeliveryPhotoAdmin(admin.ModelAdmin):
         return format_html('<span style="color: gray;">Non</span>')
     has_location.short_description = 'Géolocalisée'
 
+@admin.register(DriverSyncAction)
+class DriverSyncActionAdmin(admin.ModelAdmin):
+    list_display = ['client_id', 'driver', 'action_type', 'delivery', 'status', 'performed_at', 'received_at']
+    list_filter = ['action_type', 'status', 'received_at']
+    search_fields = ['client_id', 'driver__username', 'delivery__delivery_number']
+    date_hierarchy = 'received_at'
+    readonly_fields = [field.name for field in DriverSyncAction._meta.fields]
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(ServiceTimeEstimate)
+class ServiceTimeEstimateAdmin(admin.ModelAdmin):
+    list_display = ['dimension', 'delivery_type', 'key', 'median_minutes', 'mad_minutes', 'sample_count', 'fitted_at']
+    list_filter = ['dimension', 'delivery_type']
+    search_fields = ['key']
+    readonly_fields = [field.name for field in ServiceTimeEstimate._meta.fields]
+    
+    def has_add_permission(self, request):
+        return False
+
 # ========================================
 # ADMIN NOTIFICATIONS DE LIVRAISON
 # ========================================
@@ -1188,6 +1255,13 @@ class DeliverySettingsAdmin(admin.ModelAdmin):
                 'max_deliveries_per_route'
             )
         }),
+        ('Capacité des créneaux', {
+            'fields': (
+                'default_slot_capacity',
+                'kitchen_slot_capacity'
+            ),
+            'description': 'La capacité livraison est calculée à partir du planning des livreurs'
+        }),
     )
     
     def delivery_hours(self, obj):
@@ -1262,4 +1336,95 @@ class KitchenNotificationAdmin(admin.ModelAdmin):
         'type', 'title', 'recipient', 'recipient_type', 'is_read', 'is_urgent', 'created_at'
     )
     list_filter = ('type', 'recipient_type', 'is_read', 'is_urgent', 'created_at')
-    search_fields = ('title', 'message', 'recipient__username')
\ No newline at end of file
+    search_fields = ('title', 'message', 'recipient__username')
+
+from django.contrib import admin
+from .models import StockMovement, StockSnapshot
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'kitchen_product', 'movement_type', 'quantity',
+        'unit_cost', 'department', 'created_by'
+    )
+    list_filter = ('movement_type', 'department', 'created_at')
+    search_fields = ('kitchen_product__name', 'notes')
+    date_hierarchy = 'created_at'
+    
+    # Journal en ajout seulement : les corrections passent par un ajustement
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('taken_at', 'kitchen_product', 'quantity', 'unit_price', 'value')
+    list_filter = ('taken_at',)
+    search_fields = ('kitchen_product__name',)
+    date_hierarchy = 'taken_at'
+
+
+from django.contrib import admin
+from .models import DeliverySlot
+
+@admin.register(DeliverySlot)
+class DeliverySlotAdmin(admin.ModelAdmin):
+    list_display = (
+        'date', 'start_time', 'deliveries_booked', 'delivery_capacity',
+        'orders_booked', 'kitchen_capacity', 'updated_at'
+    )
+    list_filter = ('date',)
+    date_hierarchy = 'date'
+    readonly_fields = ('deliveries_booked', 'orders_booked', 'updated_at')
+
+
+from django.contrib import admin
+from .models import EquipmentAvailability, EquipmentReservation
+
+@admin.register(EquipmentAvailability)
+class EquipmentAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('date', 'inventory_item', 'reserved', 'remaining', 'updated_at')
+    list_filter = ('date', 'inventory_item__category')
+    search_fields = ('inventory_item__name',)
+    date_hierarchy = 'date'
+    list_select_related = ('inventory_item',)
+    readonly_fields = ('inventory_item', 'date', 'reserved', 'updated_at')
+
+@admin.register(EquipmentReservation)
+class EquipmentReservationAdmin(admin.ModelAdmin):
+    list_display = ('checklist', 'inventory_item', 'quantity', 'start_date', 'end_date')
+    list_filter = ('start_date',)
+    search_fields = ('inventory_item__name', 'checklist__order__order_number')
+    list_select_related = ('checklist__order', 'inventory_item')
+    readonly_fields = ('checklist', 'inventory_item', 'quantity', 'start_date', 'end_date')
+
+
+from django.contrib import admin
+from .models import EmailCampaign, EmailDelivery, OrderStatusJob
+
+@admin.register(EmailCampaign)
+class EmailCampaignAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'sent_count', 'failed_count', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject',)
+    readonly_fields = ('status', 'sent_count', 'failed_count', 'created_by', 'created_at', 'started_at', 'finished_at')
+
+@admin.register(EmailDelivery)
+class EmailDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('email', 'campaign', 'status', 'sent_at', 'error')
+    list_filter = ('status', 'campaign')
+    search_fields = ('email',)
+    list_select_related = ('campaign',)
+    readonly_fields = ('campaign', 'email', 'user', 'order', 'status', 'error', 'sent_at')
+
+@admin.register(OrderStatusJob)
+class OrderStatusJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'new_status', 'created_at', 'started_at', 'finished_at', 'error')
+    list_filter = ('new_status', 'created_at')
+    readonly_fields = ('order_ids', 'new_status', 'created_at', 'started_at', 'finished_at', 'error')
@@ -15,14 +15,17 @@ from django.http import JsonResponse
 from django.db.models import Sum, Count, Avg, Q, F, Max
 from django.db.models.functions import TruncDate, TruncMonth
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
 
 from .models import (
-    User, Product, Order, OrderItem, Category, Review
+    User, Product, Order, OrderItem, Category, Review, CustomerStats
 )
+from .routers import use_replica
+from .caching import active_categories
 
 # ========================================
 # 1. DECORATEURS
@@ -38,7 +41,7 @@ def admin_required(user):
 @user_passes_test(admin_required)
 def admin_product_create(request):
     """Créer un nouveau produit"""
-    categories = Category.objects.filter(is_active=True).order_by('order', 'name')
+    categories = active_categories()
     
     if request.method == 'POST':
         try:
@@ -96,7 +99,7 @@ def admin_product_create(request):
 def admin_product_edit(request, product_id):
     """Modifier un produit existant"""
     product = get_object_or_404(Product, id=product_id)
-    categories = Category.objects.filter(is_active=True).order_by('order', 'name')
+    categories = active_categories()
     
     if request.method == 'POST':
         try:
@@ -185,54 +188,8 @@ def admin_product_delete(request, product_id):
             'message': str(e)
         }, status=500)
 
-@user_passes_test(admin_required)
-def admin_dashboard(request):
-    """Dashboard principal avec statistiques"""
-    
-    # Période sélectionnée
-    period = request.GET.get('period', '30')  # 7, 30, 90 jours
-    if period == '7':
-        start_date = timezone.now() - timedelta(days=7)
-    elif period == '90':
-        start_date = timezone.now() - timedelta(days=90)
-    else:
-        start_date = timezone.now() - timedelta(days=30)
-    
-    # ========== STATISTIQUES GÉNÉRALES ==========
-    
-    # Commandes
-    total_orders = Order.objects.filter(created_at__gte=start_date).count()
-    pending_orders = Order.objects.filter(status='pending').count()
-    orders_today = Order.objects.filter(
-        created_at__date=timezone.now().date()
-    ).count()
-    
-    # Revenus
-    revenue_data = Order.objects.filter(
-        created_at__gte=start_date,
-        status__in=['confirmed', 'preparing', 'ready', 'delivered']
-    ).aggregate(
-        total=Sum('total'),
-        count=Count('id')
-    )
-    total_revenue = revenue_data['total'] or Decimal('0')
-    avg_order_value = total_revenue / revenue_data['count'] if revenue_data['count'] else Decimal('0')
-    
-    # Clients
-    new_customers = User.objects.filter(
-        created_at__gte=start_date,
-        role='customer'
-    ).count()
-    
-    total_customers = User.objects.filter(role='customer').count()
-    
-    # Produits
-    low_stock_products = Product.objects.filter(
-        stock__lt=10,
-        is_active=True
-    ).count()
-    
-    # ========== GRAPHIQUES ==========
+def dashboard_charts(start_date):
+    """Données des graphiques du dashboard admin (JSON prêt pour Chart.js)"""
     
     # Évolution des ventes (30 derniers jours)
     sales_chart_data = Order.objects.filter(
@@ -303,6 +260,74 @@ def admin_dashboard(request):
         ][1])
         status_counts.append(stat['count'])
     
+    return {
+        'sales': {
+            'labels': json.dumps(sales_labels),
+            'revenue': json.dumps(sales_revenue),
+            'count': json.dumps(sales_count),
+        },
+        'top_products': {
+            'names': json.dumps(top_products_names),
+            'quantities': json.dumps(top_products_quantities),
+        },
+        'categories': {
+            'names': json.dumps(category_names),
+            'values': json.dumps(category_values),
+        },
+        'status': {
+            'labels': json.dumps(status_labels),
+            'counts': json.dumps(status_counts),
+        }
+    }
+
+@user_passes_test(admin_required)
+@use_replica()
+def admin_dashboard(request):
+    """Dashboard principal avec statistiques"""
+    
+    # Période sélectionnée
+    period = request.GET.get('period', '30')  # 7, 30, 90 jours
+    if period == '7':
+        start_date = timezone.now() - timedelta(days=7)
+    elif period == '90':
+        start_date = timezone.now() - timedelta(days=90)
+    else:
+        start_date = timezone.now() - timedelta(days=30)
+    
+    # ========== STATISTIQUES GÉNÉRALES ==========
+    
+    # Commandes
+    total_orders = Order.objects.filter(created_at__gte=start_date).count()
+    pending_orders = Order.objects.filter(status='pending').count()
+    orders_today = Order.objects.filter(
+        created_at__date=timezone.now().date()
+    ).count()
+    
+    # Revenus
+    revenue_data = Order.objects.filter(
+        created_at__gte=start_date,
+        status__in=['confirmed', 'preparing', 'ready', 'delivered']
+    ).aggregate(
+        total=Sum('total'),
+        count=Count('id')
+    )
+    total_revenue = revenue_data['total'] or Decimal('0')
+    avg_order_value = total_revenue / revenue_data['count'] if revenue_data['count'] else Decimal('0')
+    
+    # Clients
+    new_customers = User.objects.filter(
+        created_at__gte=start_date,
+        role='customer'
+    ).count()
+    
+    total_customers = User.objects.filter(role='customer').count()
+    
+    # Produits
+    low_stock_products = Product.objects.filter(
+        stock__lt=10,
+        is_active=True
+    ).count()
+    
     # ========== COMMANDES RÉCENTES ==========
     recent_orders = Order.objects.all().order_by('-created_at')[:10]
     
@@ -359,25 +384,8 @@ def admin_dashboard(request):
             'pending_events_count': pending_events,
             'events_today': events_today,
         },
-        'charts': {
-            'sales': {
-                'labels': json.dumps(sales_labels),
-                'revenue': json.dumps(sales_revenue),
-                'count': json.dumps(sales_count),
-            },
-            'top_products': {
-                'names': json.dumps(top_products_names),
-                'quantities': json.dumps(top_products_quantities),
-            },
-            'categories': {
-                'names': json.dumps(category_names),
-                'values': json.dumps(category_values),
-            },
-            'status': {
-                'labels': json.dumps(status_labels),
-                'counts': json.dumps(status_counts),
-            }
-        },
+        # Calculés au rendu, seulement si le fragment n'est pas en cache
+        'charts': SimpleLazyObject(lambda: dashboard_charts(start_date)),
         'recent_orders': recent_orders,
         'alerts': alerts,
     }
@@ -474,6 +482,7 @@ def admin_order_detail(request, order_number):
             new_status = request.POST.get('status')
             old_status = order.status
             order.status = new_status
+            order._status_changed_by = request.user
             
             # Mettre à jour les timestamps selon le statut
             if new_status == 'confirmed' and not order.confirmed_at:
@@ -569,7 +578,7 @@ def admin_products_list(request):
     stock_out = all_products.filter(stock=0).count()
     
     # Catégories pour le filtre
-    categories = Category.objects.filter(is_active=True).order_by('order', 'name')
+    categories = active_categories()
     
     context = {
         'products': products_page,
@@ -655,6 +664,7 @@ from django.db.models.functions import Extract, ExtractWeekDay
 from .models import Order, User, Cart, Category, OrderItem  # Import your models
 
 @user_passes_test(admin_required)
+@use_replica()
 def admin_reports(request):
     """Page des rapports et analyses"""
 
@@ -753,6 +763,7 @@ def admin_reports(request):
     return render(request, 'JLTsite/reports.html', context)
 
 @user_passes_test(admin_required)
+@use_replica()
 def admin_export_data(request):
     """Exporter les données en CSV/Excel - VERSION AMÉLIORÉE"""
     
@@ -771,14 +782,16 @@ def admin_export_data(request):
             'ID', 'Nom d\'utilisateur', 'Prénom', 'Nom', 'Email', 
             'Téléphone', 'Entreprise', 'Ville', 'Code postal',
             'Date d\'inscription', 'Nombre de commandes', 'Total dépensé',
-            'Dernière commande', 'Newsletter'
+            'Dernière commande', 'Segment', 'Newsletter'
         ])
         
         customers = User.objects.filter(role='customer').annotate(
-            orders_count=Count('orders'),
-            total_spent=Sum('orders__total'),
-            last_order=Max('orders__created_at')
+            orders_count=F('customer_stats__orders_count'),
+            total_spent=F('customer_stats__total_spent'),
+            last_order=F('customer_stats__last_order_at'),
+            segment=F('customer_stats__segment')
         )
+        segment_labels = dict(CustomerStats.SEGMENT_CHOICES)
         
         # Filtrer par IDs si spécifiés
         if ids and ids[0]:
@@ -799,6 +812,7 @@ def admin_export_data(request):
                 customer.orders_count or 0,
                 f"{customer.total_spent or 0:.2f}",
                 customer.last_order.strftime('%d/%m/%Y') if customer.last_order else '',
+                segment_labels.get(customer.segment, ''),
                 'Oui' if customer.newsletter else 'Non'
             ])
         
@@ -907,13 +921,19 @@ import csv
 def admin_customers_list(request):
     """Liste des clients avec statistiques complètes"""
     
-    # Récupérer tous les clients avec leurs statistiques
+    # Récupérer tous les clients avec leurs statistiques précalculées
     customers = User.objects.filter(role='customer').annotate(
-        orders_count=Count('orders'),
-        total_spent=Sum('orders__total'),
-        last_order=Max('orders__created_at')
+        orders_count=F('customer_stats__orders_count'),
+        total_spent=F('customer_stats__total_spent'),
+        last_order=F('customer_stats__last_order_at'),
+        segment=F('customer_stats__segment')
     ).order_by('-created_at')
     
+    # Filtre par segment RFM
+    segment = request.GET.get('segment')
+    if segment:
+        customers = customers.filter(customer_stats__segment=segment)
+    
     # Filtre de recherche
     search = request.GET.get('search')
     if search:
@@ -936,18 +956,16 @@ def admin_customers_list(request):
         created_at__gte=first_day_of_this_month
     ).count()
     
-    # Clients VIP (10+ commandes)
-    customers_with_10_or_more_orders = all_customers.annotate(
-        orders_count=Count('orders')
-    ).filter(orders_count__gte=10).count()
-    
-    # Dépense moyenne par client
-    average_spent_data = all_customers.annotate(
-        total_spent=Sum('orders__total')
+    # Clients VIP (10+ commandes) et dépense moyenne par client ayant commandé
+    customer_stats = CustomerStats.objects.filter(
+        user__role='customer',
+        orders_count__gt=0
     ).aggregate(
+        vip_count=Count('pk', filter=Q(orders_count__gte=10)),
         avg_spent=Avg('total_spent')
     )
-    average_spent = average_spent_data['avg_spent'] or 0
+    customers_with_10_or_more_orders = customer_stats['vip_count']
+    average_spent = customer_stats['avg_spent'] or 0
     
     # Pagination
     paginator = Paginator(customers, 20)  # 20 clients par page
@@ -957,6 +975,8 @@ def admin_customers_list(request):
     context = {
         'customers': customers_page,
         'search_query': search,
+        'segment': segment,
+        'segment_choices': CustomerStats.SEGMENT_CHOICES,
         'total_customers': total_customers,
         'customers_last_month': customers_last_month,
         'customers_with_10_or_more_orders': customers_with_10_or_more_orders,
@@ -972,13 +992,20 @@ def admin_customer_detail(request, user_id):
     # Commandes du client
     orders = Order.objects.filter(user=customer).order_by('-created_at')
     
-    # Statistiques détaillées
+    # Statistiques détaillées (projection CustomerStats)
+    customer_stats = CustomerStats.objects.filter(user=customer).first()
+    if customer_stats is None:
+        customer_stats = CustomerStats.refresh_for_user(customer.id)
+    status_counts = orders.aggregate(
+        pending_orders=Count('id', filter=Q(status='pending')),
+        delivered_orders=Count('id', filter=Q(status='delivered')),
+    )
     stats = {
-        'total_orders': orders.count(),
-        'total_spent': orders.aggregate(Sum('total'))['total__sum'] or 0,
-        'avg_order': orders.aggregate(Avg('total'))['total__avg'] or 0,
-        'pending_orders': orders.filter(status='pending').count(),
-        'delivered_orders': orders.filter(status='delivered').count(),
+        'total_orders': customer_stats.orders_count,
+        'total_spent': customer_stats.total_spent,
+        'avg_order': customer_stats.average_order,
+        'segment': customer_stats.get_segment_display(),
+        **status_counts,
     }
     
     # Produits favoris (les plus commandés)
@@ -1018,9 +1045,9 @@ def admin_customer_detail(request, user_id):
 # 7. NOTIFICATIONS ET EMAILS
 # ========================================
 
-def send_order_status_email(order):
-    """Envoyer un email de mise à jour du statut"""
-    from django.core.mail import send_mail
+def build_order_status_email(order, connection=None):
+    """Construire l'email de mise à jour du statut (envoi unitaire ou en lot)"""
+    from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     
     subject = f'Mise à jour de votre commande {order.order_number}'
@@ -1032,25 +1059,23 @@ def send_order_status_email(order):
     
     html_message = render_to_string('JLTsite/order_status_update.html', context)
     
-    send_mail(
+    email = EmailMultiAlternatives(
         subject=subject,
-        message=f'Votre commande {order.order_number} est maintenant: {order.get_status_display()}',
+        body=f'Votre commande {order.order_number} est maintenant: {order.get_status_display()}',
         from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[order.email],
-        html_message=html_message,
-        fail_silently=False,
+        to=[order.email],
+        connection=connection
     )
+    email.attach_alternative(html_message, "text/html")
+    return email
+
+def send_order_status_email(order, connection=None):
+    """Envoyer un email de mise à jour du statut"""
+    build_order_status_email(order, connection).send()
 
 def get_status_message(status):
     """Messages personnalisés selon le statut"""
-    messages = {
-        'confirmed': 'Votre commande a été confirmée et sera préparée bientôt.',
-        'preparing': 'Votre commande est en cours de préparation par notre équipe.',
-        'ready': 'Votre commande est prête! Vous pouvez venir la récupérer.',
-        'delivered': 'Votre commande a été livrée. Bon appétit!',
-        'cancelled': 'Votre commande a été annulée. Si vous avez des questions, contactez-nous.'
-    }
-    return messages.get(status, '')
+    return OrderStatusService.STATUS_MESSAGES.get(status, '')
         
 
 # Ajouter ces vues dans votre admin_views.py
@@ -1060,6 +1085,8 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 import json
 
+from .services import BulkMailerService, OrderStatusService
+
 # ========================================
 # AJAX VIEWS FOR ORDER MANAGEMENT
 # ========================================
@@ -1085,6 +1112,7 @@ def admin_order_update_status(request):
         order = Order.objects.get(order_number=order_number)
         old_status = order.status
         order.status = new_status
+        order._status_changed_by = request.user
         
         # Mettre à jour les timestamps selon le statut
         if new_status == 'confirmed' and old_status != 'confirmed':
@@ -1158,41 +1186,24 @@ def admin_orders_bulk_update(request):
         
         new_status = action_to_status[action]
         
-        # Récupérer les commandes
-        orders = Order.objects.filter(id__in=order_ids)
-        updated_count = 0
-        
-        for order in orders:
-            old_status = order.status
-            order.status = new_status
-            
-            # Mettre à jour les timestamps
-            if new_status == 'confirmed' and old_status != 'confirmed':
-                order.confirmed_at = timezone.now()
-            elif new_status == 'delivered' and old_status != 'delivered':
-                order.delivered_at = timezone.now()
-            
-            # Ajouter une note admin
-            log_message = f"Mise à jour groupée: {old_status} → {new_status} par {request.user.username}"
-            if order.admin_notes:
-                order.admin_notes += f"\n{timezone.now().strftime('%d/%m/%Y %H:%M')} - {log_message}"
-            else:
-                order.admin_notes = f"{timezone.now().strftime('%d/%m/%Y %H:%M')} - {log_message}"
-            
-            order.save()
-            updated_count += 1
-            
-            # Optionnel: envoyer email pour certains statuts
-            if new_status in ['confirmed', 'ready', 'delivered']:
-                try:
-                    send_order_status_email(order)
-                except Exception as e:
-                    print(f"Erreur envoi email pour commande {order.order_number}: {e}")
+        # Transition validée par la machine à états, appliquée en un UPDATE ;
+        # livraisons et emails sont mis en file, traités par les commandes planifiées
+        result = OrderStatusService.bulk_transition(
+            order_ids, new_status,
+            changed_by=request.user,
+            note=f"Mise à jour groupée par {request.user.username}",
+        )
+        updated_count = len(result['updated'])
+        message = f'{updated_count} commande(s) mise(s) à jour'
+        if result['rejected']:
+            message += f" - {len(result['rejected'])} ignorée(s) (changement de statut non permis)"
         
         return JsonResponse({
             'success': True,
-            'message': f'{updated_count} commande(s) mise(s) à jour',
-            'updated_count': updated_count
+            'message': message,
+            'updated_count': updated_count,
+            'unchanged': result['unchanged'],
+            'rejected': result['rejected'],
         })
         
     except Exception as e:
@@ -1244,8 +1255,8 @@ def admin_order_send_email(request):
             'message': str(e)
         }, status=500)
 
-def send_order_invoice_email(order):
-    """Envoyer la facture par email"""
+def build_order_invoice_email(order, connection=None):
+    """Construire l'email de facture"""
     from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     
@@ -1269,10 +1280,15 @@ def send_order_invoice_email(order):
         subject=subject,
         body=text_content,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[order.email]
+        to=[order.email],
+        connection=connection
     )
     email.attach_alternative(html_content, "text/html")
-    email.send()
+    return email
+
+def send_order_invoice_email(order, connection=None):
+    """Envoyer la facture par email"""
+    build_order_invoice_email(order, connection).send()
 
 
 @user_passes_test(admin_required)
@@ -1372,6 +1388,7 @@ def admin_order_cancel(request, order_number):
         
         # Annuler la commande
         order.status = 'cancelled'
+        order._status_changed_by = request.user
         order.payment_status = 'cancelled' if order.payment_status != 'refunded' else order.payment_status
         
         # Restaurer le stock si nécessaire
@@ -1409,8 +1426,8 @@ def admin_order_cancel(request, order_number):
             'message': f'Erreur lors de l\'annulation: {str(e)}'
         }, status=500)
 
-def send_order_cancellation_email(order):
-    """Envoyer un email d'annulation au client"""
+def build_order_cancellation_email(order, connection=None):
+    """Construire l'email d'annulation"""
     from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     
@@ -1463,10 +1480,15 @@ def send_order_cancellation_email(order):
         subject=subject,
         body=text_content,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[order.email]
+        to=[order.email],
+        connection=connection
     )
     email.attach_alternative(html_content, "text/html")
-    email.send()
+    return email
+
+def send_order_cancellation_email(order, connection=None):
+    """Envoyer un email d'annulation au client"""
+    build_order_cancellation_email(order, connection).send()
 
 
 @user_passes_test(admin_required)
@@ -1506,7 +1528,7 @@ def admin_send_customer_email(request):
 @user_passes_test(admin_required)
 @require_POST
 def admin_send_bulk_email(request):
-    """Envoyer un email groupé aux clients"""
+    """Envoyer un email groupé aux clients (un message personnalisé par destinataire)"""
     try:
         data = json.loads(request.body)
         emails = data.get('emails', [])
@@ -1515,29 +1537,44 @@ def admin_send_bulk_email(request):
         if not emails:
             return JsonResponse({'success': False, 'message': 'Aucun destinataire'}, status=400)
         
-        # Créer le contenu
-        subject = 'Newsletter - Julien-Leblanc Traiteur'
-        message = 'Découvrez nos dernières nouveautés...'
-        
-        # Envoyer en BCC pour respecter la confidentialité
-        send_mail(
-            subject=subject,
+        # Créer le contenu (gabarit personnalisé pour chaque client)
+        if email_type == 'promotional':
+            subject = 'Offres spéciales chez Julien-Leblanc Traiteur'
+            message = 'Découvrez nos nouvelles offres...'
+        else:
+            subject = BulkMailerService.literal(data.get('subject') or 'Newsletter - Julien-Leblanc Traiteur')
+            message = data.get('message') or 'Découvrez nos dernières nouveautés...'
+        # Gabarits fixes : le texte saisi n'est jamais compilé, seulement passé en variable
+        greeting = "Bonjour{% if first_name %} {{ first_name }}{% endif %},"
+        campaign = BulkMailerService.create_campaign(
+            subject,
+            greeting + "\n\n{{ message }}",
+            emails,
+            created_by=request.user,
+            html_template="<p>" + greeting + "</p>\n<p>{{ message|linebreaksbr }}</p>",
             message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[settings.DEFAULT_FROM_EMAIL],  # To: nous-mêmes
-            bcc=emails,  # BCC: les clients
-            fail_silently=False,
         )
+        recipients = campaign.deliveries.count()
+        
+        # Petits envois immédiats ; les gros passent par la commande send_email_campaigns
+        if recipients <= BulkMailerService.SYNC_LIMIT and BulkMailerService.claim_campaign(campaign):
+            BulkMailerService.send_campaign(campaign)
+            return JsonResponse({
+                'success': campaign.sent_count > 0,
+                'message': f'Email envoyé à {campaign.sent_count} destinataire(s)'
+                           + (f', {campaign.failed_count} échec(s)' if campaign.failed_count else ''),
+                'campaign_id': campaign.id,
+            })
         
         return JsonResponse({
-            'success': True, 
-            'message': f'Email envoyé à {len(emails)} destinataires'
+            'success': True,
+            'message': f'Envoi de {recipients} emails programmé',
+            'campaign_id': campaign.id,
         })
         
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=500)
 
-
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import user_passes_test
 from django.http import JsonResponse, HttpResponse
@@ -1546,6 +1583,7 @@ from django.utils import timezone
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 import json
@@ -1555,6 +1593,7 @@ from .models import (
     User, Product, Order, OrderItem, Category, Cart, CartItem
 )
 from .forms import CheckoutForm
+from .services import SlotCapacityService, SlotUnavailableError
 
 def admin_required(user):
     """Vérifier si l'utilisateur est admin ou staff"""
@@ -1625,79 +1664,89 @@ def admin_create_manual_order(request):
                 else:
                     customer = None
             
-            # Créer la commande
-            order = Order.objects.create(
-                user=customer,
-                status='confirmed',  # Commandes manuelles sont automatiquement confirmées
-                first_name=first_name,
-                last_name=last_name,
-                email=email,
-                phone=phone,
-                company=company,
-                delivery_type=request.POST.get('delivery_type', 'pickup'),
-                delivery_address=request.POST.get('delivery_address', ''),
-                delivery_postal_code=request.POST.get('delivery_postal_code', ''),
-                delivery_city=request.POST.get('delivery_city', 'Montréal'),
-                delivery_date=request.POST.get('delivery_date'),
-                delivery_time=request.POST.get('delivery_time'),
-                delivery_notes=request.POST.get('delivery_notes', ''),
-                subtotal=Decimal('0.00'),
-                tax_rate=Decimal('14.975'),
-                tax_amount=Decimal('0.00'),
-                delivery_fee=Decimal('0.00'),
-                total=Decimal('0.00'),
-                payment_method=request.POST.get('payment_method', 'cash'),
-                payment_status='pending',
-                admin_notes=f"Commande créée manuellement par {request.user.username} le {timezone.now().strftime('%d/%m/%Y %H:%M')}",
-                # Nouveau champ pour identifier la source
-                order_source='manual'  # À ajouter dans le modèle
-            )
+            delivery_type = request.POST.get('delivery_type', 'pickup')
+            delivery_date = Order._meta.get_field('delivery_date').to_python(request.POST.get('delivery_date'))
+            delivery_time = Order._meta.get_field('delivery_time').to_python(request.POST.get('delivery_time'))
+            
+            # Réserver le créneau et créer la commande dans la même transaction
+            with transaction.atomic():
+                SlotCapacityService.reserve(delivery_date, delivery_time, delivery_type)
+            
+                # Créer la commande
+                order = Order(
+                    user=customer,
+                    status='confirmed',  # Commandes manuelles sont automatiquement confirmées
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=email,
+                    phone=phone,
+                    company=company,
+                    delivery_type=delivery_type,
+                    delivery_address=request.POST.get('delivery_address', ''),
+                    delivery_postal_code=request.POST.get('delivery_postal_code', ''),
+                    delivery_city=request.POST.get('delivery_city', 'Montréal'),
+                    delivery_date=delivery_date,
+                    delivery_time=delivery_time,
+                    delivery_notes=request.POST.get('delivery_notes', ''),
+                    subtotal=Decimal('0.00'),
+                    tax_rate=Decimal('14.975'),
+                    tax_amount=Decimal('0.00'),
+                    delivery_fee=Decimal('0.00'),
+                    total=Decimal('0.00'),
+                    payment_method=request.POST.get('payment_method', 'cash'),
+                    payment_status='pending',
+                    admin_notes=f"Commande créée manuellement par {request.user.username} le {timezone.now().strftime('%d/%m/%Y %H:%M')}",
+                    # Nouveau champ pour identifier la source
+                    order_source='manual'  # À ajouter dans le modèle
+                )
+                order._slot_reserved = True
+                order.save()
             
-            # Traiter les produits sélectionnés
-            products_data = json.loads(request.POST.get('products_data', '[]'))
-            subtotal = Decimal('0.00')
+                # Traiter les produits sélectionnés
+                products_data = json.loads(request.POST.get('products_data', '[]'))
+                subtotal = Decimal('0.00')
             
-            for item_data in products_data:
-                product = Product.objects.get(id=item_data['product_id'])
-                quantity = int(item_data['quantity'])
-                notes = item_data.get('notes', '')
+                for item_data in products_data:
+                    product = Product.objects.get(id=item_data['product_id'])
+                    quantity = int(item_data['quantity'])
+                    notes = item_data.get('notes', '')
                 
-                # Créer l'article de commande
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    product_name=product.name,
-                    product_price=product.get_price(),
-                    quantity=quantity,
-                    notes=notes,
-                    subtotal=product.get_price() * quantity,
-                    # Nouveau champ pour le département
-                    department=get_product_department(product)  # Fonction à créer
-                )
+                    # Créer l'article de commande
+                    order_item = OrderItem.objects.create(
+                        order=order,
+                        product=product,
+                        product_name=product.name,
+                        product_price=product.get_price(),
+                        quantity=quantity,
+                        notes=notes,
+                        subtotal=product.get_price() * quantity,
+                        # Nouveau champ pour le département
+                        department=get_product_department(product)  # Fonction à créer
+                    )
                 
-                subtotal += order_item.subtotal
+                    subtotal += order_item.subtotal
                 
-                # Mettre à jour le stock
-                product.stock -= quantity
-                product.sales_count += quantity
-                product.save()
+                    # Mettre à jour le stock
+                    product.stock -= quantity
+                    product.sales_count += quantity
+                    product.save()
             
-            # Calculer les totaux
-            order.subtotal = subtotal
-            order.tax_amount = subtotal * (order.tax_rate / 100)
+                # Calculer les totaux
+                order.subtotal = subtotal
+                order.tax_amount = subtotal * (order.tax_rate / 100)
             
-            # Frais de livraison
-            if order.delivery_type == 'delivery':
-                order.delivery_fee = Decimal('5.00') if subtotal < 50 else Decimal('0.00')
+                # Frais de livraison
+                if order.delivery_type == 'delivery':
+                    order.delivery_fee = Decimal('5.00') if subtotal < 50 else Decimal('0.00')
             
-            order.total = order.subtotal + order.tax_amount + order.delivery_fee
-            order.save()
-            
-            # Marquer comme payée si paiement immédiat
-            if request.POST.get('mark_as_paid') == 'on':
-                order.payment_status = 'paid'
+                order.total = order.subtotal + order.tax_amount + order.delivery_fee
                 order.save()
             
+                # Marquer comme payée si paiement immédiat
+                if request.POST.get('mark_as_paid') == 'on':
+                    order.payment_status = 'paid'
+                    order.save()
+            
             messages.success(request, f'Commande #{order.order_number} créée avec succès!')
             
             # Rediriger selon l'action
@@ -1706,6 +1755,8 @@ def admin_create_manual_order(request):
             else:
                 return redirect('admin_order_detail', order_number=order.order_number)
                 
+        except SlotUnavailableError as e:
+            messages.error(request, str(e))
         except Exception as e:
             messages.error(request, f'Erreur lors de la création: {str(e)}')
     
@@ -2067,40 +2118,23 @@ def get_item_department(order_item):
         return get_product_department(order_item.product)
     return 'autres'
 
-def get_available_delivery_dates():
-    """Retourner les dates de livraison disponibles (7 prochains jours)"""
-    dates = []
-    start = timezone.now().date() + timedelta(days=1)  # Commencer demain
-    
-    for i in range(7):
-        current_date = start + timedelta(days=i)
-        # Exclure les dimanches
-        if current_date.weekday() != 6:
-            dates.append({
-                'date': current_date,
-                'display': current_date.strftime('%A %d %B'),
-                'value': current_date.strftime('%Y-%m-%d')
-            })
-    
-    return dates
+def get_available_delivery_dates(delivery_type='delivery'):
+    """Dates de livraison ayant encore de la capacité (7 prochains jours, sauf dimanche)"""
+    return SlotCapacityService.get_available_dates(delivery_type=delivery_type)
 
-def get_delivery_time_slots():
-    """Retourner les créneaux horaires disponibles"""
-    slots = []
-    start_hour = 8
-    end_hour = 18
-    
-    for hour in range(start_hour, end_hour):
-        slots.append({
-            'value': f"{hour:02d}:00",
-            'display': f"{hour:02d}h00 - {hour+1:02d}h00"
-        })
-        slots.append({
-            'value': f"{hour:02d}:30",
-            'display': f"{hour:02d}h30 - {hour+1:02d}h30"
-        })
+def get_delivery_time_slots(delivery_date=None, delivery_type='delivery'):
+    """Créneaux d'une journée avec leurs places restantes"""
+    if delivery_date is None:
+        dates = get_available_delivery_dates(delivery_type)
+        if not dates:
+            return []
+        delivery_date = dates[0]['date']
     
-    return slots
+    available_key = f'{delivery_type}_available'
+    return [
+        dict(slot, available=slot[available_key])
+        for slot in SlotCapacityService.get_availability(delivery_date)
+    ]
 
 # ========================================
 # 5. API ENDPOINTS AJAX
@@ -2117,6 +2151,7 @@ def admin_quick_order_status(request):
         
         order = Order.objects.get(id=order_id)
         order.status = new_status
+        order._status_changed_by = request.user
         
         if new_status == 'confirmed':
             order.confirmed_at = timezone.now()
@@ -2164,6 +2199,8 @@ def admin_get_customer_info(request):
     
 # Ajouter dans admin_views.py
 
+from .services import StaffConflictError, StaffSchedulingService
+
 @user_passes_test(admin_required)
 def admin_create_event_from_order(request, order_number):
     """Créer un événement à partir d'une commande"""
@@ -2205,6 +2242,12 @@ def admin_create_event_from_order(request, order_number):
             maitre_hotel = None
             if maitre_hotel_id:
                 maitre_hotel = get_object_or_404(User, id=maitre_hotel_id, role='maitre_hotel')
+                # Pas de double affectation sur le créneau de l'événement
+                StaffSchedulingService.ensure_available(
+                    maitre_hotel,
+                    datetime.strptime(setup_start, '%Y-%m-%dT%H:%M'),
+                    datetime.strptime(cleanup_end, '%Y-%m-%dT%H:%M'),
+                )
             
             # Créer l'événement
             event_contract = EventContract.objects.create(
@@ -2245,11 +2288,24 @@ def admin_create_event_from_order(request, order_number):
                 created_by=request.user
             )
             
-            # Assigner le personnel si spécifié
+            # Assigner le personnel si spécifié (sauf les personnes déjà prises sur le créneau)
             staff_members = request.POST.getlist('staff_members')
+            schedule = StaffSchedulingService.index_for(
+                event_contract.setup_start_time, event_contract.cleanup_end_time
+            )
             for staff_id in staff_members:
                 if staff_id:
                     staff_member = User.objects.get(id=staff_id, role='staff')
+                    conflicts = StaffSchedulingService.conflicts_for(
+                        staff_member.id, event_contract.setup_start_time, event_contract.cleanup_end_time,
+                        index=schedule
+                    )
+                    if conflicts:
+                        messages.warning(
+                            request,
+                            f'{staff_member.get_full_name()} non ajouté(e), déjà affecté(e) : {conflicts[0]["label"]}'
+                        )
+                        continue
                     EventStaffAssignment.objects.create(
                         event=event_contract,
                         staff_member=staff_member,
@@ -2288,6 +2344,8 @@ def admin_create_event_from_order(request, order_number):
             
             return redirect('admin_order_detail', order_number=order.order_number)
             
+        except StaffConflictError as e:
+            messages.error(request, str(e))
         except Exception as e:
             messages.error(request, f'Erreur lors de la création: {str(e)}')
     
@@ -2400,6 +2458,13 @@ def admin_event_detail(request, contract_id):
             maitre_hotel_id = request.POST.get('maitre_hotel_id')
             if maitre_hotel_id:
                 maitre_hotel = get_object_or_404(User, id=maitre_hotel_id, role='maitre_hotel')
+                try:
+                    StaffSchedulingService.ensure_available(
+                        maitre_hotel, event.setup_start_time, event.cleanup_end_time, exclude_event_id=event.id
+                    )
+                except StaffConflictError as e:
+                    messages.error(request, str(e))
+                    return redirect('admin_event_detail', contract_id=event.id)
                 old_maitre_hotel = event.maitre_hotel
                 event.maitre_hotel = maitre_hotel
                 event.save()
@@ -2450,8 +2515,17 @@ def admin_event_detail(request, contract_id):
             if staff_id:
                 staff_member = get_object_or_404(User, id=staff_id, role='staff')
                 
-                # Vérifier que cette personne n'est pas déjà assignée
-                if not event.staff_assignments.filter(staff_member=staff_member).exists():
+                # Vérifier que cette personne n'est pas déjà assignée (ici ou ailleurs sur le créneau)
+                conflicts = StaffSchedulingService.conflicts_for(
+                    staff_member.id, event.setup_start_time, event.cleanup_end_time, exclude_event_id=event.id
+                )
+                if conflicts:
+                    messages.error(
+                        request,
+                        f'{staff_member.get_full_name()} est déjà affecté(e) : '
+                        + ', '.join(conflict['label'] for conflict in conflicts)
+                    )
+                elif not event.staff_assignments.filter(staff_member=staff_member).exists():
                     EventStaffAssignment.objects.create(
                         event=event,
                         staff_member=staff_member,
@@ -2472,15 +2546,17 @@ def admin_event_detail(request, contract_id):
     photos = event.photos.all().order_by('-taken_at')[:10]
     staff_assignments = event.staff_assignments.all().select_related('staff_member')
     
-    # Maîtres d'hôtel disponibles
-    maitre_hotels = User.objects.filter(role='maitre_hotel', is_active=True).order_by('first_name', 'last_name')
+    # Maîtres d'hôtel et personnel, libres sur le créneau de l'événement en premier
+    maitre_hotels = StaffSchedulingService.suggest(
+        event.setup_start_time, event.cleanup_end_time, user_role='maitre_hotel', exclude_event_id=event.id
+    )
     
     # Personnel disponible (non déjà assigné)
     assigned_staff_ids = staff_assignments.values_list('staff_member_id', flat=True)
-    available_staff = User.objects.filter(
-        role='staff', 
-        is_active=True
-    ).exclude(id__in=assigned_staff_ids).order_by('first_name', 'last_name')
+    available_staff = StaffSchedulingService.suggest(
+        event.setup_start_time, event.cleanup_end_time, user_role='staff',
+        assignment_role=request.GET.get('role'), exclude_event_id=event.id, exclude_user_ids=assigned_staff_ids
+    )
     
     context = {
         'event': event,
@@ -2494,6 +2570,38 @@ def admin_event_detail(request, contract_id):
     
     return render(request, 'JLTsite/admin_event_detail.html', context)
 
+@user_passes_test(admin_required)
+def admin_staff_planning(request):
+    """Grille hebdomadaire du personnel événementiel (affectations et doubles affectations)"""
+    today = timezone.localdate()
+    week_start = today - timedelta(days=today.weekday())
+    if request.GET.get('week'):
+        try:
+            week_start = datetime.strptime(request.GET['week'], '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    role = request.GET.get('role', 'all')
+    if role not in ('all', 'maitre_hotel', 'staff'):
+        role = 'all'
+    
+    # Toute l'équipe, y compris les personnes sans affectation cette semaine
+    roles = ['maitre_hotel', 'staff'] if role == 'all' else [role]
+    grid = StaffSchedulingService.week_grid(
+        week_start,
+        user_ids=User.objects.filter(role__in=roles, is_active=True).values_list('id', flat=True)
+    )
+    
+    context = {
+        'grid': grid,
+        'today': today,
+        'week_start': week_start,
+        'previous_week': week_start - timedelta(days=7),
+        'next_week': week_start + timedelta(days=7),
+        'current_role': role,
+        'conflicts_count': sum(1 for row in grid['rows'] if row['conflicts']),
+    }
+    return render(request, 'JLTsite/admin_staff_planning.html', context)
+
 @user_passes_test(admin_required)
 @require_POST
 def admin_change_event_status(request):
@@ -2568,6 +2676,9 @@ def admin_quick_assign_maitre_hotel(request):
         
         if maitre_hotel_id:
             maitre_hotel = get_object_or_404(User, id=maitre_hotel_id, role='maitre_hotel')
+            StaffSchedulingService.ensure_available(
+                maitre_hotel, event.setup_start_time, event.cleanup_end_time, exclude_event_id=event.id
+            )
             old_maitre_hotel = event.maitre_hotel
             event.maitre_hotel = maitre_hotel
             event.save()
@@ -2608,12 +2719,61 @@ def admin_quick_assign_maitre_hotel(request):
                 'maitre_hotel_name': None
             })
             
+    except StaffConflictError as e:
+        return JsonResponse({
+            'success': False,
+            'message': str(e)
+        }, status=409)
     except Exception as e:
         return JsonResponse({
             'success': False,
             'message': str(e)
         }, status=500)
     
+@user_passes_test(admin_required)
+def admin_staff_availability(request):
+    """
+    Personnes disponibles sur un créneau (AJAX) :
+    ?start=AAAA-MM-JJTHH:MM&end=...&user_role=staff|maitre_hotel&role=server&event_id=
+    """
+    try:
+        start = datetime.strptime(request.GET.get('start', ''), '%Y-%m-%dT%H:%M')
+        end = datetime.strptime(request.GET.get('end', ''), '%Y-%m-%dT%H:%M')
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Créneau invalide'}, status=400)
+    if end <= start:
+        return JsonResponse({'success': False, 'message': 'La fin doit suivre le début'}, status=400)
+    user_role = request.GET.get('user_role', 'staff')
+    if user_role not in ('staff', 'maitre_hotel'):
+        return JsonResponse({'success': False, 'message': 'Rôle invalide'}, status=400)
+    
+    event_id = int(request.GET['event_id']) if request.GET.get('event_id', '').isdigit() else None
+    # Le personnel déjà affecté à l'événement n'est pas reproposé
+    assigned_ids = EventStaffAssignment.objects.filter(event_id=event_id).values_list(
+        'staff_member_id', flat=True
+    ) if event_id and user_role == 'staff' else ()
+    suggestions = StaffSchedulingService.suggest(
+        start, end,
+        user_role=user_role,
+        assignment_role=request.GET.get('role') or None,
+        exclude_event_id=event_id,
+        exclude_user_ids=assigned_ids,
+    )
+    return JsonResponse({
+        'success': True,
+        'people': [
+            {
+                'id': suggestion['user'].id,
+                'name': suggestion['user'].get_full_name(),
+                'available': suggestion['available'],
+                'experience': suggestion['experience'],
+                'week_hours': suggestion['week_hours'],
+                'conflicts': [conflict['label'] for conflict in suggestion['conflicts']],
+            }
+            for suggestion in suggestions
+        ],
+    })
+
 @user_passes_test(admin_required)
 @require_POST
 def admin_remove_staff_from_event(request, contract_id, assignment_id):
@@ -0,0 +1,144 @@
+# caching.py - Cache d'objets versionné par modèle
+"""
+Chaque modèle suivi a un numéro de version en cache, incrémenté par les
+signaux post_save / post_delete (voir signals.py). Les clés de
+cached_queryset() et cached_singleton() incluent les versions des modèles
+dont elles dépendent : une modification rend l'entrée introuvable, sans
+avoir à la supprimer explicitement.
+
+Les queryset.update() / bulk_create() n'envoient pas de signaux : le code
+qui en fait sur un modèle suivi appelle bump_model_version() lui-même.
+Les entrées expirent de toute façon après DEFAULT_TIMEOUT.
+
+Les fragments de gabarits {% fragment_cache %} (templatetags/fragment_cache.py)
+utilisent les mêmes versions.
+"""
+from django.core.cache import cache
+
+DEFAULT_TIMEOUT = 60 * 10
+_MISSING = object()
+
+# Modèles dont la version est tenue à jour par les signaux
+VERSIONED_MODELS = {
+    # Données de référence
+    'JLTsite.category',
+    'JLTsite.deliverysettings',
+    'JLTsite.user',
+    # Fragments des tableaux de bord
+    'JLTsite.delivery',
+    'JLTsite.deliveryroute',
+    'JLTsite.kitchenproduction',
+    'JLTsite.order',
+    'JLTsite.orderchecklist',
+    'JLTsite.orderitem',
+    'JLTsite.product',
+    'JLTsite.routedelivery',
+    # Planning du personnel (StaffSchedulingService)
+    'JLTsite.eventcontract',
+    'JLTsite.eventstaffassignment',
+}
+
+
+def _version_key(model):
+    return f'ver:{model._meta.label_lower}'
+
+
+def model_version(model):
+    """Version courante du modèle (initialisée à 1 si absente du cache)"""
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def model_versions(*models):
+    """Versions de plusieurs modèles en un seul aller-retour au cache"""
+    keys = {_version_key(model): model for model in models}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, 1, None)
+        found[key] = 1
+    return [found[_version_key(model)] for model in models]
+
+
+def bump_model_version(model):
+    """Invalide toutes les entrées qui dépendent du modèle"""
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Clé absente (cache vidé ou redémarré)
+        cache.add(key, 1, None)
+        cache.incr(key)
+
+
+def is_versioned(model):
+    return model._meta.label_lower in VERSIONED_MODELS
+
+
+def _versioned_key(name, models):
+    versions = '.'.join(str(version) for version in model_versions(*models))
+    return f'obj:{name}:{versions}'
+
+
+def cached_queryset(name, queryset, depends_on=(), timeout=DEFAULT_TIMEOUT):
+    """
+    Liste des objets du queryset, mise en cache sous `name` jusqu'à la
+    prochaine modification du modèle du queryset ou d'un modèle de
+    `depends_on`.
+
+        categories = cached_queryset('categories:active', Category.objects.filter(is_active=True))
+    """
+    key = _versioned_key(name, (queryset.model, *depends_on))
+    objects = cache.get(key)
+    if objects is None:
+        objects = list(queryset)
+        cache.set(key, objects, timeout)
+    return objects
+
+
+def cached_singleton(model, timeout=DEFAULT_TIMEOUT):
+    """Première ligne d'un modèle de paramètres (None si la table est vide)"""
+    key = _versioned_key(f'singleton:{model._meta.label_lower}', (model,))
+    found = cache.get(key, _MISSING)
+    if found is _MISSING:
+        found = model.objects.first()
+        cache.set(key, found, timeout)
+    return found
+
+
+# ========================================
+# DONNÉES DE RÉFÉRENCE
+# ========================================
+
+def active_categories():
+    """Catégories actives, dans l'ordre du menu"""
+    from .models import Category
+    return cached_queryset(
+        'categories:active', Category.objects.filter(is_active=True).order_by('order', 'name')
+    )
+
+
+def delivery_managers(include_admins=False):
+    """Responsables livraison actifs (et administrateurs si demandé)"""
+    from .models import User
+    roles = ['delivery_manager', 'admin'] if include_admins else ['delivery_manager']
+    return cached_queryset(
+        f'users:{"+".join(roles)}', User.objects.filter(role__in=roles, is_active=True).order_by('pk')
+    )
+
+
+def first_delivery_manager(include_admins=False):
+    managers = delivery_managers(include_admins)
+    return managers[0] if managers else None
+
+
+def delivery_drivers(active_only=True):
+    """Livreurs (actifs seulement par défaut)"""
+    from .models import User
+    drivers = User.objects.filter(role='delivery_driver')
+    if active_only:
+        drivers = drivers.filter(is_active=True)
+    return cached_queryset(f'users:delivery_driver:{int(active_only)}', drivers.order_by('pk'))
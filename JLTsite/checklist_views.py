@@ -16,6 +16,7 @@ from .models import (
     Order, OrderChecklist, ChecklistItem, InventoryItem,
     ChecklistTemplate, ChecklistTemplateItem, ChecklistNotification, User
 )
+from .services import ChecklistTemplateService, EquipmentAvailabilityService
 
 # ========================================
 # DECORATEURS
@@ -47,7 +48,7 @@ def admin_create_checklist(request, order_number):
     inventory_items = InventoryItem.objects.filter(is_active=True).order_by('category', 'name')
     
     # Récupérer les modèles de checklist
-    templates = ChecklistTemplate.objects.filter(is_active=True)
+    templates = ChecklistTemplate.objects.filter(is_active=True).annotate(items_count=Count('checklisttemplateitem'))
     
     # Récupérer les responsables checklist
     checklist_managers = User.objects.filter(
@@ -55,44 +56,54 @@ def admin_create_checklist(request, order_number):
     ).order_by('last_name', 'first_name')
     
     if request.method == 'POST':
-        # Créer la checklist
-        checklist = OrderChecklist.objects.create(
-            order=order,
-            title=request.POST.get('title', f'Checklist {order.order_number}'),
-            assigned_to_id=request.POST.get('assigned_to'),
-            priority=int(request.POST.get('priority', 0)),
-            notes=request.POST.get('notes', ''),
-            created_by=request.user,
-            status='pending'
-        )
+        title = request.POST.get('title', f'Checklist {order.order_number}')
+        priority = int(request.POST.get('priority', 0))
+        notes = request.POST.get('notes', '')
         
-        # Si un modèle est sélectionné
+        # Si un modèle est sélectionné ('auto' : choisi selon le type et la taille de la commande)
         template_id = request.POST.get('template_id')
         if template_id:
-            template = ChecklistTemplate.objects.get(id=template_id)
-            for template_item in template.checklisttemplateitem_set.all():
-                ChecklistItem.objects.create(
-                    checklist=checklist,
-                    inventory_item=template_item.inventory_item,
-                    quantity_needed=template_item.default_quantity,
-                    notes=template_item.notes,
-                    order=template_item.order
-                )
+            template = None if template_id == 'auto' else get_object_or_404(ChecklistTemplate, id=template_id)
+            created, _ = ChecklistTemplateService.create_for_orders(
+                Order.objects.filter(pk=order.pk),
+                template=template,
+                created_by=request.user,
+                assigned_to=User.objects.filter(pk=request.POST.get('assigned_to') or None).first(),
+                title=title,
+                priority=priority,
+                notes=notes,
+            )
+            if not created:
+                messages.error(request, 'Aucun modèle actif ne correspond à cette commande.')
+                return redirect('admin_create_checklist', order_number=order_number)
+            checklist = created[0]
         else:
+            checklist = OrderChecklist.objects.create(
+                order=order,
+                title=title,
+                assigned_to_id=request.POST.get('assigned_to') or None,
+                priority=priority,
+                notes=notes,
+                created_by=request.user,
+                status='pending'
+            )
+            
             # Ajouter les articles sélectionnés manuellement
-            selected_items = request.POST.getlist('inventory_items')
-            for idx, item_id in enumerate(selected_items):
-                if item_id:
-                    quantity = request.POST.get(f'quantity_{item_id}', 1)
-                    ChecklistItem.objects.create(
-                        checklist=checklist,
-                        inventory_item_id=item_id,
-                        quantity_needed=int(quantity),
-                        order=idx
-                    )
-        
-        # Calculer la progression initiale
-        checklist.update_progress()
+            ChecklistItem.objects.bulk_create([
+                ChecklistItem(
+                    checklist=checklist,
+                    inventory_item_id=item_id,
+                    quantity_needed=int(request.POST.get(f'quantity_{item_id}', 1)),
+                    order=idx
+                )
+                for idx, item_id in enumerate(request.POST.getlist('inventory_items'))
+                if item_id
+            ])
+            # bulk_create n'envoie pas post_save : réserver le matériel
+            EquipmentAvailabilityService.sync([checklist.id])
+            
+            # Calculer la progression initiale
+            checklist.update_progress()
         
         messages.success(request, 'Checklist créée avec succès!')
         
@@ -102,10 +113,13 @@ def admin_create_checklist(request, order_number):
         
         return redirect('admin_edit_checklist', order_number=order_number)
     
+    suggested_template = ChecklistTemplateService.suggest(order)
     context = {
         'order': order,
         'inventory_items': inventory_items,
         'templates': templates,
+        'suggested_template': suggested_template,
+        'equipment_shortages': EquipmentAvailabilityService.check_order(order, template=suggested_template),
         'checklist_managers': checklist_managers,
     }
     
@@ -140,15 +154,16 @@ def admin_edit_checklist(request, order_number):
             
         elif action == 'add_items':
             # Ajouter de nouveaux items
-            selected_items = request.POST.getlist('new_items')
-            for item_id in selected_items:
-                if item_id:
-                    quantity = request.POST.get(f'new_quantity_{item_id}', 1)
-                    ChecklistItem.objects.create(
-                        checklist=checklist,
-                        inventory_item_id=item_id,
-                        quantity_needed=int(quantity)
-                    )
+            ChecklistItem.objects.bulk_create([
+                ChecklistItem(
+                    checklist=checklist,
+                    inventory_item_id=item_id,
+                    quantity_needed=int(request.POST.get(f'new_quantity_{item_id}', 1))
+                )
+                for item_id in request.POST.getlist('new_items')
+                if item_id
+            ])
+            EquipmentAvailabilityService.sync([checklist.id])
             
             checklist.update_progress()
             messages.success(request, 'Items ajoutés à la checklist!')
@@ -167,10 +182,38 @@ def admin_edit_checklist(request, order_number):
         'checklist': checklist,
         'inventory_items': inventory_items,
         'checklist_managers': checklist_managers,
+        'equipment_shortages': EquipmentAvailabilityService.check_order(order),
     }
     
     return render(request, 'JLTsite/admin_edit_checklist.html', context)
 
+@user_passes_test(admin_required)
+@require_POST
+def admin_generate_checklists(request):
+    """Générer depuis les modèles les checklists de toutes les commandes confirmées d'une date"""
+    try:
+        day = datetime.strptime(request.POST.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        messages.error(request, 'Date invalide.')
+        return redirect('checklist_dashboard')
+    
+    created, skipped = ChecklistTemplateService.create_for_date(
+        day,
+        created_by=request.user,
+        assigned_to=User.objects.filter(pk=request.POST.get('assigned_to') or None).first(),
+    )
+    if created:
+        messages.success(request, f'{len(created)} checklist(s) générée(s) pour le {day.strftime("%d/%m/%Y")}.')
+    else:
+        messages.info(request, f'Aucune checklist à générer pour le {day.strftime("%d/%m/%Y")}.')
+    if skipped:
+        messages.warning(
+            request,
+            f'{len(skipped)} commande(s) sans modèle correspondant : '
+            + ', '.join(order.order_number for order in skipped[:10])
+        )
+    return redirect('checklist_dashboard')
+
 # ========================================
 # DASHBOARD RESPONSABLE CHECKLIST
 # ========================================
@@ -233,6 +276,7 @@ def checklist_dashboard(request):
         'notifications': notifications,
         'current_status': status,
         'current_date': date_filter,
+        'tomorrow': timezone.now().date() + timedelta(days=1),
     }
     
     return render(request, 'JLTsite/checklist_dashboard.html', context)
@@ -426,4 +470,42 @@ def mark_notification_read(request, notification_id):
     notification.is_read = True
     notification.save()
     
-    return JsonResponse({'success': True})
\ No newline at end of file
+    return JsonResponse({'success': True})
+
+# ========================================
+# API DISPONIBILITÉ DU MATÉRIEL
+# ========================================
+
+@user_passes_test(admin_required)
+def equipment_conflicts(request):
+    """Journées du mois où le matériel réservé dépasse le stock (?month=AAAA-MM)"""
+    try:
+        start = datetime.strptime(request.GET.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        start = timezone.localdate().replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    
+    conflicts = EquipmentAvailabilityService.conflicts(start, end)
+    return JsonResponse({
+        'month': start.strftime('%Y-%m'),
+        'count': len(conflicts),
+        'conflicts': [
+            {**conflict, 'date': conflict['date'].isoformat()}
+            for conflict in conflicts
+        ],
+    })
+
+@user_passes_test(admin_required)
+def equipment_order_check(request, order_number):
+    """Le matériel de la commande est-il disponible ? (?template_id= pour tester un modèle)"""
+    order = get_object_or_404(Order.objects.prefetch_related('items__product'), order_number=order_number)
+    template = None
+    if request.GET.get('template_id'):
+        template = get_object_or_404(ChecklistTemplate, id=request.GET['template_id'])
+    
+    shortages = EquipmentAvailabilityService.check_order(order, template=template)
+    return JsonResponse({
+        'order_number': order.order_number,
+        'available': not shortages,
+        'shortages': shortages,
+    })
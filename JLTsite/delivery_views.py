@@ -2,16 +2,21 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse, HttpResponse
-from django.views.decorators.http import require_POST
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
+from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Q, Count, Sum, Prefetch, F
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
 from django.contrib import messages
 from django.core.files.base import ContentFile
 from datetime import datetime, timedelta, date
 from decimal import Decimal
+from functools import wraps
 import json
+import logging
 import base64
 import io
 from PIL import Image
@@ -21,6 +26,14 @@ from .models import (
     Order, Delivery, DeliveryRoute, RouteDelivery, DeliveryPhoto,
     DriverPlanning, DeliveryNotification, DeliverySettings, User
 )
+from .routers import use_replica
+from .caching import cached_singleton, delivery_drivers, delivery_managers, first_delivery_manager
+from .services import (
+    DeliveryFactoryService, DeliveryMapService, DriverSyncService, LoadPlanService, LocationTrackService, PlanningGridService,
+    RouteEtaService, ServiceTimeService, get_order_items_description
+)
+
+logger = logging.getLogger(__name__)
 
 # ========================================
 # DECORATEURS
@@ -104,44 +117,18 @@ def delivery_manager_dashboard(request):
         ).values_list('delivery_id', flat=True)
     ).order_by('scheduled_time_start')
     
-    # CORRECTION : Livreurs disponibles avec le bon related_name
-    available_drivers = User.objects.filter(
-        role='delivery_driver'
-    ).prefetch_related(
-        Prefetch(
-            'planning',  # ⚠️ CHANGÉ : Utilisez le related_name défini dans DriverPlanning
-            queryset=DriverPlanning.objects.filter(date=selected_date),
-            to_attr='planning_for_date'
-        ),
-        Prefetch(
-            'delivery_routes',
-            queryset=DeliveryRoute.objects.filter(date=selected_date),
-            to_attr='routes_for_date'
-        )
-    )
+    # Livreurs avec leur planning et leurs routes du jour (grille d'une journée)
+    available_drivers = delivery_drivers(active_only=False)
+    planning_grid = PlanningGridService.build_grid(available_drivers, selected_date, days=1)
+    for row in planning_grid:
+        day = row['days'][0]
+        row['driver'].planning_for_date = [day['planning']] if day['planning'] else []
+        row['driver'].routes_for_date = day['routes']
 
     # Calculer les statistiques de planning
-    planning_stats = get_planning_stats(selected_date, available_drivers)
+    planning_stats = get_planning_stats(selected_date, available_drivers, planning_grid)
 
     
-    # Préparer les données pour la carte Google Maps
-    map_deliveries = []
-    for delivery in deliveries:
-        if delivery.latitude and delivery.longitude:
-            map_deliveries.append({
-                'id': delivery.id,
-                'number': delivery.delivery_number,
-                'customer': delivery.customer_name,
-                'address': delivery.delivery_address,
-                'lat': float(delivery.latitude),
-                'lng': float(delivery.longitude),
-                'status': delivery.status,
-                'priority': delivery.priority,
-                'type': delivery.delivery_type,
-                'time': delivery.scheduled_time_start.strftime('%H:%M') if delivery.scheduled_time_start else '',
-                'assigned': bool(delivery.route_assignments.exists()),
-            })
-    
     # Notifications urgentes
     urgent_notifications = DeliveryNotification.objects.filter(
         recipient=request.user,
@@ -151,7 +138,7 @@ def delivery_manager_dashboard(request):
     
     # Paramètres Google Maps
     try:
-        settings_obj = DeliverySettings.objects.first()
+        settings_obj = cached_singleton(DeliverySettings)
         google_maps_key = settings_obj.google_maps_api_key if settings_obj else ''
     except:
         google_maps_key = ''
@@ -167,7 +154,6 @@ def delivery_manager_dashboard(request):
         'key_google': key_google,
         'available_drivers': available_drivers,
         'planning_stats': planning_stats,
-        'map_deliveries': json.dumps(map_deliveries),
         'urgent_notifications': urgent_notifications,
         'google_maps_key': google_maps_key,
     }
@@ -187,68 +173,30 @@ def create_bulk_deliveries(request):
     else:
         selected_date = timezone.now().date()
     
-    # Récupérer toutes les commandes confirmées sans livraison pour cette date
-    orders = Order.objects.filter(
-        status='confirmed',
-        delivery_date=selected_date
-    ).exclude(
-        id__in=Delivery.objects.filter(
-            delivery_type='delivery'
-        ).values_list('order_id', flat=True)
-    )
-    
-    created_count = 0
+    # Commandes confirmées de la date (celles qui ont déjà une livraison sont écartées)
+    orders = Order.objects.filter(status='confirmed', delivery_date=selected_date)
+    deliveries, skipped = DeliveryFactoryService.create_for_orders(orders, created_by=request.user, notify=False)
     
-    for order in orders:
-        try:
-            # Créer la livraison
-            delivery = Delivery.objects.create(
-                order=order,
-                delivery_type='delivery',
-                customer_name=f"{order.first_name} {order.last_name}",
-                customer_phone=order.phone,
-                customer_email=order.email,
-                company=order.company or '',
-                delivery_address=order.delivery_address,
-                delivery_postal_code=order.delivery_postal_code,
-                delivery_city=order.delivery_city,
-                scheduled_date=order.delivery_date,
-                scheduled_time_start=order.delivery_time,
-                scheduled_time_end=calculate_end_time(order.delivery_time),
-                delivery_instructions=order.delivery_notes,
-                items_description=get_order_items_description(order),
-                total_packages=1,
-                priority='normal',
-                has_checklist=hasattr(order, 'checklist'),
-                checklist_completed=order.checklist.status == 'completed' if hasattr(order, 'checklist') else False,
-                created_by=request.user
-            )
-            
-            # Géocoder l'adresse
-            geocode_delivery_address(delivery)
-            
-            created_count += 1
-            
-        except Exception as e:
-            print(f"Erreur création livraison pour commande {order.order_number}: {str(e)}")
-            continue
+    # Adresses déjà connues seulement : les appels à l'API (lents) sont faits
+    # hors requête par la commande geocode_deliveries
+    geocoded = DeliveryFactoryService.geocode(deliveries, lookup=False)
     
-    messages.success(request, f'{created_count} livraison(s) créée(s) avec succès!')
+    messages.success(request, f'{len(deliveries)} livraison(s) créée(s) avec succès!')
+    if len(deliveries) > geocoded:
+        messages.info(
+            request,
+            f'{len(deliveries) - geocoded} nouvelle(s) adresse(s) à géocoder : '
+            'elles apparaîtront sur la carte après le prochain géocodage planifié.'
+        )
+    if skipped:
+        messages.warning(
+            request,
+            f'{len(skipped)} commande(s) sans date, heure ou adresse de livraison ignorée(s) : '
+            + ', '.join(order.order_number for order in skipped)
+        )
     return redirect('delivery_manager_dashboard')
 
 
-def calculate_end_time(start_time):
-    """Calcule l'heure de fin estimée (30 minutes après le début)"""
-    from datetime import datetime, timedelta
-    
-    # Convertir l'heure en datetime pour le calcul
-    dummy_date = datetime(2000, 1, 1)
-    start_datetime = datetime.combine(dummy_date, start_time)
-    end_datetime = start_datetime + timedelta(minutes=30)
-    
-    return end_datetime.time()
-
-
 @login_required
 @user_passes_test(delivery_manager_required)
 def create_delivery_from_order(request, order_number):
@@ -262,6 +210,9 @@ def create_delivery_from_order(request, order_number):
         messages.warning(request, 'Une livraison existe déjà pour cette commande.')
         return redirect('delivery_detail', delivery_id=existing_delivery.id)
     
+    # Colis, poids et volume d'après le conditionnement des produits
+    package_count, weight, volume = LoadPlanService.stored_values(LoadPlanService.order_load(order))
+    
     if request.method == 'POST':
         # Créer la livraison
         delivery = Delivery.objects.create(
@@ -279,7 +230,9 @@ def create_delivery_from_order(request, order_number):
             scheduled_time_end=request.POST.get('scheduled_time_end', order.delivery_time),
             delivery_instructions=order.delivery_notes,
             items_description=get_order_items_description(order),
-            total_packages=int(request.POST.get('total_packages', 1)),
+            total_packages=int(request.POST.get('total_packages', package_count)),
+            weight=weight,
+            volume=volume,
             priority=request.POST.get('priority', 'normal'),
             has_checklist=hasattr(order, 'checklist'),
             checklist_completed=order.checklist.status == 'completed' if hasattr(order, 'checklist') else False,
@@ -299,6 +252,9 @@ def create_delivery_from_order(request, order_number):
     
     context = {
         'order': order,
+        'package_count': package_count,
+        'weight': weight,
+        'volume': volume,
         'has_checklist': hasattr(order, 'checklist'),
         'checklist_status': order.checklist.get_status_display() if hasattr(order, 'checklist') else None,
     }
@@ -441,6 +397,7 @@ def create_route(request):
     
     # Calculer les estimations
     calculate_route_estimates(route)
+    capacity_warning = LoadPlanService.check_route(route)
     
     # Notifier le livreur
     DeliveryNotification.objects.create(
@@ -456,7 +413,8 @@ def create_route(request):
     return JsonResponse({
         'success': True,
         'route_id': route.id,
-        'route_number': route.route_number
+        'route_number': route.route_number,
+        'capacity_warning': capacity_warning
     })
 @login_required
 @user_passes_test(delivery_manager_required)
@@ -480,7 +438,7 @@ def update_route_deliveries(request):
     # Recalculer les estimations
     calculate_route_estimates(route)
     
-    return JsonResponse({'success': True})
+    return JsonResponse({'success': True, 'capacity_warning': LoadPlanService.check_route(route)})
 
 @login_required
 @user_passes_test(delivery_manager_required)
@@ -509,6 +467,7 @@ def optimize_route(request, route_id):
     
     route.is_optimized = True
     route.save()
+    calculate_route_estimates(route)
     
     return JsonResponse({
         'success': True,
@@ -623,7 +582,13 @@ def validate_delivery(request, delivery_id):
     if request.method == 'POST':
         action = request.POST.get('action')
         
-        if action == 'validate':
+        if action == 'arrive':
+            # Sans heure d'arrivée, l'arrêt n'entre pas dans la précision des temps sur place
+            if route_delivery and not route_delivery.actual_arrival:
+                DriverSyncService.mark_arrived(route_delivery)
+            return redirect('validate_delivery', delivery_id=delivery.id)
+        
+        elif action == 'validate':
             # Enregistrer la photo de livraison
             if 'delivery_photo' in request.FILES:
                 photo = DeliveryPhoto.objects.create(
@@ -640,31 +605,13 @@ def validate_delivery(request, delivery_id):
                     photo.longitude = request.POST.get('longitude')
                     photo.save()
             
-            # Enregistrer la signature
-            if request.POST.get('signature'):
-                delivery.signature = request.POST.get('signature')
-            
-            # Notes de livraison
-            delivery.delivery_notes = request.POST.get('delivery_notes', '')
-            
-            # Marquer comme livrée
-            delivery.status = 'delivered'
-            delivery.delivered_at = timezone.now()
-            delivery.delivered_by = request.user
-            delivery.save()
-            
-            # Mettre à jour la commande originale
-            delivery.order.status = 'delivered'
-            delivery.order.delivered_at = timezone.now()
-            delivery.order.save()
-            
-            # Mettre à jour la route
+            # Signature, notes, livraison, commande et arrêt de la route
+            DriverSyncService.mark_delivered(
+                delivery, route_delivery, request.user,
+                signature=request.POST.get('signature', ''),
+                notes=request.POST.get('delivery_notes', '')
+            )
             if route_delivery:
-                route_delivery.is_completed = True
-                route_delivery.completed_at = timezone.now()
-                route_delivery.actual_departure = timezone.now().time()
-                route_delivery.save()
-                
                 route_delivery.route.update_stats()
             
             messages.success(request, 'Livraison validée avec succès!')
@@ -683,21 +630,8 @@ def validate_delivery(request, delivery_id):
             return redirect('driver_dashboard')
         
         elif action == 'report_issue':
-            # Signaler un problème
-            delivery.status = 'failed'
-            delivery.delivery_notes = request.POST.get('issue_description', '')
-            delivery.save()
-            
-            # Créer une notification pour le responsable
-            DeliveryNotification.objects.create(
-                type='issue',
-                recipient_type='manager',
-                recipient=User.objects.filter(role='delivery_manager').first(),
-                delivery=delivery,
-                title='Problème de livraison',
-                message=f'Problème signalé pour {delivery.delivery_number}: {delivery.delivery_notes}',
-                is_urgent=True
-            )
+            # Signaler un problème (notification au responsable)
+            DriverSyncService.report_issue(delivery, request.POST.get('issue_description', ''))
             
             messages.warning(request, 'Problème signalé.')
             return redirect('driver_dashboard')
@@ -808,117 +742,41 @@ def driver_planning(request):
 # FONCTIONS UTILITAIRES
 # ========================================
 
-def get_order_items_description(order):
-    """Génère une description des items de la commande"""
-    items = order.items.all()
-    description = []
-    for item in items:
-        description.append(f"{item.quantity}x {item.product_name}")
-    return ', '.join(description)
-
-import requests
 from decimal import Decimal
 from django.conf import settings
 
 def geocode_delivery_address(delivery):
     """Géocode l'adresse de livraison avec l'API Google Maps"""
-    
-    # Construire l'adresse complète
-    full_address = f"{delivery.delivery_address}, {delivery.delivery_postal_code} {delivery.delivery_city}, Canada"
-    
-    # Paramètres pour l'API Google Maps Geocoding
-    params = {
-        'address': full_address,
-        'key': settings.GOOGLE_API_KEY,  # Votre clé API
-        'region': 'ca',  # Bias vers le Canada
-        'components': 'country:CA'
-    }
-    
-    try:
-        # Appel à l'API Google Maps Geocoding
-        response = requests.get(
-            'https://maps.googleapis.com/maps/api/geocode/json',
-            params=params,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if data['status'] == 'OK' and data['results']:
-                location = data['results'][0]['geometry']['location']
-                
-                delivery.latitude = Decimal(str(location['lat']))
-                delivery.longitude = Decimal(str(location['lng']))
-                delivery.save()
-                
-                print(f"✅ Géocodage réussi pour {delivery.delivery_number}: {location['lat']}, {location['lng']}")
-                return True
-            else:
-                print(f"❌ Géocodage échoué pour {delivery.delivery_number}: {data.get('status', 'Unknown error')}")
-                return False
-        else:
-            print(f"❌ Erreur API pour {delivery.delivery_number}: {response.status_code}")
-            return False
-            
-    except requests.RequestException as e:
-        print(f"❌ Erreur réseau pour {delivery.delivery_number}: {str(e)}")
-        return False
-    except Exception as e:
-        print(f"❌ Erreur générale pour {delivery.delivery_number}: {str(e)}")
+    point = DeliveryFactoryService.lookup_coordinates(delivery)
+    if point is None:
         return False
+    
+    delivery.latitude, delivery.longitude = point
+    delivery.save()
+    logger.info("Géocodage réussi pour %s : %s, %s", delivery.delivery_number, delivery.latitude, delivery.longitude)
+    return True
 
 # Fonction pour re-géocoder toutes les livraisons existantes
 def regeocoder_toutes_livraisons():
     """Re-géocoder toutes les livraisons qui n'ont pas de coordonnées"""
     from .models import Delivery
     
-    livraisons_sans_coordonnees = Delivery.objects.filter(
+    livraisons_sans_coordonnees = list(Delivery.objects.filter(
         Q(latitude__isnull=True) | Q(longitude__isnull=True)
-    )
+    ))
     
-    print(f"🔄 Re-géocodage de {livraisons_sans_coordonnees.count()} livraisons...")
+    logger.info("Re-géocodage de %s livraisons", len(livraisons_sans_coordonnees))
     
-    succes = 0
-    echecs = 0
+    # Une adresse déjà géocodée n'est pas redemandée à l'API
+    succes = DeliveryFactoryService.geocode(livraisons_sans_coordonnees)
+    echecs = len(livraisons_sans_coordonnees) - succes
     
-    for delivery in livraisons_sans_coordonnees:
-        if geocode_delivery_address(delivery):
-            succes += 1
-        else:
-            echecs += 1
-    
-    print(f"✅ Géocodage terminé: {succes} succès, {echecs} échecs")
+    logger.info("Géocodage terminé : %s succès, %s échecs", succes, echecs)
     return succes, echecs
 
 def calculate_route_estimates(route):
-    """Calcule les estimations de temps pour une route"""
-    route_deliveries = route.route_deliveries.all().order_by('position')
-    
-    current_time = datetime.combine(route.date, route.start_time)
-    total_distance = 0
-    
-    for rd in route_deliveries:
-        # Temps de trajet estimé (simplifié)
-        travel_time = timedelta(minutes=15)  # 15 minutes entre chaque livraison
-        current_time += travel_time
-        
-        rd.estimated_arrival = current_time.time()
-        
-        # Temps sur place
-        service_time = timedelta(minutes=rd.delivery.estimated_duration)
-        current_time += service_time
-        
-        rd.estimated_departure = current_time.time()
-        rd.save()
-        
-        # Distance (simplifiée)
-        total_distance += 5  # 5km entre chaque point
-    
-    route.end_time = current_time.time()
-    route.total_distance = total_distance
-    route.estimated_duration = int((current_time - datetime.combine(route.date, route.start_time)).total_seconds() / 60)
-    route.save()
+    """Calcule les estimations de temps pour une route (voir RouteEtaService)"""
+    RouteEtaService.plan(route)
 
 @require_POST
 @csrf_exempt
@@ -966,9 +824,9 @@ def upload_delivery_photo(request):
     
     return JsonResponse({'success': False, 'error': 'Aucune photo fournie'})
 
-def send_delivery_notification(delivery, notification_type='reminder'):
-    """Envoie une notification au client"""
-    from django.core.mail import send_mail
+def build_delivery_notification(delivery, notification_type='reminder', connection=None):
+    """Construit la notification client (None si le type est inconnu)"""
+    from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     
     if notification_type == 'reminder':
@@ -978,7 +836,7 @@ def send_delivery_notification(delivery, notification_type='reminder'):
         subject = f'Livraison effectuée - {delivery.delivery_number}'
         template = 'JLTsite/email/delivery_completed.html'
     else:
-        return
+        return None
     
     context = {
         'delivery': delivery,
@@ -987,14 +845,22 @@ def send_delivery_notification(delivery, notification_type='reminder'):
     
     html_message = render_to_string(template, context)
     
-    send_mail(
+    email = EmailMultiAlternatives(
         subject=subject,
-        message='',
+        body='',
         from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[delivery.customer_email],
-        html_message=html_message,
-        fail_silently=False,
+        to=[delivery.customer_email],
+        connection=connection
     )
+    email.attach_alternative(html_message, "text/html")
+    return email
+
+def send_delivery_notification(delivery, notification_type='reminder', connection=None):
+    """Envoie une notification au client"""
+    email = build_delivery_notification(delivery, notification_type, connection)
+    if email is None:
+        return
+    email.send()
     
     if notification_type == 'reminder':
         delivery.reminder_sent = True
@@ -1060,7 +926,7 @@ def start_route(request, route_id):
         DeliveryNotification.objects.create(
             type='route_assigned',
             recipient_type='manager',
-            recipient=User.objects.filter(role='delivery_manager').first(),
+            recipient=first_delivery_manager(),
             route=route,
             title='Route démarrée',
             message=f'{request.user.get_full_name()} a démarré la route {route.route_number}'
@@ -1113,7 +979,7 @@ def complete_route(request, route_id):
         DeliveryNotification.objects.create(
             type='completed',
             recipient_type='manager',
-            recipient=User.objects.filter(role='delivery_manager').first(),
+            recipient=first_delivery_manager(),
             route=route,
             title='Route terminée',
             message=f'La route {route.route_number} a été complétée par {request.user.get_full_name()}',
@@ -1161,7 +1027,7 @@ def report_delivery_issue(request):
         DeliveryNotification.objects.create(
             type='issue',
             recipient_type='manager',
-            recipient=User.objects.filter(role='delivery_manager').first(),
+            recipient=first_delivery_manager(),
             delivery=delivery,
             title='Problème de livraison',
             message=f'Problème signalé sur {delivery.delivery_number}: {description}',
@@ -1221,61 +1087,20 @@ def driver_planning_overview(request):
     week_end = week_start + timedelta(days=6)
     
     # Récupérer tous les livreurs
-    drivers = User.objects.filter(role='delivery_driver', is_active=True)
+    drivers = delivery_drivers()
     
-    # Créer la grille de planning
-    planning_grid = []
-    for driver in drivers:
-        driver_planning = {
-            'driver': driver,
-            'days': []
-        }
-        
-        for day_offset in range(7):
-            current_date = week_start + timedelta(days=day_offset)
-            
-            # Planning du jour
-            planning = DriverPlanning.objects.filter(
-                driver=driver,
-                date=current_date
-            ).first()
-            
-            # Routes du jour
-            routes = DeliveryRoute.objects.filter(
-                driver=driver,
-                date=current_date
-            )
-            
-            # Livraisons du jour
-            deliveries_count = 0
-            for route in routes:
-                deliveries_count += route.route_deliveries.count()
-            
-            driver_planning['days'].append({
-                'date': current_date,
-                'planning': planning,
-                'routes': routes,
-                'deliveries_count': deliveries_count,
-                'is_available': planning.is_available if planning else True
-            })
-        
-        planning_grid.append(driver_planning)
+    # Créer la grille de planning (plannings, routes et comptes chargés en bloc)
+    planning_grid = PlanningGridService.build_grid(drivers, week_start, days=7)
     
     # Statistiques de la semaine
-    week_stats = {
-        'total_deliveries': Delivery.objects.filter(
-            scheduled_date__range=[week_start, week_end]
-        ).count(),
-        'assigned_deliveries': Delivery.objects.filter(
-            scheduled_date__range=[week_start, week_end],
-            status='assigned'
-        ).count(),
-        'completed_deliveries': Delivery.objects.filter(
-            scheduled_date__range=[week_start, week_end],
-            status='delivered'
-        ).count(),
-        'active_drivers': drivers.count(),
-    }
+    week_stats = Delivery.objects.filter(
+        scheduled_date__range=[week_start, week_end]
+    ).aggregate(
+        total_deliveries=Count('id'),
+        assigned_deliveries=Count('id', filter=Q(status='assigned')),
+        completed_deliveries=Count('id', filter=Q(status='delivered')),
+    )
+    week_stats['active_drivers'] = len(drivers)
     
     context = {
         'planning_grid': planning_grid,
@@ -1366,6 +1191,7 @@ def delivery_detail(request, delivery_id):
 
 @login_required
 @user_passes_test(delivery_manager_required)
+@use_replica()
 def delivery_reports(request):
     """Rapports et analyses des livraisons"""
     
@@ -1406,29 +1232,20 @@ def delivery_reports(request):
         
         'on_time_rate': calculate_on_time_rate(start_date),
     }
+    if stats['avg_delivery_time'] is not None:
+        stats['avg_delivery_hours'] = round(stats['avg_delivery_time'].total_seconds() / 3600, 1)
     
-    # Performance par livreur
+    # Performance par livreur (une seule requête groupée)
     driver_performance = []
-    drivers = User.objects.filter(role='delivery_driver')
-    
-    for driver in drivers:
-        routes = DeliveryRoute.objects.filter(
-            driver=driver,
-            date__gte=start_date
-        )
-        
-        deliveries = Delivery.objects.filter(
-            route_assignments__route__driver=driver,
-            created_at__gte=start_date
-        )
-        
+    for driver in get_driver_performance(start_date):
         driver_performance.append({
             'driver': driver,
-            'total_routes': routes.count(),
-            'total_deliveries': deliveries.count(),
-            'completed': deliveries.filter(status='delivered').count(),
-            'failed': deliveries.filter(status='failed').count(),
-            'success_rate': (deliveries.filter(status='delivered').count() / deliveries.count() * 100) if deliveries.count() > 0 else 0,
+            'total_routes': driver.total_routes,
+            'total_deliveries': driver.total_deliveries,
+            'completed': driver.completed,
+            'failed': driver.failed,
+            'on_time': driver.on_time,
+            'success_rate': (driver.completed / driver.total_deliveries * 100) if driver.total_deliveries > 0 else 0,
         })
     
     # Livraisons par jour
@@ -1456,6 +1273,9 @@ def delivery_reports(request):
         avg_time=Avg('estimated_duration')
     ).order_by('-count')[:20]
     
+    # Précision des temps sur place appris et des heures d'arrivée estimées
+    service_time_accuracy = ServiceTimeService.accuracy(start_date)
+    
     context = {
         'period': period,
         'stats': stats,
@@ -1463,6 +1283,7 @@ def delivery_reports(request):
         'daily_deliveries': list(daily_deliveries),
         'issues': issues,
         'zones_stats': zones_stats,
+        'service_time_accuracy': service_time_accuracy,
     }
     
     return render(request, 'JLTsite/delivery_reports.html', context)
@@ -1543,29 +1364,54 @@ def export_deliveries(request):
 
 def calculate_on_time_rate(start_date):
     """Calculer le taux de livraison à temps"""
-    deliveries = Delivery.objects.filter(
+    # La comparaison se fait en SQL grâce à la colonne scheduled_end_at
+    counts = Delivery.objects.filter(
         created_at__gte=start_date,
         status='delivered',
         delivered_at__isnull=False
+    ).aggregate(
+        total=Count('id'),
+        on_time=Count('id', filter=Q(delivered_at__lte=F('scheduled_end_at')))
     )
     
-    total = deliveries.count()
-    if total == 0:
+    if counts['total'] == 0:
         return 0
     
-    on_time = 0
-    for delivery in deliveries:
-        # Comparer l'heure de livraison avec l'heure prévue
-        scheduled_end = datetime.combine(
-            delivery.scheduled_date,
-            delivery.scheduled_time_end
-        )
-        scheduled_end = timezone.make_aware(scheduled_end)
-        
-        if delivery.delivered_at <= scheduled_end:
-            on_time += 1
+    return (counts['on_time'] / counts['total']) * 100
+
+def get_driver_performance(start_date):
+    """Livreurs annotés de leurs statistiques sur la période (routes, livraisons, réussites, retards)"""
+    delivery_path = 'delivery_routes__route_deliveries__delivery'
+    in_period = Q(**{f'{delivery_path}__created_at__gte': start_date})
     
-    return (on_time / total) * 100
+    return User.objects.filter(
+        role='delivery_driver'
+    ).annotate(
+        total_routes=Count(
+            'delivery_routes',
+            filter=Q(delivery_routes__date__gte=start_date),
+            distinct=True
+        ),
+        total_deliveries=Count(delivery_path, filter=in_period, distinct=True),
+        completed=Count(
+            delivery_path,
+            filter=in_period & Q(**{f'{delivery_path}__status': 'delivered'}),
+            distinct=True
+        ),
+        failed=Count(
+            delivery_path,
+            filter=in_period & Q(**{f'{delivery_path}__status': 'failed'}),
+            distinct=True
+        ),
+        on_time=Count(
+            delivery_path,
+            filter=in_period & Q(**{
+                f'{delivery_path}__status': 'delivered',
+                f'{delivery_path}__delivered_at__lte': F(f'{delivery_path}__scheduled_end_at'),
+            }),
+            distinct=True
+        ),
+    ).order_by('first_name', 'last_name')
 
 def send_issue_notification_email(delivery, issue_type, description):
     """Envoyer un email de notification pour un problème"""
@@ -1576,10 +1422,7 @@ def send_issue_notification_email(delivery, issue_type, description):
     subject = f'Problème de livraison - {delivery.delivery_number}'
     
     # Récupérer les emails des responsables
-    managers = User.objects.filter(
-        role__in=['delivery_manager', 'admin'],
-        is_active=True
-    ).values_list('email', flat=True)
+    managers = [manager.email for manager in delivery_managers(include_admins=True)]
     
     if not managers:
         return
@@ -1674,7 +1517,7 @@ def update_delivery_status_api(request, delivery_id):
             DeliveryNotification.objects.create(
                 type='issue',
                 recipient_type='manager',
-                recipient=User.objects.filter(role='delivery_manager').first(),
+                recipient=first_delivery_manager(),
                 delivery=delivery,
                 title='Livraison échouée',
                 message=f'La livraison {delivery.delivery_number} a échoué',
@@ -1968,39 +1811,14 @@ L'équipe de livraison
         print(f"Erreur envoi email planning: {str(e)}")
 
 # Fonction utilitaire pour calculer les statistiques de planning
-def get_planning_stats(selected_date, drivers):
+def get_planning_stats(selected_date, drivers, planning_grid=None):
     """Calculer les statistiques du planning pour une date donnée"""
     
-    # Récupérer tous les plannings pour cette date
-    plannings = DriverPlanning.objects.filter(
-        date=selected_date,
-        driver__in=drivers
-    )
-    
-    # Récupérer toutes les routes pour cette date
-    routes = DeliveryRoute.objects.filter(
-        date=selected_date,
-        driver__in=drivers
-    )
-    
-    # Calculer les statistiques
-    available_count = plannings.filter(is_available=True).count()
-    unavailable_count = plannings.filter(is_available=False).count()
-    total_routes = routes.count()
-    
-    # Calculer la moyenne de livraisons par livreur
-    total_deliveries = 0
-    for route in routes:
-        total_deliveries += route.route_deliveries.count()
-    
-    avg_deliveries = total_deliveries / len(drivers) if drivers else 0
+    # Réutiliser la grille déjà construite par la vue si elle est fournie
+    if planning_grid is None:
+        planning_grid = PlanningGridService.build_grid(drivers, selected_date, days=1)
     
-    return {
-        'available': available_count,
-        'unavailable': unavailable_count,
-        'total_routes': total_routes,
-        'avg_deliveries': round(avg_deliveries, 1)
-    }
+    return PlanningGridService.get_day_stats(planning_grid)
 
 @login_required
 @user_passes_test(delivery_driver_required)
@@ -2207,6 +2025,241 @@ def driver_stats_api(request):
         'date': selected_date.strftime('%Y-%m-%d')
     })
 
+# ========================================
+# SYNCHRONISATION APPLICATION LIVREUR
+# ========================================
+
+@login_required
+@user_passes_test(delivery_driver_required)
+@require_GET
+@gzip_page
+def driver_sync_api(request):
+    """
+    Journée du livreur en un document (routes, arrêts, consignes, photos).
+    ?date=AAAA-MM-JJ (aujourd'hui par défaut), ?since=<cursor> pour ne
+    recevoir que les arrêts modifiés. Répond 304 si l'ETag envoyé dans
+    If-None-Match correspond toujours à l'état de la journée.
+    """
+    driver = request.user
+    try:
+        day = datetime.strptime(request.GET['date'], '%Y-%m-%d').date() if request.GET.get('date') \
+            else timezone.localdate()
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Date invalide'}, status=400)
+    
+    since = None
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None:
+            return JsonResponse({'success': False, 'message': 'Curseur invalide'}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    
+    etag = quote_etag(DriverSyncService.etag(driver, day))
+    # gzip_page affaiblit l'ETag (W/"…") : comparaison faible, comme la RFC 9110 pour If-None-Match
+    known = {strip_weak_etag(tag) for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+    if etag in known or '*' in known:
+        response = HttpResponseNotModified()
+    else:
+        payload = DriverSyncService.build_payload(driver, day, since)
+        response = JsonResponse(payload, json_dumps_params={'separators': (',', ':')})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Driver-Token'] = DriverSyncService.issue_token(driver)
+    return response
+
+def strip_weak_etag(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+def driver_token_required(view):
+    """
+    API d'envoi de l'application livreur : authentification par le jeton
+    reçu dans l'en-tête X-Driver-Token de driver_sync_api
+    (Authorization: Bearer <jeton>) et non par le cookie de session, d'où
+    l'exemption CSRF.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        driver = DriverSyncService.token_user(token.strip()) if scheme.lower() == 'bearer' else None
+        if driver is None:
+            return JsonResponse({'success': False, 'message': 'Jeton invalide ou expiré'}, status=401)
+        if not delivery_driver_required(driver):
+            return JsonResponse({'success': False, 'message': 'Accès refusé'}, status=403)
+        request.user = driver
+        return view(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
+
+@driver_token_required
+@require_POST
+def driver_sync_actions_api(request):
+    """
+    Envoi groupé des actions mises en file hors ligne :
+    {"actions": [{"id": "<uuid client>", "type": "arrive|validate|issue|signature|gps",
+                  "delivery_id": 12, "at": "<ISO 8601>", ...}]}
+    Les actions déjà reçues (même id) ne sont pas rejouées.
+    """
+    try:
+        actions = json.loads(request.body).get('actions', [])
+        if not isinstance(actions, list) or not all(isinstance(action, dict) for action in actions):
+            raise ValueError('actions doit être une liste d\'objets')
+        results, positions = DriverSyncService.apply_batch(request.user, actions)
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'results': results,
+        'positions': positions,
+    })
+
+@driver_token_required
+@require_POST
+def driver_locations_api(request):
+    """
+    Positions GPS mises en file par l'application, envoyées par lots :
+    {"route_id": 3 (facultatif), "points": [{"lat": 45.5, "lng": -73.6, "at": "<ISO 8601>", "accuracy": 12}]}
+    """
+    try:
+        data = json.loads(request.body)
+        points = data.get('points', [])
+        if not isinstance(points, list) or not all(isinstance(point, dict) for point in points):
+            raise ValueError('points doit être une liste d\'objets')
+        result = LocationTrackService.ingest(request.user, points, route_id=data.get('route_id'))
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({'success': True, **result})
+
+@login_required
+@user_passes_test(delivery_manager_required)
+def driver_positions_api(request):
+    """Dernière position connue de chaque livreur pour la carte du responsable"""
+    try:
+        day = datetime.strptime(request.GET['date'], '%Y-%m-%d').date() if request.GET.get('date') \
+            else timezone.localdate()
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Date invalide'}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'date': day.isoformat(),
+        'positions': LocationTrackService.last_positions(day),
+    })
+
+@login_required
+@user_passes_test(delivery_manager_required)
+@gzip_page
+def route_track_api(request, route_id):
+    """Trace GPS d'une route ([heure, lat, lng] dans l'ordre), ?since=<ISO 8601> pour la suite"""
+    route = get_object_or_404(DeliveryRoute, id=route_id)
+    since = parse_datetime(request.GET['since']) if request.GET.get('since') else None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    
+    points = LocationTrackService.track(route, since)
+    return JsonResponse({
+        'success': True,
+        'route_id': route.id,
+        'points': [[at.isoformat(), lat, lng] for at, lat, lng, _ in points],
+    }, json_dumps_params={'separators': (',', ':')})
+
+@login_required
+@user_passes_test(delivery_manager_required)
+@gzip_page
+def delivery_map_api(request):
+    """
+    GeoJSON des livraisons du jour pour la carte du responsable, limité à
+    ?bbox=sud,ouest,nord,est et regroupé selon ?zoom ; ?period et
+    ?hide_assigned=1 reprennent les filtres de la carte, ?bounds=1 ajoute
+    l'emprise de toutes les livraisons du jour (cadrage initial).
+    """
+    try:
+        day = datetime.strptime(request.GET['date'], '%Y-%m-%d').date() if request.GET.get('date') \
+            else timezone.localdate()
+        zoom = int(request.GET.get('zoom', DeliveryMapService.DEFAULT_ZOOM))
+        bbox = [float(value) for value in request.GET['bbox'].split(',')] if request.GET.get('bbox') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Paramètres invalides'}, status=400)
+    if bbox is not None and len(bbox) != 4:
+        return JsonResponse({'success': False, 'message': 'bbox attend sud,ouest,nord,est'}, status=400)
+    
+    deliveries = DeliveryMapService.day_deliveries(
+        day, request.GET.get('period'), request.GET.get('hide_assigned') == '1'
+    )
+    data = DeliveryMapService.geojson(deliveries, zoom, bbox)
+    if request.GET.get('bounds') == '1':
+        data['bounds'] = DeliveryMapService.bounds(deliveries)
+    return JsonResponse(data, json_dumps_params={'separators': (',', ':')})
+
+def nearby_delivery_data(delivery):
+    return {
+        'id': delivery.id,
+        'number': delivery.delivery_number,
+        'customer': delivery.customer_name,
+        'address': delivery.delivery_address,
+        'postal_code': delivery.delivery_postal_code,
+        'status': delivery.status,
+        'time': delivery.scheduled_time_start.strftime('%H:%M') if delivery.scheduled_time_start else '',
+        'lat': float(delivery.latitude) if delivery.latitude is not None else None,
+        'lng': float(delivery.longitude) if delivery.longitude is not None else None,
+    }
+
+@login_required
+@user_passes_test(delivery_manager_required)
+def nearby_deliveries_api(request, delivery_id):
+    """Livraisons du même jour à moins de ?radius km (2 par défaut), les plus proches d'abord"""
+    delivery = get_object_or_404(Delivery, id=delivery_id)
+    try:
+        radius = min(float(request.GET.get('radius', DeliveryMapService.NEAR_RADIUS_KM)), 50)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Rayon invalide'}, status=400)
+    
+    nearby = DeliveryMapService.near(delivery, radius)
+    return JsonResponse({
+        'success': True,
+        'radius_km': radius,
+        'deliveries': [{**nearby_delivery_data(other), 'distance_km': other.distance_km} for other in nearby],
+    })
+
+@login_required
+@user_passes_test(delivery_manager_required)
+def driver_zone_deliveries_api(request, planning_id):
+    """Livraisons du jour situées dans les zones (codes postaux) du planning d'un livreur"""
+    planning = get_object_or_404(DriverPlanning, id=planning_id)
+    deliveries = DeliveryMapService.in_driver_zone(planning).order_by('scheduled_time_start')
+    if request.GET.get('unassigned') == '1':
+        deliveries = deliveries.filter(status='pending')
+    return JsonResponse({
+        'success': True,
+        'zones': DeliveryMapService.zone_prefixes(planning.zones),
+        'deliveries': [nearby_delivery_data(delivery) for delivery in deliveries],
+    })
+
+@login_required
+@user_passes_test(delivery_manager_required)
+def loading_sheet(request, route_id=None):
+    """
+    Feuille de chargement : toutes les routes du jour (?date=), ou une
+    seule route, arrêts listés dans l'ordre de chargement (dernier arrêt
+    au fond du véhicule)
+    """
+    if route_id is not None:
+        route = get_object_or_404(DeliveryRoute, id=route_id)
+        selected_date, route_ids = route.date, [route.id]
+    else:
+        selected_date, route_ids = request.GET.get('date', timezone.now().date()), None
+        if isinstance(selected_date, str):
+            selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
+    
+    context = {
+        'selected_date': selected_date,
+        'plans': LoadPlanService.day_plan(selected_date, route_ids),
+        'bay_volume': LoadPlanService.BAY_VOLUME,
+        'printed_at': timezone.now(),
+    }
+    return render(request, 'JLTsite/loading_sheet.html', context)
+
 # ========================================
 # VUES ADDITIONNELLES
 # ========================================
@@ -2345,12 +2398,16 @@ def driver_realtime_stats_api(request):
     if stats['total'] > 0:
         stats['completion_rate'] = round((stats['completed'] / stats['total']) * 100, 1)
     
-    # Estimation de fin (logique simple)
+    # Estimation de fin : heure de fin tenue à jour par RouteEtaService,
+    # sinon somme des temps sur place appris des livraisons restantes
     if current_route and stats['pending'] > 0:
-        avg_time_per_delivery = 30  # 30 minutes par livraison en moyenne
-        estimated_minutes = stats['pending'] * avg_time_per_delivery
-        estimated_completion = timezone.now() + timedelta(minutes=estimated_minutes)
-        stats['estimated_completion'] = estimated_completion.strftime('%H:%M')
+        if current_route.end_time:
+            stats['estimated_completion'] = current_route.end_time.strftime('%H:%M')
+        else:
+            pending = [d for d in deliveries if d.status in ['assigned', 'in_transit']]
+            estimated_minutes = sum(ServiceTimeService.predict_many(pending).values())
+            estimated_completion = timezone.now() + timedelta(minutes=estimated_minutes)
+            stats['estimated_completion'] = estimated_completion.strftime('%H:%M')
     
     # Notifications non lues
     unread_notifications = DeliveryNotification.objects.filter(
@@ -0,0 +1,120 @@
+# geo.py - Index spatial des livraisons (geohash)
+"""
+Le geohash découpe le globe en une grille hiérarchique : chaque caractère
+divise la cellule précédente en 32. Deux points d'une même cellule partagent
+le même préfixe ; une zone de carte devient une liste de préfixes, filtrée
+par `geohash__startswith` (LIKE 'f25d%') sur une colonne indexée, sans
+parcourir les livraisons en Python.
+
+Taille approximative d'une cellule selon la précision (caractères) :
+    1: 5000 km   3: 156 km   5: 4,9 km   7: 153 m   9: 4,8 m
+    2: 1250 km   4: 39 km    6: 1,2 km   8: 38 m
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash d'un point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, value = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def decode_bbox(geohash):
+    """(sud, ouest, nord, est) de la cellule"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lng_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def cell_size(precision):
+    """(hauteur, largeur) d'une cellule en degrés"""
+    bits = precision * 5
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def cover(south, west, north, east, max_cells=32):
+    """
+    Préfixes dont l'union couvre le rectangle, à la précision la plus fine
+    qui en donne au plus `max_cells`.
+    """
+    south, north = max(min(south, north), -90.0), min(max(south, north), 90.0)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        first_row, first_col = math.floor(south / height), math.floor(west / width)
+        rows = math.floor(north / height) - first_row + 1
+        cols = math.floor(east / width) - first_col + 1
+        if rows * cols <= max_cells:
+            break
+    return sorted({
+        encode(
+            min((first_row + row + 0.5) * height, 90.0),
+            min((first_col + col + 0.5) * width, 180.0),
+            precision
+        )
+        for row in range(rows)
+        for col in range(cols)
+    })
+
+
+def around(latitude, longitude, radius_km, max_cells=9):
+    """Préfixes couvrant le carré de demi-côté `radius_km` centré sur le point"""
+    latitude, longitude = float(latitude), float(longitude)
+    lat_delta = radius_km / KM_PER_DEGREE
+    lng_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return cover(latitude - lat_delta, longitude - lng_delta,
+                 latitude + lat_delta, longitude + lng_delta, max_cells)
+
+
+def precision_for_zoom(zoom, cell_pixels=60):
+    """
+    Précision de regroupement pour un niveau de zoom Google Maps : des
+    cellules d'environ `cell_pixels` pixels à l'écran.
+    """
+    target = 360.0 / 2 ** zoom * cell_pixels / 256
+    for precision in range(1, PRECISION + 1):
+        if cell_size(precision)[1] <= target * 2:
+            return precision
+    return PRECISION
+
+
+def haversine_km(origin, destination):
+    """Distance à vol d'oiseau entre deux points (lat, lng)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (*origin, *destination))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def postal_prefix(postal_code):
+    """Région de tri d'acheminement (3 premiers caractères du code postal)"""
+    return (postal_code or '').replace(' ', '').upper()[:3]
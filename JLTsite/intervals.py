@@ -0,0 +1,74 @@
+# intervals.py - Index d'intervalles (planning du personnel)
+"""
+Arbre d'intervalles statique : les intervalles sont triés par début et
+rangés dans un arbre binaire implicite (le milieu de chaque tranche est
+la racine de sa sous-arborescence), chaque nœud mémorisant la plus grande
+fin de sa sous-arborescence. Une recherche élague les sous-arbres qui
+finissent avant le début demandé et s'arrête dès que les débuts dépassent
+la fin demandée : O(log n + k) pour k intervalles trouvés.
+
+Les intervalles sont semi-ouverts [début, fin) : un départ à 17 h et une
+arrivée à 17 h ne se chevauchent pas. Début et fin peuvent être de tout
+type ordonné (datetime, date, nombres).
+"""
+from operator import itemgetter
+
+
+class IntervalTree:
+    """Intervalles (début, fin, données) interrogeables par chevauchement"""
+
+    def __init__(self, intervals=()):
+        self.intervals = sorted(intervals, key=itemgetter(0, 1))
+        self.max_end = [None] * len(self.intervals)
+        self._build(0, len(self.intervals))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.intervals[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self.max_end[mid] = max_end
+        return max_end
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __iter__(self):
+        return iter(self.intervals)
+
+    def overlapping(self, start, end):
+        """Intervalles qui chevauchent [start, end), par début croissant"""
+        found = []
+        self._search(0, len(self.intervals), start, end, found)
+        return found
+
+    def _search(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_end[mid] <= start:
+            return
+        self._search(lo, mid, start, end, found)
+        interval = self.intervals[mid]
+        if interval[0] >= end:
+            # Le nœud et tout son sous-arbre droit commencent après la fin
+            return
+        if interval[1] > start:
+            found.append(interval)
+        self._search(mid + 1, hi, start, end, found)
+
+    def overlaps(self, start, end):
+        return bool(self.overlapping(start, end))
+
+    def overlapping_pairs(self):
+        """Paires d'intervalles qui se chevauchent (balayage par début)"""
+        pairs = []
+        active = []
+        for interval in self.intervals:
+            active = [other for other in active if other[1] > interval[0]]
+            pairs.extend((other, interval) for other in active)
+            active.append(interval)
+        return pairs
@@ -5,6 +5,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponse
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.db import transaction
 from django.db.models import Q, Count, Sum, Avg
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_http_methods
@@ -13,11 +15,72 @@ import json
 from django.urls import reverse
 from .models import *
 from JLTsite.models import Order, OrderItem
+from .routers import use_replica
+from .services import DemandForecastService, StockLedgerService
 
 # ========================================
 # VUES CHEF DE CUISINE (HEAD CHEF)
 # ========================================
 
+def head_chef_order_stats(start_date, today):
+    """Commandes de la période (jusqu'à J+7) : nombre, en attente, revenus"""
+    orders = Order.objects.filter(
+        delivery_date__gte=start_date,
+        delivery_date__lte=today + timedelta(days=7)
+    )
+    totals = orders.aggregate(
+        total_orders=Count('id'),
+        pending_orders=Count('id', filter=Q(status='pending')),
+        total_revenue=Sum('total'),
+        avg_order_value=Avg('total'),
+    )
+    totals['total_revenue'] = totals['total_revenue'] or 0
+    totals['avg_order_value'] = totals['avg_order_value'] or 0
+    return totals
+
+def head_chef_production_stats(today_productions):
+    """Avancement des productions du jour, en une requête"""
+    totals = today_productions.aggregate(
+        total_departments=Count('id'),
+        completed_departments=Count('id', filter=Q(status='completed')),
+        in_progress_departments=Count('id', filter=Q(status='in_progress')),
+        avg_progress=Avg('progress_percentage'),
+    )
+    totals['avg_progress'] = totals['avg_progress'] or 0
+    return totals
+
+def head_chef_department_progress(today):
+    """Progression par département sur les 7 derniers jours (du plus récent au plus ancien)"""
+    dept_data = {}
+    productions = KitchenProduction.objects.filter(
+        date__gt=today - timedelta(days=7), date__lte=today
+    ).order_by('-date')
+    for prod in productions:
+        dept_data.setdefault(prod.department, []).append(prod.progress_percentage)
+    return dept_data
+
+def demand_forecast(department=None, top=10):
+    """
+    Prévision sur 7 jours pour les tableaux de bord ; par département,
+    ajoute les `top` premiers produits mis en forme pour le tableau.
+    """
+    forecast = DemandForecastService.get_forecast(days=7, department=department)
+    if department is None:
+        return {'forecast': forecast}
+    return {
+        'forecast': forecast,
+        'forecast_rows': [
+            {
+                'product_name': row['product_name'],
+                'cells': [
+                    {'forecast': quantity, 'booked': booked}
+                    for quantity, booked in zip(row['forecast'], row['booked'])
+                ],
+            }
+            for row in forecast['rows'][:top]
+        ],
+    }
+
 @login_required
 def head_chef_dashboard(request):
     """Dashboard principal du chef de cuisine"""
@@ -36,27 +99,11 @@ def head_chef_dashboard(request):
     else:
         start_date = today - timedelta(days=90)
     
-    # Statistiques générales
-    orders = Order.objects.filter(
-        delivery_date__gte=start_date,
-        delivery_date__lte=today + timedelta(days=7)
-    )
-    
-    stats = {
-        'total_orders': orders.count(),
-        'pending_orders': orders.filter(status='pending').count(),
-        'total_revenue': orders.aggregate(Sum('total'))['total__sum'] or 0,
-        'avg_order_value': orders.aggregate(Avg('total'))['total__avg'] or 0,
-    }
-    
-    # Productions du jour
+    # Statistiques générales et productions du jour : calculées au rendu,
+    # seulement si le fragment correspondant n'est pas en cache
+    stats = SimpleLazyObject(lambda: head_chef_order_stats(start_date, today))
     today_productions = KitchenProduction.objects.filter(date=today)
-    production_stats = {
-        'total_departments': today_productions.count(),
-        'completed_departments': today_productions.filter(status='completed').count(),
-        'in_progress_departments': today_productions.filter(status='in_progress').count(),
-        'avg_progress': today_productions.aggregate(Avg('progress_percentage'))['progress_percentage__avg'] or 0,
-    }
+    production_stats = SimpleLazyObject(lambda: head_chef_production_stats(today_productions))
     
     # Commandes de produits en attente
     pending_product_orders = ProductOrder.objects.filter(status='pending').count()
@@ -90,14 +137,7 @@ def head_chef_dashboard(request):
     
     # Données pour les graphiques
     # Production par département (7 derniers jours)
-    dept_data = {}
-    for i in range(7):
-        check_date = today - timedelta(days=i)
-        productions = KitchenProduction.objects.filter(date=check_date)
-        for prod in productions:
-            if prod.department not in dept_data:
-                dept_data[prod.department] = []
-            dept_data[prod.department].append(prod.progress_percentage)
+    dept_data = SimpleLazyObject(lambda: head_chef_department_progress(today))
     
     context = {
         'period': period,
@@ -107,6 +147,8 @@ def head_chef_dashboard(request):
         'notifications': notifications,
         'today_productions': today_productions,
         'dept_data': dept_data,
+        # Prévision de la demande (calculée une fois par jour)
+        **demand_forecast(),
     }
     
     return render(request, 'JLTsite/head_chef_dashboard.html', context)
@@ -394,13 +436,22 @@ def head_chef_product_order_detail(request, order_id):
             messages.warning(request, f"Commande {product_order.order_number} rejetée")
             
         elif action == 'mark_received':
-            product_order.status = 'received'
-            product_order.save()
-            
-            # Mettre à jour le stock
-            for item in product_order.items.all():
-                item.product.current_stock += item.received_quantity
-                item.product.save()
+            with transaction.atomic():
+                # Verrouiller la commande pour éviter une double réception
+                locked_order = ProductOrder.objects.select_for_update().get(pk=product_order.pk)
+                if locked_order.status == 'received':
+                    messages.warning(request, "Cette commande a déjà été reçue")
+                    return redirect('head_chef_product_orders')
+                
+                # Écrire sur la ligne verrouillée : product_order a été lue avant le verrou
+                locked_order.status = 'received'
+                locked_order.save(update_fields=['status', 'updated_at'])
+                
+                # Mettre à jour le stock via le journal des mouvements
+                StockLedgerService.receive_items(
+                    locked_order.items.select_related('product', 'order'),
+                    created_by=request.user
+                )
                 
             messages.success(request, "Commande marquée comme reçue et stock mis à jour")
         
@@ -548,7 +599,6 @@ def head_chef_add_product(request):
             name=request.POST.get('name'),
             category=request.POST.get('category'),
             unit=request.POST.get('unit'),
-            current_stock=request.POST.get('current_stock', 0),
             min_stock=request.POST.get('min_stock', 0),
             max_stock=request.POST.get('max_stock', 0),
             unit_price=request.POST.get('unit_price', 0),
@@ -564,6 +614,13 @@ def head_chef_add_product(request):
         product.departments = departments
         
         product.save()
+        
+        # Le stock initial passe par le journal des mouvements
+        initial_stock = request.POST.get('current_stock') or 0
+        StockLedgerService.record(
+            product, StockMovement.ADJUSTMENT, initial_stock,
+            created_by=request.user, notes='Stock initial'
+        )
         messages.success(request, f"Produit {product.name} ajouté avec succès")
         return redirect('head_chef_manage_products')
     
@@ -590,7 +647,6 @@ def head_chef_edit_product(request, product_id):
         product.name = request.POST.get('name')
         product.category = request.POST.get('category')
         product.unit = request.POST.get('unit')
-        product.current_stock = request.POST.get('current_stock', 0)
         product.min_stock = request.POST.get('min_stock', 0)
         product.max_stock = request.POST.get('max_stock', 0)
         product.unit_price = request.POST.get('unit_price', 0)
@@ -603,7 +659,15 @@ def head_chef_edit_product(request, product_id):
         departments = request.POST.getlist('departments')
         product.departments = departments
         
-        product.save()
+        # Ne pas réécrire current_stock : il n'est modifié que par le journal
+        product.save(update_fields=[
+            'name', 'category', 'unit', 'min_stock', 'max_stock', 'unit_price',
+            'shelf_life_days', 'supplier', 'departments', 'updated_at'
+        ])
+        
+        counted_stock = request.POST.get('current_stock')
+        if counted_stock not in (None, ''):
+            StockLedgerService.set_stock(product, counted_stock, created_by=request.user)
         messages.success(request, f"Produit {product.name} modifié avec succès")
         return redirect('head_chef_manage_products')
     
@@ -674,6 +738,7 @@ def head_chef_manage_suppliers(request):
 # ========================================
 
 @login_required
+@use_replica()
 def head_chef_reports(request):
     """Page principale des rapports"""
     if request.user.role not in ['head_chef', 'admin']:
@@ -833,6 +898,7 @@ def head_chef_export_reports(request):
     
     return redirect('head_chef_reports')
 
+@use_replica()
 def export_csv_report(request, report_type, start_date, end_date):
     """Exporter en CSV"""
     response = HttpResponse(content_type='text/csv')
@@ -1147,6 +1213,8 @@ def department_chef_dashboard(request):
         'notifications': notifications,
         'unread_notifications_count': unread_notifications_count,
         'is_today': selected_date == today,
+        # Prévision de la demande du département (produits principaux)
+        **demand_forecast(department),
     }
     
     return render(request, 'JLTsite/department_chef_dashboard.html', context)
@@ -1841,25 +1909,28 @@ def mark_product_order_received(request, order_id):
         return JsonResponse({'success': False, 'error': 'Accès non autorisé'})
     
     try:
-        product_order = get_object_or_404(ProductOrder, id=order_id, requested_by=request.user)
-        
-        if product_order.status != 'ordered':
-            return JsonResponse({'success': False, 'error': 'Cette commande doit être commandée avant d\'être marquée comme reçue'})
-        
-        product_order.status = 'received'
-        product_order.delivery_date = timezone.now().date()
-        product_order.save()
-        
-        # Mettre à jour le stock des produits
-        for item in product_order.items.all():
-            item.received_quantity = item.quantity
-            item.received_at = timezone.now()
-            item.save()
+        with transaction.atomic():
+            # Verrouiller la commande : deux réceptions simultanées ne doivent pas doubler le stock
+            product_order = get_object_or_404(
+                ProductOrder.objects.select_for_update(), id=order_id, requested_by=request.user
+            )
+            
+            if product_order.status != 'ordered':
+                return JsonResponse({'success': False, 'error': 'Cette commande doit être commandée avant d\'être marquée comme reçue'})
+            
+            now = timezone.now()
+            product_order.status = 'received'
+            product_order.delivery_date = now.date()
+            product_order.save()
+            
+            items = list(product_order.items.select_related('product', 'order'))
+            for item in items:
+                item.received_quantity = item.quantity
+                item.received_at = now
+            ProductOrderItem.objects.bulk_update(items, ['received_quantity', 'received_at'])
             
-            # Ajouter au stock
-            product = item.product
-            product.current_stock += item.quantity
-            product.save()
+            # Ajouter au stock via le journal des mouvements
+            StockLedgerService.receive_items(items, created_by=request.user)
         
         return JsonResponse({'success': True})
     except Exception as e:
@@ -15,6 +15,7 @@ import json
 from datetime import datetime, timedelta, date
 from .models import *
 from .models import User
+from .services import StaffSchedulingService
 
 def maitre_hotel_required(user):
     """Vérifier que l'utilisateur est un maître d'hôtel"""
@@ -330,13 +331,15 @@ def maitre_hotel_planning(request):
     # Calculer les 7 jours suivants
     dates = [start_date + timedelta(days=i) for i in range(7)]
     
-    # Événements de la semaine
-    events_by_date = {}
-    for day in dates:
-        events_by_date[day] = EventContract.objects.filter(
-            maitre_hotel=request.user,
-            event_start_time__date=day
-        ).order_by('event_start_time')
+    # Événements de la semaine (une requête, répartis par jour)
+    week_start, week_end = StaffSchedulingService.day_bounds(start_date, len(dates))
+    events_by_date = {day: [] for day in dates}
+    for event in EventContract.objects.filter(
+        maitre_hotel=request.user,
+        event_start_time__gte=week_start,
+        event_start_time__lt=week_end
+    ).order_by('event_start_time'):
+        events_by_date[timezone.localtime(event.event_start_time).date()].append(event)
     
     context = {
         'start_date': start_date,
@@ -0,0 +1,84 @@
+# management/commands/backtest_forecast.py
+# Mesure l'erreur de la prévision de la demande sur l'historique des commandes
+
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from JLTsite.models import OrderItem
+from JLTsite.services import DemandForecastService
+
+class Command(BaseCommand):
+    help = 'Rejoue la prévision de la demande sur une période passée et affiche l\'erreur par département'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=28,
+            help='Nombre de jours rejoués, se terminant hier (défaut : 28)'
+        )
+        parser.add_argument(
+            '--end',
+            help='Dernier jour rejoué (AAAA-MM-JJ, défaut : hier)'
+        )
+        parser.add_argument(
+            '--horizon',
+            type=int,
+            default=1,
+            help='Nombre de jours entre la prévision et le jour prédit (défaut : 1)'
+        )
+        parser.add_argument(
+            '--department',
+            choices=[code for code, _ in OrderItem.DEPARTMENT_CHOICES],
+            help='Limiter au département indiqué'
+        )
+
+    def handle(self, *args, **options):
+        if options['end']:
+            try:
+                end_date = datetime.strptime(options['end'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Format de date invalide, attendu AAAA-MM-JJ')
+        else:
+            end_date = timezone.localdate() - timedelta(days=1)
+        if options['horizon'] < 1:
+            raise CommandError('L\'horizon doit être d\'au moins 1 jour')
+        start_date = end_date - timedelta(days=options['days'] - 1)
+        
+        start = time.perf_counter()
+        results = DemandForecastService.backtest(
+            start_date, end_date,
+            horizon=options['horizon'],
+            department=options['department']
+        )
+        elapsed = time.perf_counter() - start
+        
+        if not results:
+            self.stdout.write(self.style.WARNING('Aucune commande sur la période'))
+            return
+        
+        self.stdout.write(
+            f'Backtest du {start_date} au {end_date} (horizon {options["horizon"]} j) en {elapsed:.2f}s'
+        )
+        self.stdout.write(f'{"Département":<22}{"Réel":>8}{"WAPE":>9}{"Biais":>9}{"Naïf":>9}')
+        
+        department_names = dict(OrderItem.DEPARTMENT_CHOICES)
+        for code, metrics in sorted(results.items(), key=lambda item: (item[0] == '__all__', item[0])):
+            label = 'Total' if code == '__all__' else department_names.get(code, code)
+            self.stdout.write(
+                f'{label:<22}{metrics["actual"]:>8}'
+                f'{self.format_pct(metrics["wape"]):>9}'
+                f'{self.format_pct(metrics["bias"]):>9}'
+                f'{self.format_pct(metrics["naive_wape"]):>9}'
+            )
+        
+        self.stdout.write(self.style.SUCCESS(
+            'WAPE : erreur absolue / quantité réelle ; Naïf : même jour la semaine précédente'
+        ))
+
+    @staticmethod
+    def format_pct(value):
+        return '-' if value is None else f'{value:.1f}%'
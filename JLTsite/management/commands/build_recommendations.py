@@ -0,0 +1,82 @@
+# management/commands/build_recommendations.py
+# Construit le modèle de co-achat (à planifier chaque nuit avec --incremental)
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from django.utils import timezone
+
+from JLTsite.models import Order, OrderItem, Product, ProductRecommendation
+from JLTsite.services import RecommendationService
+
+class Command(BaseCommand):
+    help = 'Calcule les recommandations « souvent commandés ensemble » à partir de l\'historique des commandes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Ne recalcule que les produits des commandes modifiées récemment'
+        )
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=26,
+            help='Fenêtre de la mise à jour incrémentale en heures (défaut : 26)'
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=RecommendationService.TOP_K,
+            help='Nombre de voisins conservés par produit'
+        )
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='Mesure le temps de construction et de lecture sur les données actuelles'
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        
+        if options['incremental']:
+            since = timezone.now() - timedelta(hours=options['hours'])
+            count = RecommendationService.update_recent(since, top_k=options['top_k'])
+            mode = 'incrémentale'
+        else:
+            count = RecommendationService.build_co_purchase_model(top_k=options['top_k'])
+            mode = 'complète'
+        
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Construction {mode} : {count} recommandation(s) écrite(s) en {elapsed:.2f}s'
+        ))
+        
+        if options['benchmark']:
+            self.run_benchmark()
+
+    def run_benchmark(self):
+        """Affiche le volume traité et le coût des lectures à froid et en cache"""
+        self.stdout.write(
+            f'Volume : {Order.objects.count()} commandes, {OrderItem.objects.count()} articles, '
+            f'{Product.objects.count()} produits, {ProductRecommendation.objects.count()} voisins stockés'
+        )
+        
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        if not product_ids:
+            return
+        
+        cache.delete_many([RecommendationService._product_cache_key(pid) for pid in product_ids])
+        start = time.perf_counter()
+        for product_id in product_ids:
+            RecommendationService.get_complementary_items(product_id)
+        cold = (time.perf_counter() - start) / len(product_ids) * 1000
+        
+        start = time.perf_counter()
+        for product_id in product_ids:
+            RecommendationService.get_complementary_items(product_id)
+        warm = (time.perf_counter() - start) / len(product_ids) * 1000
+        
+        self.stdout.write(f'Lecture à froid : {cold:.3f} ms/produit, en cache : {warm:.3f} ms/produit')
@@ -0,0 +1,134 @@
+# management/commands/check_query_plans.py
+# Vérifie par EXPLAIN que les requêtes critiques des vues utilisent un index
+
+import json
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from JLTsite.models import (
+    Delivery, DeliveryNotification, DeliveryRoute, DeliverySlot, DriverPlanning,
+    EventNotifications, KitchenNotification, Order, OrderItem
+)
+
+# Lignes de plan SQLite du type "SCAN JLTsite_order" (parcours complet de la table),
+# "SCAN TABLE JLTsite_order" avant SQLite 3.36
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(?!TABLE\b)(\w+)(?! USING (?:COVERING )?INDEX)(?!\w)')
+
+
+def hot_querysets():
+    """Catalogue des requêtes critiques : (libellé, queryset, tables devant être accédées par index)"""
+    today = timezone.localdate()
+    week_end = today + timedelta(days=7)
+    user_id = 1
+
+    return [
+        ('Commandes du jour par statut (production, calendrier)',
+         Order.objects.filter(delivery_date=today, status__in=['confirmed', 'preparing']),
+         [Order]),
+        ('Commandes à traiter, plus récentes d\'abord (admin)',
+         Order.objects.filter(status='pending').order_by('-created_at'),
+         [Order]),
+        ('Articles d\'un département pour un jour (cuisine)',
+         OrderItem.objects.filter(department='chaud', order__delivery_date=today),
+         [Order, OrderItem]),
+        ('Routes d\'un livreur pour un jour',
+         DeliveryRoute.objects.filter(date=today, driver_id=user_id),
+         [DeliveryRoute]),
+        ('Routes du jour',
+         DeliveryRoute.objects.filter(date=today),
+         [DeliveryRoute]),
+        ('Planning d\'un livreur',
+         DriverPlanning.objects.filter(driver_id=user_id, date__range=(today, week_end)),
+         [DriverPlanning]),
+        ('Livreurs disponibles sur la semaine (créneaux)',
+         DriverPlanning.objects.filter(date__range=(today, week_end), is_available=True),
+         [DriverPlanning]),
+        ('Livraisons du jour par statut',
+         Delivery.objects.filter(scheduled_date=today, status='scheduled'),
+         [Delivery]),
+        ('Créneaux d\'un jour',
+         DeliverySlot.objects.filter(date=today),
+         [DeliverySlot]),
+        ('Notifications livraison non lues',
+         DeliveryNotification.objects.filter(recipient_id=user_id, is_read=False),
+         [DeliveryNotification]),
+        ('Notifications cuisine non lues',
+         KitchenNotification.objects.filter(recipient_id=user_id, is_read=False),
+         [KitchenNotification]),
+        ('Notifications maître d\'hôtel non lues',
+         EventNotifications.objects.filter(recipient_id=user_id, is_read=False),
+         [EventNotifications]),
+    ]
+
+
+def sqlite_full_scans(plan):
+    """Tables parcourues entièrement d'après le plan SQLite"""
+    return {match.group(1) for match in SQLITE_FULL_SCAN.finditer(plan)}
+
+
+def mysql_full_scans(plan, min_rows):
+    """Tables en access_type ALL dans le plan JSON MySQL (au-delà de min_rows lignes estimées)"""
+    scans = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL' and 'table_name' in node:
+                rows = int(node.get('rows_examined_per_scan', min_rows))
+                if rows >= min_rows:
+                    scans.add(node['table_name'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return scans
+
+
+class Command(BaseCommand):
+    help = 'Exécute EXPLAIN sur les requêtes critiques et échoue si l\'une parcourt une table entière'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=1000,
+            help='MySQL : ignorer les parcours complets estimés sous ce nombre de lignes (défaut : 1000)'
+        )
+        parser.add_argument(
+            '--show-plans',
+            action='store_true',
+            help='Afficher le plan de chaque requête'
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in ('sqlite', 'mysql'):
+            raise CommandError(f'Base {vendor} non prise en charge (SQLite ou MySQL)')
+
+        failures = []
+        for label, queryset, models in hot_querysets():
+            if vendor == 'mysql':
+                plan = queryset.explain(format='JSON')
+                scans = mysql_full_scans(plan, options['min_rows'])
+            else:
+                plan = queryset.explain()
+                scans = sqlite_full_scans(plan)
+
+            regressions = sorted(scans & {model._meta.db_table for model in models})
+            if regressions:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f'✗ {label} : parcours complet de {", ".join(regressions)}'))
+            else:
+                self.stdout.write(f'✓ {label}')
+            if options['show_plans'] or regressions:
+                self.stdout.write(f'    {plan}'.replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError(f'{len(failures)} requête(s) sans index adapté')
+        self.stdout.write(self.style.SUCCESS('Toutes les requêtes critiques utilisent un index'))
@@ -0,0 +1,34 @@
+# management/commands/downsample_gps_tracks.py
+# Sous-échantillonnage des anciennes traces GPS (à planifier chaque nuit)
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from JLTsite.services import LocationTrackService
+
+class Command(BaseCommand):
+    help = 'Regroupe par heure les blocs GPS d\'une minute plus anciens que GPS_DOWNSAMPLE_AFTER_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.GPS_DOWNSAMPLE_AFTER_DAYS,
+            help=f'Âge minimal des blocs en jours (défaut : {settings.GPS_DOWNSAMPLE_AFTER_DAYS})'
+        )
+        parser.add_argument(
+            '--step',
+            type=int,
+            default=settings.GPS_DOWNSAMPLE_STEP_SECONDS,
+            help=f'Une position gardée toutes les N secondes (défaut : {settings.GPS_DOWNSAMPLE_STEP_SECONDS})'
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options['days'])
+        removed, written = LocationTrackService.downsample(older_than, options['step'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{removed} bloc(s) d\'une minute regroupé(s) en {written} bloc(s) horaire(s)'
+        ))
@@ -0,0 +1,27 @@
+# management/commands/fit_service_times.py
+# Apprentissage des temps sur place des livraisons (à planifier chaque nuit)
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.services import ServiceTimeService
+
+class Command(BaseCommand):
+    help = 'Recalcule les temps sur place appris (ServiceTimeEstimate) à partir des heures réelles des arrêts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=ServiceTimeService.HISTORY_DAYS,
+            help=f'Historique pris en compte en jours (défaut : {ServiceTimeService.HISTORY_DAYS})'
+        )
+
+    def handle(self, *args, **options):
+        estimates = ServiceTimeService.fit(history_days=options['days'])
+        by_dimension = Counter(estimate.dimension for estimate in estimates)
+        detail = ', '.join(f'{dimension} : {count}' for dimension, count in sorted(by_dimension.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(estimates)} estimation(s) enregistrée(s)' + (f' ({detail})' if detail else '')
+        ))
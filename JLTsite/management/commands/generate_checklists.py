@@ -0,0 +1,37 @@
+# management/commands/generate_checklists.py
+# Checklists des commandes confirmées d'une date, depuis les modèles (à planifier chaque soir pour le lendemain)
+
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from JLTsite.services import ChecklistTemplateService
+
+class Command(BaseCommand):
+    help = 'Génère depuis les modèles les checklists manquantes des commandes confirmées d\'une date'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            help='Date de livraison (AAAA-MM-JJ, demain par défaut)'
+        )
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Date invalide, format attendu AAAA-MM-JJ')
+        else:
+            day = timezone.localdate() + timedelta(days=1)
+
+        created, skipped = ChecklistTemplateService.create_for_date(day)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} checklist(s) générée(s) pour le {day:%d/%m/%Y}'
+        ))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{len(skipped)} commande(s) sans modèle correspondant : '
+                + ', '.join(order.order_number for order in skipped)
+            ))
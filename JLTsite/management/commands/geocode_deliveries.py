@@ -0,0 +1,29 @@
+# management/commands/geocode_deliveries.py
+# Géocodage groupé des livraisons sans coordonnées (à planifier régulièrement)
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from JLTsite.models import Delivery
+from JLTsite.services import DeliveryFactoryService
+
+class Command(BaseCommand):
+    help = 'Géocode les livraisons à venir sans coordonnées (adresses déjà connues reprises sans appel à l\'API)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Inclure les livraisons passées'
+        )
+
+    def handle(self, *args, **options):
+        deliveries = Delivery.objects.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True))
+        if not options['all']:
+            deliveries = deliveries.filter(scheduled_date__gte=timezone.localdate())
+        deliveries = list(deliveries)
+        geocoded = DeliveryFactoryService.geocode(deliveries)
+        self.stdout.write(self.style.SUCCESS(
+            f'{geocoded} livraison(s) géocodée(s) sur {len(deliveries)}'
+        ))
@@ -0,0 +1,14 @@
+# management/commands/process_order_jobs.py
+# Livraisons et réapprovisionnement des changements de statut groupés (à planifier toutes les minutes)
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.services import OrderStatusService
+
+class Command(BaseCommand):
+    help = 'Traite les changements de statut groupés en attente : livraisons créées en lot, un seul recalcul du réapprovisionnement'
+
+    def handle(self, *args, **options):
+        jobs = OrderStatusService.process_jobs()
+        orders = sum(len(job.order_ids) for job in jobs)
+        self.stdout.write(self.style.SUCCESS(f'{len(jobs)} traitement(s), {orders} commande(s)'))
@@ -0,0 +1,22 @@
+# management/commands/rebuild_customer_stats.py
+# Recalcule la table CustomerStats (à planifier chaque nuit pour rafraîchir les segments RFM)
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.models import CustomerStats
+
+class Command(BaseCommand):
+    help = 'Reconstruit les statistiques précalculées des clients (commandes, valeur, segment RFM)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Taille des lots d\'insertion'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reconstruction des statistiques clients...')
+        count = CustomerStats.rebuild_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count} fiche(s) client recalculée(s) avec succès !'))
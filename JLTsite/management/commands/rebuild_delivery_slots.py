@@ -0,0 +1,30 @@
+# management/commands/rebuild_delivery_slots.py
+# Recompte les capacités et réservations des créneaux de livraison
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from JLTsite.services import SlotCapacityService
+
+class Command(BaseCommand):
+    help = 'Recalcule les compteurs des créneaux de livraison à partir des commandes et du planning livreurs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=SlotCapacityService.BOOKING_DAYS + 7,
+            help='Nombre de jours recalculés à partir d\'aujourd\'hui'
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        days = [today + timedelta(days=offset) for offset in range(options['days'])]
+        slots = SlotCapacityService.rebuild(days)
+        
+        booked = sum(slot.orders_booked for slot in slots.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(slots)} créneau(x) recalculé(s) sur {len(days)} jour(s), {booked} commande(s) réservée(s)'
+        ))
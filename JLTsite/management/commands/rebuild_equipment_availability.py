@@ -0,0 +1,13 @@
+# management/commands/rebuild_equipment_availability.py
+# Recompte l'index de disponibilité du matériel depuis les checklists (réparation)
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.services import EquipmentAvailabilityService
+
+class Command(BaseCommand):
+    help = 'Reconstruit les réservations de matériel par journée à partir des checklists'
+
+    def handle(self, *args, **options):
+        count = EquipmentAvailabilityService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{count} journée(s) article reconstruite(s)'))
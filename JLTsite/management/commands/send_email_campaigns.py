@@ -0,0 +1,17 @@
+# management/commands/send_email_campaigns.py
+# Envoi des campagnes d'emails en attente (à planifier toutes les quelques minutes)
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.services import BulkMailerService
+
+class Command(BaseCommand):
+    help = 'Envoie les envois groupés en attente, une connexion SMTP pour toutes les campagnes'
+
+    def handle(self, *args, **options):
+        campaigns = BulkMailerService.send_queued_campaigns()
+        for campaign in campaigns:
+            self.stdout.write(
+                f'{campaign.subject} : {campaign.sent_count} envoyé(s), {campaign.failed_count} échec(s)'
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(campaigns)} campagne(s) traitée(s)'))
@@ -0,0 +1,16 @@
+# management/commands/take_stock_snapshots.py
+# Photo du stock cuisine (à planifier chaque nuit)
+
+from django.core.management.base import BaseCommand
+
+from JLTsite.services import StockLedgerService
+
+class Command(BaseCommand):
+    help = 'Enregistre une photo du stock de chaque produit cuisine actif'
+
+    def handle(self, *args, **options):
+        snapshots = StockLedgerService.take_snapshots()
+        total_value = sum(snapshot.value for snapshot in snapshots)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(snapshots)} photo(s) de stock enregistrée(s), valeur totale {total_value:.2f} $'
+        ))
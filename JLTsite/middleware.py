@@ -3,6 +3,9 @@
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
+from django.conf import settings
+
+from .routers import has_written, request_scope
 
 class ChecklistRoleMiddleware:
     """
@@ -69,4 +72,27 @@ class AutoRedirectMiddleware:
                 pass
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+class ReplicaStickinessMiddleware:
+    """
+    Lire ses propres écritures : après une écriture, un cookie garde les
+    lectures de l'utilisateur sur la base primaire pendant
+    REPLICA_STICKY_SECONDS, le temps que la réplique rattrape son retard.
+    """
+    COOKIE_NAME = 'db_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_scope(pinned=self.COOKIE_NAME in request.COOKIES):
+            response = self.get_response(request)
+            if has_written():
+                response.set_cookie(
+                    self.COOKIE_NAME, '1',
+                    max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+                    httponly=True,
+                    samesite='Lax',
+                )
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-19 09:12
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_scheduled_end_at(apps, schema_editor):
+    Delivery = apps.get_model('JLTsite', 'Delivery')
+    deliveries = list(
+        Delivery.objects.filter(scheduled_end_at__isnull=True)
+        .only('id', 'scheduled_date', 'scheduled_time_end')
+    )
+    for delivery in deliveries:
+        delivery.scheduled_end_at = timezone.make_aware(
+            datetime.datetime.combine(delivery.scheduled_date, delivery.scheduled_time_end)
+        )
+    Delivery.objects.bulk_update(deliveries, ['scheduled_end_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0008_eventcontract_kitchenproduct_kitchenproduction_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='scheduled_end_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Fin du créneau prévu (calculée)', null=True),
+        ),
+        migrations.RunPython(fill_scheduled_end_at, migrations.RunPython.noop),
+    ]
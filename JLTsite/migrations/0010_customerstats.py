@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-19 10:03
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0009_delivery_scheduled_end_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='customer_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('orders_count', models.IntegerField(default=0, verbose_name='Nombre de commandes')),
+                ('total_spent', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Valeur totale')),
+                ('average_order', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10, verbose_name='Panier moyen')),
+                ('first_order_at', models.DateTimeField(blank=True, null=True, verbose_name='Première commande')),
+                ('last_order_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernière commande')),
+                ('recency_score', models.IntegerField(default=0)),
+                ('frequency_score', models.IntegerField(default=0)),
+                ('monetary_score', models.IntegerField(default=0)),
+                ('segment', models.CharField(choices=[('vip', 'VIP'), ('loyal', 'Fidèle'), ('regular', 'Régulier'), ('new', 'Nouveau'), ('at_risk', 'À risque'), ('inactive', 'Inactif'), ('prospect', 'Sans commande')], default='prospect', max_length=20, verbose_name='Segment')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Statistiques client',
+                'verbose_name_plural': 'Statistiques clients',
+                'indexes': [models.Index(fields=['orders_count'], name='JLTsite_cus_orders__e532e2_idx'), models.Index(fields=['total_spent'], name='JLTsite_cus_total_s_9007dc_idx'), models.Index(fields=['last_order_at'], name='JLTsite_cus_last_or_4db809_idx'), models.Index(fields=['segment'], name='JLTsite_cus_segment_6b5a29_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-19 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0010_customerstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(default=0, verbose_name='Rang')),
+                ('score', models.FloatField(default=0, verbose_name='Score (cosinus)')),
+                ('co_orders', models.IntegerField(default=0, verbose_name='Commandes communes')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='JLTsite.product')),
+                ('recommended_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='JLTsite.product')),
+            ],
+            options={
+                'verbose_name': 'Recommandation produit',
+                'verbose_name_plural': 'Recommandations produits',
+                'ordering': ['product', 'rank'],
+                'indexes': [models.Index(fields=['product', 'rank'], name='JLTsite_pro_product_88bd43_idx')],
+                'unique_together': {('product', 'recommended_product')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-19 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0011_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productorder',
+            name='auto_generated',
+            field=models.BooleanField(default=False, verbose_name='Générée automatiquement'),
+        ),
+        migrations.CreateModel(
+            name='RecipeComponent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=10, verbose_name='Quantité par unité vendue')),
+                ('waste_percentage', models.DecimalField(decimal_places=2, default=0, max_digits=5, verbose_name='Perte (%)')),
+                ('notes', models.CharField(blank=True, max_length=200, verbose_name='Notes')),
+                ('kitchen_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='used_in', to='JLTsite.kitchenproduct', verbose_name='Ingrédient')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_components', to='JLTsite.product', verbose_name='Produit vendu')),
+            ],
+            options={
+                'verbose_name': 'Composant de recette',
+                'verbose_name_plural': 'Composants de recette',
+                'unique_together': {('product', 'kitchen_product')},
+            },
+        ),
+    ]
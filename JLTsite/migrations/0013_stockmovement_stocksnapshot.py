@@ -0,0 +1,72 @@
+# Generated by Django 5.1.6 on 2026-10-19 11:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_opening_snapshots(apps, schema_editor):
+    KitchenProduct = apps.get_model('JLTsite', 'KitchenProduct')
+    StockSnapshot = apps.get_model('JLTsite', 'StockSnapshot')
+    now = timezone.now()
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(
+            kitchen_product_id=product.id,
+            taken_at=now,
+            quantity=product.current_stock,
+            unit_price=product.unit_price,
+            value=product.current_stock * product.unit_price,
+        )
+        for product in KitchenProduct.objects.only('id', 'current_stock', 'unit_price')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0012_productorder_auto_generated_recipecomponent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('receipt', 'Réception'), ('consumption', 'Consommation'), ('adjustment', 'Ajustement'), ('waste', 'Perte')], max_length=20, verbose_name='Type de mouvement')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Quantité')),
+                ('unit_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Coût unitaire')),
+                ('department', models.CharField(blank=True, max_length=20, verbose_name='Département')),
+                ('notes', models.CharField(blank=True, max_length=255, verbose_name='Notes')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date du mouvement')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+                ('kitchen_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='JLTsite.kitchenproduct', verbose_name='Produit')),
+                ('product_order_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='JLTsite.productorderitem', verbose_name='Article de commande')),
+            ],
+            options={
+                'verbose_name': 'Mouvement de stock',
+                'verbose_name_plural': 'Mouvements de stock',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['kitchen_product', 'created_at'], name='JLTsite_sto_kitchen_0f120c_idx'), models.Index(fields=['movement_type', 'created_at'], name='JLTsite_sto_movemen_4b76b7_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(verbose_name='Date de la photo')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Quantité')),
+                ('unit_price', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Prix unitaire')),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Valeur')),
+                ('kitchen_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='JLTsite.kitchenproduct', verbose_name='Produit')),
+            ],
+            options={
+                'verbose_name': 'Photo de stock',
+                'verbose_name_plural': 'Photos de stock',
+                'ordering': ['-taken_at'],
+                'indexes': [models.Index(fields=['kitchen_product', 'taken_at'], name='JLTsite_sto_kitchen_812c61_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-19 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0013_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliverysettings',
+            name='default_slot_capacity',
+            field=models.IntegerField(default=4, help_text="Livraisons par créneau lorsque aucun planning livreur n'est saisi"),
+        ),
+        migrations.AddField(
+            model_name='deliverysettings',
+            name='kitchen_slot_capacity',
+            field=models.IntegerField(default=10, help_text='Commandes que la cuisine peut préparer par créneau'),
+        ),
+        migrations.CreateModel(
+            name='DeliverySlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('delivery_capacity', models.PositiveIntegerField(default=0, verbose_name='Capacité livraison')),
+                ('kitchen_capacity', models.PositiveIntegerField(default=0, verbose_name='Capacité cuisine')),
+                ('deliveries_booked', models.PositiveIntegerField(default=0, verbose_name='Livraisons réservées')),
+                ('orders_booked', models.PositiveIntegerField(default=0, verbose_name='Commandes réservées')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Créneau de livraison',
+                'verbose_name_plural': 'Créneaux de livraison',
+                'ordering': ['date', 'start_time'],
+                'unique_together': {('date', 'start_time')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0014_deliverysettings_default_slot_capacity_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_status', models.CharField(blank=True, choices=[('pending', 'En attente'), ('confirmed', 'Confirmée'), ('preparing', 'En préparation'), ('ready', 'Prête'), ('delivered', 'Livrée'), ('cancelled', 'Annulée')], max_length=20)),
+                ('new_status', models.CharField(choices=[('pending', 'En attente'), ('confirmed', 'Confirmée'), ('preparing', 'En préparation'), ('ready', 'Prête'), ('delivered', 'Livrée'), ('cancelled', 'Annulée')], max_length=20)),
+                ('source', models.CharField(choices=[('admin', 'Administration'), ('bulk', 'Mise à jour groupée'), ('system', 'Système')], default='system', max_length=20)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_status_changes', to=settings.AUTH_USER_MODEL, verbose_name='Modifié par')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='JLTsite.order')),
+            ],
+            options={
+                'verbose_name': 'Historique de statut',
+                'verbose_name_plural': 'Historique des statuts',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['order', 'created_at'], name='JLTsite_ord_order_i_442089_idx')],
+            },
+        ),
+    ]
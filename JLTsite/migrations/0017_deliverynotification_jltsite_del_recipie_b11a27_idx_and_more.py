@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-19 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0016_emailcampaign_emaildelivery'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliverynotification',
+            index=models.Index(fields=['recipient', 'is_read'], name='JLTsite_del_recipie_b11a27_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryroute',
+            index=models.Index(fields=['date', 'driver'], name='JLTsite_del_date_7ddac9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driverplanning',
+            index=models.Index(fields=['date', 'is_available'], name='JLTsite_dri_date_c39e69_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kitchennotification',
+            index=models.Index(fields=['recipient', 'is_read'], name='JLTsite_kit_recipie_758ee3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['delivery_date', 'status'], name='JLTsite_ord_deliver_85a9d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='JLTsite_ord_status_08d24f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['department', 'order'], name='JLTsite_ord_departm_286482_idx'),
+        ),
+    ]
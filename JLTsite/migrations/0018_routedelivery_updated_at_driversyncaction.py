@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-19 15:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0017_deliverynotification_jltsite_del_recipie_b11a27_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routedelivery',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='DriverSyncAction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(max_length=64)),
+                ('action_type', models.CharField(choices=[('arrive', 'Arrivée sur place'), ('validate', 'Livraison validée'), ('issue', 'Problème signalé'), ('signature', 'Signature')], max_length=20)),
+                ('status', models.CharField(choices=[('applied', 'Appliquée'), ('rejected', 'Rejetée')], max_length=20)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('performed_at', models.DateTimeField(help_text="Heure de l'action sur le téléphone")),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('delivery', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sync_actions', to='JLTsite.delivery')),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_actions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Action de synchronisation',
+                'verbose_name_plural': 'Actions de synchronisation',
+                'ordering': ['-received_at'],
+                'unique_together': {('driver', 'client_id')},
+            },
+        ),
+    ]
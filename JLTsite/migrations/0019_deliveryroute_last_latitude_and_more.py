@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-19 16:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0018_routedelivery_updated_at_driversyncaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryroute',
+            name='last_latitude',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryroute',
+            name='last_longitude',
+            field=models.DecimalField(blank=True, decimal_places=7, max_digits=11, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryroute',
+            name='last_position_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RouteTrackChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(help_text='Début du bloc')),
+                ('span', models.PositiveIntegerField(default=60, help_text='Durée couverte en secondes')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('points', models.BinaryField()),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_chunks', to='JLTsite.deliveryroute')),
+            ],
+            options={
+                'verbose_name': 'Bloc de trace GPS',
+                'verbose_name_plural': 'Blocs de traces GPS',
+                'ordering': ['route', 'start'],
+                'indexes': [models.Index(fields=['span', 'start'], name='JLTsite_rou_span_3f7298_idx')],
+                'unique_together': {('route', 'start')},
+            },
+        ),
+    ]
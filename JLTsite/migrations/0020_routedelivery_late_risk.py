@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0019_deliveryroute_last_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routedelivery',
+            name='late_risk',
+            field=models.BooleanField(default=False, help_text='Arrivée estimée après la fin du créneau'),
+        ),
+    ]
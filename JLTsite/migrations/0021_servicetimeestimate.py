@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0020_routedelivery_late_risk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceTimeEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('customer', 'Client'), ('company', 'Entreprise'), ('postal_prefix', 'Préfixe postal'), ('packages', 'Nombre de colis'), ('all', 'Ensemble')], max_length=20)),
+                ('delivery_type', models.CharField(choices=[('delivery', 'Livraison'), ('pickup', 'Récupération')], max_length=20)),
+                ('key', models.CharField(blank=True, help_text='Courriel, entreprise, préfixe ou nombre de colis', max_length=200)),
+                ('median_minutes', models.DecimalField(decimal_places=1, max_digits=6)),
+                ('mad_minutes', models.DecimalField(decimal_places=1, default=0, help_text='Écart absolu médian', max_digits=6)),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('fitted_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Temps de service appris',
+                'verbose_name_plural': 'Temps de service appris',
+                'ordering': ['dimension', 'delivery_type', 'key'],
+                'unique_together': {('dimension', 'delivery_type', 'key')},
+            },
+        ),
+    ]
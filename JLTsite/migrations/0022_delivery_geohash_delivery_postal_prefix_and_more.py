@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-19 18:31
+
+from django.db import migrations, models
+
+from JLTsite import geo
+
+
+def fill_geohash_and_postal_prefix(apps, schema_editor):
+    Delivery = apps.get_model('JLTsite', 'Delivery')
+    deliveries = list(Delivery.objects.only('id', 'latitude', 'longitude', 'delivery_postal_code'))
+    for delivery in deliveries:
+        if delivery.latitude is not None and delivery.longitude is not None:
+            delivery.geohash = geo.encode(delivery.latitude, delivery.longitude)
+        delivery.postal_prefix = geo.postal_prefix(delivery.delivery_postal_code)
+    Delivery.objects.bulk_update(deliveries, ['geohash', 'postal_prefix'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0021_servicetimeestimate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='postal_prefix',
+            field=models.CharField(blank=True, editable=False, max_length=3),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['scheduled_date', 'geohash'], name='JLTsite_del_schedul_9fc5c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['scheduled_date', 'postal_prefix'], name='JLTsite_del_schedul_5343a9_idx'),
+        ),
+        migrations.RunPython(fill_geohash_and_postal_prefix, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-19 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0022_delivery_geohash_delivery_postal_prefix_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='volume',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Volume en litres', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='driverplanning',
+            name='max_volume',
+            field=models.DecimalField(decimal_places=2, default=2000, help_text='Volume de chargement max en litres', max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='package_type',
+            field=models.CharField(choices=[('box', 'Boîte'), ('tray', 'Plateau'), ('crate', 'Caisse'), ('bag', 'Sac')], default='box', max_length=10, verbose_name='Type de colis'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='temperature',
+            field=models.CharField(choices=[('cold', 'Froid'), ('hot', 'Chaud'), ('ambient', 'Ambiant')], default='cold', max_length=10, verbose_name='Transport'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='unit_volume',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Volume unitaire (L)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='unit_weight',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=7, null=True, verbose_name='Poids unitaire (kg)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_per_package',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Unités par colis'),
+        ),
+    ]
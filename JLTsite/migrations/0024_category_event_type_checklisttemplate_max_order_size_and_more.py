@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-19 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0023_delivery_volume_driverplanning_max_volume_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='event_type',
+            field=models.CharField(blank=True, choices=[('corporate', 'Événement corporatif'), ('wedding', 'Mariage'), ('cocktail', 'Cocktail'), ('lunch', 'Lunch box'), ('other', 'Autre')], help_text='Choix du modèle de checklist des commandes de cette catégorie', max_length=50, verbose_name="Type d'événement"),
+        ),
+        migrations.AddField(
+            model_name='checklisttemplate',
+            name='max_order_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Taille max. de commande'),
+        ),
+        migrations.AddField(
+            model_name='checklisttemplate',
+            name='min_order_size',
+            field=models.PositiveIntegerField(default=0, verbose_name='Taille min. de commande'),
+        ),
+        migrations.AddField(
+            model_name='checklisttemplate',
+            name='reference_size',
+            field=models.PositiveIntegerField(default=10, help_text="Nombre d'unités pour lequel les quantités proportionnelles sont saisies", verbose_name='Taille de référence'),
+        ),
+        migrations.AddField(
+            model_name='checklisttemplateitem',
+            name='category',
+            field=models.ForeignKey(blank=True, help_text='Pour une quantité proportionnelle aux articles de cette catégorie', null=True, on_delete=django.db.models.deletion.SET_NULL, to='JLTsite.category', verbose_name='Catégorie de référence'),
+        ),
+        migrations.AddField(
+            model_name='checklisttemplateitem',
+            name='scaling',
+            field=models.CharField(choices=[('fixed', 'Quantité fixe'), ('order_size', 'Proportionnelle à la commande'), ('category', "Proportionnelle aux articles d'une catégorie")], default='fixed', max_length=20, verbose_name='Calcul de la quantité'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-19 20:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0024_category_event_type_checklisttemplate_max_order_size_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reserved', models.IntegerField(default=0, verbose_name='Quantité réservée')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('inventory_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='JLTsite.inventoryitem', verbose_name='Article')),
+            ],
+            options={
+                'verbose_name': 'Disponibilité du matériel',
+                'verbose_name_plural': 'Disponibilités du matériel',
+                'ordering': ['date', 'inventory_item'],
+                'indexes': [models.Index(fields=['date'], name='JLTsite_equ_date_b2b8bc_idx')],
+                'unique_together': {('inventory_item', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EquipmentReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(verbose_name='Quantité')),
+                ('start_date', models.DateField(verbose_name='Du')),
+                ('end_date', models.DateField(verbose_name='Au')),
+                ('checklist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='equipment_reservations', to='JLTsite.orderchecklist')),
+                ('inventory_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='JLTsite.inventoryitem', verbose_name='Article')),
+            ],
+            options={
+                'verbose_name': 'Réservation de matériel',
+                'verbose_name_plural': 'Réservations de matériel',
+                'unique_together': {('checklist', 'inventory_item')},
+            },
+        ),
+    ]
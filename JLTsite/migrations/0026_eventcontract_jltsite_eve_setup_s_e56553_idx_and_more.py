@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-19 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0025_equipmentavailability_equipmentreservation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventcontract',
+            index=models.Index(fields=['setup_start_time', 'cleanup_end_time'], name='JLTsite_eve_setup_s_e56553_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventstaffassignment',
+            index=models.Index(fields=['arrival_time', 'departure_time'], name='JLTsite_eve_arrival_0686b0_idx'),
+        ),
+    ]
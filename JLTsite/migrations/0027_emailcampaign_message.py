@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-19 21:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0026_eventcontract_jltsite_eve_setup_s_e56553_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailcampaign',
+            name='message',
+            field=models.TextField(blank=True, verbose_name='Message'),
+        ),
+    ]
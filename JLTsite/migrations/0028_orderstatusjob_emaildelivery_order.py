@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-19 22:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('JLTsite', '0027_emailcampaign_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_ids', models.JSONField(default=list)),
+                ('new_status', models.CharField(choices=[('pending', 'En attente'), ('confirmed', 'Confirmée'), ('preparing', 'En préparation'), ('ready', 'Prête'), ('delivered', 'Livrée'), ('cancelled', 'Annulée')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Traitement de statut en attente',
+                'verbose_name_plural': 'Traitements de statut en attente',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='emaildelivery',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='emaildelivery',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='email_deliveries', to='JLTsite.order'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='emaildelivery',
+            unique_together={('campaign', 'email', 'order')},
+        ),
+    ]
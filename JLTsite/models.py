@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.conf import settings
 import datetime
@@ -62,6 +62,67 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 import uuid
 
+from . import geo
+
+# ========================================
+# SUIVI DES MODIFICATIONS DE CHAMPS
+# ========================================
+
+class FieldTrackerMixin:
+    """
+    Mémorise la valeur des champs listés dans `tracked_fields` au chargement
+    depuis la base (from_db) et après chaque save(), pour savoir ce qui a
+    changé sans relire la ligne. À placer avant models.Model dans l'héritage.
+    
+    Pour une instance jamais chargée ni enregistrée, previous() renvoie None
+    et has_changed() renvoie True.
+    """
+    
+    tracked_fields = ()
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields()
+    
+    def _snapshot_tracked_fields(self):
+        # Les champs différés (only/defer) ne sont pas chargés : on ne les lit pas
+        loaded = self.__dict__
+        self._tracked_initial = {
+            name: self._tracked_value(name)
+            for name in self.tracked_fields
+            if self._meta.get_field(name).attname in loaded
+        }
+    
+    def _tracked_value(self, name):
+        field = self._meta.get_field(name)
+        # to_python : les vues assignent parfois les valeurs brutes du POST
+        return field.to_python(getattr(self, field.attname))
+    
+    def previous(self, name):
+        """Valeur du champ au dernier chargement / enregistrement"""
+        return getattr(self, '_tracked_initial', {}).get(name)
+    
+    def has_changed(self, name):
+        """Le champ a-t-il été modifié depuis le dernier chargement / enregistrement ?"""
+        initial = getattr(self, '_tracked_initial', None)
+        if initial is None or name not in initial:
+            return self._meta.get_field(name).attname in self.__dict__
+        return self._tracked_value(name) != initial[name]
+    
+    def changed_fields(self):
+        """{champ: (ancienne valeur, nouvelle valeur)} pour les champs suivis modifiés"""
+        return {
+            name: (self.previous(name), self._tracked_value(name))
+            for name in self.tracked_fields
+            if self.has_changed(name)
+        }
+
 # ========================================
 # 1. MODÈLE UTILISATEUR PERSONNALISÉ
 # ========================================
@@ -135,6 +196,15 @@ class User(AbstractUser):
 # 2. MODÈLES PRODUITS
 # ========================================
 
+# Types d'événement des modèles de checklist (voir ChecklistTemplateService)
+EVENT_TYPE_CHOICES = [
+    ('corporate', 'Événement corporatif'),
+    ('wedding', 'Mariage'),
+    ('cocktail', 'Cocktail'),
+    ('lunch', 'Lunch box'),
+    ('other', 'Autre'),
+]
+
 class Category(models.Model):
     """Catégories de produits"""
     name = models.CharField(max_length=100)
@@ -143,6 +213,11 @@ class Category(models.Model):
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
     order = models.IntegerField(default=0)
+    event_type = models.CharField(
+        max_length=50, choices=EVENT_TYPE_CHOICES, blank=True,
+        verbose_name='Type d\'événement',
+        help_text='Choix du modèle de checklist des commandes de cette catégorie'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -166,6 +241,19 @@ class Product(models.Model):
         (COMMANDE, 'Sur commande'),
     ]
     
+    PACKAGE_TYPE_CHOICES = [
+        ('box', 'Boîte'),
+        ('tray', 'Plateau'),
+        ('crate', 'Caisse'),
+        ('bag', 'Sac'),
+    ]
+    
+    TEMPERATURE_CHOICES = [
+        ('cold', 'Froid'),
+        ('hot', 'Chaud'),
+        ('ambient', 'Ambiant'),
+    ]
+    
     name = models.CharField(max_length=200, verbose_name='Nom')
     slug = models.SlugField(unique=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
@@ -187,6 +275,17 @@ class Product(models.Model):
     stock = models.IntegerField(default=0, verbose_name='Stock disponible')
     min_order = models.IntegerField(default=1, verbose_name='Commande minimum')
     
+    # Conditionnement (plan de chargement des véhicules, voir LoadPlanService)
+    unit_weight = models.DecimalField(max_digits=7, decimal_places=3, null=True, blank=True,
+                                      verbose_name='Poids unitaire (kg)')
+    unit_volume = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True,
+                                      verbose_name='Volume unitaire (L)')
+    units_per_package = models.PositiveIntegerField(null=True, blank=True, verbose_name='Unités par colis')
+    package_type = models.CharField(max_length=10, choices=PACKAGE_TYPE_CHOICES, default='box',
+                                    verbose_name='Type de colis')
+    temperature = models.CharField(max_length=10, choices=TEMPERATURE_CHOICES, default='cold',
+                                   verbose_name='Transport')
+    
     is_vegetarian = models.BooleanField(default=False, verbose_name='Végétarien')
     is_vegan = models.BooleanField(default=False, verbose_name='Végane')
     is_gluten_free = models.BooleanField(default=False, verbose_name='Sans gluten')
@@ -275,9 +374,11 @@ class CartItem(models.Model):
 # 4. MODÈLES COMMANDES
 # ========================================
 
-class Order(models.Model):
+class Order(FieldTrackerMixin, models.Model):
     """Commande"""
     
+    tracked_fields = ('status', 'payment_status', 'delivery_type', 'delivery_date', 'delivery_time')
+    
     # Statuts
     PENDING = 'pending'
     CONFIRMED = 'confirmed'
@@ -377,6 +478,12 @@ class Order(models.Model):
         verbose_name = 'Commande'
         verbose_name_plural = 'Commandes'
         ordering = ['-created_at']
+        indexes = [
+            # Production, créneaux et calendrier : commandes d'un jour par statut
+            models.Index(fields=['delivery_date', 'status']),
+            # Listes d'administration : commandes d'un statut, plus récentes d'abord
+            models.Index(fields=['status', 'created_at']),
+        ]
     
     def __str__(self):
         return f"Commande {self.order_number}"
@@ -442,6 +549,10 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = 'Article de commande'
         verbose_name_plural = 'Articles de commande'
+        indexes = [
+            # Tableaux de bord cuisine : articles d'un département joints par order__delivery_date
+            models.Index(fields=['department', 'order']),
+        ]
     
     def __str__(self):
         return f"{self.quantity}x {self.product_name}"
@@ -451,6 +562,65 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class OrderStatusHistory(models.Model):
+    """Historique des changements de statut d'une commande"""
+
+    SOURCE_CHOICES = [
+        ('admin', 'Administration'),
+        ('bulk', 'Mise à jour groupée'),
+        ('system', 'Système'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_history')
+    old_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, blank=True)
+    new_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='system')
+    changed_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='order_status_changes',
+        verbose_name='Modifié par'
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'Historique de statut'
+        verbose_name_plural = 'Historique des statuts'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}: {self.old_status or '-'} → {self.new_status}"
+
+
+class OrderStatusJob(models.Model):
+    """
+    Effets de bord d'un changement de statut groupé (livraisons,
+    réapprovisionnement), enregistrés avec la transition et traités hors
+    requête par la commande process_order_jobs.
+    """
+
+    order_ids = models.JSONField(default=list)
+    new_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = 'Traitement de statut en attente'
+        verbose_name_plural = 'Traitements de statut en attente'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{len(self.order_ids)} commande(s) → {self.new_status}"
+
+
 class KitchenProductionNote(models.Model):
     """Notes de production pour la cuisine"""
     
@@ -540,6 +710,200 @@ class Review(models.Model):
         return f"Avis de {self.user.username} sur {self.product.name}"
 
 
+# ========================================
+# 7. STATISTIQUES CLIENTS (PROJECTION)
+# ========================================
+
+class CustomerStats(models.Model):
+    """Statistiques précalculées par client (commandes, valeur, segment RFM)"""
+    
+    VIP = 'vip'
+    LOYAL = 'loyal'
+    REGULAR = 'regular'
+    NEW = 'new'
+    AT_RISK = 'at_risk'
+    INACTIVE = 'inactive'
+    PROSPECT = 'prospect'
+    
+    SEGMENT_CHOICES = [
+        (VIP, 'VIP'),
+        (LOYAL, 'Fidèle'),
+        (REGULAR, 'Régulier'),
+        (NEW, 'Nouveau'),
+        (AT_RISK, 'À risque'),
+        (INACTIVE, 'Inactif'),
+        (PROSPECT, 'Sans commande'),
+    ]
+    
+    # Seuils des scores RFM (score 1 à 5, du plus faible au plus fort)
+    RECENCY_DAYS_THRESHOLDS = [180, 90, 30, 14]
+    FREQUENCY_THRESHOLDS = [2, 3, 5, 10]
+    MONETARY_THRESHOLDS = [Decimal('100'), Decimal('250'), Decimal('500'), Decimal('1000')]
+    
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='customer_stats'
+    )
+    
+    orders_count = models.IntegerField(default=0, verbose_name='Nombre de commandes')
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), verbose_name='Valeur totale')
+    average_order = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), verbose_name='Panier moyen')
+    first_order_at = models.DateTimeField(null=True, blank=True, verbose_name='Première commande')
+    last_order_at = models.DateTimeField(null=True, blank=True, verbose_name='Dernière commande')
+    
+    # Segmentation RFM
+    recency_score = models.IntegerField(default=0)
+    frequency_score = models.IntegerField(default=0)
+    monetary_score = models.IntegerField(default=0)
+    segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES, default=PROSPECT, verbose_name='Segment')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Statistiques client'
+        verbose_name_plural = 'Statistiques clients'
+        indexes = [
+            models.Index(fields=['orders_count']),
+            models.Index(fields=['total_spent']),
+            models.Index(fields=['last_order_at']),
+            models.Index(fields=['segment']),
+        ]
+    
+    def __str__(self):
+        return f"Statistiques {self.user.username} - {self.get_segment_display()}"
+    
+    @staticmethod
+    def _score(value, thresholds):
+        """Score de 1 à 5 selon le nombre de seuils atteints"""
+        return 1 + sum(1 for threshold in thresholds if value >= threshold)
+    
+    def compute_segment(self, now=None):
+        """Calcule les scores RFM et le segment à partir des totaux"""
+        now = now or timezone.now()
+        if not self.orders_count or not self.last_order_at:
+            self.recency_score = self.frequency_score = self.monetary_score = 0
+            self.segment = self.PROSPECT
+            return self.segment
+        
+        days_since_last = (now - self.last_order_at).days
+        # Plus la dernière commande est récente, plus le score est élevé
+        self.recency_score = 1 + sum(1 for limit in self.RECENCY_DAYS_THRESHOLDS if days_since_last <= limit)
+        self.frequency_score = self._score(self.orders_count, self.FREQUENCY_THRESHOLDS)
+        self.monetary_score = self._score(self.total_spent, self.MONETARY_THRESHOLDS)
+        
+        if self.recency_score == 1:
+            self.segment = self.INACTIVE
+        elif self.orders_count >= 10:
+            self.segment = self.VIP
+        elif self.recency_score == 2 and self.orders_count >= 2:
+            self.segment = self.AT_RISK
+        elif self.frequency_score >= 4:
+            self.segment = self.LOYAL
+        elif self.orders_count == 1:
+            self.segment = self.NEW
+        else:
+            self.segment = self.REGULAR
+        return self.segment
+    
+    def apply_totals(self, orders_count, total_spent, first_order_at, last_order_at, now=None):
+        """Applique les agrégats de commandes et recalcule le segment"""
+        self.orders_count = orders_count or 0
+        self.total_spent = total_spent or Decimal('0.00')
+        self.average_order = (
+            (self.total_spent / self.orders_count).quantize(Decimal('0.01'))
+            if self.orders_count else Decimal('0.00')
+        )
+        self.first_order_at = first_order_at
+        self.last_order_at = last_order_at
+        self.compute_segment(now)
+    
+    @classmethod
+    def refresh_for_user(cls, user_id):
+        """Recalcule la ligne d'un seul client (appelé quand ses commandes changent)"""
+        if not user_id:
+            return None
+        totals = Order.objects.filter(user_id=user_id).aggregate(
+            orders_count=models.Count('id'),
+            total_spent=models.Sum('total'),
+            first_order_at=models.Min('created_at'),
+            last_order_at=models.Max('created_at'),
+        )
+        stats = cls(user_id=user_id)
+        stats.apply_totals(**totals)
+        stats.save()
+        return stats
+    
+    @classmethod
+    def rebuild_all(cls, batch_size=500):
+        """Reconstruit toute la table en une requête groupée et des insertions en bloc"""
+        now = timezone.now()
+        totals_by_user = {
+            row['user_id']: row
+            for row in Order.objects.filter(user__isnull=False).values('user_id').annotate(
+                orders_count=models.Count('id'),
+                total_spent=models.Sum('total'),
+                first_order_at=models.Min('created_at'),
+                last_order_at=models.Max('created_at'),
+            ).order_by()
+        }
+        
+        rows = []
+        for user_id in User.objects.filter(role=User.CUSTOMER).values_list('id', flat=True).iterator():
+            totals = totals_by_user.pop(user_id, {})
+            stats = cls(user_id=user_id)
+            stats.apply_totals(
+                totals.get('orders_count'),
+                totals.get('total_spent'),
+                totals.get('first_order_at'),
+                totals.get('last_order_at'),
+                now=now,
+            )
+            rows.append(stats)
+        
+        # Clients ayant commandé mais dont le rôle a changé depuis
+        for user_id, totals in totals_by_user.items():
+            stats = cls(user_id=user_id)
+            stats.apply_totals(
+                totals['orders_count'], totals['total_spent'],
+                totals['first_order_at'], totals['last_order_at'], now=now,
+            )
+            rows.append(stats)
+        
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+
+
+# ========================================
+# 8. RECOMMANDATIONS PRODUITS
+# ========================================
+
+class ProductRecommendation(models.Model):
+    """Voisins précalculés « souvent commandés ensemble » (top-K par produit)"""
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended_product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveIntegerField(default=0, verbose_name='Rang')
+    score = models.FloatField(default=0, verbose_name='Score (cosinus)')
+    co_orders = models.IntegerField(default=0, verbose_name='Commandes communes')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Recommandation produit'
+        verbose_name_plural = 'Recommandations produits'
+        ordering = ['product', 'rank']
+        unique_together = ['product', 'recommended_product']
+        indexes = [
+            models.Index(fields=['product', 'rank']),
+        ]
+    
+    def __str__(self):
+        return f"{self.product.name} → {self.recommended_product.name} ({self.score:.2f})"
+
+
 # Ajouter ces modèles dans votre models.py existant
 
 # ========================================
@@ -581,9 +945,11 @@ class InventoryItem(models.Model):
     def is_low_stock(self):
         return self.stock_quantity < self.min_stock
 
-class OrderChecklist(models.Model):
+class OrderChecklist(FieldTrackerMixin, models.Model):
     """Checklist principale pour une commande"""
     
+    tracked_fields = ('status',)
+    
     STATUS_CHOICES = [
         ('pending', 'En attente'),
         ('in_progress', 'En cours'),
@@ -663,9 +1029,11 @@ class OrderChecklist(models.Model):
             return f"{hours}h {minutes}min"
         return "Non commencé"
 
-class ChecklistItem(models.Model):
+class ChecklistItem(FieldTrackerMixin, models.Model):
     """Élément individuel d'une checklist"""
     
+    tracked_fields = ('inventory_item', 'quantity_needed')
+    
     checklist = models.ForeignKey(
         OrderChecklist,
         on_delete=models.CASCADE,
@@ -779,15 +1147,16 @@ class ChecklistTemplate(models.Model):
     description = models.TextField(blank=True)
     event_type = models.CharField(
         max_length=50,
-        choices=[
-            ('corporate', 'Événement corporatif'),
-            ('wedding', 'Mariage'),
-            ('cocktail', 'Cocktail'),
-            ('lunch', 'Lunch box'),
-            ('other', 'Autre'),
-        ],
+        choices=EVENT_TYPE_CHOICES,
         verbose_name='Type d\'événement'
     )
+    # Taille de commande (nombre d'unités commandées) couverte par le modèle
+    min_order_size = models.PositiveIntegerField(default=0, verbose_name='Taille min. de commande')
+    max_order_size = models.PositiveIntegerField(null=True, blank=True, verbose_name='Taille max. de commande')
+    reference_size = models.PositiveIntegerField(
+        default=10, verbose_name='Taille de référence',
+        help_text='Nombre d\'unités pour lequel les quantités proportionnelles sont saisies'
+    )
     items = models.ManyToManyField(
         InventoryItem,
         through='ChecklistTemplateItem',
@@ -808,9 +1177,22 @@ class ChecklistTemplate(models.Model):
 class ChecklistTemplateItem(models.Model):
     """Items d'un modèle de checklist"""
     
+    SCALING_CHOICES = [
+        ('fixed', 'Quantité fixe'),
+        ('order_size', 'Proportionnelle à la commande'),
+        ('category', 'Proportionnelle aux articles d\'une catégorie'),
+    ]
+    
     template = models.ForeignKey(ChecklistTemplate, on_delete=models.CASCADE)
     inventory_item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE)
     default_quantity = models.IntegerField(default=1)
+    scaling = models.CharField(max_length=20, choices=SCALING_CHOICES, default='fixed',
+                               verbose_name='Calcul de la quantité')
+    category = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True,
+        verbose_name='Catégorie de référence',
+        help_text='Pour une quantité proportionnelle aux articles de cette catégorie'
+    )
     notes = models.TextField(blank=True)
     order = models.IntegerField(default=0)
     
@@ -820,6 +1202,70 @@ class ChecklistTemplateItem(models.Model):
         ordering = ['order']
 
 
+class EquipmentAvailability(models.Model):
+    """Quantité réservée d'un article d'inventaire pour une journée"""
+    
+    inventory_item = models.ForeignKey(
+        InventoryItem,
+        on_delete=models.CASCADE,
+        related_name='availability',
+        verbose_name='Article'
+    )
+    date = models.DateField()
+    
+    # Compteur mis à jour à chaque modification des checklists (voir EquipmentAvailabilityService)
+    reserved = models.IntegerField(default=0, verbose_name='Quantité réservée')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Disponibilité du matériel'
+        verbose_name_plural = 'Disponibilités du matériel'
+        ordering = ['date', 'inventory_item']
+        unique_together = ['inventory_item', 'date']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        return f"{self.inventory_item.name} {self.date} : {self.reserved} réservé(s)"
+    
+    @property
+    def remaining(self):
+        return self.inventory_item.stock_quantity - self.reserved
+
+
+class EquipmentReservation(models.Model):
+    """
+    Ce qui est actuellement compté dans EquipmentAvailability pour une
+    checklist : permet de retirer l'ancienne réservation avant d'ajouter
+    la nouvelle, sans recalculer les journées.
+    """
+    
+    checklist = models.ForeignKey(
+        OrderChecklist,
+        on_delete=models.CASCADE,
+        related_name='equipment_reservations'
+    )
+    inventory_item = models.ForeignKey(
+        InventoryItem,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Article'
+    )
+    quantity = models.IntegerField(verbose_name='Quantité')
+    start_date = models.DateField(verbose_name='Du')
+    end_date = models.DateField(verbose_name='Au')
+    
+    class Meta:
+        verbose_name = 'Réservation de matériel'
+        verbose_name_plural = 'Réservations de matériel'
+        unique_together = ['checklist', 'inventory_item']
+    
+    def __str__(self):
+        return f"{self.inventory_item.name} × {self.quantity} ({self.start_date} → {self.end_date})"
+
+
 # ========================================
 # MODÈLES POUR LE SYSTÈME DE LIVRAISON
 # ========================================
@@ -834,9 +1280,11 @@ import uuid
 # Note: Les modèles User et Order existent déjà dans votre code
 # Assurez-vous que User a les rôles DELIVERY_MANAGER et DELIVERY_DRIVER
 
-class Delivery(models.Model):
+class Delivery(FieldTrackerMixin, models.Model):
     """Livraison basée sur une commande confirmée"""
     
+    tracked_fields = ('status', 'scheduled_date', 'scheduled_time_start', 'scheduled_time_end')
+    
     TYPE_CHOICES = [
         ('delivery', 'Livraison'),
         ('pickup', 'Récupération'),
@@ -884,11 +1332,17 @@ class Delivery(models.Model):
     delivery_city = models.CharField(max_length=100)
     latitude = models.DecimalField(max_digits=10, decimal_places=8, null=True, blank=True)
     longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
+    # Index spatial et zone, calculés à l'enregistrement (voir geo.py)
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    postal_prefix = models.CharField(max_length=3, blank=True, editable=False)
     
     # Planning
     scheduled_date = models.DateField()
     scheduled_time_start = models.TimeField()
     scheduled_time_end = models.TimeField()
+    # Fin de créneau dénormalisée (date + heure de fin) pour comparer en SQL
+    scheduled_end_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                            help_text='Fin du créneau prévu (calculée)')
     estimated_duration = models.IntegerField(default=30, help_text='Durée estimée en minutes')
     
     # Instructions
@@ -900,6 +1354,7 @@ class Delivery(models.Model):
     items_description = models.TextField(help_text='Description des items à livrer')
     total_packages = models.IntegerField(default=1)
     weight = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text='Poids en kg')
+    volume = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text='Volume en litres')
     
     # Checklist associée
     has_checklist = models.BooleanField(default=False)
@@ -933,6 +1388,8 @@ class Delivery(models.Model):
         indexes = [
             models.Index(fields=['scheduled_date', 'status']),
             models.Index(fields=['delivery_type', 'status']),
+            models.Index(fields=['scheduled_date', 'geohash']),
+            models.Index(fields=['scheduled_date', 'postal_prefix']),
         ]
     
     def __str__(self):
@@ -941,8 +1398,41 @@ class Delivery(models.Model):
     def save(self, *args, **kwargs):
         if not self.delivery_number:
             self.delivery_number = self.generate_delivery_number()
+        if (self.scheduled_end_at is None or self.has_changed('scheduled_date')
+                or self.has_changed('scheduled_time_end')):
+            self.scheduled_end_at = self.compute_scheduled_end_at()
+        self.fill_spatial_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = set()
+            if 'scheduled_date' in update_fields or 'scheduled_time_end' in update_fields:
+                derived.add('scheduled_end_at')
+            if 'latitude' in update_fields or 'longitude' in update_fields:
+                derived.add('geohash')
+            if 'delivery_postal_code' in update_fields:
+                derived.add('postal_prefix')
+            if derived:
+                kwargs['update_fields'] = set(update_fields) | derived
         super().save(*args, **kwargs)
     
+    def fill_spatial_fields(self):
+        """Geohash et préfixe postal (index spatial et zones, voir geo.py)"""
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        self.postal_prefix = geo.postal_prefix(self.delivery_postal_code)
+    
+    def compute_scheduled_end_at(self):
+        """Combine la date prévue et l'heure de fin en datetime aware"""
+        # Les vues passent parfois les valeurs brutes du POST (chaînes)
+        scheduled_date = self._meta.get_field('scheduled_date').to_python(self.scheduled_date)
+        scheduled_time_end = self._meta.get_field('scheduled_time_end').to_python(self.scheduled_time_end)
+        if not scheduled_date or not scheduled_time_end:
+            return None
+        from datetime import datetime
+        return timezone.make_aware(datetime.combine(scheduled_date, scheduled_time_end))
+    
     def generate_delivery_number(self):
         """Génère un numéro de livraison unique"""
         prefix = 'LIV' if self.delivery_type == 'delivery' else 'REC'
@@ -1012,6 +1502,11 @@ class DeliveryRoute(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    # Dernière position GPS reçue du livreur (voir RouteTrackChunk)
+    last_latitude = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
+    last_longitude = models.DecimalField(max_digits=11, decimal_places=7, null=True, blank=True)
+    last_position_at = models.DateTimeField(null=True, blank=True)
+    
     # Notes
     notes = models.TextField(blank=True)
     
@@ -1025,6 +1520,9 @@ class DeliveryRoute(models.Model):
         verbose_name_plural = 'Routes de livraison'
         ordering = ['-date', 'start_time']
         unique_together = ['driver', 'date', 'route_number']
+        indexes = [
+            models.Index(fields=['date', 'driver']),
+        ]
     
     def __str__(self):
         return f"Route {self.route_number} - {self.driver.get_full_name()} - {self.date}"
@@ -1061,6 +1559,7 @@ class RouteDelivery(models.Model):
     # Temps estimés
     estimated_arrival = models.TimeField(null=True, blank=True)
     estimated_departure = models.TimeField(null=True, blank=True)
+    late_risk = models.BooleanField(default=False, help_text='Arrivée estimée après la fin du créneau')
     
     # Temps réels
     actual_arrival = models.TimeField(null=True, blank=True)
@@ -1077,6 +1576,9 @@ class RouteDelivery(models.Model):
     # Notes spécifiques pour cette livraison dans cette route
     notes = models.TextField(blank=True)
     
+    # Synchronisation de l'application livreur (deltas depuis un curseur)
+    updated_at = models.DateTimeField(auto_now=True)
+    
     class Meta:
         verbose_name = 'Livraison de route'
         verbose_name_plural = 'Livraisons de route'
@@ -1086,6 +1588,39 @@ class RouteDelivery(models.Model):
     def __str__(self):
         return f"Route {self.route.route_number} - Position {self.position}: {self.delivery.customer_name}"
 
+class ServiceTimeEstimate(models.Model):
+    """
+    Temps sur place appris de l'historique (heures réelles d'arrivée et de
+    départ des arrêts), recalculé chaque nuit par fit_service_times.
+    """
+    
+    DIMENSION_CHOICES = [
+        ('customer', 'Client'),
+        ('company', 'Entreprise'),
+        ('postal_prefix', 'Préfixe postal'),
+        ('packages', 'Nombre de colis'),
+        ('all', 'Ensemble'),
+    ]
+    
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    delivery_type = models.CharField(max_length=20, choices=Delivery.TYPE_CHOICES)
+    key = models.CharField(max_length=200, blank=True, help_text='Courriel, entreprise, préfixe ou nombre de colis')
+    
+    median_minutes = models.DecimalField(max_digits=6, decimal_places=1)
+    mad_minutes = models.DecimalField(max_digits=6, decimal_places=1, default=0,
+                                      help_text='Écart absolu médian')
+    sample_count = models.PositiveIntegerField(default=0)
+    fitted_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = 'Temps de service appris'
+        verbose_name_plural = 'Temps de service appris'
+        ordering = ['dimension', 'delivery_type', 'key']
+        unique_together = ['dimension', 'delivery_type', 'key']
+    
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.key or '-'} ({self.delivery_type}) : {self.median_minutes} min"
+
 class DeliveryPhoto(models.Model):
     """Photos associées aux livraisons"""
     
@@ -1117,6 +1652,68 @@ class DeliveryPhoto(models.Model):
     def __str__(self):
         return f"Photo {self.get_photo_type_display()} - {self.delivery.delivery_number}"
 
+class RouteTrackChunk(models.Model):
+    """
+    Positions GPS d'une route sur une minute (une heure une fois
+    sous-échantillonnées), empaquetées en deltas dans `points`
+    (voir LocationTrackService.pack_points).
+    """
+    
+    route = models.ForeignKey(DeliveryRoute, on_delete=models.CASCADE, related_name='track_chunks')
+    start = models.DateTimeField(help_text='Début du bloc')
+    span = models.PositiveIntegerField(default=60, help_text='Durée couverte en secondes')
+    point_count = models.PositiveIntegerField(default=0)
+    points = models.BinaryField()
+    
+    class Meta:
+        verbose_name = 'Bloc de trace GPS'
+        verbose_name_plural = 'Blocs de traces GPS'
+        ordering = ['route', 'start']
+        unique_together = ['route', 'start']
+        indexes = [
+            # Sélection des blocs à sous-échantillonner
+            models.Index(fields=['span', 'start']),
+        ]
+    
+    def __str__(self):
+        return f"Trace {self.route.route_number} - {self.start:%Y-%m-%d %H:%M} ({self.point_count} points)"
+
+class DriverSyncAction(models.Model):
+    """Action hors ligne reçue de l'application livreur (rejouée une seule fois, hors positions GPS)"""
+    
+    TYPE_CHOICES = [
+        ('arrive', 'Arrivée sur place'),
+        ('validate', 'Livraison validée'),
+        ('issue', 'Problème signalé'),
+        ('signature', 'Signature'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('applied', 'Appliquée'),
+        ('rejected', 'Rejetée'),
+    ]
+    
+    driver = models.ForeignKey('User', on_delete=models.CASCADE, related_name='sync_actions')
+    # Identifiant généré par l'application, unique par livreur
+    client_id = models.CharField(max_length=64)
+    action_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    delivery = models.ForeignKey(Delivery, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='sync_actions')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    error = models.CharField(max_length=255, blank=True)
+    
+    performed_at = models.DateTimeField(help_text='Heure de l\'action sur le téléphone')
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Action de synchronisation'
+        verbose_name_plural = 'Actions de synchronisation'
+        ordering = ['-received_at']
+        unique_together = ['driver', 'client_id']
+    
+    def __str__(self):
+        return f"{self.get_action_type_display()} - {self.driver} ({self.client_id})"
+
 class DriverPlanning(models.Model):
     """Planning des livreurs"""
     
@@ -1138,6 +1735,8 @@ class DriverPlanning(models.Model):
     max_deliveries = models.IntegerField(default=20)
     max_weight = models.DecimalField(max_digits=10, decimal_places=2, 
                                      default=100, help_text='Poids max en kg')
+    max_volume = models.DecimalField(max_digits=10, decimal_places=2,
+                                     default=2000, help_text='Volume de chargement max en litres')
     
     # Zones assignées
     zones = models.JSONField(default=list, blank=True, 
@@ -1155,7 +1754,12 @@ class DriverPlanning(models.Model):
         verbose_name = 'Planning livreur'
         verbose_name_plural = 'Plannings livreurs'
         ordering = ['date', 'driver']
+        # L'unicité (driver, date) sert aussi d'index pour le planning d'un livreur
         unique_together = ['driver', 'date']
+        indexes = [
+            # Capacité des créneaux : livreurs disponibles sur une période
+            models.Index(fields=['date', 'is_available']),
+        ]
     
     def __str__(self):
         return f"Planning {self.driver.get_full_name()} - {self.date}"
@@ -1210,6 +1814,9 @@ class DeliveryNotification(models.Model):
         verbose_name = 'Notification de livraison'
         verbose_name_plural = 'Notifications de livraison'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read']),
+        ]
     
     def __str__(self):
         return f"{self.get_type_display()} - {self.recipient.get_full_name()}"
@@ -1246,6 +1853,10 @@ class DeliverySettings(models.Model):
     auto_optimize_routes = models.BooleanField(default=True)
     max_deliveries_per_route = models.IntegerField(default=20)
     
+    # Capacité des créneaux
+    default_slot_capacity = models.IntegerField(default=4, help_text='Livraisons par créneau lorsque aucun planning livreur n\'est saisi')
+    kitchen_slot_capacity = models.IntegerField(default=10, help_text='Commandes que la cuisine peut préparer par créneau')
+    
     class Meta:
         verbose_name = 'Paramètres de livraison'
         verbose_name_plural = 'Paramètres de livraison'
@@ -1253,6 +1864,44 @@ class DeliverySettings(models.Model):
     def __str__(self):
         return "Paramètres de livraison"
     
+class DeliverySlot(models.Model):
+    """Compteurs de capacité par créneau de livraison (réservés / disponibles)"""
+    
+    date = models.DateField()
+    start_time = models.TimeField()
+    
+    # Capacités calculées à partir des plannings livreurs et des paramètres cuisine
+    delivery_capacity = models.PositiveIntegerField(default=0, verbose_name='Capacité livraison')
+    kitchen_capacity = models.PositiveIntegerField(default=0, verbose_name='Capacité cuisine')
+    
+    # Compteurs mis à jour à chaque commande / annulation
+    deliveries_booked = models.PositiveIntegerField(default=0, verbose_name='Livraisons réservées')
+    orders_booked = models.PositiveIntegerField(default=0, verbose_name='Commandes réservées')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Créneau de livraison'
+        verbose_name_plural = 'Créneaux de livraison'
+        ordering = ['date', 'start_time']
+        unique_together = ['date', 'start_time']
+    
+    def __str__(self):
+        return f"Créneau {self.date} {self.start_time:%H:%M} ({self.orders_booked}/{self.kitchen_capacity})"
+    
+    @property
+    def deliveries_remaining(self):
+        return max(self.delivery_capacity - self.deliveries_booked, 0)
+    
+    @property
+    def orders_remaining(self):
+        return max(self.kitchen_capacity - self.orders_booked, 0)
+    
+    def is_available(self, delivery_type='delivery'):
+        if delivery_type == 'delivery' and not self.deliveries_remaining:
+            return False
+        return self.orders_remaining > 0
+
 
 
 # ========================================
@@ -1343,9 +1992,11 @@ class EventNotifications(models.Model):
         }
         return colors.get(self.type, 'text-info')
 
-class EventContract(models.Model):
+class EventContract(FieldTrackerMixin, models.Model):
     """Contrat d'événement géré par le maître d'hôtel"""
     
+    tracked_fields = ('status', 'maitre_hotel', 'cleanup_end_time')
+    
     STATUS_CHOICES = [
         ('draft', 'Brouillon'),
         ('confirmed', 'Confirmé'),
@@ -1424,6 +2075,9 @@ class EventContract(models.Model):
         verbose_name = 'Contrat d\'événement'
         verbose_name_plural = 'Contrats d\'événements'
         ordering = ['event_start_time']
+        indexes = [
+            models.Index(fields=['setup_start_time', 'cleanup_end_time']),
+        ]
     
     def __str__(self):
         return f"{self.contract_number} - {self.event_name}"
@@ -1481,6 +2135,9 @@ class EventStaffAssignment(models.Model):
         verbose_name = 'Assignment personnel'
         verbose_name_plural = 'Assignments personnel'
         unique_together = ['event', 'staff_member']
+        indexes = [
+            models.Index(fields=['arrival_time', 'departure_time']),
+        ]
     
     def __str__(self):
         return f"{self.staff_member.get_full_name()} - {self.get_role_display()}"
@@ -1833,6 +2490,9 @@ class ProductOrder(models.Model):
     # Totaux
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Montant total')
     
+    # Brouillon généré par le planificateur de réapprovisionnement
+    auto_generated = models.BooleanField(default=False, verbose_name='Générée automatiquement')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -1886,13 +2546,107 @@ class ProductOrderItem(models.Model):
         self.total_price = self.quantity * self.unit_price
         super().save(*args, **kwargs)
 
+class RecipeComponent(models.Model):
+    """Nomenclature : quantité d'ingrédient consommée par unité de produit vendu"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recipe_components', verbose_name='Produit vendu')
+    kitchen_product = models.ForeignKey(KitchenProduct, on_delete=models.CASCADE, related_name='used_in', verbose_name='Ingrédient')
+    
+    quantity = models.DecimalField(max_digits=10, decimal_places=3, verbose_name='Quantité par unité vendue')
+    waste_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name='Perte (%)')
+    
+    notes = models.CharField(max_length=200, blank=True, verbose_name='Notes')
+    
+    class Meta:
+        verbose_name = 'Composant de recette'
+        verbose_name_plural = 'Composants de recette'
+        unique_together = ['product', 'kitchen_product']
+    
+    def __str__(self):
+        return f"{self.product.name} : {self.quantity} {self.kitchen_product.unit} de {self.kitchen_product.name}"
+    
+    @property
+    def gross_quantity(self):
+        """Quantité à prévoir, perte incluse"""
+        return self.quantity * (1 + self.waste_percentage / 100)
+
+class StockMovement(models.Model):
+    """Journal des mouvements de stock (ajout seulement, jamais modifié)"""
+    
+    RECEIPT = 'receipt'
+    CONSUMPTION = 'consumption'
+    ADJUSTMENT = 'adjustment'
+    WASTE = 'waste'
+    
+    MOVEMENT_TYPE_CHOICES = [
+        (RECEIPT, 'Réception'),
+        (CONSUMPTION, 'Consommation'),
+        (ADJUSTMENT, 'Ajustement'),
+        (WASTE, 'Perte'),
+    ]
+    
+    kitchen_product = models.ForeignKey(KitchenProduct, on_delete=models.CASCADE, related_name='stock_movements', verbose_name='Produit')
+    movement_type = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES, verbose_name='Type de mouvement')
+    
+    # Quantité signée : positive pour une entrée, négative pour une sortie
+    quantity = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Quantité')
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Coût unitaire')
+    
+    # Origine
+    product_order_item = models.ForeignKey(
+        ProductOrderItem,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements',
+        verbose_name='Article de commande'
+    )
+    department = models.CharField(max_length=20, blank=True, verbose_name='Département')
+    notes = models.CharField(max_length=255, blank=True, verbose_name='Notes')
+    
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Date du mouvement')
+    
+    class Meta:
+        verbose_name = 'Mouvement de stock'
+        verbose_name_plural = 'Mouvements de stock'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['kitchen_product', 'created_at']),
+            models.Index(fields=['movement_type', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_movement_type_display()} {self.quantity} {self.kitchen_product.unit} de {self.kitchen_product.name}"
+
+class StockSnapshot(models.Model):
+    """Photo périodique du stock d'un produit, point de départ des calculs historiques"""
+    kitchen_product = models.ForeignKey(KitchenProduct, on_delete=models.CASCADE, related_name='stock_snapshots', verbose_name='Produit')
+    taken_at = models.DateTimeField(verbose_name='Date de la photo')
+    
+    quantity = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Quantité')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Prix unitaire')
+    value = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Valeur')
+    
+    class Meta:
+        verbose_name = 'Photo de stock'
+        verbose_name_plural = 'Photos de stock'
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['kitchen_product', 'taken_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kitchen_product.name} : {self.quantity} au {self.taken_at:%d/%m/%Y %H:%M}"
+
 # ========================================
 # MODÈLES POUR LA PRODUCTION CUISINE
 # ========================================
 
-class KitchenProduction(models.Model):
+class KitchenProduction(FieldTrackerMixin, models.Model):
     """Production quotidienne par département"""
     
+    tracked_fields = ('status', 'total_items', 'completed_items', 'progress_percentage')
+    
     date = models.DateField(verbose_name='Date de production')
     department = models.CharField(max_length=20, choices=[
         ('patisserie', 'Pâtisserie'),
@@ -1962,6 +2716,9 @@ class KitchenProduction(models.Model):
         elif self.progress_percentage == 100:
             self.status = 'completed'
         
+        # Éviter l'écriture si rien n'a bougé
+        if self.pk and not self.changed_fields():
+            return
         self.save()
 
 class ProductionItem(models.Model):
@@ -2114,6 +2871,9 @@ class KitchenNotification(models.Model):
         verbose_name = 'Notification cuisine'
         verbose_name_plural = 'Notifications cuisine'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read']),
+        ]
     
     def __str__(self):
         return f"{self.get_type_display()} - {self.recipient.get_full_name()}"
@@ -2121,4 +2881,70 @@ class KitchenNotification(models.Model):
     def mark_as_read(self):
         self.is_read = True
         self.read_at = timezone.now()
-        self.save()
\ No newline at end of file
+        self.save()
+# ========================================
+# ENVOIS GROUPÉS D'EMAILS
+# ========================================
+
+class EmailCampaign(models.Model):
+    """Envoi groupé (newsletter, promotion) personnalisé par destinataire"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'En attente'),
+        ('sending', 'En cours'),
+        ('sent', 'Envoyée'),
+        ('failed', 'Échec'),
+    ]
+    
+    subject = models.CharField(max_length=200, verbose_name='Objet')
+    # Gabarits Django : {{ first_name }}, {{ last_name }}, {{ email }}, {{ user }}, {{ message }}
+    body_template = models.TextField(verbose_name='Texte')
+    html_template = models.TextField(blank=True, verbose_name='HTML')
+    # Texte libre saisi par l'administrateur : passé en variable, jamais compilé
+    message = models.TextField(blank=True, verbose_name='Message')
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='email_campaigns')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Envoi groupé'
+        verbose_name_plural = 'Envois groupés'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.subject} ({self.get_status_display()})"
+
+class EmailDelivery(models.Model):
+    """Statut d'envoi d'une campagne pour un destinataire"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'À envoyer'),
+        ('sent', 'Envoyé'),
+        ('failed', 'Échec'),
+    ]
+    
+    campaign = models.ForeignKey(EmailCampaign, on_delete=models.CASCADE, related_name='deliveries')
+    email = models.EmailField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='email_deliveries')
+    # Courriel de suivi d'une commande : une ligne par commande, même adresse possible
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='email_deliveries')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Envoi à un destinataire'
+        verbose_name_plural = 'Envois aux destinataires'
+        unique_together = ['campaign', 'email', 'order']
+        indexes = [
+            models.Index(fields=['campaign', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.email} - {self.get_status_display()}"
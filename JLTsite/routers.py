@@ -0,0 +1,99 @@
+# routers.py - Routage des lectures vers la réplique MySQL
+"""
+Les rapports, exports et tableaux de bord lisent sur la base `replica`
+lorsqu'ils sont enveloppés dans use_replica(). Toutes les écritures vont
+sur `default`. Après une écriture de l'utilisateur, ses lectures restent
+sur le primaire (dans la requête, puis pendant REPLICA_STICKY_SECONDS via
+un cookie posé par ReplicaStickinessMiddleware). Si la réplique n'est pas
+configurée ou ne répond pas, on lit sur le primaire.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+REPLICA_ALIAS = 'replica'
+# Écritures qui ne comptent pas pour la stickiness (session réécrite à chaque requête)
+IGNORED_WRITE_APPS = {'sessions'}
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_pinned = ContextVar('replica_pinned', default=False)
+_wrote = ContextVar('replica_wrote', default=False)
+_replica_down_until = 0.0
+
+
+@contextmanager
+def use_replica():
+    """
+    Envoie les lectures du bloc (ou de la vue décorée) vers la réplique.
+
+        @use_replica()
+        def admin_reports(request): ...
+
+        with use_replica():
+            rows = list(queryset)
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def request_scope(pinned=False):
+    """Portée d'une requête : état de stickiness initial, remis à zéro à la sortie"""
+    pinned_token = _pinned.set(pinned)
+    wrote_token = _wrote.set(False)
+    try:
+        yield
+    finally:
+        _wrote.reset(wrote_token)
+        _pinned.reset(pinned_token)
+
+
+def has_written():
+    """Une écriture a-t-elle eu lieu dans la portée courante ?"""
+    return _wrote.get()
+
+
+def replica_available():
+    """La réplique est-elle configurée et joignable ? (échec mémorisé REPLICA_RETRY_SECONDS)"""
+    global _replica_down_until
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return False
+    if time.monotonic() < _replica_down_until:
+        return False
+    try:
+        connections[REPLICA_ALIAS].ensure_connection()
+    except DatabaseError:
+        _replica_down_until = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        return False
+    return True
+
+
+class ReplicaRouter:
+    """Routeur : lectures sur la réplique dans use_replica(), tout le reste sur le primaire"""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or _pinned.get():
+            return None
+        # Dans une transaction, on relit ce que la transaction a écrit
+        if connections['default'].in_atomic_block:
+            return None
+        if replica_available():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in IGNORED_WRITE_APPS:
+            # Lire ses propres écritures : la suite de la requête reste sur le primaire
+            _pinned.set(True)
+            _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Même données des deux côtés
+        return True
@@ -1,17 +1,52 @@
 # services.py - Logique métier
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import get_connection, send_mail, EmailMultiAlternatives
+from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
-from django.db import transaction
-from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, Exists, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Lower, Substr
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+from statistics import mean, median
+from time import monotonic, sleep
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal, ROUND_UP
+import hashlib
+import logging
+import math
+import re
 import qrcode
+import requests
 from io import BytesIO
 import base64
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 
+from .models import (
+    Category, ChecklistItem, ChecklistTemplate, ChecklistTemplateItem, Delivery, DeliveryNotification, DeliveryPhoto,
+    DeliverySettings, DeliverySlot, DriverPlanning, DeliveryRoute, DriverSyncAction, EmailCampaign, EmailDelivery,
+    EquipmentAvailability, EquipmentReservation, EventContract, EventStaffAssignment, InventoryItem, KitchenProduct,
+    Order, OrderChecklist, OrderItem, OrderStatusHistory, OrderStatusJob, Product, ProductOrder, ProductOrderItem,
+    ProductRecommendation, RecipeComponent, RouteDelivery, RouteTrackChunk, ServiceTimeEstimate, StockMovement,
+    StockSnapshot, User
+)
+from .caching import (
+    DEFAULT_TIMEOUT, bump_model_version, cached_singleton, delivery_managers, first_delivery_manager, model_versions
+)
+from .intervals import IntervalTree
+from . import geo
+
+logger = logging.getLogger(__name__)
+
 class EmailService:
     """Service d'envoi d'emails"""
     
@@ -97,6 +132,213 @@ class EmailService:
             html_message=html_content
         )
 
+class BulkMailerService:
+    """
+    Envoi d'emails en nombre : une seule connexion SMTP réutilisée via
+    send_messages, destinataires traités par lots, débit limité et statut
+    enregistré pour chaque destinataire. Les gabarits d'une campagne sont
+    compilés une fois puis rendus avec le contexte de chaque client.
+    Fonctionne avec les backends locmem / fichier pour les essais.
+    """
+    
+    CHUNK_SIZE = getattr(settings, 'BULK_EMAIL_CHUNK_SIZE', 100)
+    RATE_PER_SECOND = getattr(settings, 'BULK_EMAIL_RATE_PER_SECOND', 10)
+    # Au-delà, la campagne est laissée à la commande send_email_campaigns
+    SYNC_LIMIT = 50
+    # Campagne « en cours » depuis plus longtemps : envoi interrompu, reprise possible
+    STALE_AFTER = timedelta(hours=6)
+    
+    @staticmethod
+    def send_messages(messages, connection=None, rate=None):
+        """
+        Envoie les messages un par un sur une même connexion, au plus `rate`
+        par seconde. Retourne la liste des erreurs (None si envoyé), dans
+        l'ordre des messages.
+        """
+        if not messages:
+            return []
+        connection = connection or get_connection()
+        interval = 1.0 / rate if rate else 0
+        next_at = monotonic()
+        errors = []
+        
+        try:
+            opened = connection.open()
+        except Exception as e:
+            return [str(e)[:255]] * len(messages)
+        try:
+            for message in messages:
+                if interval:
+                    delay = next_at - monotonic()
+                    if delay > 0:
+                        sleep(delay)
+                    next_at = max(next_at, monotonic()) + interval
+                try:
+                    connection.send_messages([message])
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(str(e)[:255])
+                    # Connexion possiblement rompue : on repart sur une neuve
+                    try:
+                        connection.close()
+                        opened = connection.open()
+                    except Exception as reopen_error:
+                        # Serveur injoignable : le reste du lot est en échec
+                        opened = False
+                        errors.extend([str(reopen_error)[:255]] * (len(messages) - len(errors)))
+                        break
+        finally:
+            if opened:
+                connection.close()
+        return errors
+    
+    @classmethod
+    def create_campaign(cls, subject, body_template, recipients, created_by=None, html_template='', message=''):
+        """
+        Crée la campagne et une ligne EmailDelivery par adresse (doublons
+        retirés). `message` est du texte libre, rendu via {{ message }}.
+        """
+        emails = {}
+        for email in recipients:
+            email = (email or '').strip()
+            if email:
+                emails.setdefault(email.lower(), email)
+        
+        user_ids = {
+            email.lower(): user_id
+            for email, user_id in User.objects.annotate(email_key=Lower('email'))
+            .filter(email_key__in=list(emails)).values_list('email', 'id')
+        }
+        with transaction.atomic():
+            campaign = EmailCampaign.objects.create(
+                subject=subject,
+                body_template=body_template,
+                html_template=html_template,
+                message=message,
+                created_by=created_by,
+            )
+            EmailDelivery.objects.bulk_create([
+                EmailDelivery(campaign=campaign, email=email, user_id=user_ids.get(key))
+                for key, email in emails.items()
+            ], batch_size=500)
+        return campaign
+    
+    @staticmethod
+    def literal(text):
+        """Texte saisi rendu tel quel dans un gabarit (accolades neutralisées)"""
+        return re.sub(
+            r'[{}]',
+            lambda m: '{% templatetag openbrace %}' if m.group() == '{' else '{% templatetag closebrace %}',
+            text,
+        )
+    
+    @staticmethod
+    def recipient_context(campaign, delivery):
+        user = delivery.user
+        return {
+            'user': user,
+            'order': delivery.order,
+            'email': delivery.email,
+            'first_name': user.first_name if user else '',
+            'last_name': user.last_name if user else '',
+            'message': campaign.message,
+        }
+    
+    @classmethod
+    def claim_campaign(cls, campaign):
+        """
+        Réserve la campagne pour cet envoi (UPDATE conditionnel) : False si
+        un autre processus l'a déjà prise. Une campagne restée « en cours »
+        au-delà de STALE_AFTER est considérée interrompue et peut être reprise.
+        """
+        now = timezone.now()
+        claimed = EmailCampaign.objects.filter(pk=campaign.pk).filter(
+            Q(status='queued') | Q(status='sending', started_at__lt=now - cls.STALE_AFTER)
+        ).update(status='sending', started_at=now)
+        if claimed:
+            campaign.status = 'sending'
+            campaign.started_at = now
+        return bool(claimed)
+    
+    @classmethod
+    def send_campaign(cls, campaign, connection=None):
+        """Envoie les destinataires encore en attente, par lots de CHUNK_SIZE"""
+        subject_template = Template(campaign.subject)
+        body_template = Template(campaign.body_template)
+        html_template = Template(campaign.html_template) if campaign.html_template else None
+        
+        campaign.status = 'sending'
+        campaign.started_at = campaign.started_at or timezone.now()
+        campaign.save(update_fields=['status', 'started_at'])
+        
+        connection = connection or get_connection()
+        try:
+            opened = connection.open()
+        except Exception:
+            # send_messages enregistre l'erreur pour chaque destinataire
+            opened = False
+        try:
+            pending = campaign.deliveries.filter(status='pending').select_related('user', 'order').order_by('id')
+            last_id = 0
+            while True:
+                chunk = list(pending.filter(id__gt=last_id)[:cls.CHUNK_SIZE])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                
+                messages = []
+                for delivery in chunk:
+                    values = cls.recipient_context(campaign, delivery)
+                    # Pas d'échappement HTML dans l'objet et la version texte
+                    text_context = Context(values, autoescape=False)
+                    message = EmailMultiAlternatives(
+                        ' '.join(subject_template.render(text_context).split()),
+                        body_template.render(text_context),
+                        settings.DEFAULT_FROM_EMAIL,
+                        [delivery.email]
+                    )
+                    if html_template:
+                        message.attach_alternative(html_template.render(Context(values)), 'text/html')
+                    messages.append(message)
+                
+                errors = cls.send_messages(messages, connection, rate=cls.RATE_PER_SECOND)
+                now = timezone.now()
+                for delivery, error in zip(chunk, errors):
+                    delivery.status = 'failed' if error else 'sent'
+                    delivery.error = error or ''
+                    delivery.sent_at = None if error else now
+                EmailDelivery.objects.bulk_update(chunk, ['status', 'error', 'sent_at'])
+        finally:
+            if opened:
+                connection.close()
+        
+        counts = dict(
+            campaign.deliveries.values_list('status').annotate(total=Count('id')).order_by()
+        )
+        campaign.sent_count = counts.get('sent', 0)
+        campaign.failed_count = counts.get('failed', 0)
+        campaign.status = 'failed' if campaign.failed_count and not campaign.sent_count else 'sent'
+        campaign.finished_at = timezone.now()
+        campaign.save(update_fields=['sent_count', 'failed_count', 'status', 'finished_at'])
+        return campaign
+    
+    @classmethod
+    def send_queued_campaigns(cls):
+        """
+        Envoie les campagnes en attente (ou interrompues en cours d'envoi).
+        Chaque campagne est réservée avant l'envoi : deux exécutions
+        simultanées de la commande ne l'envoient pas deux fois.
+        """
+        campaigns = EmailCampaign.objects.filter(
+            Q(status='queued') | Q(status='sending', started_at__lt=timezone.now() - cls.STALE_AFTER)
+        ).order_by('created_at')
+        connection = get_connection()
+        return [
+            cls.send_campaign(campaign, connection)
+            for campaign in campaigns
+            if cls.claim_campaign(campaign)
+        ]
+
 class InvoiceService:
     """Service de génération de factures"""
     
@@ -211,58 +453,3639 @@ class InventoryService:
         return []
 
 class RecommendationService:
-    """Service de recommandations personnalisées"""
-    
-    @staticmethod
-    def get_user_recommendations(user, limit=6):
-        """Obtenir des recommandations basées sur l'historique"""
-        from django.db.models import Count
-        
-        # Catégories préférées de l'utilisateur
-        preferred_categories = OrderItem.objects.filter(
-            order__user=user
-        ).values('lunch_box__category').annotate(
-            count=Count('id')
-        ).order_by('-count')[:3].values_list('lunch_box__category', flat=True)
-        
-        # Produits jamais commandés dans ces catégories
-        ordered_items = OrderItem.objects.filter(
-            order__user=user
-        ).values_list('lunch_box_id', flat=True)
-        
-        recommendations = LunchBox.objects.filter(
-            category__in=preferred_categories,
-            is_available=True
-        ).exclude(
-            id__in=ordered_items
-        ).order_by('-sales_count')[:limit]
-        
-        # Si pas assez de recommandations, ajouter des best-sellers
-        if recommendations.count() < limit:
-            additional = LunchBox.objects.filter(
-                is_available=True
+    """Service de recommandations basé sur un modèle de co-achat précalculé"""
+    
+    TOP_K = 10
+    CACHE_TIMEOUT = 60 * 60 * 24
+    USER_CACHE_TIMEOUT = 60 * 60
+    VALID_STATUSES = ['confirmed', 'preparing', 'ready', 'delivered']
+    
+    @staticmethod
+    def _product_cache_key(product_id):
+        return f'reco:complementary:{product_id}'
+    
+    @staticmethod
+    def _user_cache_key(user_id):
+        return f'reco:user:{user_id}'
+    
+    @classmethod
+    def build_co_purchase_model(cls, product_ids=None, top_k=None):
+        """
+        Calcule la matrice creuse de co-occurrence produit × produit à partir
+        de l'historique OrderItem et stocke les top-K voisins de chaque produit.
+        
+        Si product_ids est fourni, seuls ces produits sont recalculés (mise à
+        jour incrémentale), à partir des seules commandes qui les contiennent.
+        Retourne le nombre de lignes de recommandation écrites.
+        """
+        top_k = top_k or cls.TOP_K
+        items = OrderItem.objects.filter(
+            product__isnull=False,
+            order__status__in=cls.VALID_STATUSES
+        )
+        
+        # Nombre de commandes contenant chaque produit (normalisation du score)
+        orders_per_product = dict(
+            items.values('product_id').annotate(
+                n=Count('order_id', distinct=True)
+            ).values_list('product_id', 'n').order_by()
+        )
+        
+        targets = None
+        if product_ids is not None:
+            targets = set(product_ids)
+            if not targets:
+                return 0
+            items = items.filter(
+                order_id__in=OrderItem.objects.filter(product_id__in=targets).values('order_id')
+            )
+        
+        # Matrice creuse : {produit: Counter({produit voisin: commandes communes})}
+        co_counts = defaultdict(Counter)
+        rows = items.values_list('order_id', 'product_id').distinct().order_by('order_id')
+        for order_id, group in groupby(rows.iterator(), key=itemgetter(0)):
+            basket = {product_id for _, product_id in group}
+            if len(basket) < 2:
+                continue
+            for product_id in basket:
+                if targets is not None and product_id not in targets:
+                    continue
+                neighbours = co_counts[product_id]
+                for other_id in basket:
+                    if other_id != product_id:
+                        neighbours[other_id] += 1
+        
+        recommendations = []
+        for product_id, neighbours in co_counts.items():
+            n_product = orders_per_product.get(product_id, 0)
+            scored = [
+                (co / math.sqrt(n_product * orders_per_product[other_id]), co, other_id)
+                for other_id, co in neighbours.items()
+                if n_product and orders_per_product.get(other_id)
+            ]
+            scored.sort(key=lambda row: (-row[0], -row[1], row[2]))
+            for rank, (score, co, other_id) in enumerate(scored[:top_k]):
+                recommendations.append(ProductRecommendation(
+                    product_id=product_id,
+                    recommended_product_id=other_id,
+                    rank=rank,
+                    score=score,
+                    co_orders=co,
+                ))
+        
+        with transaction.atomic():
+            existing = ProductRecommendation.objects.all()
+            if targets is not None:
+                existing = existing.filter(product_id__in=targets)
+            stale_ids = set(existing.values_list('product_id', flat=True))
+            existing.delete()
+            ProductRecommendation.objects.bulk_create(recommendations, batch_size=500)
+        
+        # Invalider le cache des produits recalculés
+        touched = stale_ids | set(co_counts) | (targets or set())
+        cache.delete_many([cls._product_cache_key(product_id) for product_id in touched])
+        
+        return len(recommendations)
+    
+    @classmethod
+    def update_recent(cls, since, top_k=None):
+        """Mise à jour incrémentale : produits présents dans les commandes modifiées depuis `since`"""
+        product_ids = OrderItem.objects.filter(
+            product__isnull=False,
+            order__updated_at__gte=since
+        ).values_list('product_id', flat=True).distinct()
+        return cls.build_co_purchase_model(product_ids=list(product_ids), top_k=top_k)
+    
+    @classmethod
+    def get_complementary_items(cls, product, limit=4):
+        """Identifiants des articles souvent commandés avec ce produit (lecture en cache)"""
+        product_id = getattr(product, 'id', product)
+        key = cls._product_cache_key(product_id)
+        
+        recommended_ids = cache.get(key)
+        if recommended_ids is None:
+            recommended_ids = list(
+                ProductRecommendation.objects.filter(
+                    product_id=product_id
+                ).order_by('rank').values_list('recommended_product_id', flat=True)
+            )
+            cache.set(key, recommended_ids, cls.CACHE_TIMEOUT)
+        
+        return recommended_ids[:limit]
+    
+    @classmethod
+    def get_complementary_products(cls, product, limit=4):
+        """Produits actifs souvent commandés avec ce produit, dans l'ordre du modèle"""
+        recommended_ids = cls.get_complementary_items(product, limit=limit * 2)
+        if not recommended_ids:
+            return []
+        products = Product.objects.filter(id__in=recommended_ids, is_active=True).select_related('category')
+        products_by_id = {p.id: p for p in products}
+        return [products_by_id[pid] for pid in recommended_ids if pid in products_by_id][:limit]
+    
+    @classmethod
+    def get_user_recommendations(cls, user, limit=6):
+        """Recommandations personnalisées : voisins des produits déjà commandés, puis best-sellers"""
+        key = cls._user_cache_key(user.id)
+        recommended_ids = cache.get(key)
+        
+        if recommended_ids is None:
+            ordered_ids = set(
+                OrderItem.objects.filter(
+                    order__user=user,
+                    product__isnull=False
+                ).values_list('product_id', flat=True).distinct()
+            )
+            
+            scores = Counter()
+            neighbours = ProductRecommendation.objects.filter(
+                product_id__in=ordered_ids
             ).exclude(
-                id__in=ordered_items
-            ).order_by('-sales_count')[:limit - recommendations.count()]
+                recommended_product_id__in=ordered_ids
+            ).values_list('recommended_product_id', 'score')
+            for product_id, score in neighbours:
+                scores[product_id] += score
+            recommended_ids = [product_id for product_id, _ in scores.most_common()]
+            
+            # Compléter avec les best-sellers jamais commandés
+            if len(recommended_ids) < limit:
+                recommended_ids += list(
+                    Product.objects.filter(is_active=True).exclude(
+                        id__in=ordered_ids | set(recommended_ids)
+                    ).order_by('-sales_count').values_list('id', flat=True)[:limit - len(recommended_ids)]
+                )
+            cache.set(key, recommended_ids, cls.USER_CACHE_TIMEOUT)
+        
+        products = Product.objects.filter(id__in=recommended_ids[:limit * 2], is_active=True)
+        products_by_id = {p.id: p for p in products}
+        return [products_by_id[pid] for pid in recommended_ids if pid in products_by_id][:limit]
+
+class PlanningGridService:
+    """Grille de planning livreurs × jours construite en trois requêtes"""
+    
+    @staticmethod
+    def build_grid(drivers, start_date, days=7):
+        """
+        Construit la matrice livreur × jour à partir des plannings, des routes
+        et du nombre de livraisons par route, chargés en une fois pour la période
+        """
+        drivers = list(drivers)
+        end_date = start_date + timedelta(days=days - 1)
+        driver_ids = [driver.id for driver in drivers]
+        
+        plannings = DriverPlanning.objects.filter(
+            driver_id__in=driver_ids,
+            date__range=[start_date, end_date]
+        )
+        planning_by_key = {(p.driver_id, p.date): p for p in plannings}
+        
+        routes = DeliveryRoute.objects.filter(
+            driver_id__in=driver_ids,
+            date__range=[start_date, end_date]
+        ).annotate(
+            deliveries_count=Count('route_deliveries')
+        ).order_by('date', 'start_time')
+        routes_by_key = defaultdict(list)
+        for route in routes:
+            routes_by_key[(route.driver_id, route.date)].append(route)
+        
+        grid = []
+        for driver in drivers:
+            driver_days = []
+            for day_offset in range(days):
+                current_date = start_date + timedelta(days=day_offset)
+                planning = planning_by_key.get((driver.id, current_date))
+                day_routes = routes_by_key.get((driver.id, current_date), [])
+                
+                driver_days.append({
+                    'date': current_date,
+                    'planning': planning,
+                    'routes': day_routes,
+                    'deliveries_count': sum(r.deliveries_count for r in day_routes),
+                    'is_available': planning.is_available if planning else True,
+                })
+            
+            grid.append({
+                'driver': driver,
+                'days': driver_days,
+            })
+        
+        return grid
+    
+    @staticmethod
+    def get_day_stats(grid, day_index=0):
+        """Statistiques d'une colonne (jour) de la grille, sans requête"""
+        cells = [row['days'][day_index] for row in grid]
+        plannings = [cell['planning'] for cell in cells if cell['planning']]
+        total_deliveries = sum(cell['deliveries_count'] for cell in cells)
+        avg_deliveries = total_deliveries / len(grid) if grid else 0
+        
+        return {
+            'available': sum(1 for p in plannings if p.is_available),
+            'unavailable': sum(1 for p in plannings if not p.is_available),
+            'total_routes': sum(len(cell['routes']) for cell in cells),
+            'avg_deliveries': round(avg_deliveries, 1)
+        }
+
+class DemandForecastService:
+    """
+    Prévision de la demande par produit / département / jour de la semaine.
+    
+    Modèle : moyenne pondérée des mêmes jours de semaine sur les dernières
+    semaines (saisonnalité hebdomadaire), corrigée par la tendance récente.
+    Les quantités déjà commandées pour les jours à venir servent de plancher.
+    """
+    
+    HISTORY_WEEKS = 8
+    TREND_DAYS = 28
+    TREND_BOUNDS = (0.5, 2.0)
+    CACHE_TIMEOUT = 60 * 60 * 24
+    EXCLUDED_STATUSES = ['cancelled']
+    
+    @staticmethod
+    def _cache_key(as_of, days, department):
+        return f'forecast:{as_of.isoformat()}:{days}:{department or "all"}'
+    
+    @classmethod
+    def load_history(cls, start_date, end_date, department=None):
+        """
+        Quantités commandées par (produit, département) et date de livraison,
+        chargées en une seule requête groupée.
+        Retourne {(product_id, department): {date: quantité}} et {clé: nom du produit}.
+        """
+        items = OrderItem.objects.filter(
+            product__isnull=False,
+            order__delivery_date__range=[start_date, end_date]
+        ).exclude(order__status__in=cls.EXCLUDED_STATUSES)
+        if department:
+            items = items.filter(department=department)
+        
+        rows = items.values(
+            'product_id', 'product_name', 'department', 'order__delivery_date'
+        ).annotate(qty=Sum('quantity')).order_by()
+        
+        series = defaultdict(lambda: defaultdict(int))
+        names = {}
+        for row in rows:
+            key = (row['product_id'], row['department'] or 'autres')
+            series[key][row['order__delivery_date']] += row['qty']
+            names.setdefault(key, row['product_name'])
+        return series, names
+    
+    @classmethod
+    def predict(cls, daily, target_date, as_of, history_weeks=None):
+        """
+        Prévision d'une série {date: quantité} pour target_date, en n'utilisant
+        que les jours strictement antérieurs à as_of.
+        """
+        history_weeks = history_weeks or cls.HISTORY_WEEKS
+        
+        # Saisonnalité : mêmes jours de semaine connus, les plus récents pèsent plus
+        first_lag = (target_date - as_of).days // 7 + 1
+        weighted, weights = 0.0, 0
+        for i in range(history_weeks):
+            weight = history_weeks - i
+            weighted += weight * daily.get(target_date - timedelta(weeks=first_lag + i), 0)
+            weights += weight
+        baseline = weighted / weights
+        if not baseline:
+            return 0.0
+        
+        # Tendance : dernières semaines comparées à la moyenne de l'historique
+        recent = sum(
+            daily.get(as_of - timedelta(days=d), 0) for d in range(1, cls.TREND_DAYS + 1)
+        ) / cls.TREND_DAYS
+        overall = sum(
+            daily.get(as_of - timedelta(days=d), 0) for d in range(1, history_weeks * 7 + 1)
+        ) / (history_weeks * 7)
+        trend = recent / overall if overall else 1.0
+        low, high = cls.TREND_BOUNDS
+        return baseline * min(max(trend, low), high)
+    
+    @classmethod
+    def build_forecast(cls, as_of, days=7, department=None):
+        """
+        Prévision des `days` prochains jours à partir de as_of (inclus).
+        Les commandes déjà passées pour ces jours sont incluses : la prévision
+        n'est jamais inférieure au déjà-commandé, et `expected` donne le
+        volume encore à venir.
+        """
+        history_start = as_of - timedelta(weeks=cls.HISTORY_WEEKS)
+        horizon_end = as_of + timedelta(days=days - 1)
+        series, names = cls.load_history(history_start, horizon_end, department)
+        dates = [as_of + timedelta(days=offset) for offset in range(days)]
+        
+        rows = []
+        departments = defaultdict(lambda: [0] * days)
+        for key, daily in series.items():
+            product_id, dept = key
+            forecast, booked = [], []
+            for index, target_date in enumerate(dates):
+                already = daily.get(target_date, 0)
+                quantity = max(already, round(cls.predict(daily, target_date, as_of)))
+                forecast.append(quantity)
+                booked.append(already)
+                departments[dept][index] += quantity
+            if not any(forecast):
+                continue
+            rows.append({
+                'product_id': product_id,
+                'product_name': names[key],
+                'department': dept,
+                'forecast': forecast,
+                'booked': booked,
+                'expected': [f - b for f, b in zip(forecast, booked)],
+                'total': sum(forecast),
+            })
+        
+        rows.sort(key=lambda row: (-row['total'], row['product_name']))
+        department_names = dict(OrderItem.DEPARTMENT_CHOICES)
+        return {
+            'as_of': as_of,
+            'dates': dates,
+            'rows': rows,
+            'departments': [
+                {
+                    'code': code,
+                    'name': department_names.get(code, code),
+                    'forecast': departments[code],
+                    'total': sum(departments[code]),
+                }
+                for code, _ in OrderItem.DEPARTMENT_CHOICES
+                if code in departments
+            ],
+        }
+    
+    @classmethod
+    def get_forecast(cls, days=7, department=None, as_of=None):
+        """Prévision mise en cache pour la journée"""
+        as_of = as_of or timezone.localdate()
+        key = cls._cache_key(as_of, days, department)
+        forecast = cache.get(key)
+        if forecast is None:
+            forecast = cls.build_forecast(as_of, days=days, department=department)
+            cache.set(key, forecast, cls.CACHE_TIMEOUT)
+        return forecast
+    
+    @classmethod
+    def backtest(cls, start_date, end_date, horizon=1, department=None):
+        """
+        Rejoue la prévision jour par jour sur [start_date, end_date] : chaque
+        jour est prédit avec l'historique arrêté `horizon` jours plus tôt, puis
+        comparé aux quantités réellement commandées. La référence naïve est la
+        même journée de la semaine précédente.
+        """
+        history_start = start_date - timedelta(weeks=cls.HISTORY_WEEKS, days=horizon)
+        series, _ = cls.load_history(history_start, end_date, department)
+        
+        totals = defaultdict(lambda: {'actual': 0, 'abs_error': 0.0, 'error': 0.0, 'naive_abs_error': 0.0})
+        target_date = start_date
+        while target_date <= end_date:
+            as_of = target_date - timedelta(days=horizon - 1)
+            naive_lag = timedelta(weeks=(horizon - 1) // 7 + 1)
+            for (product_id, dept), daily in series.items():
+                actual = daily.get(target_date, 0)
+                predicted = cls.predict(daily, target_date, as_of)
+                naive = daily.get(target_date - naive_lag, 0)
+                if not (actual or predicted or naive):
+                    continue
+                for bucket in (totals[dept], totals['__all__']):
+                    bucket['actual'] += actual
+                    bucket['abs_error'] += abs(predicted - actual)
+                    bucket['error'] += predicted - actual
+                    bucket['naive_abs_error'] += abs(naive - actual)
+            target_date += timedelta(days=1)
+        
+        results = {}
+        for dept, bucket in totals.items():
+            actual = bucket['actual']
+            results[dept] = {
+                'actual': actual,
+                'wape': bucket['abs_error'] / actual * 100 if actual else None,
+                'bias': bucket['error'] / actual * 100 if actual else None,
+                'naive_wape': bucket['naive_abs_error'] / actual * 100 if actual else None,
+            }
+        return results
+
+class ReorderPlannerService:
+    """
+    Planificateur de réapprovisionnement : les commandes confirmées sont
+    éclatées en besoins d'ingrédients via la nomenclature (RecipeComponent),
+    comparées au stock et aux commandes fournisseurs ouvertes, puis
+    regroupées en brouillons de ProductOrder par fournisseur.
+    """
+    
+    HORIZON_DAYS = 7
+    DEMAND_STATUSES = ['confirmed', 'preparing']
+    OPEN_ORDER_STATUSES = ['pending', 'approved', 'ordered']
+    QUANTITY_STEP = Decimal('0.01')
+    
+    @classmethod
+    def explode_demand(cls, start_date, end_date):
+        """
+        Besoin brut par ingrédient sur la période, en une requête : quantités
+        vendues agrégées par composant de recette, multipliées ensuite par la
+        quantité unitaire (perte incluse).
+        """
+        components = RecipeComponent.objects.filter(
+            product__orderitem__order__status__in=cls.DEMAND_STATUSES,
+            product__orderitem__order__delivery_date__range=[start_date, end_date],
+        ).values(
+            'id', 'kitchen_product_id', 'quantity', 'waste_percentage'
+        ).annotate(sold=Sum('product__orderitem__quantity')).order_by()
+        
+        demand = defaultdict(Decimal)
+        for row in components:
+            gross = row['quantity'] * (1 + row['waste_percentage'] / 100)
+            demand[row['kitchen_product_id']] += gross * row['sold']
+        return dict(demand)
+    
+    @classmethod
+    def get_on_order(cls, kitchen_product_ids):
+        """Quantités commandées et pas encore reçues, par ingrédient"""
+        rows = ProductOrderItem.objects.filter(
+            product_id__in=kitchen_product_ids,
+            order__status__in=cls.OPEN_ORDER_STATUSES
+        ).values('product_id').annotate(
+            ordered=Sum('quantity'),
+            received=Sum('received_quantity')
+        ).order_by()
+        return {
+            row['product_id']: max(row['ordered'] - row['received'], Decimal('0'))
+            for row in rows
+        }
+    
+    @classmethod
+    def plan(cls, start_date=None, end_date=None):
+        """
+        Calcule les quantités à commander : un ingrédient est réapprovisionné
+        jusqu'à son stock maximum dès que le stock projeté (stock + commandé
+        - besoin) passe sous le stock minimum.
+        """
+        start_date = start_date or timezone.localdate()
+        end_date = end_date or start_date + timedelta(days=cls.HORIZON_DAYS - 1)
+        demand = cls.explode_demand(start_date, end_date)
+        
+        products = list(
+            KitchenProduct.objects.filter(is_active=True).filter(
+                Q(id__in=list(demand)) | Q(current_stock__lt=F('min_stock'))
+            ).select_related('supplier')
+        )
+        on_order = cls.get_on_order([product.id for product in products])
+        
+        by_supplier = defaultdict(list)
+        unassigned = []
+        for product in products:
+            required = demand.get(product.id, Decimal('0'))
+            incoming = on_order.get(product.id, Decimal('0'))
+            projected = product.current_stock + incoming - required
+            if projected >= product.min_stock:
+                continue
+            
+            target = max(product.max_stock, product.min_stock)
+            quantity = (target - projected).quantize(cls.QUANTITY_STEP, rounding=ROUND_UP)
+            line = {
+                'product': product,
+                'required': required,
+                'stock': product.current_stock,
+                'on_order': incoming,
+                'projected': projected,
+                'quantity': quantity,
+                'shortage': projected < 0,
+            }
+            if product.supplier_id and product.supplier.is_active:
+                by_supplier[product.supplier].append(line)
+            else:
+                unassigned.append(line)
+        
+        suppliers = [
+            {
+                'supplier': supplier,
+                'lines': lines,
+                'total': sum(
+                    line['quantity'] * line['product'].unit_price for line in lines
+                ).quantize(cls.QUANTITY_STEP),
+            }
+            for supplier, lines in sorted(by_supplier.items(), key=lambda item: item[0].name)
+        ]
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'suppliers': suppliers,
+            'unassigned': unassigned,
+        }
+    
+    @staticmethod
+    def get_default_requester():
+        """Responsable des brouillons automatiques : chef de cuisine, sinon administrateur"""
+        return (
+            User.objects.filter(role='head_chef', is_active=True).order_by('id').first()
+            or User.objects.filter(role='admin', is_active=True).order_by('id').first()
+        )
+    
+    @classmethod
+    @transaction.atomic
+    def create_draft_orders(cls, plan, requested_by=None):
+        """
+        Remplace les brouillons générés précédemment par ceux du plan.
+        Les commandes déjà soumises ou modifiées à la main ne sont pas touchées.
+        """
+        requested_by = requested_by or cls.get_default_requester()
+        if requested_by is None:
+            return []
+        
+        ProductOrder.objects.filter(auto_generated=True, status='draft').delete()
+        
+        orders = []
+        items = []
+        for group in plan['suppliers']:
+            order = ProductOrder.objects.create(
+                requested_by=requested_by,
+                department='general',
+                supplier=group['supplier'],
+                status='draft',
+                priority='high' if any(line['shortage'] for line in group['lines']) else 'normal',
+                needed_date=plan['start_date'],
+                notes=f"Réapprovisionnement calculé pour les commandes du {plan['start_date']:%d/%m} au {plan['end_date']:%d/%m}",
+                total_amount=group['total'],
+                auto_generated=True,
+            )
+            orders.append(order)
+            for line in group['lines']:
+                unit_price = line['product'].unit_price
+                items.append(ProductOrderItem(
+                    order=order,
+                    product=line['product'],
+                    quantity=line['quantity'],
+                    unit_price=unit_price,
+                    total_price=line['quantity'] * unit_price,
+                ))
+        ProductOrderItem.objects.bulk_create(items)
+        return orders
+    
+    @classmethod
+    def replan(cls, start_date=None, end_date=None, requested_by=None):
+        """Recalcule le plan et régénère les brouillons fournisseurs"""
+        return cls.create_draft_orders(cls.plan(start_date, end_date), requested_by=requested_by)
+
+class StockLedgerService:
+    """
+    Journal des mouvements de stock cuisine. Chaque entrée ou sortie est
+    enregistrée dans StockMovement et appliquée au solde par une mise à jour
+    atomique F(), sans lecture préalable. Les StockSnapshot périodiques
+    permettent de retrouver le stock à une date sans rejouer tout le journal.
+    """
+    
+    SIGNS = {
+        StockMovement.RECEIPT: 1,
+        StockMovement.CONSUMPTION: -1,
+        StockMovement.WASTE: -1,
+        StockMovement.ADJUSTMENT: 1,
+    }
+    
+    @classmethod
+    def build_movement(cls, kitchen_product, movement_type, quantity, **extra):
+        """
+        Prépare un mouvement non enregistré. La quantité est donnée en valeur
+        absolue (sauf pour les ajustements, qui sont signés).
+        """
+        quantity = Decimal(str(quantity))
+        if movement_type != StockMovement.ADJUSTMENT:
+            quantity = abs(quantity) * cls.SIGNS[movement_type]
+        extra.setdefault('unit_cost', kitchen_product.unit_price)
+        return StockMovement(
+            kitchen_product=kitchen_product,
+            movement_type=movement_type,
+            quantity=quantity,
+            **extra
+        )
+    
+    @classmethod
+    @transaction.atomic
+    def record_many(cls, movements):
+        """Enregistre des mouvements et applique un seul UPDATE F() par produit"""
+        movements = [movement for movement in movements if movement.quantity]
+        if not movements:
+            return []
+        StockMovement.objects.bulk_create(movements)
+        
+        deltas = defaultdict(Decimal)
+        for movement in movements:
+            deltas[movement.kitchen_product_id] += movement.quantity
+        for product_id, delta in deltas.items():
+            KitchenProduct.objects.filter(pk=product_id).update(
+                current_stock=F('current_stock') + delta
+            )
+        return movements
+    
+    @classmethod
+    def record(cls, kitchen_product, movement_type, quantity, **extra):
+        """Enregistre un mouvement unique et met à jour le solde du produit"""
+        movements = cls.record_many([
+            cls.build_movement(kitchen_product, movement_type, quantity, **extra)
+        ])
+        return movements[0] if movements else None
+    
+    @classmethod
+    @transaction.atomic
+    def set_stock(cls, kitchen_product, counted, created_by=None, notes='Inventaire physique'):
+        """Aligne le stock sur un comptage par un ajustement de la différence"""
+        current = KitchenProduct.objects.select_for_update().values_list(
+            'current_stock', flat=True
+        ).get(pk=kitchen_product.pk)
+        difference = Decimal(str(counted)) - current
+        return cls.record(
+            kitchen_product, StockMovement.ADJUSTMENT, difference,
+            created_by=created_by, notes=notes
+        )
+    
+    @classmethod
+    @transaction.atomic
+    def receive_items(cls, items, created_by=None):
+        """Entrée en stock des quantités reçues d'articles de commande fournisseur"""
+        now = timezone.now()
+        return cls.record_many([
+            cls.build_movement(
+                item.product, StockMovement.RECEIPT, item.received_quantity,
+                unit_cost=item.unit_price,
+                product_order_item=item,
+                department=item.order.department,
+                notes=f"Commande {item.order.order_number}",
+                created_by=created_by,
+                created_at=now,
+            )
+            for item in items
+        ])
+    
+    @staticmethod
+    @transaction.atomic
+    def take_snapshots(taken_at=None):
+        """Photographie le stock de tous les produits actifs"""
+        taken_at = taken_at or timezone.now()
+        products = KitchenProduct.objects.filter(is_active=True).values_list(
+            'id', 'current_stock', 'unit_price'
+        )
+        return StockSnapshot.objects.bulk_create([
+            StockSnapshot(
+                kitchen_product_id=product_id,
+                taken_at=taken_at,
+                quantity=stock,
+                unit_price=unit_price,
+                value=stock * unit_price,
+            )
+            for product_id, stock, unit_price in products
+        ], batch_size=500)
+    
+    @staticmethod
+    def stock_at(at, product_ids=None):
+        """
+        Stock de chaque produit à l'instant `at` : dernière photo antérieure
+        plus les mouvements survenus depuis. Deux requêtes, quelle que soit la
+        taille du journal : les photos d'abord, puis la somme des seuls
+        mouvements postérieurs à la photo de chaque produit (index
+        produit + date).
+        Retourne {product_id: (quantité, prix unitaire de la photo ou None)}.
+        """
+        latest_snapshot = StockSnapshot.objects.filter(
+            kitchen_product_id=OuterRef('pk'),
+            taken_at__lte=at
+        ).order_by('-taken_at')
+        products = KitchenProduct.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        baselines = list(products.annotate(
+            snapshot_at=Subquery(latest_snapshot.values('taken_at')[:1]),
+            snapshot_quantity=Subquery(latest_snapshot.values('quantity')[:1]),
+            snapshot_price=Subquery(latest_snapshot.values('unit_price')[:1]),
+        ).values_list('id', 'snapshot_at', 'snapshot_quantity', 'snapshot_price'))
+        if not baselines:
+            return {}
+        
+        # Les photos sont prises pour tous les produits à la fois : peu
+        # d'instants distincts, donc une condition par instant
+        by_snapshot = defaultdict(list)
+        for product_id, snapshot_at, _, _ in baselines:
+            by_snapshot[snapshot_at].append(product_id)
+        window = Q()
+        for snapshot_at, ids in by_snapshot.items():
+            condition = Q(kitchen_product_id__in=ids)
+            if snapshot_at is not None:
+                condition &= Q(created_at__gt=snapshot_at)
+            window |= condition
+        deltas = dict(
+            StockMovement.objects.filter(window, created_at__lte=at)
+            .values('kitchen_product_id').annotate(delta=Sum('quantity'))
+            .values_list('kitchen_product_id', 'delta').order_by()
+        )
+        
+        return {
+            product_id: ((quantity or Decimal('0')) + (deltas.get(product_id) or Decimal('0')), price)
+            for product_id, _, quantity, price in baselines
+        }
+    
+    @classmethod
+    def valuation_at(cls, at, product_ids=None):
+        """Valeur du stock à une date (prix de la photo, sinon prix actuel)"""
+        stock = cls.stock_at(at, product_ids)
+        current_prices = dict(
+            KitchenProduct.objects.filter(pk__in=list(stock)).values_list('id', 'unit_price')
+        )
+        return sum(
+            (quantity * (price if price is not None else current_prices[product_id])
+             for product_id, (quantity, price) in stock.items()),
+            Decimal('0')
+        )
+
+class SlotUnavailableError(Exception):
+    """Le créneau demandé n'a plus de capacité"""
+
+class SlotCapacityService:
+    """
+    Capacité des créneaux de livraison. Chaque créneau (DeliverySlot) porte
+    ses capacités (livreurs planifiés, cuisine) et ses compteurs de
+    réservations, incrémentés par un UPDATE conditionnel au moment de la
+    commande : deux clients ne peuvent pas prendre la dernière place.
+    """
+    
+    SLOT_MINUTES = 30
+    CACHE_TIMEOUT = 60
+    BOOKING_DAYS = 7
+    INACTIVE_STATUSES = ['cancelled']
+    
+    @staticmethod
+    def _cache_key(day):
+        return f'slots:{day.isoformat()}'
+    
+    @staticmethod
+    def get_settings():
+        return cached_singleton(DeliverySettings) or DeliverySettings()
+    
+    @classmethod
+    def normalize(cls, day, start_time):
+        """Convertit date / heure (éventuellement reçues en texte) vers le début du créneau"""
+        day = Order._meta.get_field('delivery_date').to_python(day)
+        start_time = Order._meta.get_field('delivery_time').to_python(start_time)
+        minutes = (start_time.hour * 60 + start_time.minute) // cls.SLOT_MINUTES * cls.SLOT_MINUTES
+        return day, time(minutes // 60, minutes % 60)
+    
+    @classmethod
+    def slot_times(cls, settings_obj):
+        """Débuts de créneaux entre l'heure d'ouverture et l'heure de fermeture"""
+        opening = Order._meta.get_field('delivery_time').to_python(settings_obj.delivery_start_time)
+        closing = Order._meta.get_field('delivery_time').to_python(settings_obj.delivery_end_time)
+        current = datetime.combine(date.min, opening)
+        end = datetime.combine(date.min, closing)
+        times = []
+        while current < end:
+            times.append(current.time())
+            current += timedelta(minutes=cls.SLOT_MINUTES)
+        return times
+    
+    @classmethod
+    def compute_capacities(cls, days, settings_obj=None):
+        """
+        Capacité de chaque créneau : la capacité journalière de chaque livreur
+        disponible (max_deliveries) est répartie sur les créneaux de son quart.
+        Sans aucun planning pour la journée, la capacité par défaut s'applique.
+        """
+        settings_obj = settings_obj or cls.get_settings()
+        times = cls.slot_times(settings_obj)
+        plannings = DriverPlanning.objects.filter(date__in=days).values_list(
+            'date', 'start_time', 'end_time', 'max_deliveries', 'is_available'
+        )
+        plannings_by_day = defaultdict(list)
+        for row in plannings:
+            plannings_by_day[row[0]].append(row[1:])
+        
+        capacities = {}
+        for day in days:
+            day_plannings = plannings_by_day.get(day)
+            for start_time in times:
+                if day_plannings is None:
+                    delivery_capacity = settings_obj.default_slot_capacity
+                else:
+                    delivery_capacity = 0
+                    for shift_start, shift_end, max_deliveries, is_available in day_plannings:
+                        if not is_available or not (shift_start <= start_time < shift_end):
+                            continue
+                        shift_minutes = (
+                            datetime.combine(day, shift_end) - datetime.combine(day, shift_start)
+                        ).total_seconds() / 60
+                        shift_slots = max(int(shift_minutes // cls.SLOT_MINUTES), 1)
+                        delivery_capacity += math.ceil(max_deliveries / shift_slots)
+                capacities[(day, start_time)] = (delivery_capacity, settings_obj.kitchen_slot_capacity)
+        return capacities
+    
+    @classmethod
+    def count_bookings(cls, days):
+        """Commandes actives par créneau, recomptées depuis les commandes"""
+        orders = Order.objects.filter(delivery_date__in=days).exclude(
+            status__in=cls.INACTIVE_STATUSES
+        ).values_list('delivery_date', 'delivery_time', 'delivery_type')
+        
+        counts = defaultdict(lambda: [0, 0])
+        for day, start_time, delivery_type in orders:
+            key = cls.normalize(day, start_time)
+            counts[key][1] += 1
+            if delivery_type == 'delivery':
+                counts[key][0] += 1
+        return counts
+    
+    @classmethod
+    def ensure_slots(cls, days):
+        """
+        Crée les créneaux manquants des journées données, compteurs initialisés
+        à partir des commandes existantes. Retourne {(date, heure): DeliverySlot}.
+        """
+        days = sorted(set(days))
+        slots = {
+            (slot.date, slot.start_time): slot
+            for slot in DeliverySlot.objects.filter(date__in=days)
+        }
+        missing_days = [day for day in days if not any(key[0] == day for key in slots)]
+        if missing_days:
+            capacities = cls.compute_capacities(missing_days)
+            bookings = cls.count_bookings(missing_days)
+            DeliverySlot.objects.bulk_create([
+                DeliverySlot(
+                    date=day,
+                    start_time=start_time,
+                    delivery_capacity=delivery_capacity,
+                    kitchen_capacity=kitchen_capacity,
+                    deliveries_booked=bookings[(day, start_time)][0] if (day, start_time) in bookings else 0,
+                    orders_booked=bookings[(day, start_time)][1] if (day, start_time) in bookings else 0,
+                )
+                for (day, start_time), (delivery_capacity, kitchen_capacity) in capacities.items()
+            ], ignore_conflicts=True)
+            slots.update({
+                (slot.date, slot.start_time): slot
+                for slot in DeliverySlot.objects.filter(date__in=missing_days)
+            })
+        return slots
+    
+    @classmethod
+    def refresh_capacity(cls, day):
+        """Recalcule les capacités d'une journée (après modification du planning livreurs)"""
+        slots = list(DeliverySlot.objects.filter(date=day))
+        if slots:
+            capacities = cls.compute_capacities([day])
+            for slot in slots:
+                slot.delivery_capacity, slot.kitchen_capacity = capacities.get(
+                    (day, slot.start_time), (0, 0)
+                )
+            DeliverySlot.objects.bulk_update(slots, ['delivery_capacity', 'kitchen_capacity'])
+        cache.delete(cls._cache_key(day))
+    
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, days):
+        """Recompte capacités et réservations des journées données (réparation)"""
+        DeliverySlot.objects.filter(date__in=days).delete()
+        slots = cls.ensure_slots(days)
+        cache.delete_many([cls._cache_key(day) for day in days])
+        return slots
+    
+    @classmethod
+    def get_availability(cls, day):
+        """Créneaux d'une journée avec places restantes (lecture en cache)"""
+        key = cls._cache_key(day)
+        availability = cache.get(key)
+        if availability is None:
+            slots = cls.ensure_slots([day])
+            availability = []
+            for (_, start_time), slot in sorted(slots.items()):
+                end_time = (datetime.combine(day, start_time) + timedelta(minutes=cls.SLOT_MINUTES)).time()
+                availability.append({
+                    'value': start_time.strftime('%H:%M'),
+                    'display': f"{start_time:%H}h{start_time:%M} - {end_time:%H}h{end_time:%M}",
+                    'deliveries_remaining': slot.deliveries_remaining,
+                    'orders_remaining': slot.orders_remaining,
+                    'delivery_available': slot.is_available('delivery'),
+                    'pickup_available': slot.is_available('pickup'),
+                })
+            cache.set(key, availability, cls.CACHE_TIMEOUT)
+        return availability
+    
+    @classmethod
+    def booking_dates(cls, days=None, start=None):
+        """Dates réservables : les BOOKING_DAYS jours à partir de demain, sauf dimanche"""
+        days = days or cls.BOOKING_DAYS
+        start = start or timezone.localdate() + timedelta(days=1)
+        return [
+            start + timedelta(days=offset) for offset in range(days)
+            if (start + timedelta(days=offset)).weekday() != 6
+        ]
+    
+    @classmethod
+    def get_available_dates(cls, days=None, start=None, delivery_type='delivery'):
+        """Prochaines dates de livraison (sauf dimanche) ayant au moins un créneau libre"""
+        candidates = cls.booking_dates(days, start)
+        cls.ensure_slots(candidates)
+        
+        availability_key = f'{delivery_type}_available'
+        dates = []
+        for day in candidates:
+            if any(slot[availability_key] for slot in cls.get_availability(day)):
+                dates.append({
+                    'date': day,
+                    'display': day.strftime('%A %d %B'),
+                    'value': day.strftime('%Y-%m-%d'),
+                })
+        return dates
+    
+    @classmethod
+    def reserve(cls, day, start_time, delivery_type='delivery'):
+        """
+        Réserve une place dans le créneau, ou lève SlotUnavailableError.
+        L'incrément est conditionnel : il échoue si la capacité est atteinte
+        au moment de l'UPDATE, même en cas de commandes simultanées.
+        """
+        day, start_time = cls.normalize(day, start_time)
+        slot = cls.ensure_slots([day]).get((day, start_time))
+        if slot is None:
+            raise SlotUnavailableError("Ce créneau est en dehors des heures de livraison.")
+        
+        conditions = Q(orders_booked__lt=F('kitchen_capacity'))
+        updates = {'orders_booked': F('orders_booked') + 1}
+        if delivery_type == 'delivery':
+            conditions &= Q(deliveries_booked__lt=F('delivery_capacity'))
+            updates['deliveries_booked'] = F('deliveries_booked') + 1
+        
+        reserved = DeliverySlot.objects.filter(conditions, pk=slot.pk).update(**updates)
+        cache.delete(cls._cache_key(day))
+        if not reserved:
+            raise SlotUnavailableError(
+                f"Le créneau du {day:%d/%m} à {start_time:%H:%M} est complet. Veuillez choisir un autre horaire."
+            )
+        return slot
+    
+    @classmethod
+    def adjust(cls, day, start_time, delivery_type, delta):
+        """
+        Ajuste les compteurs sans contrôle de capacité (annulation, report ou
+        commande créée hors parcours de réservation).
+        
+        Appelé une fois la commande enregistrée : si la journée n'a pas
+        encore de créneaux, ils sont créés à partir des commandes, qui
+        comptent déjà ce changement, et le delta n'est pas appliqué.
+        """
+        if day is None or start_time is None:
+            return
+        day, start_time = cls.normalize(day, start_time)
+        
+        slots = DeliverySlot.objects.filter(date=day, start_time=start_time)
+        if delta < 0:
+            updates = {'orders_booked': Greatest(F('orders_booked') + delta, 0)}
+            if delivery_type == 'delivery':
+                updates['deliveries_booked'] = Greatest(F('deliveries_booked') + delta, 0)
+        else:
+            updates = {'orders_booked': F('orders_booked') + delta}
+            if delivery_type == 'delivery':
+                updates['deliveries_booked'] = F('deliveries_booked') + delta
+        if not slots.update(**updates):
+            # Journée sans créneaux (ou heure hors créneaux : rien n'est créé)
+            cls.ensure_slots([day])
+        cache.delete(cls._cache_key(day))
+    
+    @classmethod
+    def booking_key(cls, day, start_time, delivery_type, status):
+        """Clé de réservation d'une commande (None si elle n'occupe pas de créneau)"""
+        if status in cls.INACTIVE_STATUSES or day is None or start_time is None:
+            return None
+        day, start_time = cls.normalize(day, start_time)
+        return day, start_time, delivery_type
+
+# ========================================
+# TRANSITIONS DE STATUT DES COMMANDES
+# ========================================
+
+class InvalidTransitionError(Exception):
+    """Changement de statut non autorisé par la machine à états"""
+
+class OrderStatusService:
+    """
+    Machine à états des commandes. Les changements groupés sont appliqués en
+    un seul UPDATE et historisés par insertion en bloc dans
+    OrderStatusHistory. Les effets de bord ne sont pas exécutés dans la
+    requête : les courriels sont déposés dans la file des envois groupés
+    (send_email_campaigns), livraisons et réapprovisionnement dans un
+    OrderStatusJob (process_order_jobs), dans la même transaction que la
+    transition.
+    """
+    
+    # Parcours normal : une commande n'avance que vers l'avant
+    FLOW = [Order.PENDING, Order.CONFIRMED, Order.PREPARING, Order.READY, Order.DELIVERED]
+    NOTIFY_STATUSES = [Order.CONFIRMED, Order.READY, Order.DELIVERED]
+    STATUS_MESSAGES = {
+        Order.CONFIRMED: 'Votre commande a été confirmée et sera préparée bientôt.',
+        Order.PREPARING: 'Votre commande est en cours de préparation par notre équipe.',
+        Order.READY: 'Votre commande est prête! Vous pouvez venir la récupérer.',
+        Order.DELIVERED: 'Votre commande a été livrée. Bon appétit!',
+        Order.CANCELLED: 'Votre commande a été annulée. Si vous avez des questions, contactez-nous.',
+    }
+    # Gabarits du courriel de suivi, rendus à l'envoi pour chaque commande
+    EMAIL_SUBJECT = 'Mise à jour de votre commande {{ order.order_number }}'
+    EMAIL_BODY = 'Votre commande {{ order.order_number }} est maintenant: {{ order.get_status_display }}'
+    EMAIL_HTML = "{% include 'JLTsite/order_status_update.html' with status_message=message %}"
+    # Traitement resté « en cours » au-delà : interrompu, il peut être repris
+    JOB_STALE_AFTER = timedelta(minutes=30)
+    
+    @classmethod
+    def allowed_targets(cls, status):
+        """Statuts atteignables depuis `status`"""
+        if status == Order.CANCELLED:
+            return {Order.PENDING}
+        if status == Order.DELIVERED or status not in cls.FLOW:
+            return set()
+        return set(cls.FLOW[cls.FLOW.index(status) + 1:]) | {Order.CANCELLED}
+    
+    @classmethod
+    def can_transition(cls, old_status, new_status):
+        return new_status in cls.allowed_targets(old_status)
+    
+    @staticmethod
+    def timestamp_updates(new_status, now):
+        """Horodatages à poser avec le statut (la première confirmation est conservée)"""
+        if new_status == Order.CONFIRMED:
+            return {'confirmed_at': Coalesce('confirmed_at', Value(now))}
+        if new_status == Order.DELIVERED:
+            return {'delivered_at': now}
+        return {}
+    
+    @classmethod
+    def bulk_transition(cls, order_ids, new_status, changed_by=None, note='', source='bulk', notify=True):
+        """
+        Passe les commandes `order_ids` au statut `new_status`.
+        
+        Retourne {'updated': [...], 'unchanged': [...], 'rejected': [{id, status}], 'missing': [...]}.
+        Les commandes dont la transition n'est pas permise sont ignorées et
+        listées dans `rejected`.
+        """
+        if new_status not in dict(Order.STATUS_CHOICES):
+            raise InvalidTransitionError(f"Statut inconnu: {new_status}")
+        
+        order_ids = [int(pk) for pk in order_ids]
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                Order.objects.select_for_update()
+                .filter(id__in=order_ids)
+                .values('id', 'status', 'delivery_type', 'delivery_date', 'delivery_time')
+            )
+            accepted, unchanged, rejected = [], [], []
+            for row in rows:
+                if row['status'] == new_status:
+                    unchanged.append(row['id'])
+                elif cls.can_transition(row['status'], new_status):
+                    accepted.append(row)
+                else:
+                    rejected.append({'id': row['id'], 'status': row['status']})
+            
+            updated_ids = [row['id'] for row in accepted]
+            reactivated_or_cancelled = [
+                row['id'] for row in accepted if Order.CANCELLED in (row['status'], new_status)
+            ]
+            if updated_ids:
+                Order.objects.filter(id__in=updated_ids).update(
+                    status=new_status, updated_at=now, **cls.timestamp_updates(new_status, now)
+                )
+                OrderStatusHistory.objects.bulk_create([
+                    OrderStatusHistory(
+                        order_id=row['id'],
+                        old_status=row['status'],
+                        new_status=new_status,
+                        source=source,
+                        changed_by=changed_by,
+                        note=note[:255],
+                        created_at=now,
+                    )
+                    for row in accepted
+                ], batch_size=500)
+                cls.sync_slot_bookings(accepted, new_status)
+                # update() n'envoie pas post_save : invalider les fragments en cache
+                transaction.on_commit(lambda: bump_model_version(Order))
+                if reactivated_or_cancelled:
+                    transaction.on_commit(
+                        lambda: EquipmentAvailabilityService.sync_for_orders(reactivated_or_cancelled)
+                    )
+                cls.enqueue_side_effects(updated_ids, new_status, changed_by, notify)
+        
+        found = {row['id'] for row in rows}
+        return {
+            'updated': updated_ids,
+            'unchanged': unchanged,
+            'rejected': rejected,
+            'missing': [pk for pk in order_ids if pk not in found],
+        }
+    
+    @staticmethod
+    def sync_slot_bookings(rows, new_status):
+        """Répercute les annulations / réactivations sur les compteurs de créneaux, un UPDATE par créneau"""
+        deltas = Counter()
+        for row in rows:
+            old_key = SlotCapacityService.booking_key(
+                row['delivery_date'], row['delivery_time'], row['delivery_type'], row['status']
+            )
+            new_key = SlotCapacityService.booking_key(
+                row['delivery_date'], row['delivery_time'], row['delivery_type'], new_status
+            )
+            if old_key == new_key:
+                continue
+            if old_key:
+                deltas[old_key] -= 1
+            if new_key:
+                deltas[new_key] += 1
+        for key, delta in deltas.items():
+            if delta:
+                SlotCapacityService.adjust(*key, delta=delta)
+    
+    @classmethod
+    def enqueue_side_effects(cls, order_ids, new_status, changed_by=None, notify=True):
+        """
+        Met en file les effets de bord de la transition (deux ou trois
+        insertions) : ils ne sont exécutés qu'une fois la transaction validée,
+        par les commandes planifiées.
+        """
+        if new_status == Order.CONFIRMED:
+            OrderStatusJob.objects.create(order_ids=list(order_ids), new_status=new_status)
+        if notify and new_status in cls.NOTIFY_STATUSES:
+            cls.queue_status_emails(order_ids, new_status, changed_by)
+    
+    @classmethod
+    def queue_status_emails(cls, order_ids, new_status, created_by=None):
+        """Courriels de suivi déposés dans la file des envois groupés, une ligne par commande"""
+        orders = Order.objects.filter(id__in=order_ids).exclude(email='').values_list('id', 'email', 'user_id')
+        campaign = EmailCampaign.objects.create(
+            subject=cls.EMAIL_SUBJECT,
+            body_template=cls.EMAIL_BODY,
+            html_template=cls.EMAIL_HTML,
+            message=cls.STATUS_MESSAGES.get(new_status, ''),
+            created_by=created_by,
+        )
+        EmailDelivery.objects.bulk_create([
+            EmailDelivery(campaign=campaign, email=email, user_id=user_id, order_id=order_id)
+            for order_id, email, user_id in orders
+        ], batch_size=500)
+        return campaign
+    
+    @classmethod
+    def claim_job(cls, job):
+        """Réserve le traitement (UPDATE conditionnel) : False si un autre processus l'a pris"""
+        now = timezone.now()
+        claimed = OrderStatusJob.objects.filter(pk=job.pk, finished_at__isnull=True).filter(
+            Q(started_at__isnull=True) | Q(started_at__lt=now - cls.JOB_STALE_AFTER)
+        ).update(started_at=now)
+        return bool(claimed)
+    
+    @classmethod
+    def process_jobs(cls):
+        """
+        Traite les transitions en attente : livraisons des commandes
+        confirmées créées en un lot, puis un seul recalcul du
+        réapprovisionnement pour l'ensemble. Renvoie les traitements effectués.
+        """
+        pending = OrderStatusJob.objects.filter(finished_at__isnull=True).filter(
+            Q(started_at__isnull=True) | Q(started_at__lt=timezone.now() - cls.JOB_STALE_AFTER)
+        ).order_by('created_at')
+        jobs = [job for job in pending if cls.claim_job(job)]
+        if not jobs:
+            return []
+        
+        job_ids = [job.id for job in jobs]
+        confirmed = sorted({pk for job in jobs if job.new_status == Order.CONFIRMED for pk in job.order_ids})
+        try:
+            if confirmed:
+                cls.create_deliveries(confirmed)
+                ReorderPlannerService.replan()
+        except Exception as e:
+            # Repris après JOB_STALE_AFTER
+            OrderStatusJob.objects.filter(id__in=job_ids).update(error=str(e)[:255])
+            raise
+        OrderStatusJob.objects.filter(id__in=job_ids).update(finished_at=timezone.now(), error='')
+        return jobs
+    
+    @staticmethod
+    def create_deliveries(order_ids):
+        """
+        Crée les livraisons manquantes des commandes confirmées (en lot),
+        sauf celles annulées depuis. Seules les adresses déjà connues sont
+        géocodées ici ; les autres le sont par la commande geocode_deliveries.
+        """
+        orders = Order.objects.filter(id__in=order_ids).exclude(status=Order.CANCELLED)
+        deliveries, _ = DeliveryFactoryService.create_for_orders(orders)
+        DeliveryFactoryService.geocode(deliveries, lookup=False)
+        return deliveries
+
+# ========================================
+# CRÉATION DES LIVRAISONS EN LOT
+# ========================================
+
+def calculate_end_time(start_time):
+    """Calcule l'heure de fin estimée (30 minutes après le début)"""
+    return (datetime.combine(date(2000, 1, 1), start_time) + timedelta(minutes=30)).time()
+
+def determine_priority(order):
+    """Priorité de la livraison : urgente le jour même, haute le lendemain ou au-delà de 500 $"""
+    days_until_delivery = (order.delivery_date - timezone.now().date()).days
+    if days_until_delivery <= 0:
+        return 'urgent'
+    if days_until_delivery == 1 or order.total > 500:
+        return 'high'
+    return 'normal'
+
+def get_order_items_description(order):
+    """Génère une description des items de la commande"""
+    return ', '.join(f"{item.quantity}x {item.product_name}" for item in order.items.all())
+
+def should_create_pickup(delivery):
+    """
+    Détermine si une récupération doit être planifiée : location de
+    matériel ou retour mentionnés dans les notes de la commande
+    """
+    keywords = ['location', 'récupération', 'retour', 'rental']
+    if delivery.order.delivery_notes:
+        notes_lower = delivery.order.delivery_notes.lower()
+        return any(keyword in notes_lower for keyword in keywords)
+    return False
+
+class DeliveryFactoryService:
+    """
+    Livraisons des commandes confirmées, créées en lot : commandes,
+    checklists, articles et produits chargés en trois requêtes (colis,
+    poids et volume d'après LoadPlanService), numéros générés d'avance,
+    une insertion bulk_create, puis notifications et rappels de
+    récupération en une insertion. Le géocodage est une étape séparée
+    (geocode()), à lancer après le commit ; en lot, seules les adresses
+    déjà connues sont reprises pendant la requête, les appels à l'API étant
+    laissés à la commande geocode_deliveries.
+    
+    bulk_create n'envoie pas post_save : les effets des signaux de Delivery
+    (rappel de récupération, version du cache) sont appliqués ici.
+    """
+    
+    GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+    GEOCODE_TIMEOUT = 10
+    
+    @staticmethod
+    def build(order, created_by=None):
+        """Livraison non enregistrée d'une commande (articles et checklist préchargés)"""
+        checklist = getattr(order, 'checklist', None)
+        total_packages, weight, volume = LoadPlanService.stored_values(LoadPlanService.order_load(order))
+        delivery = Delivery(
+            order=order,
+            delivery_type='delivery',
+            customer_name=f"{order.first_name} {order.last_name}",
+            customer_phone=order.phone,
+            customer_email=order.email,
+            company=order.company or '',
+            delivery_address=order.delivery_address,
+            delivery_postal_code=order.delivery_postal_code,
+            delivery_city=order.delivery_city,
+            scheduled_date=order.delivery_date,
+            scheduled_time_start=order.delivery_time,
+            scheduled_time_end=calculate_end_time(order.delivery_time),
+            delivery_instructions=order.delivery_notes,
+            items_description=get_order_items_description(order),
+            total_packages=total_packages,
+            weight=weight,
+            volume=volume,
+            priority=determine_priority(order),
+            has_checklist=checklist is not None,
+            checklist_completed=checklist is not None and checklist.status == 'completed',
+            created_by=created_by,
+        )
+        delivery.scheduled_end_at = delivery.compute_scheduled_end_at()
+        delivery.fill_spatial_fields()
+        return delivery
+    
+    @staticmethod
+    def assign_numbers(deliveries):
+        """Numéros uniques pour tout le lot, vérifiés en une requête"""
+        numbers = set()
+        pending = list(deliveries)
+        while pending:
+            for delivery in pending:
+                number = delivery.generate_delivery_number()
+                while number in numbers:
+                    number = delivery.generate_delivery_number()
+                delivery.delivery_number = number
+                numbers.add(number)
+            taken = set(
+                Delivery.objects.filter(delivery_number__in=[delivery.delivery_number for delivery in pending])
+                .values_list('delivery_number', flat=True)
+            )
+            pending = [delivery for delivery in pending if delivery.delivery_number in taken]
+    
+    @classmethod
+    def create_for_orders(cls, orders, created_by=None, notify=True):
+        """
+        Crée les livraisons manquantes des commandes du queryset `orders`.
+        Renvoie (livraisons créées, commandes ignorées faute d'heure, de date
+        ou d'adresse de livraison).
+        """
+        orders = list(
+            orders.exclude(
+                id__in=Delivery.objects.filter(delivery_type='delivery').values('order_id')
+            ).select_related('checklist').prefetch_related('items__product')
+        )
+        deliveries, skipped = [], []
+        for order in orders:
+            if not (order.delivery_date and order.delivery_time and order.delivery_address):
+                skipped.append(order)
+                continue
+            deliveries.append(cls.build(order, created_by))
+        if not deliveries:
+            return [], skipped
+        
+        cls.assign_numbers(deliveries)
+        orders_by_id = {order.id: order for order in orders}
+        with transaction.atomic():
+            Delivery.objects.bulk_create(deliveries, batch_size=500)
+            # MySQL ne renvoie pas les clés des lignes insérées : relecture par numéro
+            created = list(
+                Delivery.objects.filter(delivery_number__in=[delivery.delivery_number for delivery in deliveries])
+                .order_by('scheduled_time_start', 'id')
+            )
+            for delivery in created:
+                delivery.order = orders_by_id[delivery.order_id]
+            cls.create_notifications(created, notify)
+            transaction.on_commit(lambda: bump_model_version(Delivery))
+        return created, skipped
+    
+    @staticmethod
+    def create_notifications(deliveries, notify=True):
+        """Nouvelles livraisons pour les responsables et rappels de récupération, en une insertion"""
+        notifications = []
+        if notify:
+            managers = delivery_managers(include_admins=True)
+            notifications += [
+                DeliveryNotification(
+                    type='new_delivery',
+                    recipient_type='manager',
+                    recipient=manager,
+                    delivery=delivery,
+                    title='Nouvelle livraison à planifier',
+                    message=f'La commande {delivery.order.order_number} a été confirmée. '
+                            f'Livraison {delivery.delivery_number} créée automatiquement '
+                            f'pour le {delivery.scheduled_date.strftime("%d/%m/%Y")}',
+                    is_urgent=delivery.priority in ['urgent', 'high']
+                )
+                for delivery in deliveries
+                for manager in managers
+            ]
+        
+        reminder_recipient = first_delivery_manager(include_admins=True)
+        if reminder_recipient:
+            notifications += [
+                DeliveryNotification(
+                    type='reminder',
+                    recipient_type='manager',
+                    recipient=reminder_recipient,
+                    delivery=delivery,
+                    title='Récupération à planifier',
+                    message=f'Pensez à planifier la récupération pour la livraison {delivery.delivery_number}',
+                    is_urgent=False,
+                    scheduled_for=timezone.make_aware(
+                        datetime.combine(delivery.scheduled_date + timedelta(days=1), time.min)
+                    )
+                )
+                for delivery in deliveries
+                if should_create_pickup(delivery)
+            ]
+        if notifications:
+            DeliveryNotification.objects.bulk_create(notifications, batch_size=500)
+    
+    # ---------- Géocodage ----------
+    
+    @staticmethod
+    def address_key(address, postal_code, city):
+        return (
+            ' '.join((address or '').lower().split()),
+            (postal_code or '').replace(' ', '').upper(),
+            ' '.join((city or '').lower().split()),
+        )
+    
+    @classmethod
+    def lookup_coordinates(cls, delivery):
+        """(latitude, longitude) de l'adresse via l'API Google Geocoding, None en cas d'échec"""
+        params = {
+            'address': f"{delivery.delivery_address}, {delivery.delivery_postal_code} {delivery.delivery_city}, Canada",
+            'key': settings.GOOGLE_API_KEY,
+            'region': 'ca',
+            'components': 'country:CA',
+        }
+        try:
+            response = requests.get(cls.GEOCODE_URL, params=params, timeout=cls.GEOCODE_TIMEOUT)
+            data = response.json() if response.status_code == 200 else {}
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Erreur réseau au géocodage de %s : %s", delivery.delivery_number, e)
+            return None
+        if data.get('status') != 'OK' or not data.get('results'):
+            logger.warning(
+                "Géocodage échoué pour %s : %s", delivery.delivery_number, data.get('status', response.status_code)
+            )
+            return None
+        location = data['results'][0]['geometry']['location']
+        return Decimal(str(location['lat'])), Decimal(str(location['lng']))
+    
+    @classmethod
+    def geocode(cls, deliveries, lookup=True):
+        """
+        Géocode les livraisons sans coordonnées : reprises d'une livraison
+        déjà géocodée à la même adresse (une requête), sinon un appel à
+        l'API par adresse distincte (lookup=False : adresses connues
+        seulement) ; enregistrées en un bulk_update.
+        Renvoie le nombre de livraisons géocodées.
+        """
+        pending = [delivery for delivery in deliveries if delivery.latitude is None or delivery.longitude is None]
+        if not pending:
+            return 0
+        
+        by_address = defaultdict(list)
+        for delivery in pending:
+            by_address[cls.address_key(
+                delivery.delivery_address, delivery.delivery_postal_code, delivery.delivery_city
+            )].append(delivery)
+        
+        known = {}
+        rows = Delivery.objects.filter(
+            postal_prefix__in={geo.postal_prefix(delivery.delivery_postal_code) for delivery in pending},
+            latitude__isnull=False,
+            longitude__isnull=False,
+        ).values_list('delivery_address', 'delivery_postal_code', 'delivery_city', 'latitude', 'longitude')
+        for address, postal_code, city, latitude, longitude in rows:
+            known.setdefault(cls.address_key(address, postal_code, city), (latitude, longitude))
+        
+        now = timezone.now()
+        geocoded = []
+        for key, group in by_address.items():
+            point = known.get(key) or (cls.lookup_coordinates(group[0]) if lookup else None)
+            if point is None:
+                continue
+            for delivery in group:
+                delivery.latitude, delivery.longitude = point
+                delivery.fill_spatial_fields()
+                delivery.updated_at = now
+                geocoded.append(delivery)
+        
+        if geocoded:
+            Delivery.objects.bulk_update(geocoded, ['latitude', 'longitude', 'geohash', 'updated_at'], batch_size=500)
+            transaction.on_commit(lambda: bump_model_version(Delivery))
+        return len(geocoded)
+
+# ========================================
+# SYNCHRONISATION DE L'APPLICATION LIVREUR
+# ========================================
+
+class SyncActionError(Exception):
+    """Action hors ligne impossible à appliquer (rejetée définitivement)"""
+
+class DriverSyncService:
+    """
+    Journée d'un livreur pour l'application mobile : un seul document
+    (routes, arrêts, adresses, consignes, photos de référence) versionné par
+    ETag, avec deltas depuis un curseur ; et application en une transaction
+    des actions mises en file hors ligne, chacune rejouée au plus une fois
+    grâce à son identifiant client (DriverSyncAction).
+    """
+    
+    PAYLOAD_VERSION = 1
+    MAX_ACTIONS = 500
+    # Recouvrement du curseur : une écriture committée pendant la lecture
+    # réapparaît au delta suivant (le client applique les arrêts en upsert)
+    CURSOR_OVERLAP = timedelta(seconds=5)
+    RECORDED_TYPES = {'arrive', 'validate', 'issue', 'signature'}
+    # Jeton des API d'envoi (en-tête Authorization), renouvelé à chaque synchronisation
+    TOKEN_SALT = 'JLTsite.driver-sync'
+    TOKEN_MAX_AGE = timedelta(days=7)
+    
+    # ---------- Authentification ----------
+    
+    @classmethod
+    def _password_key(cls, driver):
+        # Changer le mot de passe invalide les jetons déjà remis
+        return salted_hmac(cls.TOKEN_SALT, driver.password).hexdigest()[:16]
+    
+    @classmethod
+    def issue_token(cls, driver):
+        return signing.dumps([driver.pk, cls._password_key(driver)], salt=cls.TOKEN_SALT, compress=True)
+    
+    @classmethod
+    def token_user(cls, token):
+        """Livreur actif correspondant au jeton, None s'il est invalide ou expiré"""
+        try:
+            user_id, key = signing.loads(token, salt=cls.TOKEN_SALT, max_age=cls.TOKEN_MAX_AGE)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        driver = User.objects.filter(pk=user_id, is_active=True).first()
+        if driver is None or not constant_time_compare(key, cls._password_key(driver)):
+            return None
+        return driver
+    
+    # ---------- Lecture ----------
+    
+    @staticmethod
+    def day_routes(driver, day):
+        return DeliveryRoute.objects.filter(driver=driver, date=day)
+    
+    @classmethod
+    def etag(cls, driver, day):
+        """Empreinte de l'état de la journée, en une requête d'agrégats"""
+        state = cls.day_routes(driver, day).aggregate(
+            routes=Count('id', distinct=True),
+            routes_at=Max('updated_at'),
+            stops=Count('route_deliveries', distinct=True),
+            stops_at=Max('route_deliveries__updated_at'),
+            deliveries_at=Max('route_deliveries__delivery__updated_at'),
+            photos_at=Max('route_deliveries__delivery__parent_delivery__photos__taken_at'),
+        )
+        raw = f'{cls.PAYLOAD_VERSION}:{driver.pk}:{day.isoformat()}:' + ':'.join(
+            str(state[key]) for key in sorted(state)
+        )
+        return hashlib.md5(raw.encode()).hexdigest()
+    
+    @classmethod
+    def build_payload(cls, driver, day, since=None):
+        """
+        Document de synchronisation. Sans `since`, tous les arrêts ; avec,
+        seulement ceux modifiés depuis le curseur. Chaque route porte la liste
+        complète de ses arrêts (`stops`) : le client supprime ceux qui n'y
+        figurent plus.
+        """
+        cursor = timezone.now()
+        routes = list(cls.day_routes(driver, day).order_by('start_time'))
+        stops = list(
+            RouteDelivery.objects.filter(route__in=routes)
+            .select_related('delivery')
+            .order_by('route_id', 'position')
+        )
+        
+        parent_ids = {
+            rd.delivery.parent_delivery_id for rd in stops
+            if rd.delivery.delivery_type == 'pickup' and rd.delivery.parent_delivery_id
+        }
+        photos = defaultdict(list)
+        for photo in DeliveryPhoto.objects.filter(delivery_id__in=parent_ids, photo_type='delivery'):
+            photos[photo.delivery_id].append(photo)
+        
+        stop_ids = defaultdict(list)
+        for rd in stops:
+            stop_ids[rd.route_id].append(rd.id)
+        
+        changed = stops
+        if since is not None:
+            threshold = since - cls.CURSOR_OVERLAP
+            changed = [
+                rd for rd in stops
+                if rd.updated_at >= threshold
+                or rd.delivery.updated_at >= threshold
+                or any(photo.taken_at >= threshold for photo in photos[rd.delivery.parent_delivery_id])
+            ]
+        
+        return {
+            'v': cls.PAYLOAD_VERSION,
+            'date': day.isoformat(),
+            'cursor': cursor.isoformat(),
+            'full': since is None,
+            'routes': [cls.route_data(route, stop_ids[route.id]) for route in routes],
+            'stops': [cls.stop_data(rd, photos[rd.delivery.parent_delivery_id]) for rd in changed],
+        }
+    
+    @staticmethod
+    def _time(value):
+        return value.strftime('%H:%M') if value else None
+    
+    @staticmethod
+    def _coord(value):
+        return float(value) if value is not None else None
+    
+    @classmethod
+    def route_data(cls, route, stop_ids):
+        return {
+            'id': route.id,
+            'number': route.route_number,
+            'name': route.name,
+            'status': route.status,
+            'start_time': cls._time(route.start_time),
+            'end_time': cls._time(route.end_time),
+            'vehicle': route.vehicle,
+            'start': [route.start_location, cls._coord(route.start_latitude), cls._coord(route.start_longitude)],
+            'notes': route.notes,
+            'stops': stop_ids,
+        }
+    
+    @classmethod
+    def stop_data(cls, rd, reference_photos):
+        delivery = rd.delivery
+        return {
+            'id': rd.id,
+            'route': rd.route_id,
+            'position': rd.position,
+            'eta': [cls._time(rd.estimated_arrival), cls._time(rd.estimated_departure)],
+            'late_risk': rd.late_risk,
+            'done': rd.is_completed,
+            'notes': rd.notes,
+            'delivery': {
+                'id': delivery.id,
+                'number': delivery.delivery_number,
+                'type': delivery.delivery_type,
+                'status': delivery.status,
+                'priority': delivery.priority,
+                'customer': delivery.customer_name,
+                'phone': delivery.customer_phone,
+                'company': delivery.company,
+                'address': [delivery.delivery_address, delivery.delivery_postal_code, delivery.delivery_city],
+                'point': [cls._coord(delivery.latitude), cls._coord(delivery.longitude)],
+                'window': [cls._time(delivery.scheduled_time_start), cls._time(delivery.scheduled_time_end)],
+                'duration': delivery.estimated_duration,
+                'instructions': delivery.delivery_instructions,
+                'access_code': delivery.access_code,
+                'parking': delivery.parking_info,
+                'items': delivery.items_description,
+                'packages': delivery.total_packages,
+                'checklist': [delivery.has_checklist, delivery.checklist_completed],
+            },
+            'photos': [photo.photo.url for photo in reference_photos],
+        }
+    
+    # ---------- Actions (partagées avec les vues livreur) ----------
+    
+    @staticmethod
+    def mark_arrived(route_delivery, at=None):
+        """Heure d'arrivée réelle de l'arrêt (base des temps sur place appris)"""
+        route_delivery.actual_arrival = timezone.localtime(at or timezone.now()).time()
+        route_delivery.save(update_fields=['actual_arrival', 'updated_at'])
+    
+    @staticmethod
+    def mark_delivered(delivery, route_delivery, driver, at=None, signature='', notes=''):
+        """Valide la livraison, la commande et l'arrêt (les stats de la route restent à l'appelant)"""
+        at = at or timezone.now()
+        if signature:
+            delivery.signature = signature
+        delivery.delivery_notes = notes
+        delivery.status = 'delivered'
+        delivery.delivered_at = at
+        delivery.delivered_by = driver
+        delivery.save()
+        
+        order = delivery.order
+        order.status = 'delivered'
+        order.delivered_at = at
+        order._status_changed_by = driver
+        order.save()
+        
+        if route_delivery:
+            route_delivery.is_completed = True
+            route_delivery.completed_at = at
+            route_delivery.actual_departure = timezone.localtime(at).time()
+            route_delivery.save()
+            RouteEtaService.advance(route_delivery, at)
+    
+    @staticmethod
+    def report_issue(delivery, description):
+        """Passe la livraison en échec et prévient le responsable livraison"""
+        delivery.status = 'failed'
+        delivery.delivery_notes = description
+        delivery.save()
+        
+        DeliveryNotification.objects.create(
+            type='issue',
+            recipient_type='manager',
+            recipient=first_delivery_manager(),
+            delivery=delivery,
+            title='Problème de livraison',
+            message=f'Problème signalé pour {delivery.delivery_number}: {delivery.delivery_notes}',
+            is_urgent=True
+        )
+    
+    # ---------- Envoi groupé ----------
+    
+    @staticmethod
+    def action_time(action):
+        """Heure de l'action sur le téléphone (maintenant si absente)"""
+        raw = action.get('at')
+        if not raw:
+            return timezone.now()
+        at = parse_datetime(str(raw))
+        if at is None:
+            raise SyncActionError(f"Horodatage invalide : {raw}")
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        return at
+    
+    @classmethod
+    def apply_action(cls, driver, action, stop, at):
+        """Applique une action sur l'arrêt `stop` du livreur"""
+        action_type = action.get('type')
+        delivery = stop.delivery
+        
+        if action_type == 'arrive':
+            cls.mark_arrived(stop, at)
+        elif action_type == 'signature':
+            if not action.get('signature'):
+                raise SyncActionError('Signature vide')
+            delivery.signature = action['signature']
+            delivery.save(update_fields=['signature', 'updated_at'])
+        elif action_type == 'validate':
+            if delivery.status in ('delivered', 'cancelled'):
+                raise SyncActionError(f'Livraison déjà {delivery.get_status_display().lower()}')
+            cls.mark_delivered(
+                delivery, stop, driver, at,
+                signature=action.get('signature', ''), notes=action.get('notes', '')
+            )
+        elif action_type == 'issue':
+            if delivery.status in ('delivered', 'cancelled'):
+                raise SyncActionError(f'Livraison déjà {delivery.get_status_display().lower()}')
+            cls.report_issue(delivery, action.get('description', ''))
+        else:
+            raise SyncActionError(f"Type d'action inconnu : {action_type}")
+    
+    @staticmethod
+    def _as_id(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    
+    @classmethod
+    def apply_batch(cls, driver, actions):
+        """
+        Applique les actions dans l'ordre, en une transaction. Chaque action
+        porte un identifiant client `id` : une action déjà reçue n'est pas
+        rejouée et renvoie son résultat d'origine. Une action invalide est
+        rejetée sans bloquer les suivantes.
+        
+        Les positions GPS (`type: gps`) ne sont pas journalisées : elles vont
+        dans la trace de la route (LocationTrackService), où un rejeu est sans effet.
+        
+        Retourne ([{'id', 'status': applied|rejected|duplicate, 'error'}], nombre de positions reçues).
+        """
+        if len(actions) > cls.MAX_ACTIONS:
+            raise ValueError(f'{cls.MAX_ACTIONS} actions au maximum par envoi')
+        
+        gps_fixes = [action for action in actions if action.get('type') == 'gps']
+        actions = [action for action in actions if action.get('type') != 'gps']
+        client_ids = [str(action.get('id') or '')[:64] for action in actions]
+        delivery_ids = [cls._as_id(action.get('delivery_id')) for action in actions]
+        
+        results, records, touched_routes = [], [], {}
+        with transaction.atomic():
+            done = {
+                sync.client_id: sync
+                for sync in DriverSyncAction.objects.filter(driver=driver, client_id__in=client_ids)
+            }
+            stops = {
+                rd.delivery_id: rd
+                for rd in RouteDelivery.objects.filter(route__driver=driver, delivery_id__in=set(delivery_ids))
+                .select_related('delivery__order', 'route')
+                .order_by('route__date')
+            }
             
-            recommendations = list(recommendations) + list(additional)
+            for client_id, delivery_id, action in zip(client_ids, delivery_ids, actions):
+                if not client_id:
+                    results.append({'id': None, 'status': 'rejected', 'error': 'Identifiant manquant'})
+                    continue
+                if client_id in done:
+                    previous = done[client_id]
+                    results.append({'id': client_id, 'status': 'duplicate',
+                                    'result': previous.status, 'error': previous.error})
+                    continue
+                
+                stop = stops.get(delivery_id)
+                at = None
+                try:
+                    at = cls.action_time(action)
+                    if stop is None:
+                        raise SyncActionError('Livraison absente de vos routes')
+                    with transaction.atomic():
+                        cls.apply_action(driver, action, stop, at)
+                    status, error = 'applied', ''
+                    touched_routes[stop.route_id] = stop.route
+                except SyncActionError as e:
+                    status, error = 'rejected', str(e)[:255]
+                
+                if action.get('type') in cls.RECORDED_TYPES:
+                    sync = DriverSyncAction(
+                        driver=driver,
+                        client_id=client_id,
+                        action_type=action['type'],
+                        delivery=stop.delivery if stop else None,
+                        status=status,
+                        error=error,
+                        performed_at=at or timezone.now(),
+                    )
+                    records.append(sync)
+                    done[client_id] = sync
+                results.append({'id': client_id, 'status': status, 'error': error})
+            
+            DriverSyncAction.objects.bulk_create(records)
+            for route in touched_routes.values():
+                route.update_stats()
+        
+        positions = LocationTrackService.ingest(driver, gps_fixes)['stored'] if gps_fixes else 0
+        return results, positions
+
+# ========================================
+# TRACES GPS DES LIVREURS
+# ========================================
+
+class LocationTrackService:
+    """
+    Positions GPS des livreurs, stockées par route dans des blocs d'une
+    minute (RouteTrackChunk) : une ligne par minute et par route au lieu
+    d'une ligne par position. Chaque position est codée en deltas
+    (millisecondes, latitude et longitude en micro-degrés, précision) sous
+    forme de varints zigzag, soit quelques octets par point. Après
+    GPS_DOWNSAMPLE_AFTER_DAYS, les blocs sont regroupés par heure avec une
+    position par GPS_DOWNSAMPLE_STEP_SECONDS.
+    """
+    
+    FORMAT_VERSION = 1
+    MAX_POINTS = 2000
+    # Positions acceptées : mises en file jusqu'à 2 jours, horloge du téléphone en avance de 5 min
+    MAX_AGE = timedelta(days=2)
+    MAX_CLOCK_SKEW = timedelta(minutes=5)
+    MINUTE = 60
+    HOUR = 60 * 60
+    
+    # ---------- Codage ----------
+    
+    @staticmethod
+    def _write_varint(buffer, value):
+        value = (value << 1) ^ (value >> 63)  # zigzag : petits négatifs -> petits positifs
+        while value > 0x7F:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+    
+    @staticmethod
+    def _read_varints(data, offset):
+        value, shift = 0, 0
+        while offset < len(data):
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                yield (value >> 1) ^ -(value & 1)
+                value, shift = 0, 0
+            else:
+                shift += 7
+    
+    @classmethod
+    def pack_points(cls, start, points):
+        """[(at, lat, lng, accuracy)] triés -> octets (deltas par rapport au point précédent)"""
+        buffer = bytearray([cls.FORMAT_VERSION])
+        previous = (0, 0, 0)
+        for at, lat, lng, accuracy in points:
+            current = (
+                # Division entière exacte : total_seconds() * 1000 tronque parfois 1 ms trop tôt
+                (at - start) // timedelta(milliseconds=1),
+                round(lat * 1_000_000),
+                round(lng * 1_000_000),
+            )
+            for value, before in zip(current, previous):
+                cls._write_varint(buffer, value - before)
+            cls._write_varint(buffer, accuracy if accuracy is not None else -1)
+            previous = current
+        return bytes(buffer)
+    
+    @classmethod
+    def unpack_points(cls, start, data):
+        """Inverse de pack_points"""
+        data = bytes(data)
+        if not data or data[0] != cls.FORMAT_VERSION:
+            return []
+        values = list(cls._read_varints(data, 1))
+        points, offset_ms, lat, lng = [], 0, 0, 0
+        for index in range(0, len(values) - 3, 4):
+            offset_ms += values[index]
+            lat += values[index + 1]
+            lng += values[index + 2]
+            accuracy = values[index + 3]
+            points.append((
+                start + timedelta(milliseconds=offset_ms),
+                lat / 1_000_000,
+                lng / 1_000_000,
+                accuracy if accuracy >= 0 else None,
+            ))
+        return points
+    
+    @staticmethod
+    def merge_points(*point_lists):
+        """Fusionne et trie par heure ; une position par milliseconde (rejeux idempotents)"""
+        merged = {}
+        for points in point_lists:
+            for point in points:
+                merged[point[0]] = point
+        return [merged[at] for at in sorted(merged)]
+    
+    @staticmethod
+    def bucket_start(at, span):
+        timestamp = int(at.timestamp())
+        return datetime.fromtimestamp(timestamp - timestamp % span, tz=dt_timezone.utc)
+    
+    # ---------- Réception ----------
+    
+    @classmethod
+    def clean_fixes(cls, fixes):
+        """Positions valides [(at, lat, lng, accuracy)] ; les autres sont ignorées"""
+        now = timezone.now()
+        # Jamais dans une heure déjà sous-échantillonnée
+        oldest = now - min(cls.MAX_AGE, timedelta(days=settings.GPS_DOWNSAMPLE_AFTER_DAYS))
+        cleaned = []
+        for fix in fixes[:cls.MAX_POINTS]:
+            try:
+                lat, lng = float(fix['lat']), float(fix['lng'])
+                at = parse_datetime(str(fix['at'])) if fix.get('at') else now
+                accuracy = fix.get('accuracy')
+                accuracy = max(0, int(round(float(accuracy)))) if accuracy is not None else None
+            except (KeyError, TypeError, ValueError):
+                continue
+            if at is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                continue
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            # Précision du stockage : la milliseconde (un rejeu retombe sur la même clé)
+            at = at.replace(microsecond=at.microsecond // 1000 * 1000)
+            if oldest <= at <= now + cls.MAX_CLOCK_SKEW:
+                cleaned.append((at, lat, lng, accuracy))
+        cleaned.sort(key=itemgetter(0))
+        return cleaned
+    
+    @staticmethod
+    def routes_for_points(driver, points, route_id=None):
+        """Route du livreur pour chaque jour couvert (la route en cours d'abord)"""
+        days = {timezone.localtime(point[0]).date() for point in points}
+        routes = DeliveryRoute.objects.filter(driver=driver, date__in=days).exclude(status='cancelled')
+        if route_id:
+            routes = routes.filter(pk=route_id)
+        by_day = {}
+        for route in sorted(routes, key=lambda route: (route.status != 'in_progress', route.start_time)):
+            by_day.setdefault(route.date, route)
+        return by_day
+    
+    @classmethod
+    def ingest(cls, driver, fixes, route_id=None):
+        """
+        Ajoute un lot de positions aux traces des routes du livreur :
+        {'stored': n, 'ignored': n}. Quelques requêtes par lot, quel que soit
+        le nombre de positions.
+        """
+        points = cls.clean_fixes(fixes)
+        routes = cls.routes_for_points(driver, points, route_id) if points else {}
+        
+        groups = defaultdict(list)
+        latest = {}
+        for point in points:
+            route = routes.get(timezone.localtime(point[0]).date())
+            if route is None:
+                continue
+            groups[(route.id, cls.bucket_start(point[0], cls.MINUTE))].append(point)
+            latest[route.id] = point
+        stored = sum(len(group) for group in groups.values())
+        
+        if groups:
+            try:
+                cls._store(groups, latest)
+            except IntegrityError:
+                # Un autre lot a créé le même bloc entre-temps : on relit et on fusionne
+                cls._store(groups, latest)
+        return {'stored': stored, 'ignored': len(fixes) - stored}
+    
+    @classmethod
+    def _store(cls, groups, latest):
+        route_ids = {route_id for route_id, _ in groups}
+        starts = {start for _, start in groups}
+        with transaction.atomic():
+            existing = {
+                (chunk.route_id, chunk.start): chunk
+                for chunk in RouteTrackChunk.objects.select_for_update()
+                .filter(route_id__in=route_ids, start__in=starts, span=cls.MINUTE)
+            }
+            created, changed = [], []
+            for (route_id, start), group in groups.items():
+                chunk = existing.get((route_id, start))
+                if chunk is None:
+                    merged = cls.merge_points(group)
+                    chunk = RouteTrackChunk(route_id=route_id, start=start, span=cls.MINUTE)
+                    created.append(chunk)
+                else:
+                    merged = cls.merge_points(cls.unpack_points(start, chunk.points), group)
+                    changed.append(chunk)
+                chunk.points = cls.pack_points(start, merged)
+                chunk.point_count = len(merged)
+            
+            RouteTrackChunk.objects.bulk_create(created)
+            RouteTrackChunk.objects.bulk_update(changed, ['points', 'point_count'])
+            
+            # update() : ni updated_at ni signaux, la position n'invalide pas les caches
+            for route_id, (at, lat, lng, _) in latest.items():
+                DeliveryRoute.objects.filter(
+                    Q(last_position_at__isnull=True) | Q(last_position_at__lt=at), pk=route_id
+                ).update(last_latitude=round(lat, 7), last_longitude=round(lng, 7), last_position_at=at)
+    
+    # ---------- Lecture ----------
+    
+    @staticmethod
+    def last_positions(day):
+        """Dernière position de chaque livreur ayant une route ce jour-là (une requête)"""
+        routes = DeliveryRoute.objects.filter(
+            date=day, last_position_at__isnull=False
+        ).select_related('driver').order_by('driver_id', '-last_position_at')
+        positions = {}
+        for route in routes:
+            positions.setdefault(route.driver_id, {
+                'driver_id': route.driver_id,
+                'driver': route.driver.get_full_name() or route.driver.username,
+                'route_id': route.id,
+                'route': route.route_number,
+                'route_status': route.status,
+                'lat': float(route.last_latitude),
+                'lng': float(route.last_longitude),
+                'at': route.last_position_at.isoformat(),
+            })
+        return list(positions.values())
+    
+    @classmethod
+    def track(cls, route, since=None):
+        """Positions de la route [(at, lat, lng, accuracy)], dans l'ordre"""
+        chunks = route.track_chunks.order_by('start')
+        if since is not None:
+            chunks = chunks.filter(start__gte=cls.bucket_start(since, cls.HOUR))
+        points = []
+        for chunk in chunks:
+            points.extend(cls.unpack_points(chunk.start, chunk.points))
+        if since is not None:
+            points = [point for point in points if point[0] > since]
+        return points
+    
+    # ---------- Sous-échantillonnage ----------
+    
+    @classmethod
+    def downsample(cls, older_than=None, step=None):
+        """
+        Regroupe par heure les blocs d'une minute antérieurs à `older_than`
+        en gardant une position toutes les `step` secondes. Retourne
+        (blocs supprimés, blocs horaires écrits).
+        """
+        older_than = older_than or timezone.now() - timedelta(days=settings.GPS_DOWNSAMPLE_AFTER_DAYS)
+        step = step or settings.GPS_DOWNSAMPLE_STEP_SECONDS
+        # On ne coupe pas une heure en deux
+        cutoff = cls.bucket_start(older_than, cls.HOUR)
+        removed = written = 0
+        
+        route_ids = (
+            RouteTrackChunk.objects.filter(span=cls.MINUTE, start__lt=cutoff)
+            .values_list('route_id', flat=True).distinct()
+        )
+        for route_id in list(route_ids):
+            with transaction.atomic():
+                minute_chunks = list(
+                    RouteTrackChunk.objects.select_for_update()
+                    .filter(route_id=route_id, span=cls.MINUTE, start__lt=cutoff)
+                )
+                hours = defaultdict(list)
+                for chunk in minute_chunks:
+                    hours[cls.bucket_start(chunk.start, cls.HOUR)].extend(
+                        cls.unpack_points(chunk.start, chunk.points)
+                    )
+                existing = {
+                    chunk.start: chunk
+                    for chunk in RouteTrackChunk.objects.select_for_update()
+                    .filter(route_id=route_id, span=cls.HOUR, start__in=hours.keys())
+                }
+                
+                created, changed = [], []
+                for start, points in hours.items():
+                    chunk = existing.get(start)
+                    if chunk is None:
+                        chunk = RouteTrackChunk(route_id=route_id, start=start, span=cls.HOUR)
+                        created.append(chunk)
+                    else:
+                        points = points + cls.unpack_points(start, chunk.points)
+                        changed.append(chunk)
+                    kept = cls.thin(cls.merge_points(points), step)
+                    chunk.points = cls.pack_points(start, kept)
+                    chunk.point_count = len(kept)
+                
+                RouteTrackChunk.objects.filter(pk__in=[chunk.pk for chunk in minute_chunks]).delete()
+                RouteTrackChunk.objects.bulk_create(created)
+                RouteTrackChunk.objects.bulk_update(changed, ['points', 'point_count'])
+                removed += len(minute_chunks)
+                written += len(created) + len(changed)
+        return removed, written
+    
+    @staticmethod
+    def thin(points, step):
+        """Une position par tranche de `step` secondes (la dernière de la tranche)"""
+        kept = {}
+        for point in points:
+            kept[int(point[0].timestamp()) // step] = point
+        return [kept[slot] for slot in sorted(kept)]
+
+# ========================================
+# ESTIMATIONS D'ARRIVÉE DES ROUTES
+# ========================================
+
+class RouteEtaService:
+    """
+    Heures d'arrivée et de départ estimées des arrêts d'une route. Chaque
+    trajet est estimé d'après la distance à vol d'oiseau entre les points
+    géocodés, corrigée d'un facteur routier ; le temps sur place vient de
+    ServiceTimeService. Les arrêts sont écrits en un seul bulk_update.
+    
+    plan() recalcule toute la route (création, réordonnancement) ;
+    advance() ne recalcule que les arrêts restants après un arrêt terminé,
+    à partir de l'heure réelle, et signale les nouveaux risques de retard.
+    """
+    
+    # Distance routière ≈ distance à vol d'oiseau × facteur (réseau urbain)
+    ROAD_FACTOR = 1.3
+    AVERAGE_SPEED_KMH = 30
+    # Stationnement et accès, même entre deux adresses voisines
+    MIN_LEG_MINUTES = 3
+    # Adresse non géocodée : ancienne hypothèse forfaitaire
+    FALLBACK_LEG_KM = Decimal('5')
+    FALLBACK_LEG_MINUTES = 15
+    
+    ESTIMATE_FIELDS = ['estimated_arrival', 'estimated_departure', 'distance_from_previous', 'late_risk', 'updated_at']
+    CLOSED_STATUSES = ('delivered', 'failed', 'cancelled')
+    
+    @staticmethod
+    def point(latitude, longitude):
+        if latitude is None or longitude is None:
+            return None
+        return float(latitude), float(longitude)
+    
+    @classmethod
+    def leg(cls, origin, destination):
+        """Distance (km) et durée d'un trajet ; forfait si un des points est inconnu"""
+        if origin is None or destination is None:
+            return cls.FALLBACK_LEG_KM, timedelta(minutes=cls.FALLBACK_LEG_MINUTES)
+        km = geo.haversine_km(origin, destination) * cls.ROAD_FACTOR
+        minutes = max(km / cls.AVERAGE_SPEED_KMH * 60, cls.MIN_LEG_MINUTES)
+        return Decimal(str(round(km, 2))), timedelta(minutes=round(minutes))
+    
+    @staticmethod
+    def is_late_risk(delivery, arrival):
+        if delivery.status in ('delivered', 'cancelled'):
+            return False
+        return arrival > datetime.combine(delivery.scheduled_date, delivery.scheduled_time_end)
+    
+    @classmethod
+    def _project(cls, stops, clock, origin):
+        """
+        Enchaîne les arrêts depuis `origin` à l'heure `clock` (datetime
+        naïf, heure locale). Renvoie l'heure de fin, la distance totale et
+        les arrêts qui viennent de passer à risque de retard.
+        """
+        now = timezone.now()
+        service_minutes = ServiceTimeService.predict_many([rd.delivery for rd in stops])
+        distance = Decimal('0')
+        newly_late = []
+        for rd in stops:
+            delivery = rd.delivery
+            destination = cls.point(delivery.latitude, delivery.longitude)
+            km, travel = cls.leg(origin, destination)
+            clock += travel
+            rd.estimated_arrival = clock.time()
+            late = cls.is_late_risk(delivery, clock)
+            if late and not rd.late_risk:
+                newly_late.append(rd)
+            rd.late_risk = late
+            clock += timedelta(minutes=round(service_minutes[delivery.id]))
+            rd.estimated_departure = clock.time()
+            rd.distance_from_previous = km
+            # bulk_update ne renseigne pas auto_now (curseur de synchronisation)
+            rd.updated_at = now
+            distance += km
+            origin = destination
+        return clock, distance, newly_late
+    
+    @classmethod
+    def _save_stops(cls, stops):
+        if stops:
+            RouteDelivery.objects.bulk_update(stops, cls.ESTIMATE_FIELDS)
+            transaction.on_commit(lambda: bump_model_version(RouteDelivery))
+    
+    @classmethod
+    def plan(cls, route):
+        """Recalcule tous les arrêts et les totaux de la route depuis son départ"""
+        # Les vues passent parfois l'heure brute du POST (chaîne)
+        start_time = route._meta.get_field('start_time').to_python(route.start_time)
+        stops = list(route.route_deliveries.select_related('delivery').order_by('position'))
+        start = datetime.combine(route.date, start_time)
+        end, distance, _ = cls._project(stops, start, cls.point(route.start_latitude, route.start_longitude))
+        cls._save_stops(stops)
+        
+        route.end_time = end.time()
+        route.total_distance = distance
+        route.estimated_duration = int((end - start).total_seconds() // 60)
+        route.save(update_fields=['end_time', 'total_distance', 'estimated_duration', 'updated_at'])
+        return stops
+    
+    @classmethod
+    def advance(cls, route_delivery, at=None):
+        """
+        Après l'arrêt `route_delivery` terminé à `at` : recalcule seulement
+        les arrêts suivants encore ouverts, depuis la position de cet arrêt,
+        et prévient les responsables de ceux qui passent à risque de retard.
+        """
+        route = route_delivery.route
+        stops = list(
+            route.route_deliveries
+            .filter(is_completed=False, position__gt=route_delivery.position)
+            .exclude(delivery__status__in=cls.CLOSED_STATUSES)
+            .select_related('delivery')
+            .order_by('position')
+        )
+        delivery = route_delivery.delivery
+        clock = timezone.localtime(at or timezone.now()).replace(tzinfo=None, microsecond=0)
+        end, _, newly_late = cls._project(stops, clock, cls.point(delivery.latitude, delivery.longitude))
+        cls._save_stops(stops)
+        
+        route.end_time = end.time()
+        route.save(update_fields=['end_time', 'updated_at'])
+        cls.notify_late_risks(route, newly_late)
+        return stops
+    
+    @staticmethod
+    def notify_late_risks(route, stops):
+        if not stops:
+            return
+        DeliveryNotification.objects.bulk_create([
+            DeliveryNotification(
+                type='delivery_late',
+                recipient_type='manager',
+                recipient=manager,
+                delivery=rd.delivery,
+                route=route,
+                title='Risque de retard',
+                message=f'{rd.delivery.delivery_number} ({rd.delivery.customer_name}) : arrivée estimée '
+                        f'{rd.estimated_arrival:%H:%M}, créneau jusqu\'à {rd.delivery.scheduled_time_end:%H:%M}',
+                is_urgent=True
+            )
+            for rd in stops
+            for manager in delivery_managers(include_admins=True)
+        ])
+
+# ========================================
+# TEMPS DE SERVICE APPRIS
+# ========================================
+
+class ServiceTimeService:
+    """
+    Temps sur place appris des heures réelles d'arrivée et de départ des
+    arrêts. fit() (commande nocturne fit_service_times) calcule, par type de
+    livraison, la médiane robuste des durées observées par client, par
+    entreprise, par préfixe postal et par nombre de colis, et remplace la
+    table ServiceTimeEstimate. predict_many() retient pour chaque livraison
+    l'estimation la plus spécifique disponible.
+    """
+    
+    HISTORY_DAYS = 180
+    MIN_SAMPLES = 3
+    # Durées plausibles (minutes) : au-delà, arrêt validé en retard ou en lot
+    PLAUSIBLE_MINUTES = (1, 240)
+    # Rejet des valeurs à plus de N écarts absolus médians (normalisés) de la médiane
+    OUTLIER_MADS = 3
+    MAD_SCALE = 1.4826
+    MAX_PACKAGES_KEY = 10
+    SPECIFIC_DIMENSIONS = ('customer', 'company')
+    GENERAL_DIMENSIONS = ('postal_prefix', 'packages')
+    
+    @classmethod
+    def keys_for(cls, delivery_type, customer_email, company, postal_code, packages):
+        """Clés (dimension, type, clé) d'une livraison, de la plus spécifique à la plus générale"""
+        keys = []
+        if customer_email:
+            keys.append(('customer', delivery_type, customer_email.strip().lower()[:200]))
+        if company and company.strip():
+            keys.append(('company', delivery_type, company.strip().lower()[:200]))
+        prefix = geo.postal_prefix(postal_code)
+        if prefix:
+            keys.append(('postal_prefix', delivery_type, prefix))
+        keys.append(('packages', delivery_type, str(min(max(packages or 1, 1), cls.MAX_PACKAGES_KEY))))
+        keys.append(('all', delivery_type, ''))
+        return keys
+    
+    @staticmethod
+    def minutes_between(start, end):
+        """Minutes entre deux heures (TimeField) d'une même journée"""
+        return (datetime.combine(date.min, end) - datetime.combine(date.min, start)).total_seconds() / 60
+    
+    @classmethod
+    def is_plausible(cls, minutes):
+        low, high = cls.PLAUSIBLE_MINUTES
+        return low <= minutes <= high
+    
+    @classmethod
+    def completed_stops(cls, since):
+        return RouteDelivery.objects.filter(
+            is_completed=True,
+            completed_at__gte=since,
+            actual_arrival__isnull=False,
+            actual_departure__isnull=False,
+        )
+    
+    # ---------- Apprentissage ----------
+    
+    @classmethod
+    def observations(cls, since):
+        """(clés, minutes sur place) des arrêts terminés, lus en une requête"""
+        rows = cls.completed_stops(since).values_list(
+            'actual_arrival', 'actual_departure', 'delivery__delivery_type', 'delivery__customer_email',
+            'delivery__company', 'delivery__delivery_postal_code', 'delivery__total_packages'
+        )
+        for arrival, departure, *delivery in rows.iterator(chunk_size=2000):
+            minutes = cls.minutes_between(arrival, departure)
+            if cls.is_plausible(minutes):
+                yield cls.keys_for(*delivery), minutes
+    
+    @classmethod
+    def robust_median(cls, values):
+        """Médiane et écart absolu médian, après rejet des valeurs aberrantes"""
+        center = median(values)
+        mad = median(abs(value - center) for value in values)
+        if mad:
+            bound = cls.OUTLIER_MADS * cls.MAD_SCALE * mad
+            values = [value for value in values if abs(value - center) <= bound]
+            center = median(values)
+            mad = median(abs(value - center) for value in values)
+        return center, mad
+    
+    @classmethod
+    def fit(cls, as_of=None, history_days=None):
+        """Recalcule la table ServiceTimeEstimate ; renvoie les estimations enregistrées"""
+        now = as_of or timezone.now()
+        since = now - timedelta(days=history_days or cls.HISTORY_DAYS)
+        samples = defaultdict(list)
+        for keys, minutes in cls.observations(since):
+            for key in keys:
+                samples[key].append(minutes)
+        
+        estimates = []
+        for (dimension, delivery_type, key), values in samples.items():
+            if len(values) < cls.MIN_SAMPLES:
+                continue
+            center, mad = cls.robust_median(values)
+            estimates.append(ServiceTimeEstimate(
+                dimension=dimension,
+                delivery_type=delivery_type,
+                key=key,
+                median_minutes=Decimal(str(round(center, 1))),
+                mad_minutes=Decimal(str(round(mad, 1))),
+                sample_count=len(values),
+                fitted_at=now,
+            ))
+        
+        with transaction.atomic():
+            ServiceTimeEstimate.objects.all().delete()
+            ServiceTimeEstimate.objects.bulk_create(estimates, batch_size=500)
+        return estimates
+    
+    # ---------- Prévision ----------
+    
+    @classmethod
+    def combine(cls, keys, found, default):
+        """Client ou entreprise si connus, sinon moyenne préfixe postal / colis, sinon ensemble"""
+        for key in keys:
+            if key[0] in cls.SPECIFIC_DIMENSIONS and key in found:
+                return found[key]
+        general = [found[key] for key in keys if key[0] in cls.GENERAL_DIMENSIONS and key in found]
+        if general:
+            return sum(general) / len(general)
+        return found.get(keys[-1], default)
+    
+    @classmethod
+    def predict_many(cls, deliveries):
+        """{id de livraison: minutes sur place}, en une requête (estimated_duration sans historique)"""
+        keys = {
+            delivery.id: cls.keys_for(
+                delivery.delivery_type, delivery.customer_email, delivery.company,
+                delivery.delivery_postal_code, delivery.total_packages
+            )
+            for delivery in deliveries
+        }
+        found = {}
+        if keys:
+            rows = ServiceTimeEstimate.objects.filter(
+                key__in={key for delivery_keys in keys.values() for _, _, key in delivery_keys}
+            ).values_list('dimension', 'delivery_type', 'key', 'median_minutes')
+            found = {(dimension, delivery_type, key): float(minutes) for dimension, delivery_type, key, minutes in rows}
+        return {
+            delivery.id: cls.combine(keys[delivery.id], found, delivery.estimated_duration)
+            for delivery in deliveries
+        }
+    
+    # ---------- Précision ----------
+    
+    @classmethod
+    def accuracy(cls, since):
+        """
+        Écarts entre le prévu des ETA (arrivée et départ estimés) et le réel
+        sur les arrêts terminés depuis `since`, en minutes. Un biais positif
+        signifie que le temps sur place est surestimé.
+        """
+        rows = cls.completed_stops(since).filter(
+            estimated_arrival__isnull=False,
+            estimated_departure__isnull=False,
+        ).values_list('estimated_arrival', 'estimated_departure', 'actual_arrival', 'actual_departure')
+        
+        service_errors, arrival_errors = [], []
+        for estimated_arrival, estimated_departure, actual_arrival, actual_departure in rows:
+            actual = cls.minutes_between(actual_arrival, actual_departure)
+            if not cls.is_plausible(actual):
+                continue
+            service_errors.append(cls.minutes_between(estimated_arrival, estimated_departure) - actual)
+            arrival_errors.append(cls.minutes_between(estimated_arrival, actual_arrival))
+        
+        model = ServiceTimeEstimate.objects.aggregate(estimates=Count('id'), fitted_at=Max('fitted_at'))
+        # Arrêts validés sans heure d'arrivée : hors mesure (arrivée non signalée)
+        missing_arrival = RouteDelivery.objects.filter(
+            is_completed=True, completed_at__gte=since, actual_arrival__isnull=True
+        ).count()
+        metrics = {'samples': len(service_errors), 'missing_arrival': missing_arrival, **model}
+        if service_errors:
+            absolute = [abs(error) for error in service_errors]
+            metrics.update({
+                'service_mae': round(mean(absolute), 1),
+                'service_median_error': round(median(absolute), 1),
+                'service_bias': round(mean(service_errors), 1),
+                'service_within_5_min': round(sum(1 for error in absolute if error <= 5) / len(absolute) * 100, 1),
+                'arrival_mae': round(mean(abs(error) for error in arrival_errors), 1),
+            })
+        return metrics
+
+# ========================================
+# CARTE DES LIVRAISONS
+# ========================================
+
+class DeliveryMapService:
+    """
+    Carte des livraisons d'une journée : GeoJSON limité au rectangle
+    affiché et regroupé côté serveur par cellule geohash selon le zoom (un
+    GROUP BY), et recherches de proximité ou de zone faites sur les colonnes
+    indexées Delivery.geohash et Delivery.postal_prefix (voir geo.py).
+    """
+    
+    MAX_COVER_CELLS = 32
+    # Au-delà de ce zoom, chaque livraison a son marqueur
+    CLUSTER_MAX_ZOOM = 15
+    DEFAULT_ZOOM = 11
+    PERIODS = {
+        'morning': (time(6), time(12)),
+        'noon': (time(12), time(14)),
+        'afternoon': (time(14), time(20)),
+    }
+    NEAR_RADIUS_KM = 2
+    # Région de tri d'acheminement canadienne (H2X, G1R...)
+    POSTAL_PREFIX_RE = re.compile(r'^[A-Z]\d[A-Z]$')
+    
+    # ---------- Filtres indexés ----------
+    
+    @staticmethod
+    def in_cells(queryset, prefixes):
+        condition = Q()
+        for prefix in prefixes:
+            condition |= Q(geohash__startswith=prefix)
+        return queryset.filter(condition)
+    
+    @classmethod
+    def in_bbox(cls, queryset, south, west, north, east):
+        """Livraisons du rectangle : cellules couvrantes (index) puis bornes exactes"""
+        prefixes = geo.cover(south, west, north, east, cls.MAX_COVER_CELLS)
+        return cls.in_cells(queryset, prefixes).filter(
+            latitude__range=(south, north),
+            longitude__range=(west, east),
+        )
+    
+    @classmethod
+    def near(cls, delivery, radius_km=None, queryset=None):
+        """Livraisons (du même jour par défaut) à moins de radius_km, les plus proches d'abord"""
+        if not delivery.geohash:
+            return []
+        radius_km = radius_km or cls.NEAR_RADIUS_KM
+        if queryset is None:
+            queryset = Delivery.objects.filter(scheduled_date=delivery.scheduled_date)
+        candidates = cls.in_cells(
+            queryset.exclude(pk=delivery.pk),
+            geo.around(delivery.latitude, delivery.longitude, radius_km)
+        )
+        origin = (float(delivery.latitude), float(delivery.longitude))
+        found = []
+        for candidate in candidates:
+            candidate.distance_km = round(
+                geo.haversine_km(origin, (float(candidate.latitude), float(candidate.longitude))), 2
+            )
+            if candidate.distance_km <= radius_km:
+                found.append(candidate)
+        return sorted(found, key=lambda candidate: candidate.distance_km)
+    
+    @classmethod
+    def zone_prefixes(cls, zones):
+        """Préfixes postaux des zones saisies librement ('H2X', 'h2x 1a1'...)"""
+        prefixes = {geo.postal_prefix(zone) for zone in zones or [] if isinstance(zone, str)}
+        return sorted(prefix for prefix in prefixes if cls.POSTAL_PREFIX_RE.match(prefix))
+    
+    @classmethod
+    def in_driver_zone(cls, planning, queryset=None):
+        """Livraisons du jour du planning situées dans les zones du livreur"""
+        if queryset is None:
+            queryset = Delivery.objects.filter(scheduled_date=planning.date)
+        prefixes = cls.zone_prefixes(planning.zones)
+        return queryset.filter(postal_prefix__in=prefixes) if prefixes else queryset.none()
+    
+    # ---------- GeoJSON ----------
+    
+    @classmethod
+    def day_deliveries(cls, day, period=None, hide_assigned=False):
+        deliveries = Delivery.objects.filter(scheduled_date=day).exclude(geohash='')
+        if period in cls.PERIODS:
+            start, end = cls.PERIODS[period]
+            deliveries = deliveries.filter(scheduled_time_start__gte=start, scheduled_time_start__lt=end)
+        if hide_assigned:
+            deliveries = deliveries.exclude(Exists(RouteDelivery.objects.filter(delivery=OuterRef('pk'))))
+        return deliveries
+    
+    @staticmethod
+    def bounds(deliveries):
+        """[sud, ouest, nord, est] des livraisons (None si aucune)"""
+        box = deliveries.aggregate(
+            south=Min('latitude'), west=Min('longitude'), north=Max('latitude'), east=Max('longitude')
+        )
+        if box['south'] is None:
+            return None
+        return [float(box[side]) for side in ('south', 'west', 'north', 'east')]
+    
+    @staticmethod
+    def point_features(deliveries):
+        rows = deliveries.annotate(
+            assigned=Exists(RouteDelivery.objects.filter(delivery=OuterRef('pk')))
+        ).values(
+            'id', 'delivery_number', 'customer_name', 'delivery_address', 'latitude', 'longitude',
+            'status', 'priority', 'delivery_type', 'scheduled_time_start', 'assigned'
+        )
+        return [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(row['longitude']), float(row['latitude'])]},
+            'properties': {
+                'id': row['id'],
+                'number': row['delivery_number'],
+                'customer': row['customer_name'],
+                'address': row['delivery_address'],
+                'status': row['status'],
+                'priority': row['priority'],
+                'type': row['delivery_type'],
+                'time': row['scheduled_time_start'].strftime('%H:%M') if row['scheduled_time_start'] else '',
+                'assigned': row['assigned'],
+            },
+        } for row in rows]
+    
+    @classmethod
+    def features(cls, deliveries, zoom):
+        """
+        Marqueurs pour le zoom : une entité par cellule geohash de la taille
+        d'un marqueur (centre moyen et comptes), et les livraisons seules
+        dans leur cellule en points détaillés.
+        """
+        if zoom > cls.CLUSTER_MAX_ZOOM:
+            return cls.point_features(deliveries)
+        
+        precision = geo.precision_for_zoom(zoom)
+        cells = deliveries.annotate(cell=Substr('geohash', 1, precision)).values('cell').annotate(
+            count=Count('id'),
+            latitude=Avg('latitude'),
+            longitude=Avg('longitude'),
+            pending=Count('id', filter=Q(status='pending')),
+            urgent=Count('id', filter=Q(priority='urgent')),
+        ).order_by()
+        
+        features, single_cells = [], []
+        for cell in cells:
+            if cell['count'] == 1:
+                single_cells.append(cell['cell'])
+                continue
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [float(cell['longitude']), float(cell['latitude'])]},
+                'properties': {
+                    'cluster': True,
+                    'cell': cell['cell'],
+                    'count': cell['count'],
+                    'pending': cell['pending'],
+                    'urgent': cell['urgent'],
+                },
+            })
+        if single_cells:
+            features += cls.point_features(
+                deliveries.annotate(cell=Substr('geohash', 1, precision)).filter(cell__in=single_cells)
+            )
+        return features
+    
+    @classmethod
+    def geojson(cls, deliveries, zoom=None, bbox=None):
+        zoom = cls.DEFAULT_ZOOM if zoom is None else zoom
+        visible = cls.in_bbox(deliveries, *bbox) if bbox else deliveries
+        return {
+            'type': 'FeatureCollection',
+            'features': cls.features(visible, zoom),
+            'zoom': zoom,
+        }
+
+
+# ========================================
+# PLAN DE CHARGEMENT DES VÉHICULES
+# ========================================
+
+class LoadPlanService:
+    """
+    Colis, poids et volume des livraisons d'après le conditionnement des
+    produits (Product.unit_weight, unit_volume, units_per_package,
+    temperature), et plan de chargement des routes d'une journée.
+    
+    Le véhicule est chargé dans l'ordre inverse des arrêts : le dernier
+    arrêt au fond, le premier près des portes. Chaque zone de transport
+    (froid, chaud, ambiant) est découpée en bacs de BAY_VOLUME litres
+    remplis à la suite (next-fit) : les colis d'un arrêt restent groupés,
+    dans l'ordre de déchargement. Les arrêts qui dépassent le poids ou le
+    volume max du planning du livreur sont laissés à quai et signalés.
+    """
+    
+    # Produit sans conditionnement renseigné : boîte à lunch type
+    DEFAULT_UNIT_WEIGHT = Decimal('0.6')
+    DEFAULT_UNIT_VOLUME = Decimal('2.5')
+    DEFAULT_UNITS_PER_PACKAGE = 10
+    DEFAULT_TEMPERATURE = 'cold'
+    # Livreur sans planning ce jour-là : valeurs par défaut de DriverPlanning
+    DEFAULT_MAX_WEIGHT = Decimal('100')
+    DEFAULT_MAX_VOLUME = Decimal('2000')
+    BAY_VOLUME = Decimal('250')
+    ZONE_CODES = {'cold': 'F', 'hot': 'C', 'ambient': 'A'}
+    
+    LOAD_FIELDS = ['total_packages', 'weight', 'volume', 'updated_at']
+    
+    @classmethod
+    def item_packages(cls, item):
+        """Colis d'une ligne de commande, un dictionnaire par colis"""
+        product = item.product
+        unit_weight = (product and product.unit_weight) or cls.DEFAULT_UNIT_WEIGHT
+        unit_volume = (product and product.unit_volume) or cls.DEFAULT_UNIT_VOLUME
+        per_package = (product and product.units_per_package) or cls.DEFAULT_UNITS_PER_PACKAGE
+        package_type = product.package_type if product else 'box'
+        temperature = product.temperature if product else cls.DEFAULT_TEMPERATURE
         
-        return recommendations
+        packages, remaining = [], item.quantity
+        while remaining > 0:
+            units = min(remaining, per_package)
+            packages.append({
+                'name': item.product_name,
+                'type': package_type,
+                'temperature': temperature,
+                'units': units,
+                'weight': unit_weight * units,
+                'volume': unit_volume * units,
+            })
+            remaining -= units
+        return packages
     
     @staticmethod
-    def get_complementary_items(lunch_box, limit=4):
-        """Obtenir des articles complémentaires"""
-        # Articles souvent commandés ensemble
-        orders_with_item = Order.objects.filter(
-            items__lunch_box=lunch_box
-        ).values_list('id', flat=True)
+    def summarize(packages):
+        return {
+            'packages': packages,
+            'count': len(packages),
+            'weight': sum((package['weight'] for package in packages), Decimal('0')),
+            'volume': sum((package['volume'] for package in packages), Decimal('0')),
+        }
+    
+    @classmethod
+    def order_load(cls, order):
+        """Chargement d'une commande (articles préchargés avec leurs produits)"""
+        return cls.summarize([package for item in order.items.all() for package in cls.item_packages(item)])
+    
+    @classmethod
+    def manual_load(cls, delivery):
+        """Livraison sans commande : colis saisis, poids et volume répartis également"""
+        count = max(delivery.total_packages, 1)
+        default_weight = cls.DEFAULT_UNIT_WEIGHT * cls.DEFAULT_UNITS_PER_PACKAGE
+        default_volume = cls.DEFAULT_UNIT_VOLUME * cls.DEFAULT_UNITS_PER_PACKAGE
+        weight = delivery.weight / count if delivery.weight else default_weight
+        volume = delivery.volume / count if delivery.volume else default_volume
+        return cls.summarize([{
+            'name': 'Colis',
+            'type': 'box',
+            'temperature': cls.DEFAULT_TEMPERATURE,
+            'units': 1,
+            'weight': weight,
+            'volume': volume,
+        } for _ in range(count)])
+    
+    @classmethod
+    def delivery_loads(cls, deliveries):
+        """
+        {id de livraison: chargement}, articles et produits chargés en une
+        requête. Une récupération ne charge rien au départ.
+        """
+        order_ids = {delivery.order_id for delivery in deliveries
+                     if delivery.order_id and delivery.delivery_type == 'delivery'}
+        items = defaultdict(list)
+        for item in OrderItem.objects.filter(order_id__in=order_ids).select_related('product'):
+            items[item.order_id].append(item)
         
-        complementary = OrderItem.objects.filter(
-            order__in=orders_with_item
-        ).exclude(
-            lunch_box=lunch_box
-        ).values('lunch_box').annotate(
-            count=Count('id')
-        ).order_by('-count')[:limit]
+        loads = {}
+        for delivery in deliveries:
+            if delivery.delivery_type != 'delivery':
+                loads[delivery.id] = cls.summarize([])
+            elif delivery.order_id in items:
+                loads[delivery.id] = cls.summarize([
+                    package for item in items[delivery.order_id] for package in cls.item_packages(item)
+                ])
+            else:
+                loads[delivery.id] = cls.manual_load(delivery)
+        return loads
+    
+    @staticmethod
+    def stored_values(load):
+        """(total_packages, weight, volume) tels qu'enregistrés sur Delivery"""
+        cents = Decimal('0.01')
+        return max(load['count'], 1), load['weight'].quantize(cents), load['volume'].quantize(cents)
+    
+    @classmethod
+    def refresh(cls, deliveries):
+        """
+        Complète poids et volume des livraisons issues d'une commande quand
+        ils sont vides, sans toucher aux valeurs saisies à la main (un
+        bulk_update des seules livraisons modifiées). Le nombre de colis
+        (1 par défaut, indiscernable d'une saisie) n'est renseigné que pour
+        une livraison sans poids ni volume. Renvoie le nombre de livraisons
+        mises à jour.
+        """
+        empty = [delivery for delivery in deliveries
+                 if delivery.order_id and delivery.delivery_type == 'delivery'
+                 and (delivery.weight is None or delivery.volume is None)]
+        loads = cls.delivery_loads(empty)
+        now = timezone.now()
+        for delivery in empty:
+            total_packages, weight, volume = cls.stored_values(loads[delivery.id])
+            if delivery.weight is None and delivery.volume is None:
+                delivery.total_packages = total_packages
+            if delivery.weight is None:
+                delivery.weight = weight
+            if delivery.volume is None:
+                delivery.volume = volume
+            # bulk_update ne renseigne pas auto_now (curseur de synchronisation)
+            delivery.updated_at = now
+        if empty:
+            Delivery.objects.bulk_update(empty, cls.LOAD_FIELDS, batch_size=500)
+            transaction.on_commit(lambda: bump_model_version(Delivery))
+        return len(empty)
+    
+    @staticmethod
+    def lines(packages):
+        """Colis regroupés par produit et zone pour la feuille de chargement"""
+        temperatures = dict(Product.TEMPERATURE_CHOICES)
+        package_types = dict(Product.PACKAGE_TYPE_CHOICES)
+        grouped = defaultdict(lambda: [0, 0])
+        for package in packages:
+            key = (package['temperature'], package['name'], package['type'])
+            grouped[key][0] += 1
+            grouped[key][1] += package['units']
+        return [{
+            'temperature': temperatures.get(temperature, temperature),
+            'name': name,
+            'type': package_types.get(package_type, package_type),
+            'count': count,
+            'units': units,
+        } for (temperature, name, package_type), (count, units) in sorted(grouped.items())]
+    
+    @classmethod
+    def pack(cls, stops, loads, max_weight, max_volume):
+        """
+        Charge les arrêts (RouteDelivery triés par position) du dernier au
+        premier. Renvoie les étapes dans l'ordre de chargement, les totaux
+        chargés, le nombre de bacs par zone et les arrêts qui ne rentrent pas.
+        """
+        bays = {}
+        weight = volume = Decimal('0')
+        steps = []
+        for rd in reversed(stops):
+            load = loads[rd.delivery_id]
+            fits = weight + load['weight'] <= max_weight and volume + load['volume'] <= max_volume
+            placed = Counter()
+            if fits:
+                weight += load['weight']
+                volume += load['volume']
+                for package in sorted(load['packages'], key=itemgetter('temperature')):
+                    zone = package['temperature']
+                    number, free = bays.get(zone, (0, Decimal('0')))
+                    if number == 0 or package['volume'] > free:
+                        number, free = number + 1, cls.BAY_VOLUME
+                    bays[zone] = (number, free - package['volume'])
+                    placed[f"{cls.ZONE_CODES.get(zone, 'A')}{number}"] += 1
+            steps.append({
+                'sequence': len(steps) + 1,
+                'stop': rd.position + 1,
+                'route_delivery': rd,
+                'delivery': rd.delivery,
+                'count': load['count'],
+                'weight': load['weight'],
+                'volume': load['volume'],
+                'lines': cls.lines(load['packages']),
+                'bays': sorted(placed.items()),
+                'fits': fits,
+            })
+        return {
+            'steps': steps,
+            'count': sum(step['count'] for step in steps if step['fits']),
+            'weight': weight,
+            'volume': volume,
+            'bays': {zone: number for zone, (number, _) in bays.items()},
+            'overflow': [step for step in steps if not step['fits']],
+        }
+    
+    @classmethod
+    def capacities(cls, day, driver_ids):
+        """{livreur: (poids max, volume max)} d'après les plannings du jour"""
+        return {
+            driver_id: (max_weight, max_volume)
+            for driver_id, max_weight, max_volume in DriverPlanning.objects.filter(
+                date=day, driver_id__in=driver_ids
+            ).values_list('driver_id', 'max_weight', 'max_volume')
+        }
+    
+    @classmethod
+    def day_plan(cls, day, route_ids=None):
+        """
+        Plans de chargement des routes du jour : routes, arrêts, plannings
+        et articles chargés en quatre requêtes, quel que soit leur nombre.
+        """
+        routes = DeliveryRoute.objects.filter(date=day).exclude(status='cancelled').select_related(
+            'driver'
+        ).prefetch_related(
+            Prefetch('route_deliveries',
+                     queryset=RouteDelivery.objects.select_related('delivery').order_by('position'))
+        ).order_by('start_time', 'route_number')
+        if route_ids is not None:
+            routes = routes.filter(id__in=route_ids)
+        routes = list(routes)
+        
+        stops = {route.id: list(route.route_deliveries.all()) for route in routes}
+        loads = cls.delivery_loads([rd.delivery for route_stops in stops.values() for rd in route_stops])
+        capacities = cls.capacities(day, [route.driver_id for route in routes])
         
-        return [item['lunch_box'] for item in complementary]
\ No newline at end of file
+        plans = []
+        for route in routes:
+            max_weight, max_volume = capacities.get(
+                route.driver_id, (cls.DEFAULT_MAX_WEIGHT, cls.DEFAULT_MAX_VOLUME)
+            )
+            plan = cls.pack(stops[route.id], loads, max_weight, max_volume)
+            # Taux de remplissage demandé : au-delà de 100 %, des arrêts restent à quai
+            demand_weight = sum((step['weight'] for step in plan['steps']), Decimal('0'))
+            demand_volume = sum((step['volume'] for step in plan['steps']), Decimal('0'))
+            plan.update({
+                'route': route,
+                'max_weight': max_weight,
+                'max_volume': max_volume,
+                'weight_percent': round(demand_weight / max_weight * 100) if max_weight else 0,
+                'volume_percent': round(demand_volume / max_volume * 100) if max_volume else 0,
+            })
+            plans.append(plan)
+        return plans
+    
+    @classmethod
+    def check_route(cls, route):
+        """
+        Met à jour le chargement des livraisons de la route et renvoie un
+        avertissement si elle dépasse la capacité du livreur ('' sinon).
+        """
+        plans = cls.day_plan(route.date, route_ids=[route.id])
+        if not plans:
+            return ''
+        plan = plans[0]
+        cls.refresh([step['delivery'] for step in plan['steps']])
+        if not plan['overflow']:
+            return ''
+        customers = [step['delivery'].customer_name for step in reversed(plan['overflow'])]
+        listed = ', '.join(customers[:5]) + (', ...' if len(customers) > 5 else '')
+        return (f"Capacité du véhicule dépassée ({plan['max_weight']:.0f} kg, {plan['max_volume']:.0f} L) : "
+                f"{len(customers)} arrêt(s) ne rentrent pas ({listed})")
+
+
+# ========================================
+# CHECKLISTS GÉNÉRÉES DEPUIS LES MODÈLES
+# ========================================
+
+class ChecklistTemplateService:
+    """
+    Checklists de préparation générées depuis les ChecklistTemplate. Le
+    modèle est choisi d'après le type d'événement de la commande (celui de
+    la catégorie de produits la plus commandée, Category.event_type) et sa
+    taille (unités commandées, entre min_order_size et max_order_size) ;
+    les quantités proportionnelles sont rapportées à reference_size.
+    
+    create_for_orders() traite un lot de commandes avec un nombre fixe de
+    requêtes : modèles et articles chargés une fois, une insertion
+    bulk_create pour les checklists et une pour tous leurs éléments.
+    """
+    
+    FALLBACK_EVENT_TYPE = 'other'
+    
+    @staticmethod
+    def order_size(order):
+        """Nombre d'unités commandées (articles préchargés)"""
+        return sum(item.quantity for item in order.items.all())
+    
+    @staticmethod
+    def units_by_category(order):
+        units = Counter()
+        for item in order.items.all():
+            if item.product_id:
+                units[item.product.category_id] += item.quantity
+        return units
+    
+    @classmethod
+    def event_type_for(cls, order, category_event_types):
+        """
+        Type d'événement de la commande : celui de la catégorie qui totalise
+        le plus d'unités, sinon corporatif pour une entreprise
+        """
+        units = Counter()
+        for category_id, quantity in cls.units_by_category(order).items():
+            event_type = category_event_types.get(category_id)
+            if event_type:
+                units[event_type] += quantity
+        if units:
+            return units.most_common(1)[0][0]
+        return 'corporate' if order.company else cls.FALLBACK_EVENT_TYPE
+    
+    @staticmethod
+    def load_templates():
+        """Modèles actifs et leurs éléments (deux requêtes)"""
+        return list(
+            ChecklistTemplate.objects.filter(is_active=True).prefetch_related(
+                Prefetch('checklisttemplateitem_set',
+                         queryset=ChecklistTemplateItem.objects.order_by('order', 'id'))
+            )
+        )
+    
+    @staticmethod
+    def covers(template, size):
+        return template.min_order_size <= size and (
+            template.max_order_size is None or size <= template.max_order_size
+        )
+    
+    @classmethod
+    def select(cls, templates, event_type, size):
+        """
+        Modèle du type d'événement dont la plage couvre la taille, le plus
+        précis (plage la plus étroite) ; à défaut, un modèle « Autre »
+        """
+        for wanted in (event_type, cls.FALLBACK_EVENT_TYPE):
+            candidates = [template for template in templates
+                          if template.event_type == wanted and cls.covers(template, size)]
+            if candidates:
+                return min(candidates, key=lambda template: (
+                    (template.max_order_size if template.max_order_size is not None else 10 ** 9)
+                    - template.min_order_size,
+                    template.id,
+                ))
+        return None
+    
+    @staticmethod
+    def scaled_quantity(template, template_item, size, units_by_category):
+        """Quantité d'un élément pour la commande ; 0 s'il ne la concerne pas"""
+        if template_item.scaling == 'fixed':
+            return template_item.default_quantity
+        units = size if template_item.scaling == 'order_size' else units_by_category.get(template_item.category_id, 0)
+        if not units:
+            return 0
+        reference = template.reference_size or 1
+        return max(math.ceil(template_item.default_quantity * units / reference), 1)
+    
+    @classmethod
+    def build_items(cls, template, order):
+        """Éléments non enregistrés de la checklist de `order` selon `template`"""
+        size = cls.order_size(order)
+        units = cls.units_by_category(order)
+        items = []
+        for template_item in template.checklisttemplateitem_set.all():
+            quantity = cls.scaled_quantity(template, template_item, size, units)
+            if quantity > 0:
+                items.append(ChecklistItem(
+                    inventory_item_id=template_item.inventory_item_id,
+                    quantity_needed=quantity,
+                    notes=template_item.notes,
+                    order=template_item.order,
+                ))
+        return items
+    
+    @classmethod
+    def create_for_orders(cls, orders, template=None, created_by=None, assigned_to=None,
+                          title=None, priority=0, notes=''):
+        """
+        Crée les checklists manquantes des commandes du queryset `orders`,
+        avec `template` ou le modèle choisi pour chaque commande. Renvoie
+        (checklists créées, commandes ignorées faute de modèle).
+        """
+        orders = list(
+            orders.filter(checklist__isnull=True).prefetch_related('items__product')
+        )
+        if not orders:
+            return [], []
+        if template is None:
+            templates = cls.load_templates()
+            category_event_types = dict(
+                Category.objects.exclude(event_type='').values_list('id', 'event_type')
+            )
+        
+        planned, skipped = [], []
+        for order in orders:
+            chosen = template or cls.select(
+                templates, cls.event_type_for(order, category_event_types), cls.order_size(order)
+            )
+            if chosen is None:
+                skipped.append(order)
+                continue
+            planned.append((order, cls.build_items(chosen, order)))
+        if not planned:
+            return [], skipped
+        
+        with transaction.atomic():
+            OrderChecklist.objects.bulk_create([
+                OrderChecklist(
+                    order=order,
+                    title=title or f'Checklist {order.order_number}',
+                    assigned_to=assigned_to,
+                    priority=priority,
+                    notes=notes,
+                    created_by=created_by,
+                    status='pending',
+                    total_items=len(items),
+                )
+                for order, items in planned
+            ], batch_size=500)
+            # MySQL ne renvoie pas les clés des lignes insérées : relecture par commande
+            created = list(
+                OrderChecklist.objects.filter(order_id__in=[order.id for order, _ in planned])
+                .select_related('order')
+            )
+            checklist_ids = {checklist.order_id: checklist.id for checklist in created}
+            for order, items in planned:
+                for item in items:
+                    item.checklist_id = checklist_ids[order.id]
+            ChecklistItem.objects.bulk_create(
+                [item for _, items in planned for item in items], batch_size=1000
+            )
+            Delivery.objects.filter(order_id__in=checklist_ids, delivery_type='delivery').update(
+                has_checklist=True, checklist_completed=False, updated_at=timezone.now()
+            )
+            transaction.on_commit(lambda: bump_model_version(OrderChecklist))
+            transaction.on_commit(lambda: bump_model_version(Delivery))
+            # bulk_create n'envoie pas post_save : réservation du matériel ici
+            new_ids = list(checklist_ids.values())
+            transaction.on_commit(lambda: EquipmentAvailabilityService.sync(new_ids))
+        return created, skipped
+    
+    @classmethod
+    def create_for_date(cls, day, created_by=None, assigned_to=None):
+        """Checklists de toutes les commandes confirmées livrées le jour `day`"""
+        return cls.create_for_orders(
+            Order.objects.filter(delivery_date=day, status='confirmed'),
+            created_by=created_by,
+            assigned_to=assigned_to,
+        )
+    
+    @classmethod
+    def suggest(cls, order):
+        """Modèle qui serait choisi pour une commande"""
+        category_event_types = dict(Category.objects.exclude(event_type='').values_list('id', 'event_type'))
+        return cls.select(
+            cls.load_templates(), cls.event_type_for(order, category_event_types), cls.order_size(order)
+        )
+
+
+# ========================================
+# DISPONIBILITÉ DU MATÉRIEL
+# ========================================
+
+class EquipmentAvailabilityService:
+    """
+    Index de disponibilité du matériel : une ligne EquipmentAvailability
+    par article et par journée porte la quantité réservée par les
+    checklists, du jour de l'événement à son retour (récupération
+    planifiée ou fin du démontage). « Peut-on prendre cette commande ? »
+    et « quels conflits ce mois-ci ? » se résolvent en une requête sur
+    cet index, sans relire checklists ni commandes.
+    
+    Les compteurs sont tenus à jour par différence : EquipmentReservation
+    mémorise ce qui est compté pour chaque checklist ; sync() calcule la
+    nouvelle réservation, retire l'ancienne et ajoute la nouvelle par des
+    UPDATE F('reserved') + delta, un par plage de journées contiguës.
+    """
+    
+    INACTIVE_STATUSES = ['cancelled']
+    INACTIVE_PICKUP_STATUSES = ['cancelled', 'failed']
+    # Consommés sur place : réservés le jour de l'événement seulement
+    CONSUMABLE_CATEGORIES = ('condiments', 'boissons')
+    # Garde-fou contre une date de retour erronée
+    MAX_SPAN_DAYS = 31
+    BATCH_SIZE = 500
+    
+    @staticmethod
+    def days(start, end):
+        return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    
+    @classmethod
+    def pickup_dates(cls, order_ids):
+        """Date de récupération la plus tardive de chaque commande (une requête)"""
+        return dict(
+            Delivery.objects.filter(order_id__in=order_ids, delivery_type='pickup')
+            .exclude(status__in=cls.INACTIVE_PICKUP_STATUSES)
+            .values('order_id').annotate(last=Max('scheduled_date'))
+            .values_list('order_id', 'last')
+        )
+    
+    @classmethod
+    def span(cls, order, pickup_date=None):
+        """(premier jour, dernier jour) d'immobilisation du matériel de la commande"""
+        start = order.delivery_date
+        end = start
+        if pickup_date:
+            end = max(end, pickup_date)
+        contract = getattr(order, 'event_contract', None)
+        if contract is not None and contract.cleanup_end_time:
+            end = max(end, timezone.localtime(contract.cleanup_end_time).date())
+        return start, min(end, start + timedelta(days=cls.MAX_SPAN_DAYS))
+    
+    @classmethod
+    def desired(cls, checklists):
+        """{(checklist, article): (quantité, début, fin)} que les checklists devraient réserver"""
+        active = [
+            checklist for checklist in checklists
+            if checklist.status not in cls.INACTIVE_STATUSES
+            and checklist.order.status not in cls.INACTIVE_STATUSES
+        ]
+        if not active:
+            return {}
+        pickups = cls.pickup_dates([checklist.order_id for checklist in active])
+        spans = {
+            checklist.id: cls.span(checklist.order, pickups.get(checklist.order_id))
+            for checklist in active
+        }
+        quantities = Counter()
+        categories = {}
+        items = ChecklistItem.objects.filter(
+            checklist_id__in=spans, quantity_needed__gt=0
+        ).values_list('checklist_id', 'inventory_item_id', 'inventory_item__category', 'quantity_needed')
+        for checklist_id, item_id, category, quantity in items:
+            quantities[(checklist_id, item_id)] += quantity
+            categories[item_id] = category
+        
+        wanted = {}
+        for (checklist_id, item_id), quantity in quantities.items():
+            start, end = spans[checklist_id]
+            if categories[item_id] in cls.CONSUMABLE_CATEGORIES:
+                end = start
+            wanted[(checklist_id, item_id)] = (quantity, start, end)
+        return wanted
+    
+    @classmethod
+    def apply(cls, deltas):
+        """
+        Ajoute les deltas {(article, jour): n} aux compteurs : lignes
+        manquantes créées en une insertion, puis un UPDATE par plage de
+        journées contiguës de même delta (regroupant les articles).
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        EquipmentAvailability.objects.bulk_create([
+            EquipmentAvailability(inventory_item_id=item_id, date=day)
+            for item_id, day in deltas
+        ], ignore_conflicts=True, batch_size=1000)
+        
+        segments = defaultdict(list)
+        for item_id, group in groupby(sorted(deltas), key=itemgetter(0)):
+            run = None
+            for _, day in group:
+                delta = deltas[(item_id, day)]
+                if run and run[2] == delta and run[1] + timedelta(days=1) == day:
+                    run[1] = day
+                    continue
+                if run:
+                    segments[tuple(run)].append(item_id)
+                run = [day, day, delta]
+            segments[tuple(run)].append(item_id)
+        
+        now = timezone.now()
+        for (start, end, delta), item_ids in segments.items():
+            EquipmentAvailability.objects.filter(
+                inventory_item_id__in=item_ids, date__range=(start, end)
+            ).update(reserved=F('reserved') + delta, updated_at=now)
+    
+    @classmethod
+    @transaction.atomic
+    def sync(cls, checklist_ids):
+        """Aligne les réservations des checklists données sur leur contenu actuel"""
+        checklist_ids = list(set(checklist_ids))
+        if not checklist_ids:
+            return
+        # Verrou : deux synchronisations d'une même checklist ne se croisent pas
+        checklists = list(
+            OrderChecklist.objects.select_for_update(of=('self',))
+            .filter(id__in=checklist_ids)
+            .select_related('order', 'order__event_contract')
+        )
+        wanted = cls.desired(checklists)
+        current = {
+            (reservation.checklist_id, reservation.inventory_item_id): reservation
+            for reservation in EquipmentReservation.objects.filter(
+                checklist_id__in=[checklist.id for checklist in checklists]
+            )
+        }
+        
+        deltas = Counter()
+        to_create, to_update, to_delete = [], [], []
+        for key in set(wanted) | set(current):
+            reservation = current.get(key)
+            new = wanted.get(key)
+            old = (reservation.quantity, reservation.start_date, reservation.end_date) if reservation else None
+            if old == new:
+                continue
+            if old:
+                for day in cls.days(old[1], old[2]):
+                    deltas[(key[1], day)] -= old[0]
+            if new:
+                for day in cls.days(new[1], new[2]):
+                    deltas[(key[1], day)] += new[0]
+            if reservation is None:
+                to_create.append(EquipmentReservation(
+                    checklist_id=key[0], inventory_item_id=key[1],
+                    quantity=new[0], start_date=new[1], end_date=new[2],
+                ))
+            elif new is None:
+                to_delete.append(reservation.id)
+            else:
+                reservation.quantity, reservation.start_date, reservation.end_date = new
+                to_update.append(reservation)
+        
+        cls.apply(deltas)
+        if to_create:
+            EquipmentReservation.objects.bulk_create(to_create, batch_size=1000)
+        if to_update:
+            EquipmentReservation.objects.bulk_update(
+                to_update, ['quantity', 'start_date', 'end_date'], batch_size=1000
+            )
+        if to_delete:
+            EquipmentReservation.objects.filter(id__in=to_delete).delete()
+    
+    @classmethod
+    def sync_for_orders(cls, order_ids):
+        """Après un changement de date ou de statut des commandes"""
+        cls.sync(OrderChecklist.objects.filter(order_id__in=order_ids).values_list('id', flat=True))
+    
+    @classmethod
+    @transaction.atomic
+    def release(cls, checklist_ids):
+        """Retire des compteurs tout ce que réservent les checklists (avant suppression)"""
+        reservations = list(EquipmentReservation.objects.filter(checklist_id__in=checklist_ids))
+        if not reservations:
+            return
+        deltas = Counter()
+        for reservation in reservations:
+            for day in cls.days(reservation.start_date, reservation.end_date):
+                deltas[(reservation.inventory_item_id, day)] -= reservation.quantity
+        cls.apply(deltas)
+        EquipmentReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).delete()
+    
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls):
+        """Recompte tout l'index depuis les checklists (réparation)"""
+        EquipmentReservation.objects.all().delete()
+        EquipmentAvailability.objects.all().delete()
+        checklist_ids = list(OrderChecklist.objects.values_list('id', flat=True))
+        for offset in range(0, len(checklist_ids), cls.BATCH_SIZE):
+            cls.sync(checklist_ids[offset:offset + cls.BATCH_SIZE])
+        return EquipmentAvailability.objects.count()
+    
+    @staticmethod
+    def check(requirements, start, end, already_reserved=None):
+        """
+        Articles qui manqueraient si l'on ajoutait `requirements` ({article:
+        quantité}) du `start` au `end` inclus, en une requête : le pic de
+        réservation de la période est comparé au stock. `already_reserved`
+        ({article: quantité}) retire ce que la commande réserve déjà.
+        """
+        already_reserved = already_reserved or {}
+        items = InventoryItem.objects.filter(id__in=list(requirements)).annotate(
+            peak=Coalesce(Max('availability__reserved', filter=Q(availability__date__range=(start, end))), 0)
+        ).values_list('id', 'name', 'unit', 'stock_quantity', 'peak')
+        shortages = []
+        for item_id, name, unit, stock, peak in items:
+            reserved = max(peak - already_reserved.get(item_id, 0), 0)
+            missing = reserved + requirements[item_id] - stock
+            if missing > 0:
+                shortages.append({
+                    'item_id': item_id,
+                    'name': name,
+                    'unit': unit,
+                    'stock': stock,
+                    'reserved': reserved,
+                    'needed': requirements[item_id],
+                    'missing': missing,
+                })
+        return sorted(shortages, key=itemgetter('name'))
+    
+    @classmethod
+    def check_order(cls, order, template=None):
+        """
+        Peut-on fournir le matériel de la commande ? Besoins tirés de sa
+        checklist, sinon du modèle `template` (ou de celui qui serait choisi).
+        Renvoie la liste des manques (vide si tout est disponible).
+        """
+        checklist = getattr(order, 'checklist', None)
+        already_reserved = {}
+        if checklist is not None:
+            requirements = Counter()
+            for item_id, quantity in checklist.items.values_list('inventory_item_id', 'quantity_needed'):
+                requirements[item_id] += quantity
+            already_reserved = dict(
+                checklist.equipment_reservations.values_list('inventory_item_id', 'quantity')
+            )
+        else:
+            template = template or ChecklistTemplateService.suggest(order)
+            if template is None:
+                return []
+            requirements = Counter()
+            for item in ChecklistTemplateService.build_items(template, order):
+                requirements[item.inventory_item_id] += item.quantity_needed
+        if not requirements:
+            return []
+        start, end = cls.span(order, cls.pickup_dates([order.id]).get(order.id))
+        return cls.check(requirements, start, end, already_reserved)
+    
+    @staticmethod
+    def conflicts(start, end):
+        """
+        Journées où la réservation dépasse le stock entre `start` et `end`
+        (index par date), avec les commandes concernées (deux requêtes)
+        """
+        rows = list(
+            EquipmentAvailability.objects.filter(
+                date__range=(start, end), reserved__gt=F('inventory_item__stock_quantity')
+            ).values_list('date', 'inventory_item_id', 'inventory_item__name',
+                          'inventory_item__unit', 'inventory_item__stock_quantity', 'reserved')
+            .order_by('date', 'inventory_item__name')
+        )
+        if not rows:
+            return []
+        orders = defaultdict(list)
+        reservations = EquipmentReservation.objects.filter(
+            inventory_item_id__in={row[1] for row in rows}, start_date__lte=end, end_date__gte=start
+        ).values_list('inventory_item_id', 'start_date', 'end_date', 'checklist__order__order_number')
+        for item_id, first_day, last_day, order_number in reservations:
+            orders[item_id].append((first_day, last_day, order_number))
+        return [
+            {
+                'date': day,
+                'item_id': item_id,
+                'name': name,
+                'unit': unit,
+                'stock': stock,
+                'reserved': reserved,
+                'missing': reserved - stock,
+                'orders': sorted(number for first_day, last_day, number in orders[item_id]
+                                 if first_day <= day <= last_day),
+            }
+            for day, item_id, name, unit, stock, reserved in rows
+        ]
+
+
+# ========================================
+# PLANNING DU PERSONNEL ÉVÉNEMENTIEL
+# ========================================
+
+class StaffConflictError(Exception):
+    """Le membre du personnel est déjà pris sur ce créneau"""
+
+class StaffSchedulingService:
+    """
+    Créneaux du personnel événementiel : un maître d'hôtel est pris de
+    l'installation à la fin du nettoyage de ses événements, un employé de
+    son arrivée à son départ (EventStaffAssignment). Les créneaux d'une
+    semaine sont lus en deux requêtes et gardés en cache jusqu'à la
+    prochaine modification d'un événement ou d'une affectation ; ils
+    alimentent un arbre d'intervalles par personne (intervals.py) qui
+    répond aux questions de disponibilité sans nouvelle requête.
+    """
+    
+    INACTIVE_EVENT_STATUSES = ['cancelled']
+    MAITRE_HOTEL = 'maitre_hotel'
+    WEEK_DAYS = 7
+    
+    @staticmethod
+    def aware(value):
+        """Les vues construisent parfois les horaires par strptime (naïfs)"""
+        if value is not None and timezone.is_naive(value):
+            return timezone.make_aware(value)
+        return value
+    
+    @classmethod
+    def day_bounds(cls, first_day, days=1):
+        start = timezone.make_aware(datetime.combine(first_day, time.min))
+        return start, start + timedelta(days=days)
+    
+    @classmethod
+    def load_shifts(cls, start, end):
+        """Créneaux (début, fin, infos) qui chevauchent [start, end) (deux requêtes)"""
+        events = EventContract.objects.exclude(status__in=cls.INACTIVE_EVENT_STATUSES).filter(
+            maitre_hotel__isnull=False, setup_start_time__lt=end, cleanup_end_time__gt=start
+        ).values_list('id', 'event_name', 'maitre_hotel_id', 'setup_start_time', 'cleanup_end_time')
+        shifts = [
+            (setup, cleanup, {
+                'user_id': user_id, 'event_id': event_id, 'event_name': name,
+                'role': cls.MAITRE_HOTEL, 'assignment_id': None,
+            })
+            for event_id, name, user_id, setup, cleanup in events
+        ]
+        assignments = EventStaffAssignment.objects.exclude(
+            event__status__in=cls.INACTIVE_EVENT_STATUSES
+        ).filter(arrival_time__lt=end, departure_time__gt=start).values_list(
+            'id', 'staff_member_id', 'role', 'arrival_time', 'departure_time', 'event_id', 'event__event_name'
+        )
+        shifts.extend(
+            (arrival, departure, {
+                'user_id': user_id, 'event_id': event_id, 'event_name': name,
+                'role': role, 'assignment_id': assignment_id,
+            })
+            for assignment_id, user_id, role, arrival, departure, event_id, name in assignments
+        )
+        return shifts
+    
+    @classmethod
+    def week_shifts(cls, first_day):
+        """Créneaux des 7 jours à partir de `first_day`, en cache versionné"""
+        versions = '.'.join(str(version) for version in model_versions(EventContract, EventStaffAssignment))
+        key = f'staff-week:{first_day.isoformat()}:{versions}'
+        shifts = cache.get(key)
+        if shifts is None:
+            shifts = cls.load_shifts(*cls.day_bounds(first_day, cls.WEEK_DAYS))
+            cache.set(key, shifts, DEFAULT_TIMEOUT)
+        return shifts
+    
+    @staticmethod
+    def build_index(shifts):
+        """{utilisateur: IntervalTree de ses créneaux}"""
+        by_user = defaultdict(list)
+        for shift in shifts:
+            by_user[shift[2]['user_id']].append(shift)
+        return {user_id: IntervalTree(user_shifts) for user_id, user_shifts in by_user.items()}
+    
+    @classmethod
+    def index_for(cls, start, end):
+        """
+        Index couvrant [start, end) : semaines (lundi) en cache concernées,
+        un créneau à cheval sur deux semaines n'étant compté qu'une fois
+        """
+        start, end = cls.aware(start), cls.aware(end)
+        first = timezone.localtime(start).date()
+        first -= timedelta(days=first.weekday())
+        last = timezone.localtime(end).date()
+        shifts = {}
+        while first <= last:
+            for shift in cls.week_shifts(first):
+                info = shift[2]
+                shifts[(info['user_id'], info['event_id'], info['assignment_id'])] = shift
+            first += timedelta(days=cls.WEEK_DAYS)
+        return cls.build_index(shifts.values())
+    
+    @staticmethod
+    def describe(shift):
+        start, end, info = shift
+        return {
+            **info,
+            'start': start,
+            'end': end,
+            'label': f"{info['event_name']} ({timezone.localtime(start):%d/%m %H:%M} - {timezone.localtime(end):%H:%M})",
+        }
+    
+    @classmethod
+    def conflicts_for(cls, user_id, start, end, exclude_event_id=None, index=None):
+        """Créneaux de l'utilisateur qui chevauchent [start, end) (hors l'événement exclu)"""
+        start, end = cls.aware(start), cls.aware(end)
+        index = index if index is not None else cls.index_for(start, end)
+        tree = index.get(user_id)
+        if tree is None:
+            return []
+        return [
+            cls.describe(shift) for shift in tree.overlapping(start, end)
+            if shift[2]['event_id'] != exclude_event_id
+        ]
+    
+    @classmethod
+    def ensure_available(cls, user, start, end, exclude_event_id=None):
+        """Lève StaffConflictError si `user` est déjà pris entre start et end"""
+        conflicts = cls.conflicts_for(user.id, start, end, exclude_event_id)
+        if conflicts:
+            raise StaffConflictError(
+                f"{user.get_full_name()} est déjà affecté(e) : "
+                + ', '.join(conflict['label'] for conflict in conflicts)
+            )
+    
+    @classmethod
+    def suggest(cls, start, end, user_role='staff', assignment_role=None, exclude_event_id=None,
+                exclude_user_ids=()):
+        """
+        Personnes du rôle `user_role` pour le créneau : disponibles d'abord,
+        puis les plus expérimentées dans `assignment_role` (affectations
+        passées), puis les moins chargées de la semaine.
+        """
+        start, end = cls.aware(start), cls.aware(end)
+        users = list(
+            User.objects.filter(role=user_role, is_active=True)
+            .exclude(id__in=list(exclude_user_ids)).order_by('first_name', 'last_name')
+        )
+        index = cls.index_for(start, end)
+        experience = Counter()
+        if assignment_role:
+            experience.update(dict(
+                EventStaffAssignment.objects.filter(
+                    role=assignment_role, staff_member_id__in=[user.id for user in users]
+                ).values('staff_member_id').annotate(count=Count('id')).values_list('staff_member_id', 'count')
+            ))
+        week_start, week_end = cls.day_bounds(
+            timezone.localtime(start).date() - timedelta(days=timezone.localtime(start).weekday()), cls.WEEK_DAYS
+        )
+        
+        suggestions = []
+        for user in users:
+            tree = index.get(user.id)
+            conflicts = cls.conflicts_for(user.id, start, end, exclude_event_id, index)
+            week_hours = sum(
+                (min(shift_end, week_end) - max(shift_start, week_start)).total_seconds() / 3600
+                for shift_start, shift_end, _ in (tree.overlapping(week_start, week_end) if tree else [])
+            )
+            suggestions.append({
+                'user': user,
+                'available': not conflicts,
+                'conflicts': conflicts,
+                'experience': experience[user.id],
+                'week_hours': round(week_hours, 1),
+            })
+        suggestions.sort(key=lambda suggestion: (
+            not suggestion['available'], -suggestion['experience'], suggestion['week_hours']
+        ))
+        return suggestions
+    
+    @classmethod
+    def week_grid(cls, first_day, user_role=None, user_ids=None):
+        """
+        Grille de 7 jours à partir de `first_day` : une ligne par personne
+        (rôle `user_role` ou `user_ids`), une cellule par jour avec ses
+        créneaux, heures de la semaine et doubles affectations, calculée en
+        un passage sur les créneaux de la semaine.
+        """
+        days = [first_day + timedelta(days=offset) for offset in range(cls.WEEK_DAYS)]
+        bounds = [cls.day_bounds(day) for day in days]
+        index = cls.build_index(cls.week_shifts(first_day))
+        
+        users = User.objects.filter(is_active=True)
+        if user_ids is not None:
+            users = users.filter(id__in=user_ids)
+        elif user_role:
+            users = users.filter(role=user_role)
+        else:
+            users = users.filter(id__in=list(index))
+        
+        rows = []
+        for user in users.order_by('first_name', 'last_name'):
+            tree = index.get(user.id)
+            shifts = list(tree) if tree else []
+            double_booked = set()
+            for first, second in (tree.overlapping_pairs() if tree else []):
+                double_booked.update((id(first), id(second)))
+            cells = [{'day': day, 'shifts': []} for day in days]
+            hours = 0
+            for shift in shifts:
+                described = {**cls.describe(shift), 'conflict': id(shift) in double_booked}
+                for position, (day_start, day_end) in enumerate(bounds):
+                    if shift[0] < day_end and shift[1] > day_start:
+                        cells[position]['shifts'].append(described)
+                        hours += (min(shift[1], day_end) - max(shift[0], day_start)).total_seconds() / 3600
+            rows.append({
+                'user': user,
+                'cells': cells,
+                'hours': round(hours, 1),
+                'conflicts': len(double_booked),
+            })
+        return {'days': days, 'rows': rows}
+    
+    @classmethod
+    def double_bookings(cls, first_day):
+        """Paires de créneaux qui se chevauchent pour une même personne sur la semaine"""
+        return [
+            (cls.describe(first), cls.describe(second))
+            for tree in cls.build_index(cls.week_shifts(first_day)).values()
+            for first, second in tree.overlapping_pairs()
+        ]
@@ -1,153 +1,190 @@
 # signals.py - À créer dans votre app JLTsite
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta
 import uuid, datetime
 
-from .models import Order, Delivery, DeliveryNotification, User
-
-@receiver(pre_save, sender=Order)
-def track_order_status_change(sender, instance, **kwargs):
-    """Détecte quand une commande passe au statut confirmé"""
-    if instance.pk:  # Si l'ordre existe déjà
-        try:
-            old_order = Order.objects.get(pk=instance.pk)
-            # Stocker l'ancien statut dans une variable temporaire
-            instance._old_status = old_order.status
-        except Order.DoesNotExist:
-            instance._old_status = None
-    else:
-        instance._old_status = None
+from .models import (
+    ChecklistItem, CustomerStats, Delivery, DeliveryNotification, DriverPlanning, EventContract, Order,
+    OrderChecklist, OrderStatusHistory, User
+)
+from .caching import bump_model_version, first_delivery_manager, is_versioned
+from .services import (
+    DeliveryFactoryService, EquipmentAvailabilityService, ReorderPlannerService, SlotCapacityService,
+    should_create_pickup
+)
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_cached_model_version(sender, **kwargs):
+    """Invalide le cache versionné (caching.py) des modèles suivis modifiés"""
+    if is_versioned(sender):
+        # Après le commit : une lecture concurrente ne remet pas en cache
+        # l'ancien état sous la nouvelle version
+        transaction.on_commit(lambda: bump_model_version(sender))
+
+def order_just_confirmed(order):
+    """La commande vient-elle de passer au statut confirmé ? (sans requête, via le suivi de champs)"""
+    return order.status == 'confirmed' and order.has_changed('status')
 
 @receiver(post_save, sender=Order)
 def create_delivery_on_order_confirmation(sender, instance, created, **kwargs):
     """
     Crée automatiquement une livraison quand une commande est confirmée
+    (et prévient les responsables livraison) ; géocodage après le commit
     """
-    # Vérifier si le statut vient de passer à 'confirmed'
-    old_status = getattr(instance, '_old_status', None)
-    
-    if instance.status == 'confirmed' and old_status != 'confirmed':
-        # Vérifier qu'il n'y a pas déjà une livraison pour cette commande
-        existing_delivery = Delivery.objects.filter(
-            order=instance,
-            delivery_type='delivery'
-        ).first()
-        
-        if not existing_delivery:
-            # Créer automatiquement la livraison
-            delivery = create_automatic_delivery(instance)
-            
-            # Envoyer une notification au responsable livraison
-            notify_delivery_managers(delivery)
-            
-            # Logger la création
-            print(f"Livraison {delivery.delivery_number} créée automatiquement pour la commande {instance.order_number}")
-
-def create_automatic_delivery(order):
+    if order_just_confirmed(instance):
+        deliveries, _ = DeliveryFactoryService.create_for_orders(Order.objects.filter(pk=instance.pk))
+        if deliveries:
+            transaction.on_commit(lambda: DeliveryFactoryService.geocode(deliveries))
+
+# ========================================
+# SIGNAL POUR LE RÉAPPROVISIONNEMENT CUISINE
+# ========================================
+
+@receiver(post_save, sender=Order)
+def replan_purchasing_on_confirmation(sender, instance, created, **kwargs):
+    """Recalcule les brouillons de commandes fournisseurs à chaque confirmation"""
+    if order_just_confirmed(instance):
+        transaction.on_commit(ReorderPlannerService.replan)
+
+# ========================================
+# SIGNAUX POUR LA CAPACITÉ DES CRÉNEAUX
+# ========================================
+
+@receiver(post_save, sender=Order)
+def sync_delivery_slot_booking(sender, instance, created, **kwargs):
     """
-    Crée une livraison à partir d'une commande confirmée
+    Répercute annulations et changements de créneau sur les compteurs.
+    Les commandes réservées via SlotCapacityService.reserve() sont marquées
+    _slot_reserved et ne sont pas comptées une seconde fois.
     """
-    from .delivery_views import get_order_items_description, geocode_delivery_address
-    
-    # Créer la livraison
-    delivery = Delivery.objects.create(
-        order=order,
-        delivery_type='delivery',
-        customer_name=f"{order.first_name} {order.last_name}",
-        customer_phone=order.phone,
-        customer_email=order.email,
-        company=order.company or '',
-        delivery_address=order.delivery_address,
-        delivery_postal_code=order.delivery_postal_code,
-        delivery_city=order.delivery_city,
-        scheduled_date=order.delivery_date,
-        scheduled_time_start=order.delivery_time,
-        scheduled_time_end=calculate_end_time(order.delivery_time),
-        delivery_instructions=order.delivery_notes,
-        items_description=get_order_items_description(order),
-        total_packages=estimate_packages_count(order),
-        priority=determine_priority(order),
-        has_checklist=hasattr(order, 'checklist'),
-        checklist_completed=order.checklist.status == 'completed' if hasattr(order, 'checklist') else False,
-        created_by=None  # Système automatique
+    new_booking = SlotCapacityService.booking_key(
+        instance.delivery_date, instance.delivery_time,
+        instance.delivery_type, instance.status
     )
+    if created:
+        old_booking = new_booking if getattr(instance, '_slot_reserved', False) else None
+    elif not instance.changed_fields():
+        return
+    else:
+        old_booking = SlotCapacityService.booking_key(
+            instance.previous('delivery_date'), instance.previous('delivery_time'),
+            instance.previous('delivery_type'), instance.previous('status')
+        )
     
-    # Géocoder l'adresse
-    geocode_delivery_address(delivery)
-    
-    return delivery
+    if old_booking == new_booking:
+        return
+    if old_booking:
+        SlotCapacityService.adjust(*old_booking, delta=-1)
+    if new_booking:
+        SlotCapacityService.adjust(*new_booking, delta=1)
 
-def calculate_end_time(start_time):
-    """
-    Calcule l'heure de fin estimée (30 minutes après le début)
-    """
-    from datetime import datetime, timedelta
-    
-    # Convertir l'heure en datetime pour le calcul
-    dummy_date = datetime(2000, 1, 1)
-    start_datetime = datetime.combine(dummy_date, start_time)
-    end_datetime = start_datetime + timedelta(minutes=30)
-    
-    return end_datetime.time()
+@receiver(post_delete, sender=Order)
+def release_delivery_slot(sender, instance, **kwargs):
+    """Libère la place d'une commande supprimée"""
+    booking = SlotCapacityService.booking_key(
+        instance.delivery_date, instance.delivery_time,
+        instance.delivery_type, instance.status
+    )
+    if booking:
+        SlotCapacityService.adjust(*booking, delta=-1)
 
-def estimate_packages_count(order):
-    """
-    Estime le nombre de colis basé sur les items de la commande
-    """
-    total_items = sum(item.quantity for item in order.items.all())
-    
-    # Logique d'estimation (à adapter selon vos besoins)
-    if total_items <= 5:
-        return 1
-    elif total_items <= 15:
-        return 2
-    elif total_items <= 30:
-        return 3
-    else:
-        return (total_items // 10) + 1
+@receiver(post_save, sender=DriverPlanning)
+@receiver(post_delete, sender=DriverPlanning)
+def refresh_slot_capacity(sender, instance, **kwargs):
+    """Le planning livreurs détermine la capacité de livraison de la journée"""
+    day = instance.date
+    transaction.on_commit(lambda: SlotCapacityService.refresh_capacity(day))
 
-def determine_priority(order):
-    """
-    Détermine la priorité de la livraison
-    """
-    from datetime import datetime, timedelta
-    
-    # Si la livraison est pour aujourd'hui ou demain = priorité haute
-    days_until_delivery = (order.delivery_date - timezone.now().date()).days
-    
-    if days_until_delivery <= 0:
-        return 'urgent'
-    elif days_until_delivery == 1:
-        return 'high'
-    elif order.total > 500:  # Commandes importantes
-        return 'high'
-    else:
-        return 'normal'
+# ========================================
+# SIGNAUX POUR LA DISPONIBILITÉ DU MATÉRIEL
+# ========================================
 
-def notify_delivery_managers(delivery):
-    """
-    Notifie les responsables livraison de la nouvelle livraison
-    """
-    # Récupérer tous les responsables livraison
-    managers = User.objects.filter(
-        role__in=['delivery_manager', 'admin'],
-        is_active=True
+def sync_equipment_on_commit(checklist_ids=(), order_ids=()):
+    checklist_ids, order_ids = list(checklist_ids), list(order_ids)
+    if checklist_ids:
+        transaction.on_commit(lambda: EquipmentAvailabilityService.sync(checklist_ids))
+    if order_ids:
+        transaction.on_commit(lambda: EquipmentAvailabilityService.sync_for_orders(order_ids))
+
+@receiver(post_save, sender=ChecklistItem)
+def sync_equipment_on_item_change(sender, instance, created, **kwargs):
+    """Article ou quantité modifiés (la validation d'un élément ne change rien)"""
+    if created or instance.changed_fields():
+        sync_equipment_on_commit(checklist_ids=[instance.checklist_id])
+
+@receiver(post_delete, sender=ChecklistItem)
+def sync_equipment_on_item_delete(sender, instance, **kwargs):
+    sync_equipment_on_commit(checklist_ids=[instance.checklist_id])
+
+@receiver(post_save, sender=OrderChecklist)
+def sync_equipment_on_checklist_status(sender, instance, created, **kwargs):
+    """Une checklist annulée libère son matériel, réactivée elle le reprend"""
+    if not created and instance.has_changed('status'):
+        sync_equipment_on_commit(checklist_ids=[instance.pk])
+
+@receiver(pre_delete, sender=OrderChecklist)
+def release_equipment(sender, instance, **kwargs):
+    """Avant la suppression : les réservations partent en cascade avec la checklist"""
+    EquipmentAvailabilityService.release([instance.pk])
+
+@receiver(post_save, sender=Order)
+def sync_equipment_on_order_change(sender, instance, created, **kwargs):
+    """Report ou annulation de la commande"""
+    if not created and (instance.has_changed('delivery_date') or instance.has_changed('status')):
+        sync_equipment_on_commit(order_ids=[instance.pk])
+
+@receiver(post_save, sender=Delivery)
+def sync_equipment_on_pickup_change(sender, instance, created, **kwargs):
+    """La récupération planifiée marque le retour du matériel"""
+    if instance.delivery_type == 'pickup' and (
+        instance.has_changed('scheduled_date') or instance.has_changed('status')
+    ):
+        sync_equipment_on_commit(order_ids=[instance.order_id])
+
+@receiver(post_delete, sender=Delivery)
+def sync_equipment_on_pickup_delete(sender, instance, **kwargs):
+    if instance.delivery_type == 'pickup':
+        sync_equipment_on_commit(order_ids=[instance.order_id])
+
+@receiver(post_save, sender=EventContract)
+def sync_equipment_on_cleanup_change(sender, instance, created, **kwargs):
+    """La fin du démontage prolonge la réservation de l'événement"""
+    if instance.has_changed('cleanup_end_time'):
+        sync_equipment_on_commit(order_ids=[instance.order_id])
+
+# ========================================
+# SIGNAL POUR LES STATISTIQUES CLIENTS
+# ========================================
+
+@receiver(post_save, sender=Order)
+def record_order_status_history(sender, instance, created, **kwargs):
+    """
+    Historise les changements de statut faits par save(). Les vues posent
+    _status_changed_by ; les changements groupés passent par
+    OrderStatusService.bulk_transition qui écrit l'historique en bloc.
+    """
+    if created or not instance.has_changed('status'):
+        return
+    changed_by = getattr(instance, '_status_changed_by', None)
+    OrderStatusHistory.objects.create(
+        order=instance,
+        old_status=instance.previous('status') or '',
+        new_status=instance.status,
+        source='admin' if changed_by else 'system',
+        changed_by=changed_by,
     )
-    
-    for manager in managers:
-        DeliveryNotification.objects.create(
-            type='new_delivery',
-            recipient_type='manager',
-            recipient=manager,
-            delivery=delivery,
-            title='Nouvelle livraison à planifier',
-            message=f'La commande {delivery.order.order_number} a été confirmée. '
-                   f'Livraison {delivery.delivery_number} créée automatiquement '
-                   f'pour le {delivery.scheduled_date.strftime("%d/%m/%Y")}',
-            is_urgent=delivery.priority in ['urgent', 'high']
-        )
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def refresh_customer_stats(sender, instance, **kwargs):
+    """Met à jour la projection CustomerStats du client de la commande"""
+    user_id = instance.user_id
+    if user_id:
+        transaction.on_commit(lambda: CustomerStats.refresh_for_user(user_id))
 
 # ========================================
 # SIGNAL POUR RÉCUPÉRATION AUTOMATIQUE
@@ -165,22 +202,6 @@ def create_pickup_reminder(sender, instance, created, **kwargs):
             # Créer une notification pour planifier la récupération
             schedule_pickup_notification(instance)
 
-def should_create_pickup(delivery):
-    """
-    Détermine si une récupération doit être planifiée
-    """
-    # Logique pour déterminer si une récupération est nécessaire
-    # Par exemple, vérifier si la commande contient des items en location
-    
-    # Pour l'instant, on peut vérifier les notes ou un champ spécifique
-    keywords = ['location', 'récupération', 'retour', 'rental']
-    
-    if delivery.order.delivery_notes:
-        notes_lower = delivery.order.delivery_notes.lower()
-        return any(keyword in notes_lower for keyword in keywords)
-    
-    return False
-
 def schedule_pickup_notification(delivery):
     """
     Programme une notification pour créer une récupération
@@ -188,10 +209,7 @@ def schedule_pickup_notification(delivery):
     # Notification pour le lendemain de la livraison
     scheduled_date = delivery.scheduled_date + timedelta(days=1)
     
-    managers = User.objects.filter(
-        role__in=['delivery_manager', 'admin'],
-        is_active=True
-    ).first()
+    managers = first_delivery_manager(include_admins=True)
     
     if managers:
         DeliveryNotification.objects.create(
@@ -0,0 +1,146 @@
+# templatetags/fragment_cache.py - Cache de fragments versionné par modèle
+"""
+    {% load fragment_cache %}
+    {% fragment_cache "admin:charts" models="Order OrderItem Product" period today %}
+        ... rendu coûteux ...
+    {% endfragment_cache %}
+
+La clé du fragment contient la version (caching.py) de chaque modèle listé
+dans `models` : toute sauvegarde ou suppression d'un de ces modèles fait
+recalculer le fragment au prochain affichage. Les arguments positionnels
+après le nom (période, date, utilisateur...) distinguent les variantes.
+
+Options :
+    models   noms de modèles séparés par des espaces ("Order" ou "app.Model"),
+             obligatoirement présents dans caching.VERSIONED_MODELS
+    timeout  durée de vie en secondes (caching.DEFAULT_TIMEOUT par défaut)
+    overlay  "html" (défaut) ou "js" pour un fragment placé dans un <script>
+
+Avec FRAGMENT_CACHE_DEBUG, chaque fragment affiche un badge
+« nom · HIT/MISS · temps de rendu » (ou un console.debug() en mode js).
+"""
+import hashlib
+import json
+from time import perf_counter
+
+from django import template
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from JLTsite.caching import DEFAULT_TIMEOUT, VERSIONED_MODELS, model_versions
+
+register = template.Library()
+
+OVERLAY_MODES = ('html', 'js')
+
+
+def fragment_key(name, models, vary_on):
+    """Clé du fragment : nom, versions des modèles et empreinte des variantes"""
+    versions = '.'.join(str(version) for version in model_versions(*models))
+    vary = hashlib.md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return f'frag:{name}:{versions}:{vary}'
+
+
+def resolve_models(names, tag_name):
+    """Classes de modèles d'après "Order OrderItem" (application JLTsite par défaut)"""
+    models = []
+    for name in names.split():
+        app_label, _, model_name = name.rpartition('.')
+        try:
+            model = apps.get_model(app_label or 'JLTsite', model_name)
+        except LookupError:
+            raise template.TemplateSyntaxError(f"{tag_name} : modèle inconnu '{name}'")
+        if model._meta.label_lower not in VERSIONED_MODELS:
+            raise template.TemplateSyntaxError(
+                f"{tag_name} : '{name}' n'est pas versionné (ajouter à caching.VERSIONED_MODELS)"
+            )
+        models.append(model)
+    if not models:
+        raise template.TemplateSyntaxError(f"{tag_name} : l'option models est obligatoire")
+    return models
+
+
+class FragmentCacheNode(template.Node):
+
+    def __init__(self, nodelist, name, models, vary_on, timeout, overlay):
+        self.nodelist = nodelist
+        self.name = name
+        self.models = models
+        self.vary_on = vary_on
+        self.timeout = timeout
+        self.overlay = overlay
+
+    def render(self, context):
+        started = perf_counter()
+        queries_before = len(connection.queries) if connection.queries_logged else None
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        timeout = self.timeout.resolve(context) if self.timeout else DEFAULT_TIMEOUT
+        key = fragment_key(self.name, self.models, vary_on)
+        content = cache.get(key)
+        hit = content is not None
+        if not hit:
+            content = self.nodelist.render(context)
+            cache.set(key, str(content), int(timeout))
+        elapsed_ms = (perf_counter() - started) * 1000
+
+        if not getattr(settings, 'FRAGMENT_CACHE_DEBUG', False):
+            return mark_safe(content)
+        queries = None if queries_before is None else len(connection.queries) - queries_before
+        return self.debug_overlay(content, hit, elapsed_ms, queries)
+
+    def debug_overlay(self, content, hit, elapsed_ms, queries):
+        label = f"{self.name} · {'HIT' if hit else 'MISS'} · {elapsed_ms:.1f} ms"
+        if queries is not None:
+            label += f' · {queries} requête(s)'
+        if self.overlay == 'js':
+            return format_html(
+                '{}\nconsole.debug({});\n', mark_safe(content), mark_safe(json.dumps(f'[fragment] {label}'))
+            )
+        color = '#28a745' if hit else '#dc3545'
+        return format_html(
+            '<div class="fragment-cache-debug" style="position: relative; outline: 1px dashed {};">'
+            '<span style="position: absolute; top: 0; right: 0; z-index: 1000; padding: 1px 6px; '
+            'background: {}; color: #fff; font: 11px monospace; opacity: 0.85;">{}</span>{}</div>',
+            color, color, label, mark_safe(content)
+        )
+
+
+@register.tag('fragment_cache')
+def do_fragment_cache(parser, token):
+    """
+    {% fragment_cache "nom" models="Order OrderItem" [timeout=600] [overlay="js"] [variantes...] %}
+    """
+    bits = token.split_contents()
+    tag_name = bits[0]
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"{tag_name} : nom et models=\"...\" sont obligatoires")
+
+    name = bits[1]
+    if name[0] not in '"\'' or name[-1] != name[0]:
+        raise template.TemplateSyntaxError(f"{tag_name} : le nom doit être une chaîne littérale")
+    name = name[1:-1]
+
+    options, vary_on = {}, []
+    for bit in bits[2:]:
+        option, sep, value = bit.partition('=')
+        if sep and option in ('models', 'timeout', 'overlay'):
+            if option in options:
+                raise template.TemplateSyntaxError(f"{tag_name} : option '{option}' répétée")
+            options[option] = value
+        else:
+            vary_on.append(parser.compile_filter(bit))
+
+    # models et overlay sont lus à la compilation : des littéraux seulement
+    models = resolve_models(options.get('models', '').strip('"\''), tag_name)
+    overlay = options.get('overlay', '"html"').strip('"\'')
+    if overlay not in OVERLAY_MODES:
+        raise template.TemplateSyntaxError(f"{tag_name} : overlay doit valoir {' ou '.join(OVERLAY_MODES)}")
+    timeout = parser.compile_filter(options['timeout']) if 'timeout' in options else None
+
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, name, models, vary_on, timeout, overlay)
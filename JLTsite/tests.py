@@ -1,3 +1,706 @@
-from django.test import TestCase
+import json
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import combinations
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .intervals import IntervalTree
+from .management.commands.check_query_plans import sqlite_full_scans
+from .models import (
+    Delivery, DeliverySlot, EmailCampaign, EventContract, EventStaffAssignment, KitchenProduct, Order, OrderStatusJob,
+    StockMovement, StockSnapshot, User,
+)
+from .routers import REPLICA_ALIAS, has_written, request_scope, use_replica
+from .services import (
+    BulkMailerService, DeliveryFactoryService, DriverSyncService, LoadPlanService, LocationTrackService,
+    OrderStatusService, ReorderPlannerService, SlotCapacityService, StaffConflictError, StaffSchedulingService,
+    StockLedgerService,
+)
+
+
+# ========================================
+# PLANS DE REQUÊTES
+# ========================================
+
+class QueryPlanParsingTests(TestCase):
+
+    def test_sqlite_full_scans_with_and_without_table_keyword(self):
+        plan = '\n'.join([
+            'SCAN JLTsite_order',
+            'SCAN TABLE JLTsite_orderitem',
+            'SCAN TABLE JLTsite_delivery USING INDEX JLTsite_del_sched_idx',
+            'SCAN JLTsite_deliveryslot USING COVERING INDEX JLTsite_slot_date_idx',
+            'SEARCH TABLE JLTsite_deliveryroute USING INDEX JLTsite_route_date_idx (date=?)',
+        ])
+
+        self.assertEqual(sqlite_full_scans(plan), {'JLTsite_order', 'JLTsite_orderitem'})
+
+
+# ========================================
+# ENVOIS GROUPÉS
+# ========================================
+
+class FlakyBackend(EmailBackend):
+    """Backend locmem qui refuse certaines adresses (et peut perdre le serveur)"""
+
+    def __init__(self, refused=(), down_after_failure=False, **kwargs):
+        super().__init__(**kwargs)
+        self.refused = set(refused)
+        self.down_after_failure = down_after_failure
+        self.down = False
+        self.opened = 0
+
+    def open(self):
+        if self.down:
+            raise ConnectionRefusedError('Serveur injoignable')
+        self.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.refused.intersection(message.to):
+                self.down = self.down_after_failure
+                raise ValueError(f'Adresse refusée : {message.to[0]}')
+        return super().send_messages(messages)
+
+
+class FakeClock:
+    """Horloge monotone qui n'avance que pendant sleep()"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    DEFAULT_FROM_EMAIL='noreply@example.com',
+)
+class BulkMailerServiceTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'x', first_name='Alice')
+        self.emails = ['alice@example.com', 'bob@example.com', 'carol@example.com',
+                       'dave@example.com', 'erin@example.com']
+
+    def create_campaign(self, **kwargs):
+        return BulkMailerService.create_campaign(
+            'Nouveautés',
+            'Bonjour{% if first_name %} {{ first_name }}{% endif %},\n\n{{ message }}',
+            self.emails,
+            message='Nos nouveaux menus',
+            **kwargs
+        )
+
+    def send(self, campaign, connection=None, chunk_size=2):
+        clock = FakeClock()
+        with mock.patch('JLTsite.services.monotonic', clock.monotonic), \
+                mock.patch('JLTsite.services.sleep', clock.sleep), \
+                mock.patch.object(BulkMailerService, 'RATE_PER_SECOND', 10), \
+                mock.patch.object(BulkMailerService, 'CHUNK_SIZE', chunk_size):
+            BulkMailerService.send_campaign(campaign, connection)
+        return clock
+
+    def test_campaign_sent_to_each_recipient(self):
+        campaign = self.create_campaign()
+        self.send(campaign)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'sent')
+        self.assertEqual(campaign.sent_count, 5)
+        self.assertEqual(campaign.failed_count, 0)
+        self.assertIsNotNone(campaign.finished_at)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+        self.assertEqual(mail.outbox[0].body, 'Bonjour Alice,\n\nNos nouveaux menus')
+        self.assertEqual(mail.outbox[1].body, 'Bonjour,\n\nNos nouveaux menus')
+        self.assertFalse(campaign.deliveries.exclude(status='sent').exists())
+
+    def test_sending_is_throttled(self):
+        campaign = self.create_campaign()
+        clock = self.send(campaign, chunk_size=100)
+
+        # 10 par seconde : une pause de 0,1 s avant chaque message sauf le premier
+        self.assertEqual(len(clock.sleeps), 4)
+        for delay in clock.sleeps:
+            self.assertAlmostEqual(delay, 0.1)
+
+    def test_recipient_failure_is_recorded(self):
+        campaign = self.create_campaign()
+        connection = FlakyBackend(refused=['bob@example.com'])
+        self.send(campaign, connection)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'sent')
+        self.assertEqual(campaign.sent_count, 4)
+        self.assertEqual(campaign.failed_count, 1)
+        failed = campaign.deliveries.get(status='failed')
+        self.assertEqual(failed.email, 'bob@example.com')
+        self.assertIn('Adresse refusée', failed.error)
+        self.assertIsNone(failed.sent_at)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_server_lost_fails_remaining_recipients(self):
+        campaign = self.create_campaign()
+        connection = FlakyBackend(refused=['alice@example.com'], down_after_failure=True)
+        self.send(campaign, connection)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'failed')
+        self.assertEqual(campaign.sent_count, 0)
+        self.assertEqual(campaign.failed_count, 5)
+        self.assertFalse(campaign.deliveries.filter(status='pending').exists())
+        self.assertEqual(
+            campaign.deliveries.filter(error__contains='Serveur injoignable').count(), 4
+        )
+
+    def test_queued_campaign_claimed_once(self):
+        campaign = self.create_campaign()
+        self.assertTrue(BulkMailerService.claim_campaign(campaign))
+        self.assertFalse(BulkMailerService.claim_campaign(campaign))
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'sending')
+        self.assertEqual(BulkMailerService.send_queued_campaigns(), [])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_queued_campaigns(self):
+        campaign = self.create_campaign()
+        sent = BulkMailerService.send_queued_campaigns()
+
+        self.assertEqual([c.pk for c in sent], [campaign.pk])
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'sent')
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_admin_message_is_not_compiled(self):
+        admin = User.objects.create_user('admin', 'admin@example.com', 'x', role='admin')
+        self.client.force_login(admin)
+
+        response = self.client.post(
+            reverse('admin_send_bulk_email'),
+            json.dumps({
+                'emails': ['alice@example.com'],
+                'subject': 'Promo {{ user.password }}',
+                'message': 'Mot de passe : {{ user.password }} {% now "Y" %}\nÀ bientôt',
+            }),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Promo {{ user.password }}')
+        self.assertIn('Mot de passe : {{ user.password }} {% now "Y" %}\nÀ bientôt', message.body)
+        self.assertNotIn(self.alice.password, message.body)
+        html = message.alternatives[0][0]
+        self.assertIn('{{ user.password }} {% now &quot;Y&quot; %}<br>À bientôt', html)
+
+
+# ========================================
+# SYNCHRONISATION APPLICATION LIVREUR
+# ========================================
+
+class DriverSyncApiTests(TestCase):
+
+    def setUp(self):
+        self.driver = User.objects.create_user('livreur', 'livreur@example.com', 'x', role='delivery_driver')
+        self.client.force_login(self.driver)
+
+    def test_weak_etag_returns_not_modified(self):
+        response = self.client.get(reverse('driver_sync_api'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        for tag in (etag, 'W/' + etag.removeprefix('W/')):
+            response = self.client.get(
+                reverse('driver_sync_api'), HTTP_IF_NONE_MATCH=tag, HTTP_ACCEPT_ENCODING='gzip'
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_actions_require_token_not_session(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.driver)
+        url = reverse('driver_sync_actions_api')
+        body = json.dumps({'actions': []})
+
+        response = client.post(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        token = client.get(reverse('driver_sync_api'))['X-Driver-Token']
+        response = client.post(url, body, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+
+    def test_token_revoked_by_password_change(self):
+        token = DriverSyncService.issue_token(self.driver)
+        self.assertEqual(DriverSyncService.token_user(token), self.driver)
+
+        self.driver.set_password('nouveau')
+        self.driver.save()
+        self.assertIsNone(DriverSyncService.token_user(token))
+        self.assertIsNone(DriverSyncService.token_user('falsifié'))
+
+
+# ========================================
+# TRACES GPS
+# ========================================
+
+class LocationTrackPackingTests(TestCase):
+
+    def test_packed_offsets_round_trip_to_the_millisecond(self):
+        start = datetime(2026, 10, 19, 14, 0, tzinfo=dt_timezone.utc)
+        # Offsets dont total_seconds() * 1000 tombe juste sous l'entier
+        points = [
+            (start + timedelta(milliseconds=ms), 45.5, -73.6, None)
+            for ms in range(0, 60_000, 7)
+        ]
+        unpacked = LocationTrackService.unpack_points(start, LocationTrackService.pack_points(start, points))
+
+        self.assertEqual([point[0] for point in unpacked], [point[0] for point in points])
+        merged = LocationTrackService.merge_points(unpacked, points)
+        self.assertEqual(len(merged), len(points))
+
+
+# ========================================
+# JOURNAL DE STOCK
+# ========================================
+
+class StockLedgerServiceTests(TestCase):
+
+    def test_stock_at_matches_full_ledger(self):
+        start = datetime(2026, 10, 1, 8, 0, tzinfo=dt_timezone.utc)
+        products = [
+            KitchenProduct.objects.create(name=name, category='legumes', unit='kg', unit_price=Decimal('2'))
+            for name in ('Farine', 'Sucre', 'Sel')
+        ]
+        flour, sugar, salt = products
+
+        def move(product, hours, quantity):
+            StockLedgerService.record(
+                product, StockMovement.ADJUSTMENT, quantity, created_at=start + timedelta(hours=hours)
+            )
+
+        move(flour, 1, 10)
+        move(sugar, 1, 4)
+        move(salt, 1, 7)
+        # Photos à des instants différents selon le produit ; le sel n'en a aucune
+        StockLedgerService.take_snapshots(taken_at=start + timedelta(hours=2))
+        salt_snapshot = StockSnapshot.objects.get(kitchen_product=salt)
+        salt_snapshot.delete()
+        move(flour, 3, -3)
+        move(sugar, 3, 5)
+        StockSnapshot.objects.filter(kitchen_product=sugar).delete()
+        StockSnapshot.objects.create(
+            kitchen_product=sugar, taken_at=start + timedelta(hours=4), quantity=9, unit_price=2, value=18
+        )
+        move(sugar, 5, -1)
+        move(salt, 5, -2)
+        move(flour, 6, Decimal('0.5'))
+
+        for hours in (0, 1, 2, 3, 4, 5, 6, 7):
+            at = start + timedelta(hours=hours)
+            with self.assertNumQueries(2):
+                stock = StockLedgerService.stock_at(at)
+            for product in products:
+                expected = sum(
+                    StockMovement.objects.filter(kitchen_product=product, created_at__lte=at)
+                    .values_list('quantity', flat=True),
+                    Decimal('0'),
+                )
+                self.assertEqual(stock[product.id][0], expected, (product.name, hours))
+
+        self.assertEqual(StockLedgerService.stock_at(start, product_ids=[salt.id]), {salt.id: (Decimal('0'), None)})
+
+
+# ========================================
+# RAPPORTS LIVRAISONS
+# ========================================
+
+class DeliveryReportsTests(TestCase):
+
+    def test_reports_render_service_time_accuracy(self):
+        manager = User.objects.create_user('responsable', 'responsable@example.com', 'x', role='delivery_manager')
+        self.client.force_login(manager)
+
+        response = self.client.get(reverse('delivery_reports'), {'period': 'week'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Précision des temps sur place')
+        self.assertContains(response, '0 arrêt(s) mesuré(s)')
+
+
+# ========================================
+# CAPACITÉ DES CRÉNEAUX
+# ========================================
+
+class SlotCapacityTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.day = SlotCapacityService.booking_dates()[0]
+
+    def create_order(self):
+        # Commande saisie hors parcours de réservation (admin, téléphone)
+        return Order.objects.create(
+            first_name='Client', last_name='Test', email='client@example.com', phone='514',
+            delivery_address='1 rue', delivery_postal_code='H2X 1Y4', delivery_city='Montréal',
+            delivery_date=self.day, delivery_time=time(11, 30), subtotal=0, tax_amount=0, total=0,
+        )
+
+    def slot(self):
+        return DeliverySlot.objects.get(date=self.day, start_time=time(11, 30))
+
+    def test_order_outside_reserve_on_fresh_day_is_counted_once(self):
+        self.create_order()
+        self.assertEqual((self.slot().orders_booked, self.slot().deliveries_booked), (1, 1))
+
+        self.create_order()
+        self.assertEqual((self.slot().orders_booked, self.slot().deliveries_booked), (2, 2))
+
+    def test_cancellation_on_fresh_day_is_not_subtracted_twice(self):
+        first = self.create_order()
+        self.create_order()
+        DeliverySlot.objects.filter(date=self.day).delete()
+
+        first.status = 'cancelled'
+        first.save()
+
+        self.assertEqual(self.slot().orders_booked, 1)
+
+    def test_api_rejects_dates_outside_booking_window(self):
+        far = timezone.localdate() + timedelta(days=400)
+        sunday = next(day for day in (timezone.localdate() + timedelta(days=n) for n in range(1, 8))
+                      if day.weekday() == 6)
+
+        for day in (far, sunday, timezone.localdate()):
+            response = self.client.get(reverse('delivery_slots_api'), {'date': day.isoformat()})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(DeliverySlot.objects.exclude(date=self.day).exists())
+
+        response = self.client.get(reverse('delivery_slots_api'), {'date': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['slots'])
+
+
+# ========================================
+# CHANGEMENTS DE STATUT GROUPÉS
+# ========================================
+
+class OrderStatusJobTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.orders = [
+            Order.objects.create(
+                first_name='Client', last_name=str(number), email='client@example.com', phone='514',
+                delivery_address=f'{number} rue', delivery_postal_code='H2X 1Y4', delivery_city='Montréal',
+                delivery_date=timezone.localdate() + timedelta(days=3), delivery_time=time(11),
+                subtotal=0, tax_amount=0, total=0,
+            )
+            for number in (1, 2)
+        ]
+
+    def test_bulk_confirmation_only_enqueues_side_effects(self):
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(ReorderPlannerService, 'replan') as replan:
+            result = OrderStatusService.bulk_transition([order.id for order in self.orders], Order.CONFIRMED)
+
+        self.assertEqual(len(result['updated']), 2)
+        self.assertEqual(mail.outbox, [])
+        replan.assert_not_called()
+        self.assertFalse(Delivery.objects.exists())
+        self.assertEqual(OrderStatusJob.objects.get().order_ids, result['updated'])
+        # Même adresse pour les deux commandes : un courriel par commande
+        self.assertEqual(EmailCampaign.objects.get().deliveries.count(), 2)
+
+    def test_scheduled_commands_process_the_queue(self):
+        OrderStatusService.bulk_transition([order.id for order in self.orders], Order.CONFIRMED)
+
+        with mock.patch.object(ReorderPlannerService, 'replan') as replan:
+            call_command('process_order_jobs', stdout=mock.Mock())
+            call_command('process_order_jobs', stdout=mock.Mock())
+        BulkMailerService.send_queued_campaigns()
+
+        replan.assert_called_once()
+        self.assertEqual(Delivery.objects.filter(order__in=self.orders).count(), 2)
+        self.assertIsNotNone(OrderStatusJob.objects.get().finished_at)
+        self.assertEqual(
+            sorted(message.subject for message in mail.outbox),
+            sorted(f'Mise à jour de votre commande {order.order_number}' for order in self.orders),
+        )
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn(OrderStatusService.STATUS_MESSAGES[Order.CONFIRMED], html)
+
+
+# ========================================
+# GÉOCODAGE DES LIVRAISONS
+# ========================================
+
+def geocode_response(status='OK'):
+    results = [{'geometry': {'location': {'lat': 45.52, 'lng': -73.58}}}] if status == 'OK' else []
+    return mock.Mock(status_code=200, json=mock.Mock(return_value={'status': status, 'results': results}))
+
+
+class DeliveryGeocodingTests(TestCase):
+
+    def setUp(self):
+        self.manager = User.objects.create_user('responsable', 'responsable@example.com', 'x', role='delivery_manager')
+        self.day = timezone.localdate() + timedelta(days=3)
+
+    def confirmed_order(self, address):
+        order = Order.objects.create(
+            first_name='Client', last_name=address, email='client@example.com', phone='514',
+            delivery_address=address, delivery_postal_code='H2X 1Y4', delivery_city='Montréal',
+            delivery_date=self.day, delivery_time=time(11), subtotal=0, tax_amount=0, total=0,
+        )
+        # Confirmée sans passer par le signal, comme une commande déjà en base
+        Order.objects.filter(pk=order.pk).update(status='confirmed')
+        return order
+
+    def create_bulk(self):
+        self.client.force_login(self.manager)
+        return self.client.post(reverse('create_bulk_deliveries'), {'date': self.day.isoformat()})
+
+    def test_bulk_creation_reuses_known_addresses_without_api_calls(self):
+        known = self.confirmed_order('1 rue Connue')
+        self.create_bulk()
+        Delivery.objects.filter(order=known).update(latitude=Decimal('45.5'), longitude=Decimal('-73.6'))
+        same = self.confirmed_order('1 rue Connue')
+        new = self.confirmed_order('2 rue Nouvelle')
+
+        with mock.patch('JLTsite.services.requests.get') as get:
+            response = self.create_bulk()
+
+        get.assert_not_called()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Delivery.objects.get(order=same).latitude, Decimal('45.5'))
+        self.assertIsNone(Delivery.objects.get(order=new).latitude)
+
+    def test_command_geocodes_remaining_addresses(self):
+        order = self.confirmed_order('2 rue Nouvelle')
+        self.create_bulk()
+
+        with mock.patch('JLTsite.services.requests.get', return_value=geocode_response()) as get:
+            call_command('geocode_deliveries', stdout=mock.Mock())
+
+        get.assert_called_once()
+        self.assertEqual(Delivery.objects.get(order=order).latitude, Decimal('45.52'))
+
+    def test_geocoding_failure_is_logged(self):
+        self.confirmed_order('3 rue Introuvable')
+        self.create_bulk()
+
+        with mock.patch('JLTsite.services.requests.get', return_value=geocode_response('ZERO_RESULTS')), \
+                self.assertLogs('JLTsite.services', 'WARNING') as logs:
+            call_command('geocode_deliveries', stdout=mock.Mock())
+
+        self.assertIn('ZERO_RESULTS', logs.output[0])
+
+
+# ========================================
+# PLAN DE CHARGEMENT
+# ========================================
+
+class LoadPlanRefreshTests(TestCase):
+
+    def setUp(self):
+        orders = [
+            Order.objects.create(
+                first_name='Client', last_name=str(number), email='client@example.com', phone='514',
+                delivery_address=f'{number} rue', delivery_postal_code='H2X 1Y4', delivery_city='Montréal',
+                delivery_date=timezone.localdate() + timedelta(days=3), delivery_time=time(11),
+                subtotal=0, tax_amount=0, total=0,
+            )
+            for number in (1, 2)
+        ]
+        self.manual, self.empty = DeliveryFactoryService.create_for_orders(
+            Order.objects.filter(id__in=[order.id for order in orders]).order_by('id'), notify=False
+        )[0]
+
+    def test_refresh_keeps_manual_values_and_fills_empty_ones(self):
+        Delivery.objects.filter(pk=self.manual.pk).update(total_packages=7, weight=Decimal('42.00'))
+        Delivery.objects.filter(pk=self.empty.pk).update(total_packages=1, weight=None, volume=None)
+        deliveries = list(Delivery.objects.filter(pk__in=[self.manual.pk, self.empty.pk]))
+
+        self.assertEqual(LoadPlanService.refresh(deliveries), 1)
+
+        self.manual.refresh_from_db()
+        self.empty.refresh_from_db()
+        self.assertEqual((self.manual.total_packages, self.manual.weight), (7, Decimal('42.00')))
+        expected = LoadPlanService.stored_values(LoadPlanService.delivery_loads([self.empty])[self.empty.id])
+        self.assertEqual((self.empty.total_packages, self.empty.weight, self.empty.volume), expected)
+
+
+# ========================================
+# ROUTAGE VERS LA RÉPLIQUE
+# ========================================
+
+@skipUnless(REPLICA_ALIAS in settings.DATABASES, 'Réplique non configurée (DB_SQLITE=True ou DB_REPLICA_HOST)')
+class ReplicaRouterTests(TransactionTestCase):
+    # Hors transaction de test : dans un bloc atomic, le routeur reste sur le primaire
+    databases = {'default', REPLICA_ALIAS} & set(settings.DATABASES)
+
+    def test_reads_go_to_replica(self):
+        with request_scope(), use_replica():
+            self.assertEqual(User.objects.all().db, REPLICA_ALIAS)
+            self.assertEqual(list(User.objects.all()), [])
+        with request_scope():
+            self.assertEqual(User.objects.all().db, 'default')
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        with request_scope(), use_replica():
+            user = User.objects.create_user('ecriture', 'ecriture@example.com', 'x')
+            self.assertEqual(user._state.db, 'default')
+            self.assertTrue(has_written())
+            # Lire ses propres écritures : la suite de la requête reste sur le primaire
+            self.assertEqual(User.objects.all().db, 'default')
+
+    def test_reads_inside_atomic_go_to_primary(self):
+        with request_scope(), use_replica(), transaction.atomic():
+            self.assertEqual(User.objects.all().db, 'default')
+
+
+# ========================================
+# PLANNING DU PERSONNEL
+# ========================================
+
+class IntervalTreeTests(TestCase):
+
+    def test_overlapping_matches_brute_force(self):
+        rng = random.Random(1)
+        for size in (0, 1, 2, 7, 50, 300):
+            intervals = [(start, start + rng.randint(1, 30), index)
+                         for index, start in enumerate(rng.randint(0, 500) for _ in range(size))]
+            tree = IntervalTree(intervals)
+            self.assertEqual(len(tree), size)
+            for _ in range(100):
+                start = rng.randint(-10, 520)
+                end = start + rng.randint(1, 40)
+                expected = sorted(i[2] for i in intervals if i[0] < end and i[1] > start)
+                self.assertEqual(sorted(i[2] for i in tree.overlapping(start, end)), expected)
+                self.assertEqual(tree.overlaps(start, end), bool(expected))
+
+    def test_intervals_are_half_open(self):
+        tree = IntervalTree([(9, 17, 'jour'), (17, 23, 'soir')])
+        self.assertEqual([i[2] for i in tree.overlapping(17, 18)], ['soir'])
+        self.assertEqual(tree.overlapping(23, 24), [])
+        self.assertEqual(tree.overlapping_pairs(), [])
+
+    def test_overlapping_pairs_matches_brute_force(self):
+        rng = random.Random(2)
+        intervals = [(start, start + rng.randint(1, 30), index)
+                     for index, start in enumerate(rng.randint(0, 300) for _ in range(80))]
+        expected = {
+            frozenset((a[2], b[2]))
+            for a, b in combinations(intervals, 2) if a[0] < b[1] and b[0] < a[1]
+        }
+        pairs = IntervalTree(intervals).overlapping_pairs()
+        self.assertEqual(len(pairs), len(expected))
+        self.assertEqual({frozenset((a[2], b[2])) for a, b in pairs}, expected)
+
+
+class StaffSchedulingTests(TestCase):
+
+    def setUp(self):
+        # Les créneaux de la semaine sont en cache versionné ; la base, elle, est remise à zéro
+        cache.clear()
+        self.admin = User.objects.create_user('admin', 'admin@example.com', 'x', role='admin')
+        self.maitre_hotel = User.objects.create_user('mh', 'mh@example.com', 'x', role='maitre_hotel')
+        day = timezone.localdate() + timedelta(days=30)
+        self.at = lambda hour: timezone.make_aware(datetime.combine(day, time(hour)))
+        self.first = self.create_event('Mariage', 14, 23, maitre_hotel=self.maitre_hotel)
+        self.second = self.create_event('Cocktail', 20, 23)
+
+    def create_event(self, name, start, end, **extra):
+        order = Order.objects.create(
+            first_name='Client', last_name=name, email='client@example.com', phone='514',
+            delivery_address='1 rue', delivery_postal_code='H2X 1Y4', delivery_city='Montréal',
+            delivery_date=self.at(start).date(), delivery_time=time(start),
+            subtotal=0, tax_amount=0, total=0,
+        )
+        return EventContract.objects.create(
+            order=order, event_name=name,
+            setup_start_time=self.at(start), event_start_time=self.at(start),
+            event_end_time=self.at(end), cleanup_end_time=self.at(end),
+            **extra
+        )
+
+    def quick_assign(self):
+        self.client.force_login(self.admin)
+        return self.client.post(
+            reverse('admin_quick_assign_maitre_hotel'),
+            json.dumps({'event_id': self.second.id, 'maitre_hotel_id': self.maitre_hotel.id}),
+            content_type='application/json',
+        )
+
+    def test_quick_assign_conflict_returns_409(self):
+        response = self.quick_assign()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+        self.second.refresh_from_db()
+        self.assertIsNone(self.second.maitre_hotel_id)
+
+    def test_cancelled_event_frees_the_slot(self):
+        with self.assertRaises(StaffConflictError):
+            StaffSchedulingService.ensure_available(
+                self.maitre_hotel, self.second.setup_start_time, self.second.cleanup_end_time
+            )
+
+        # Le cache des créneaux est invalidé au commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.status = 'cancelled'
+            self.first.save()
+
+        self.assertEqual(StaffSchedulingService.conflicts_for(
+            self.maitre_hotel.id, self.second.setup_start_time, self.second.cleanup_end_time
+        ), [])
+        response = self.quick_assign()
+        self.assertEqual(response.status_code, 200)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.maitre_hotel_id, self.maitre_hotel.id)
+
+    def test_availability_api_flags_busy_and_skips_assigned_staff(self):
+        busy, assigned, free = (
+            User.objects.create_user(name, f'{name}@example.com', 'x', role='staff', first_name=name)
+            for name in ('occupe', 'affecte', 'libre')
+        )
+        for staff, event in ((busy, self.first), (assigned, self.second)):
+            EventStaffAssignment.objects.create(
+                event=event, staff_member=staff, role='server',
+                arrival_time=event.setup_start_time, departure_time=event.cleanup_end_time,
+            )
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('admin_staff_availability'), {
+            'start': timezone.localtime(self.second.setup_start_time).strftime('%Y-%m-%dT%H:%M'),
+            'end': timezone.localtime(self.second.cleanup_end_time).strftime('%Y-%m-%dT%H:%M'),
+            'role': 'server',
+            'event_id': self.second.id,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        people = {person['id']: person for person in response.json()['people']}
+        self.assertNotIn(assigned.id, people)
+        self.assertFalse(people[busy.id]['available'])
+        self.assertTrue(people[free.id]['available'])
+        self.assertEqual(people[busy.id]['conflicts'][0].split(' (')[0], 'Mariage')
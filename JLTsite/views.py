@@ -185,6 +185,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q, Count, Sum, Avg
 from django.utils import timezone
 from django.core.mail import send_mail
@@ -202,6 +203,8 @@ from .forms import (
     SignUpForm, LoginForm, CheckoutForm,
     ReviewForm, ProfileForm
 )
+from .caching import active_categories
+from .services import RecommendationService, SlotCapacityService, SlotUnavailableError
 
 # ========================================
 # 1. VUES AUTHENTIFICATION
@@ -329,7 +332,7 @@ def shop_view(request):
     products = paginator.get_page(page)
     
     # Catégories pour le menu
-    categories = Category.objects.filter(is_active=True).order_by('order')
+    categories = active_categories()
     
     # Produits populaires
     featured_products = Product.objects.filter(
@@ -361,11 +364,15 @@ def product_detail_view(request, slug):
     reviews = product.reviews.all().order_by('-created_at')
     avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
     
-    # Produits similaires
-    similar_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(id=product.id)[:4]
+    # Produits souvent commandés ensemble (modèle précalculé), complétés par la catégorie
+    similar_products = RecommendationService.get_complementary_products(product, limit=4)
+    if len(similar_products) < 4:
+        similar_products += list(Product.objects.filter(
+            category=product.category,
+            is_active=True
+        ).exclude(
+            id__in=[product.id] + [p.id for p in similar_products]
+        )[:4 - len(similar_products)])
     
     # Vérifier si l'utilisateur peut laisser un avis
     can_review = False
@@ -568,42 +575,54 @@ def checkout_view(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Créer la commande
-            order = form.save(commit=False)
-            order.user = request.user
-            order.subtotal = cart.get_total()
-            
-            # Calculer les montants
-            order.tax_amount = order.subtotal * (order.tax_rate / 100)
-            order.delivery_fee = Decimal('5.00') if order.subtotal < 50 else Decimal('0.00')
-            order.total = order.calculate_totals()
-            order.save()
-            
-            # Créer les articles de commande
-            for item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    product_name=item.product.name,
-                    product_price=item.product.get_price(),
-                    quantity=item.quantity,
-                    notes=item.notes
-                )
+            try:
+                # Réserver le créneau et créer la commande dans la même transaction
+                with transaction.atomic():
+                    SlotCapacityService.reserve(
+                        form.cleaned_data['delivery_date'],
+                        form.cleaned_data['delivery_time'],
+                        form.cleaned_data['delivery_type']
+                    )
+                    
+                    # Créer la commande
+                    order = form.save(commit=False)
+                    order.user = request.user
+                    order.subtotal = cart.get_total()
+                    
+                    # Calculer les montants
+                    order.tax_amount = order.subtotal * (order.tax_rate / 100)
+                    order.delivery_fee = Decimal('5.00') if order.subtotal < 50 else Decimal('0.00')
+                    order.total = order.calculate_totals()
+                    order._slot_reserved = True
+                    order.save()
+                    
+                    # Créer les articles de commande
+                    for item in cart.items.all():
+                        OrderItem.objects.create(
+                            order=order,
+                            product=item.product,
+                            product_name=item.product.name,
+                            product_price=item.product.get_price(),
+                            quantity=item.quantity,
+                            notes=item.notes
+                        )
+                        
+                        # Mettre à jour le stock et les ventes
+                        item.product.stock -= item.quantity
+                        item.product.sales_count += item.quantity
+                        item.product.save()
+                    
+                    # Vider le panier
+                    cart.items.all().delete()
+            except SlotUnavailableError as e:
+                form.add_error('delivery_time', str(e))
+            else:
+                # Envoyer les emails
+                send_order_confirmation_email(order)
+                send_order_notification_to_admin(order)
                 
-                # Mettre à jour le stock et les ventes
-                item.product.stock -= item.quantity
-                item.product.sales_count += item.quantity
-                item.product.save()
-            
-            # Vider le panier
-            cart.items.all().delete()
-            
-            # Envoyer les emails
-            send_order_confirmation_email(order)
-            send_order_notification_to_admin(order)
-            
-            messages.success(request, 'Votre commande a été confirmée!')
-            return redirect('order_confirmation', order_number=order.order_number)
+                messages.success(request, 'Votre commande a été confirmée!')
+                return redirect('order_confirmation', order_number=order.order_number)
     else:
         initial_data = {
             'first_name': request.user.first_name,
@@ -635,6 +654,34 @@ def checkout_view(request):
     
     return render(request, 'JLTsite/checkout.html', context)
 
+def delivery_slots_api(request):
+    """Places restantes par créneau pour une date (utilisé par la commande et la commande manuelle)"""
+    try:
+        delivery_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Date invalide'}, status=400)
+    # Les créneaux d'une journée sont créés à la première consultation : dates réservables seulement
+    if delivery_date not in SlotCapacityService.booking_dates():
+        return JsonResponse({'success': False, 'error': 'Date hors de la période de réservation'}, status=400)
+    
+    delivery_type = request.GET.get('delivery_type', 'delivery')
+    available_key = f'{delivery_type}_available'
+    slots = SlotCapacityService.get_availability(delivery_date)
+    
+    return JsonResponse({
+        'success': True,
+        'date': delivery_date.isoformat(),
+        'slots': [
+            {
+                'value': slot['value'],
+                'display': slot['display'],
+                'available': slot.get(available_key, False),
+                'remaining': slot['deliveries_remaining'] if delivery_type == 'delivery' else slot['orders_remaining'],
+            }
+            for slot in slots
+        ],
+    })
+
 def order_confirmation_view(request, order_number):
     """Page de confirmation de commande"""
     order = get_object_or_404(Order, order_number=order_number)
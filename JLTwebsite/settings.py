@@ -26,19 +26,79 @@ ALLOWED_HOSTS = config('ALLOWED_HOST', default='', cast=Csv()) + ['127.0.0.1', '
 # Configuration optionnelle pour de meilleures performances
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT'),
-        'OPTIONS': {
-            'charset': 'utf8mb4',
+# Développement local sans MySQL : DB_SQLITE=True utilise deux fichiers SQLite,
+# la base principale et une « réplique » (alias replica) pour exercer le routage
+# des lectures. La réplique n'est pas alimentée : la recopier au besoin
+# (cp db.sqlite3 db_replica.sqlite3) ; en tests elle reflète la principale.
+if config('DB_SQLITE', default=False, cast=bool):
+    SQLITE_DIR = Path(__file__).resolve().parent.parent
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_SQLITE_NAME', default=str(SQLITE_DIR / 'db.sqlite3')),
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_SQLITE_REPLICA_NAME', default=str(SQLITE_DIR / 'db_replica.sqlite3')),
+            'TEST': {'MIRROR': 'default'},
         },
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT'),
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+            },
+        }
+    }
+
+# Réplique en lecture pour les rapports, exports et tableaux de bord (optionnelle).
+# Sans DB_REPLICA_HOST, toutes les lectures restent sur la base principale.
+if config('DB_REPLICA_HOST', default='') and 'replica' not in DATABASES:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Cache : mémoire locale par défaut, Redis si REDIS_URL est défini
+# (redis://hôte:6379/0, nécessite le paquet redis)
+if config('REDIS_URL', default=''):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL'),
+            'KEY_PREFIX': 'jlt',
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'jlt-default',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+# Badge HIT/MISS et temps de rendu sur les fragments {% fragment_cache %}
+FRAGMENT_CACHE_DEBUG = config('FRAGMENT_CACHE_DEBUG', default=DEBUG, cast=bool)
+
+DATABASE_ROUTERS = ['JLTsite.routers.ReplicaRouter']
+# Durée pendant laquelle un utilisateur qui vient d'écrire lit sur le primaire
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+# Délai avant de retenter une réplique injoignable
+REPLICA_RETRY_SECONDS = config('REPLICA_RETRY_SECONDS', default=30, cast=int)
 # Si vous voulez voir les requêtes SQL dans la console (développement uniquement)
 if DEBUG:
     LOGGING = {
@@ -94,6 +154,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'JLTsite.middleware.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -199,6 +260,14 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = config('EMAIL_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_PASSWORD')
 
+# Envois groupés : taille des lots et débit maximal (messages / seconde)
+BULK_EMAIL_CHUNK_SIZE = config('BULK_EMAIL_CHUNK_SIZE', default=100, cast=int)
+BULK_EMAIL_RATE_PER_SECOND = config('BULK_EMAIL_RATE_PER_SECOND', default=10, cast=int)
+
+# Traces GPS des livreurs : au-delà de N jours, une position par pas (secondes), blocs d'une heure
+GPS_DOWNSAMPLE_AFTER_DAYS = config('GPS_DOWNSAMPLE_AFTER_DAYS', default=7, cast=int)
+GPS_DOWNSAMPLE_STEP_SECONDS = config('GPS_DOWNSAMPLE_STEP_SECONDS', default=60, cast=int)
+
 # APIs
 GOOGLE_API_KEY = config('GOOGLE_API_KEY', default='')
 
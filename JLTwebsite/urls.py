@@ -34,6 +34,7 @@ urlpatterns = [
     
     # ========== COMMANDE ==========
     path('checkout/', views.checkout_view, name='checkout'),
+    path('api/delivery-slots/', views.delivery_slots_api, name='delivery_slots_api'),
     path('order/confirmation/<str:order_number>/', views.order_confirmation_view, name='order_confirmation'),
     
     # ========== DASHBOARD CLIENT ==========
@@ -94,6 +95,19 @@ urlpatterns = [
          checklist_views.admin_edit_checklist, 
          name='admin_edit_checklist'),
     
+    # Générer les checklists d'une date depuis les modèles
+    path('admin-dashboard/checklists/generate/', 
+         checklist_views.admin_generate_checklists, 
+         name='admin_generate_checklists'),
+    
+    # Disponibilité du matériel (JSON)
+    path('admin-dashboard/api/equipment/conflicts/', 
+         checklist_views.equipment_conflicts, 
+         name='equipment_conflicts'),
+    path('admin-dashboard/api/equipment/order/<str:order_number>/', 
+         checklist_views.equipment_order_check, 
+         name='equipment_order_check'),
+    
     # === DASHBOARD RESPONSABLE CHECKLIST ===
     # Dashboard principal
     path('checklist-dashboard/', 
@@ -197,6 +211,25 @@ urlpatterns = [
 
      # Statistiques du livreur en temps réel
      path('driver/api/stats/', delivery_views.driver_stats_api, name='driver_stats_api'),
+
+     # Synchronisation hors ligne : journée du livreur (ETag, deltas) et envoi groupé des actions
+     path('driver/api/sync/', delivery_views.driver_sync_api, name='driver_sync_api'),
+     path('driver/api/sync/actions/', delivery_views.driver_sync_actions_api, name='driver_sync_actions_api'),
+
+     # Positions GPS : envoi par lots (livreur), dernières positions et traces (responsable)
+     path('driver/api/locations/', delivery_views.driver_locations_api, name='driver_locations_api'),
+     path('delivery/api/driver-positions/', delivery_views.driver_positions_api, name='driver_positions_api'),
+     path('delivery/api/route/<int:route_id>/track/', delivery_views.route_track_api, name='route_track_api'),
+
+     # Carte des livraisons (GeoJSON regroupé par zoom) et recherches spatiales
+     path('delivery/api/map/', delivery_views.delivery_map_api, name='delivery_map_api'),
+     path('delivery/api/<int:delivery_id>/nearby/', delivery_views.nearby_deliveries_api, name='nearby_deliveries_api'),
+     path('delivery/api/planning/<int:planning_id>/zone-deliveries/', delivery_views.driver_zone_deliveries_api, name='driver_zone_deliveries_api'),
+
+     # Feuilles de chargement des véhicules (journée ou route)
+     path('delivery/routes/loading/', delivery_views.loading_sheet, name='loading_sheet'),
+     path('delivery/route/<int:route_id>/print/', delivery_views.loading_sheet, name='route_loading_sheet'),
+
      # Démarrer une route
      path('delivery/route/<int:route_id>/start/', delivery_views.start_route, name='start_route'),
 
@@ -326,6 +359,7 @@ urlpatterns = [
      # ========== GESTION DES ÉVÉNEMENTS ==========
     # Liste des événements pour les ventes
     path('admin-dashboard/events/', admin_views.admin_events_list, name='admin_events_list'),
+    path('admin-dashboard/events/staffing/', admin_views.admin_staff_planning, name='admin_staff_planning'),
     path('admin-dashboard/event/<int:contract_id>/', admin_views.admin_event_detail, name='admin_event_detail'),
     path('admin-dashboard/event/<int:contract_id>/remove-staff/<int:assignment_id>/', admin_views.admin_remove_staff_from_event, name='admin_remove_staff_from_event'),
     
@@ -341,6 +375,11 @@ urlpatterns = [
          admin_views.admin_quick_assign_maitre_hotel, 
          name='admin_quick_assign_maitre_hotel'),
     
+    # Personnel disponible sur un créneau
+    path('admin-dashboard/api/staff-availability/', 
+         admin_views.admin_staff_availability, 
+         name='admin_staff_availability'),
+    
     # Changer le statut d'un événement
     path('admin-dashboard/api/change-event-status/', 
          admin_views.admin_change_event_status, 